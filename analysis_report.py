@@ -5,7 +5,7 @@
   - Telegram /analysis 指令（main_eth._handle_analysis，html=True）
   - VPS 終端機 CLI（analyze.py，html=False）
 
-只讀 trades.csv（+ bar_snapshots.csv 做 regime join），無副作用、不碰 API/executor。
+只讀交易帳本 trades.db（trade_ledger；+ bar_snapshots.csv 做 regime join），無副作用、不碰 API/executor。
 指標對齊 dashboard 收益分析：總損益 / WR / PF / 最大回撤 / 出場分佈 / L vs S / regime。
 """
 import os
@@ -40,33 +40,33 @@ def to_exec_time(s, fmt="%Y-%m-%d %H:%M"):
 
 
 def _load_closed(data_dir: str, days: int = None):
-    """讀 trades.csv 的已平倉交易（依出場時間過濾最近 N 天），回傳 list[dict]。"""
-    trades_path = os.path.join(data_dir, "trades.csv")
-    if not os.path.exists(trades_path):
+    """讀交易帳本的已平倉交易（依出場時間過濾最近 N 天，走索引），回傳 list[dict]；沒有帳本回 None。"""
+    import trade_ledger
+    if not trade_ledger.exists(data_dir):
         return None
     cutoff = None
     if days:
         cutoff = (datetime.utcnow() + timedelta(hours=8)) - timedelta(days=days)
     rows = []
-    with open(trades_path, "r", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            pnl_raw = row.get("net_pnl_usd", "")
-            if pnl_raw is None or str(pnl_raw).strip() == "":
+    since = cutoff.strftime("%Y-%m-%d %H:%M:%S") if cutoff is not None else None
+    for row in trade_ledger.rows(data_dir, closed=True, exit_since=since):
+        pnl_raw = row.get("net_pnl_usd", "")
+        if pnl_raw is None or str(pnl_raw).strip() == "":
+            continue
+        if cutoff is not None:
+            edt = _parse_dt(row.get("exit_time_utc8", ""))
+            if edt is None or edt < cutoff:
                 continue
-            if cutoff is not None:
-                edt = _parse_dt(row.get("exit_time_utc8", ""))
-                if edt is None or edt < cutoff:
-                    continue
-            try:
-                row["_pnl"] = float(pnl_raw)
-            except (ValueError, TypeError):
-                continue
-            try:
-                row["_hold"] = float(row.get("hold_bars", 0) or 0)
-            except (ValueError, TypeError):
-                row["_hold"] = 0.0
-            row["_exit_dt"] = _parse_dt(row.get("exit_time_utc8", ""))
-            rows.append(row)
+        try:
+            row["_pnl"] = float(pnl_raw)
+        except (ValueError, TypeError):
+            continue
+        try:
+            row["_hold"] = float(row.get("hold_bars", 0) or 0)
+        except (ValueError, TypeError):
+            row["_hold"] = 0.0
+        row["_exit_dt"] = _parse_dt(row.get("exit_time_utc8", ""))
+        rows.append(row)
     return rows
 
 
@@ -77,7 +77,7 @@ def build_trades_table(data_dir: str, days: int = None, limit: int = 20) -> str:
     """
     rows = _load_closed(data_dir, days)
     if rows is None:
-        return "📭 尚無交易記錄（trades.csv 不存在）"
+        return "📭 尚無交易記錄（交易帳本不存在）"
     if not rows:
         scope = f"最近 {days} 天" if days else "全期間"
         return f"📭 {scope}無已平倉交易"
@@ -154,7 +154,7 @@ def build_report(data_dir: str, days: int = None, html: bool = False) -> str:
     """產生收益分析報表字串。
 
     Args:
-        data_dir: 含 trades.csv / bar_snapshots.csv 的目錄（data/ 或 data_live/）
+        data_dir: 含 trades.db / bar_snapshots.csv 的目錄（data/ 或 data_live/）
         days: 只算最近 N 天（依出場時間）；None = 全期間
         html: True 用 Telegram HTML 標籤；False 用純文字（終端機）
     """
@@ -168,35 +168,10 @@ def build_report(data_dir: str, days: int = None, html: bool = False) -> str:
     def i(t):  # 斜體
         return f"{ITAL_L}{t}{ITAL_R}" if html else t
 
-    trades_path = os.path.join(data_dir, "trades.csv")
-    if not os.path.exists(trades_path):
+    rows = _load_closed(data_dir, days)
+    if rows is None:
         return "📭 尚無交易記錄"
 
-    cutoff = None
-    if days:
-        cutoff = (datetime.utcnow() + timedelta(hours=8)) - timedelta(days=days)
-
-    rows = []
-    with open(trades_path, "r", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            pnl_raw = row.get("net_pnl_usd", "")
-            if pnl_raw is None or str(pnl_raw).strip() == "":
-                continue  # 未平倉
-            if cutoff is not None:
-                edt = _parse_dt(row.get("exit_time_utc8", ""))
-                if edt is None or edt < cutoff:
-                    continue
-            try:
-                row["_pnl"] = float(pnl_raw)
-            except (ValueError, TypeError):
-                continue
-            try:
-                row["_hold"] = float(row.get("hold_bars", 0) or 0)
-            except (ValueError, TypeError):
-                row["_hold"] = 0.0
-            row["_exit_dt"] = _parse_dt(row.get("exit_time_utc8", ""))
-            rows.append(row)
-
     scope = f"最近 {days} 天" if days else "全期間"
     if not rows:
         return f"📭 {scope}無已平倉交易"
@@ -12,6 +12,7 @@ V14+R = V14 + asymmetric SMA200-slope regime gate:
 import pandas as pd
 import numpy as np
 import os
+import sys
 from collections import defaultdict
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -102,8 +103,16 @@ except Exception:  # standalone fallback（值同 strategy.py）
         return "MILD_UP"
 
 
+try:
+    from strategy import rolling_rank_pctile as _rank_kernel  # 共用向量化 kernel
+except Exception:  # standalone fallback：下方逐窗 loop（語意相同）
+    _rank_kernel = None
+
+
 def rolling_pctile(vals, window):
-    """與 strategy.py _rank_pctile 完全一致：strict < 且 /（n-1）"""
+    """與 strategy.rolling_rank_pctile 完全一致：strict < 且 /（n-1）"""
+    if _rank_kernel is not None:
+        return _rank_kernel(vals, window)
     out = np.full(len(vals), np.nan)
     for i in range(window - 1, len(vals)):
         w = vals[i - window + 1: i + 1]
@@ -117,12 +126,12 @@ def rolling_pctile(vals, window):
     return out
 
 
-def compute_indicators(df):
-    o = df['open'].values
-    h = df['high'].values
-    l = df['low'].values
-    c = df['close'].values
+def _rolling_means(o, h, l, c):
+    """rolling mean 類欄位（GK 比值 shift(1)、SMA200 斜率 shift(1)）。
 
+    pandas rolling mean 是累加演算法，數值與序列起點有關（末位誤差）；
+    快取只重算尾段時這幾欄要從序列起點算，才會與全量重算逐位元一致。
+    """
     log_hl = np.log(h / np.maximum(l, 1e-10))
     co_ratio = c / np.maximum(o, 1e-10)
     co_ratio = np.maximum(co_ratio, 1e-10)
@@ -137,13 +146,29 @@ def compute_indicators(df):
     ratio_L = (gk_mean_5 / gk_mean_20.replace(0, np.nan)).values
     shifted_L = np.roll(ratio_L, 1)
     shifted_L[0] = np.nan
-    pctile_L = rolling_pctile(shifted_L, 100)
 
     gk_mean_10 = gk_s.rolling(S_GK_S, min_periods=S_GK_S).mean()
     gk_mean_30 = gk_s.rolling(S_GK_L, min_periods=S_GK_L).mean()
     ratio_S = (gk_mean_10 / gk_mean_30.replace(0, np.nan)).values
     shifted_S = np.roll(ratio_S, 1)
     shifted_S[0] = np.nan
+
+    # V14+R Regime Gate: SMA200 100-bar 相對斜率（shift(1) 防前瞻）
+    sma200 = close_s.rolling(R_SMA_WIN, min_periods=R_SMA_WIN).mean()
+    slope = (sma200 - sma200.shift(R_SLOPE_WIN)) / sma200.shift(R_SLOPE_WIN)
+    slope_use = slope.shift(1).values  # 用昨日斜率
+    return shifted_L, shifted_S, slope_use
+
+
+def compute_indicators(df, means=None):
+    """means：_rolling_means 的結果（已對齊 df）；None = 就地從 df 起點算"""
+    o = df['open'].values
+    h = df['high'].values
+    l = df['low'].values
+    c = df['close'].values
+
+    shifted_L, shifted_S, slope_use = means if means is not None else _rolling_means(o, h, l, c)
+    pctile_L = rolling_pctile(shifted_L, 100)
     pctile_S = rolling_pctile(shifted_S, 100)
 
     shifted_close = np.roll(c, 1)
@@ -159,10 +184,6 @@ def compute_indicators(df):
     months = (dt.dt.year * 100 + dt.dt.month).values
     days = (dt.dt.year * 10000 + dt.dt.month * 100 + dt.dt.day).values
 
-    # V14+R Regime Gate: SMA200 100-bar 相對斜率（shift(1) 防前瞻）
-    sma200 = close_s.rolling(R_SMA_WIN, min_periods=R_SMA_WIN).mean()
-    slope = (sma200 - sma200.shift(R_SLOPE_WIN)) / sma200.shift(R_SLOPE_WIN)
-    slope_use = slope.shift(1).values  # 用昨日斜率
     regime_block_l = (slope_use > R_TH_UP) & (~np.isnan(slope_use))
     regime_block_s = (np.abs(slope_use) < R_TH_SIDE) & (~np.isnan(slope_use))
 
@@ -176,6 +197,115 @@ def compute_indicators(df):
     }
 
 
+# =========================================================================
+# 指標磁碟快取：同一份 K 線 + 同一組指標參數 → 第二次起直接讀 npz，不重算
+#   - 槽位 = 指標參數 + 引擎程式碼 + 序列身分（第一根 bar）→ 參數/程式改了自動作廢
+#   - 槽內記錄已算的 bar 數 n 與前 n 根內容雜湊；新資料只是尾端追加 → 只重算尾段
+#     （rolling mean 類欄位仍從序列起點算 → 與全量重算逐位元一致；百分位 / 突破 / 時間欄
+#       是純窗口函數，帶 2×WARMUP 根前文重算即可）
+#   - 任何讀寫失敗一律退回 compute_indicators（fail-open）
+# =========================================================================
+
+IND_CACHE_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'cache', 'indicators')
+_IND_KEYS = ('o', 'h', 'l', 'c', 'pctile_L', 'pctile_S', 'brk_up', 'brk_dn', 'hours', 'dows',
+             'months', 'days', 'regime_block_l', 'regime_block_s', 'slope')
+
+
+def _bar_arrays(df):
+    """雜湊用：OHLC + datetime（int64 ns）。"""
+    dt = pd.to_datetime(df['datetime']).values.astype('datetime64[ns]').astype(np.int64)
+    return [np.ascontiguousarray(df[k].values, dtype=np.float64)
+            for k in ('open', 'high', 'low', 'close')] + [dt]
+
+
+def _hash_arrays(arrays, n):
+    import hashlib
+    hsh = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        hsh.update(a[:n].tobytes())
+    return hsh.hexdigest()
+
+
+def _indicator_slot(arrays):
+    """指標參數 + 程式碼 + 序列第一根 → 槽位檔名。"""
+    import hashlib
+    import inspect
+    try:
+        code = (inspect.getsource(_rolling_means) + inspect.getsource(compute_indicators)
+                + inspect.getsource(rolling_pctile))
+    except (OSError, TypeError):
+        code = ''
+    params = (L_GK_S, L_GK_L, S_GK_S, S_GK_L, L_BRK, S_BRK,
+              R_SMA_WIN, R_SLOPE_WIN, R_TH_UP, R_TH_SIDE)
+    first = tuple(float(a[0]) for a in arrays) if len(arrays[0]) else ()
+    key = repr((params, first)) + code
+    return 'ind_' + hashlib.blake2b(key.encode(), digest_size=12).hexdigest() + '.npz'
+
+
+def compute_indicators_cached(df, cache_dir=None):
+    """compute_indicators 的磁碟快取版（回傳同一個 dict 結構）。"""
+    cache_dir = cache_dir or IND_CACHE_DIR
+    try:
+        arrays = _bar_arrays(df)
+        m = len(arrays[0])
+        path = os.path.join(cache_dir, _indicator_slot(arrays))
+    except Exception:
+        return compute_indicators(df)
+
+    prev = None
+    try:
+        if m and os.path.exists(path):
+            with np.load(path, allow_pickle=False) as z:
+                n = int(z['n'])
+                if n <= m and str(z['prefix_hash']) == _hash_arrays(arrays, n):
+                    prev = {k: z[k] for k in _IND_KEYS}
+    except Exception:
+        prev = None
+
+    if prev is not None and n == m:
+        return prev
+
+    ctx = 2 * WARMUP
+    if prev is not None and n > ctx:
+        # 只追加尾端：rolling mean 從起點算（便宜），窗口函數帶前文只重算尾段，前 n 根沿用快取
+        means = _rolling_means(*(df[k].values for k in ('open', 'high', 'low', 'close')))
+        tail = compute_indicators(df.iloc[n - ctx:], means=tuple(a[n - ctx:] for a in means))
+        ind = {k: np.concatenate([prev[k], np.asarray(tail[k])[ctx:]]) for k in _IND_KEYS}
+    else:
+        ind = compute_indicators(df)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez(tmp, n=m, prefix_hash=_hash_arrays(arrays, m),
+                 **{k: np.asarray(ind[k]) for k in _IND_KEYS})
+        os.replace(tmp, path)
+    except Exception:
+        pass
+    return ind
+
+
+def _margin_scale(datetimes, margin_schedule, n):
+    """保證金時間表 → 每 bar 縮放係數（200U 基準）。
+
+    datetimes 依時間遞增，每段起點用 searchsorted 找（不逐列轉字串比對）：
+    字串陣列（CSV 讀進來的 'YYYY-MM-DD HH:MM:SS'）直接以字串比，datetime64 以時間比，
+    兩者都等同「str(bar 時間) >= 日期」。
+    """
+    scale = np.full(n, float(margin_schedule[0][1]) / 200.0)
+    dts = np.asarray(datetimes)
+    if dts.dtype.kind == 'M':
+        keys = [np.datetime64(pd.Timestamp(d)) for d, _ in margin_schedule[1:]]
+    elif dts.dtype.kind == 'U' or (n and isinstance(dts[0], str)):
+        keys = [str(d) for d, _ in margin_schedule[1:]]
+    else:  # Timestamp / datetime 物件
+        dts = pd.to_datetime(dts).values
+        keys = [np.datetime64(pd.Timestamp(d)) for d, _ in margin_schedule[1:]]
+    for key, (_, m) in zip(keys, margin_schedule[1:]):
+        scale[np.searchsorted(dts, key, side='left'):] = float(m) / 200.0
+    return scale
+
+
 def simulate_v14_detailed(ind, datetimes, start_bar=None,
                           realistic=False, slip_bps=0.0, margin_schedule=None):
     """Run V14 L+S simulation with full trade detail (MAE/MFE/GK pctile).
@@ -211,12 +341,7 @@ def simulate_v14_detailed(ind, datetimes, start_bar=None,
     n = len(o)
 
     # 保證金時間表 → 每 bar 的縮放係數（200U 基準；None = 全程 1.0 走原始常數路徑）
-    scale_arr = None
-    if margin_schedule:
-        dts = np.array([str(x) for x in datetimes])
-        scale_arr = np.full(n, float(margin_schedule[0][1]) / 200.0)
-        for d, m in margin_schedule[1:]:
-            scale_arr[dts >= d] = float(m) / 200.0
+    scale_arr = _margin_scale(datetimes, margin_schedule, n) if margin_schedule else None
 
     sim_start = max(start_bar, WARMUP) if start_bar is not None else WARMUP
 
@@ -505,13 +630,691 @@ def simulate_v14_detailed(ind, datetimes, start_bar=None,
     return trades
 
 
+# =========================================================================
+# 編譯版模擬核心（Numba，可選依賴）
+# simulate_v14_detailed 保持為「參考實作」（v27/v31 研究腳本會 patch 其原始碼），
+# simulate_v14_fast 為同一狀態機的 array-in/array-out 版本，輸出交易清單逐欄一致。
+# 沒裝 numba（或編譯失敗）→ 自動退回 simulate_v14_detailed，結果不變只是比較慢。
+# =========================================================================
+
+_REGIME_NAMES = ("NA", "UP", "SIDE", "DOWN", "MILD_UP")
+_REASON_NAMES = ("SN", "TP", "MFE", "MH", "BE", "MHx")
+
+try:
+    from strategy import R_TH_UP as _CLS_UP, R_TH_SIDE as _CLS_SIDE  # classify_regime 同源門檻
+except Exception:
+    _CLS_UP, _CLS_SIDE = 0.045, 0.010
+
+_fast_kernel = None      # lazy 編譯（第一次呼叫才 JIT；cache=True 跨進程重用）
+_fast_unavailable = False
+
+
+def _regime_code(s, th_up, th_side):
+    """_classify_regime 的代碼版（索引對應 _REGIME_NAMES；優先序相同）。"""
+    if np.isnan(s):
+        return 0
+    if s > th_up:
+        return 1
+    if abs(s) < th_side:
+        return 2
+    if s < -th_side:
+        return 3
+    return 4
+
+
+def _sim_kernel(o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, rblk_l, rblk_s,
+                slope, months, days, scale, sim_start, realistic, slip,
+                l_blk_h, l_blk_d, s_blk_h, s_blk_d,
+                l_tp_tab, l_mh_tab, s_mh_tab, fp, ip, out_f, out_i):
+    """逐 bar 狀態機（與 simulate_v14_detailed 同一順序、同一浮點運算）。
+
+    l_blk_h / s_blk_h（長 24）、l_blk_d / s_blk_d（長 7）：封鎖時段查表（True = 封鎖）。
+
+    fp（float 參數）：NOTIONAL, FEE, L_SN, L_SN_SLIP, L_MFE_ACT, L_MFE_TR, L_CMH_TH,
+                     S_TP, S_SN, S_SN_SLIP, CB_DAILY, CB_L_MONTH, CB_S_MONTH, L_GK_TH, S_GK_TH
+    ip（int 參數）：L_CMH_BAR, L_CMH_MH, L_EXT, S_EXT, L_CD, S_CD, L_CAP, S_CAP,
+                   CB_CONSEC, CB_CONSEC_CD
+    out_f 每列：entry_price, exit_price, pnl_pct, pnl, mfe, mae, gk_pctile, ntl
+    out_i 每列：side(0=L,1=S), entry_bar, exit_bar, reason, bars_held, regime
+    Returns: 交易筆數
+    """
+    NOTIONAL_, FEE_, L_SN_, L_SN_SLIP_, L_MFE_ACT_, L_MFE_TR_, L_CMH_TH_ = (
+        fp[0], fp[1], fp[2], fp[3], fp[4], fp[5], fp[6])
+    S_TP_, S_SN_, S_SN_SLIP_, CB_DAILY_, CB_L_MONTH_, CB_S_MONTH_ = (
+        fp[7], fp[8], fp[9], fp[10], fp[11], fp[12])
+    L_GK_TH_, S_GK_TH_, CLS_UP_, CLS_SIDE_ = fp[13], fp[14], fp[15], fp[16]
+    L_CMH_BAR_, L_CMH_MH_, L_EXT_, S_EXT_, L_CD_, S_CD_ = ip[0], ip[1], ip[2], ip[3], ip[4], ip[5]
+    L_CAP_, S_CAP_, CB_CONSEC_, CB_CONSEC_CD_ = ip[6], ip[7], ip[8], ip[9]
+
+    n = len(o)
+    nt = 0
+
+    lp_active = False
+    lp_entry = 0.0
+    lp_ntl = NOTIONAL_
+    lp_fee = FEE_
+    lp_bar = 0
+    lp_held = 0
+    lp_mfe = 0.0
+    lp_mae = 0.0
+    lp_reduced = False
+    lp_ext = False
+    lp_ext_bars = 0
+    lp_gk = 0.0
+    lp_regime = 0
+
+    sp_active = False
+    sp_entry = 0.0
+    sp_ntl = NOTIONAL_
+    sp_fee = FEE_
+    sp_bar = 0
+    sp_held = 0
+    sp_mfe = 0.0
+    sp_mae = 0.0
+    sp_ext = False
+    sp_ext_bars = 0
+    sp_gk = 0.0
+    sp_regime = 0
+
+    l_last_exit = -999
+    s_last_exit = -999
+    cur_month = -1
+    l_m_entries = 0
+    s_m_entries = 0
+    l_m_pnl = 0.0
+    s_m_pnl = 0.0
+    cur_day = -1
+    d_pnl = 0.0
+    consec = 0
+    consec_end = -999
+
+    for i in range(sim_start, n):
+        hi = h[i]
+        li = l[i]
+        ci = c[i]
+
+        if months[i] != cur_month:
+            cur_month = months[i]
+            l_m_entries = 0
+            s_m_entries = 0
+            l_m_pnl = 0.0
+            s_m_pnl = 0.0
+        if days[i] != cur_day:
+            cur_day = days[i]
+            d_pnl = 0.0
+
+        # --- L EXIT ---
+        if lp_active:
+            lp_held += 1
+            ep = lp_entry
+            bh = lp_held
+            bar_mfe = (hi - ep) / ep
+            bar_mae = (li - ep) / ep
+            if bar_mfe > lp_mfe:
+                lp_mfe = bar_mfe
+            if bar_mae < lp_mae:
+                lp_mae = bar_mae
+
+            ex_price = 0.0
+            ex_reason = -1
+            l_tp_eff = l_tp_tab[lp_regime]
+            l_mh_eff = l_mh_tab[lp_regime]
+            l_mkt = ci * (1 - slip) if realistic else ci
+
+            sn_lv = ep * (1 - L_SN_)
+            if li <= sn_lv:
+                ex_price = sn_lv - (sn_lv - li) * L_SN_SLIP_
+                ex_reason = 0
+            elif hi >= ep * (1 + l_tp_eff):
+                ex_price = l_mkt if realistic else ep * (1 + l_tp_eff)
+                ex_reason = 1
+            else:
+                cpnl = (ci - ep) / ep
+                if lp_mfe >= L_MFE_ACT_ and (lp_mfe - cpnl) >= L_MFE_TR_ and bh >= 1:
+                    ex_price = l_mkt
+                    ex_reason = 2
+                else:
+                    if bh == L_CMH_BAR_ and cpnl <= L_CMH_TH_:
+                        lp_reduced = True
+                    mh = L_CMH_MH_ if lp_reduced else l_mh_eff
+                    if not lp_ext:
+                        if bh >= mh:
+                            if cpnl > 0:
+                                lp_ext = True
+                                lp_ext_bars = 0
+                            else:
+                                ex_price = l_mkt
+                                ex_reason = 3
+                    else:
+                        lp_ext_bars += 1
+                        if li <= ep:
+                            ex_price = l_mkt if realistic else ep
+                            ex_reason = 4
+                        elif lp_ext_bars >= L_EXT_:
+                            ex_price = l_mkt
+                            ex_reason = 5
+
+            if ex_price > 0:
+                pnl_pct = (ex_price - ep) / ep
+                pnl = pnl_pct * lp_ntl - lp_fee
+                out_f[nt, 0] = ep
+                out_f[nt, 1] = ex_price
+                out_f[nt, 2] = pnl_pct
+                out_f[nt, 3] = pnl
+                out_f[nt, 4] = lp_mfe
+                out_f[nt, 5] = lp_mae
+                out_f[nt, 6] = lp_gk
+                out_f[nt, 7] = lp_ntl
+                out_i[nt, 0] = 0
+                out_i[nt, 1] = lp_bar
+                out_i[nt, 2] = i
+                out_i[nt, 3] = ex_reason
+                out_i[nt, 4] = bh
+                out_i[nt, 5] = lp_regime
+                nt += 1
+                lp_active = False
+                l_last_exit = i
+                l_m_pnl += pnl
+                d_pnl += pnl
+                if pnl < 0:
+                    consec += 1
+                else:
+                    consec = 0
+                if consec >= CB_CONSEC_:
+                    consec_end = i + CB_CONSEC_CD_
+
+        # --- S EXIT ---
+        if sp_active:
+            sp_held += 1
+            ep = sp_entry
+            bh = sp_held
+            bar_mfe = (ep - li) / ep
+            bar_mae = (ep - hi) / ep
+            if bar_mfe > sp_mfe:
+                sp_mfe = bar_mfe
+            if bar_mae < sp_mae:
+                sp_mae = bar_mae
+
+            ex_price = 0.0
+            ex_reason = -1
+            s_mh_eff = s_mh_tab[sp_regime]
+            s_mkt = ci * (1 + slip) if realistic else ci
+
+            sn_lv = ep * (1 + S_SN_)
+            if hi >= sn_lv:
+                ex_price = sn_lv + (hi - sn_lv) * S_SN_SLIP_
+                ex_reason = 0
+            elif li <= ep * (1 - S_TP_):
+                ex_price = s_mkt if realistic else ep * (1 - S_TP_)
+                ex_reason = 1
+            else:
+                cpnl = (ep - ci) / ep
+                if not sp_ext:
+                    if bh >= s_mh_eff:
+                        if cpnl > 0:
+                            sp_ext = True
+                            sp_ext_bars = 0
+                        else:
+                            ex_price = s_mkt
+                            ex_reason = 3
+                else:
+                    sp_ext_bars += 1
+                    if hi >= ep:
+                        ex_price = s_mkt if realistic else ep
+                        ex_reason = 4
+                    elif sp_ext_bars >= S_EXT_:
+                        ex_price = s_mkt
+                        ex_reason = 5
+
+            if ex_price > 0:
+                pnl_pct = (ep - ex_price) / ep
+                pnl = pnl_pct * sp_ntl - sp_fee
+                out_f[nt, 0] = ep
+                out_f[nt, 1] = ex_price
+                out_f[nt, 2] = pnl_pct
+                out_f[nt, 3] = pnl
+                out_f[nt, 4] = sp_mfe
+                out_f[nt, 5] = sp_mae
+                out_f[nt, 6] = sp_gk
+                out_f[nt, 7] = sp_ntl
+                out_i[nt, 0] = 1
+                out_i[nt, 1] = sp_bar
+                out_i[nt, 2] = i
+                out_i[nt, 3] = ex_reason
+                out_i[nt, 4] = bh
+                out_i[nt, 5] = sp_regime
+                nt += 1
+                sp_active = False
+                s_last_exit = i
+                s_m_pnl += pnl
+                d_pnl += pnl
+                if pnl < 0:
+                    consec += 1
+                else:
+                    consec = 0
+                if consec >= CB_CONSEC_:
+                    consec_end = i + CB_CONSEC_CD_
+
+        # --- ENTRY CHECKS ---
+        cbs = scale[i]
+        l_cb = (d_pnl <= CB_DAILY_ * cbs or l_m_pnl <= CB_L_MONTH_ * cbs or i < consec_end)
+        s_cb = (d_pnl <= CB_DAILY_ * cbs or s_m_pnl <= CB_S_MONTH_ * cbs or i < consec_end)
+
+        if (not lp_active and not l_cb and
+                i - l_last_exit >= L_CD_ and l_m_entries < L_CAP_ and
+                not l_blk_h[hours[i]] and not l_blk_d[dows[i]] and not rblk_l[i] and
+                not np.isnan(pL[i]) and pL[i] < L_GK_TH_ and brk_up[i]):
+            lp_active = True
+            lp_entry = ci * (1 + slip) if realistic else ci
+            lp_ntl = NOTIONAL_ * cbs
+            lp_fee = FEE_ * cbs
+            lp_bar = i
+            lp_held = 0
+            lp_mfe = 0.0
+            lp_mae = 0.0
+            lp_reduced = False
+            lp_ext = False
+            lp_ext_bars = 0
+            lp_gk = pL[i]
+            lp_regime = _regime_code(slope[i], CLS_UP_, CLS_SIDE_)
+            l_m_entries += 1
+
+        if (not sp_active and not s_cb and
+                i - s_last_exit >= S_CD_ and s_m_entries < S_CAP_ and
+                not s_blk_h[hours[i]] and not s_blk_d[dows[i]] and not rblk_s[i] and
+                not np.isnan(pS[i]) and pS[i] < S_GK_TH_ and brk_dn[i]):
+            sp_active = True
+            sp_entry = ci * (1 - slip) if realistic else ci
+            sp_ntl = NOTIONAL_ * cbs
+            sp_fee = FEE_ * cbs
+            sp_bar = i
+            sp_held = 0
+            sp_mfe = 0.0
+            sp_mae = 0.0
+            sp_ext = False
+            sp_ext_bars = 0
+            sp_gk = pS[i]
+            sp_regime = _regime_code(slope[i], CLS_UP_, CLS_SIDE_)
+            s_m_entries += 1
+
+    return nt
+
+
+def _get_fast_kernel():
+    """第一次呼叫才 JIT；numba 不可用或編譯失敗 → None（呼叫端退回 Python 版）。"""
+    global _fast_kernel, _fast_unavailable
+    if _fast_kernel is not None or _fast_unavailable:
+        return _fast_kernel
+    try:
+        from numba import njit
+    except ImportError:
+        _fast_unavailable = True
+        print("⚠️ numba 未安裝：回測退回純 Python 版（結果相同，但慢約 50 倍）"
+              " → pip install -r requirements-vps.txt", file=sys.stderr)
+        return None
+    global _regime_code
+    # 磁碟快取重載時 numba 以模組名 import 本模組：spec_from_file_location 載入但沒登記 sys.modules
+    # （run_backtest / 儀表板）或 exec 載入（v27/v31 patch 版）都 import 不到 → 第二次執行起 ModuleNotFoundError
+    mod = sys.modules.get(__name__)
+    cache = mod is not None and getattr(mod, '__dict__', None) is globals()
+    try:
+        _regime_code = njit(cache=cache)(_regime_code)
+        _fast_kernel = njit(cache=cache, nogil=True)(_sim_kernel)
+    except Exception:
+        try:  # exec 載入（v27/v31 patch 版）沒有可快取的來源檔 → 不快取
+            _regime_code = njit(_regime_code.py_func if hasattr(_regime_code, 'py_func')
+                                else _regime_code)
+            _fast_kernel = njit(nogil=True)(_sim_kernel)
+        except Exception as e:
+            _fast_unavailable = True
+            print(f"⚠️ numba 編譯失敗（{e}）：回測退回純 Python 版（結果相同，但慢約 50 倍）", file=sys.stderr)
+    return _fast_kernel
+
+
+def _block_table(blocked, size):
+    t = np.zeros(size, dtype=np.bool_)
+    t[list(blocked)] = True
+    return t
+
+
+_FP_NAMES = ('NOTIONAL', 'FEE', 'L_SN', 'L_SN_SLIP', 'L_MFE_ACT', 'L_MFE_TR', 'L_CMH_TH',
+             'S_TP', 'S_SN', 'S_SN_SLIP', 'CB_DAILY', 'CB_L_MONTH', 'CB_S_MONTH',
+             'L_GK_TH', 'S_GK_TH')
+_IP_NAMES = ('L_CMH_BAR', 'L_CMH_MH', 'L_EXT', 'S_EXT', 'L_CD', 'S_CD', 'L_CAP', 'S_CAP',
+             'CB_CONSEC', 'CB_CONSEC_CD')
+
+
+def _given(over, name, default):
+    """over[name]，缺值或 NaN（DataFrame 缺欄補出來的）→ default。"""
+    v = over.get(name)
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return default
+    return v
+
+
+def _param_arrays(over=None):
+    """kernel 參數陣列；over 可覆寫任一模組常數名（及 'L_TP@DOWN' 這類 regime 格）。"""
+    over = over or {}
+    g = globals()
+
+    def p(name):
+        return _given(over, name, g[name])
+
+    def tab(name, base_table):
+        return [_given(over, f"{name}@{r}", base_table.get(r, p(name))) for r in _REGIME_NAMES]
+
+    fp = np.array([p(k) for k in _FP_NAMES] + [_CLS_UP, _CLS_SIDE], dtype=np.float64)
+    ip = np.array([p(k) for k in _IP_NAMES], dtype=np.int64)
+    return dict(
+        l_tp_tab=np.array(tab('L_TP', _L_TP_BR), dtype=np.float64),
+        l_mh_tab=np.array(tab('L_MH', _L_MH_BR), dtype=np.int64),
+        s_mh_tab=np.array(tab('S_MH', _S_MH_BR), dtype=np.int64),
+        fp=fp, ip=ip,
+    )
+
+
+def _fast_inputs(ind, datetimes, start_bar, realistic, slip_bps, margin_schedule):
+    """把 ind dict + 目前模組常數（儀表板會 patch）轉成 kernel 的純陣列參數。"""
+    o, h, l, c = (np.ascontiguousarray(ind[k], dtype=np.float64) for k in ('o', 'h', 'l', 'c'))
+    n = len(o)
+    slope = ind.get('slope')
+    rblk_l = ind.get('regime_block_l')
+    rblk_s = ind.get('regime_block_s')
+
+    scale = _margin_scale(datetimes, margin_schedule, n) if margin_schedule else np.ones(n)
+
+    return dict(
+        o=o, h=h, l=l, c=c,
+        pL=np.ascontiguousarray(ind['pctile_L'], dtype=np.float64),
+        pS=np.ascontiguousarray(ind['pctile_S'], dtype=np.float64),
+        brk_up=np.asarray(ind['brk_up'], dtype=np.bool_),
+        brk_dn=np.asarray(ind['brk_dn'], dtype=np.bool_),
+        hours=np.asarray(ind['hours'], dtype=np.int64),
+        dows=np.asarray(ind['dows'], dtype=np.int64),
+        rblk_l=(np.asarray(rblk_l, dtype=np.bool_) if rblk_l is not None
+                else np.zeros(n, dtype=np.bool_)),
+        rblk_s=(np.asarray(rblk_s, dtype=np.bool_) if rblk_s is not None
+                else np.zeros(n, dtype=np.bool_)),
+        slope=(np.ascontiguousarray(slope, dtype=np.float64) if slope is not None
+               else np.full(n, np.nan)),
+        months=np.asarray(ind['months'], dtype=np.int64),
+        days=np.asarray(ind['days'], dtype=np.int64),
+        scale=scale,
+        sim_start=max(start_bar, WARMUP) if start_bar is not None else WARMUP,
+        realistic=bool(realistic),
+        slip=slip_bps / 10000.0,
+        l_blk_h=_block_table(L_BLK_H, 24), l_blk_d=_block_table(L_BLK_D, 7),
+        s_blk_h=_block_table(S_BLK_H, 24), s_blk_d=_block_table(S_BLK_D, 7),
+        **_param_arrays(),
+        out_f=np.empty((n + 1, 8)), out_i=np.empty((n + 1, 6), dtype=np.int64),  # kernel 每筆整列寫滿
+    )
+
+
+_KERNEL_ARGS = _sim_kernel.__code__.co_varnames[:_sim_kernel.__code__.co_argcount]
+
+
+def _round_like_python(a, nd):
+    """np.round 向量化，結果與內建 round(float, nd) 逐值相同（任意形狀 ndarray）。
+
+    np.round = rint(x·10^nd)/10^nd：只有 x·10^nd 貼近 .5 時（乘法誤差可能跨過進位點）
+    才可能與 Python 的十進位正確捨入不同，那幾個值改用內建 round 重算。
+    """
+    a = np.asarray(a, dtype=np.float64)
+    out = np.round(a, nd)
+    scaled = a * 10.0 ** nd
+    with np.errstate(invalid='ignore'):
+        near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for k in zip(*np.nonzero(near_half)):
+        out[k] = round(float(a[k]), nd)
+    return out
+
+
+def simulate_v14_fast(ind, datetimes, start_bar=None,
+                      realistic=False, slip_bps=0.0, margin_schedule=None):
+    """simulate_v14_detailed 的編譯版（參數、回傳的交易清單逐欄相同）。
+
+    每 bar 每方向最多一筆出場，且進出場不同 bar → 交易數 <= n，輸出陣列預配 n+1 列。
+    """
+    kernel = _get_fast_kernel()
+    if kernel is None:
+        return simulate_v14_detailed(ind, datetimes, start_bar=start_bar, realistic=realistic,
+                                     slip_bps=slip_bps, margin_schedule=margin_schedule)
+
+    args = _fast_inputs(ind, datetimes, start_bar, realistic, slip_bps, margin_schedule)
+    nt = kernel(*[args[k] for k in _KERNEL_ARGS])  # 位置參數：numba 以關鍵字呼叫 30 個參數的派發成本是 kernel 本身的數倍
+    out_f = args['out_f'][:nt]
+    out_i = args['out_i'][:nt]
+
+    # 逐欄處理（每欄一次 numpy 運算），最後以 dict 字面值組每筆（欄位順序同 simulate_v14_detailed）
+    dts = np.asarray(datetimes, dtype=object)
+    entry_dt = dts[out_i[:, 1]].tolist()
+    exit_dt = dts[out_i[:, 2]].tolist()
+    money = _round_like_python(np.column_stack((out_f[:, 7] / 20.0, out_f[:, 0], out_f[:, 1],
+                                                out_f[:, 3])), 2).T.tolist()
+    pcts = _round_like_python(out_f[:, [2, 4, 5]] * 100, 3).T.tolist()
+    cols = (
+        ['L' if x == 0 else 'S' for x in out_i[:, 0].tolist()],
+        money[0],
+        out_i[:, 1].tolist(),
+        out_i[:, 2].tolist(),
+        entry_dt,
+        exit_dt,
+        money[1],
+        money[2],
+        pcts[0],
+        money[3],
+        [_REASON_NAMES[x] for x in out_i[:, 3].tolist()],
+        out_i[:, 4].tolist(),
+        pcts[1],
+        pcts[2],
+        _round_like_python(out_f[:, 6], 1).tolist(),
+        [_REGIME_NAMES[x] for x in out_i[:, 5].tolist()],
+    )
+    return [{'side': sd, 'margin': mg, 'entry_bar': eb, 'exit_bar': xb, 'entry_dt': edt,
+             'exit_dt': xdt, 'entry_price': ep, 'exit_price': xp, 'pnl_pct': pp, 'pnl_usd': pu,
+             'exit_reason': rs, 'bars_held': bh, 'mfe_pct': mf, 'mae_pct': ma, 'gk_pctile': gk,
+             'entry_regime': rg}
+            for sd, mg, eb, xb, edt, xdt, ep, xp, pp, pu, rs, bh, mf, ma, gk, rg in zip(*cols)]
+
+
+def check_fast_parity(ind, datetimes, **kwargs):
+    """Python 參考版 vs 編譯版逐筆逐欄比對；回傳不一致描述清單（空 = 一致）。"""
+    ref = simulate_v14_detailed(ind, datetimes, **kwargs)
+    fast = simulate_v14_fast(ind, datetimes, **kwargs)
+    diffs = []
+    if len(ref) != len(fast):
+        diffs.append(f"trade count {len(ref)} vs {len(fast)}")
+    for k, (a, b) in enumerate(zip(ref, fast)):
+        for key in a:
+            if a[key] != b.get(key):
+                diffs.append(f"#{k} {key}: {a[key]!r} vs {b.get(key)!r}")
+    return diffs
+
+
+# =========================================================================
+# 參數網格批次模擬：指標 / 陣列前處理只做一次，N 組參數共用
+# param_table 欄位 = 模組常數名（L_TP, L_SN, L_MH, L_CD, L_GK_TH, L_MFE_ACT, L_MFE_TR,
+# S_TP, S_SN, S_MH, S_CD, S_GK_TH, R_TH_UP, R_TH_SIDE, …），另可用 'L_TP@DOWN'、
+# 'L_MH@MILD_UP'、'S_MH@UP' 覆寫 V25-D regime 格；沒給的欄位沿用目前模組值。
+# =========================================================================
+
+GRID_METRICS = ('n', 'n_l', 'n_s', 'pnl', 'pnl_l', 'pnl_s', 'wins', 'gross_win', 'gross_loss',
+                'max_dd', 'n_is', 'pnl_is', 'n_oos', 'pnl_oos')
+
+_grid_kernel = None
+
+
+def _grid_rows(bars, l_tp_tabs, l_mh_tabs, s_mh_tabs, fps, ips, r_th, use_rblk, split_bar,
+               row_lo, row_hi, metrics):
+    """第 row_lo..row_hi 組參數逐一跑狀態機，把績效寫進 metrics（交易明細不出 Python）。"""
+    (o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, slope, months, days, scale,
+     sim_start, realistic, slip, l_blk_h, l_blk_d, s_blk_h, s_blk_d) = bars
+    n = len(o)
+    for r in range(row_lo, row_hi):
+        _grid_one(o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, slope, months, days, scale,
+                  sim_start, realistic, slip, l_blk_h, l_blk_d, s_blk_h, s_blk_d,
+                  l_tp_tabs[r], l_mh_tabs[r], s_mh_tabs[r], fps[r], ips[r],
+                  r_th[r, 0], r_th[r, 1], use_rblk, split_bar, n, metrics[r])
+
+
+def _grid_one(o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, slope, months, days, scale,
+              sim_start, realistic, slip, l_blk_h, l_blk_d, s_blk_h, s_blk_d,
+              l_tp_tab, l_mh_tab, s_mh_tab, fp, ip, r_up, r_side, use_rblk, split_bar, n, m):
+    rblk_l = np.zeros(n, dtype=np.bool_)
+    rblk_s = np.zeros(n, dtype=np.bool_)
+    if use_rblk:
+        for i in range(n):
+            s = slope[i]
+            rblk_l[i] = s > r_up          # NaN 比較恆 False（同 compute_indicators 的 & ~isnan）
+            rblk_s[i] = abs(s) < r_side
+    out_f = np.zeros((n + 1, 8))
+    out_i = np.zeros((n + 1, 6), dtype=np.int64)
+    nt = _sim_kernel(o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, rblk_l, rblk_s,
+                     slope, months, days, scale, sim_start, realistic, slip,
+                     l_blk_h, l_blk_d, s_blk_h, s_blk_d,
+                     l_tp_tab, l_mh_tab, s_mh_tab, fp, ip, out_f, out_i)
+    for j in range(len(m)):
+        m[j] = 0.0
+    cum = 0.0
+    peak = -np.inf
+    for k in range(nt):
+        pnl = out_f[k, 3]
+        m[0] += 1
+        if out_i[k, 0] == 0:
+            m[1] += 1
+            m[4] += pnl
+        else:
+            m[2] += 1
+            m[5] += pnl
+        m[3] += pnl
+        if pnl > 0:
+            m[6] += 1
+            m[7] += pnl
+        elif pnl < 0:
+            m[8] -= pnl
+        cum += pnl
+        if cum > peak:
+            peak = cum
+        if peak - cum > m[9]:
+            m[9] = peak - cum
+        if out_i[k, 1] < split_bar:
+            m[10] += 1
+            m[11] += pnl
+        else:
+            m[12] += 1
+            m[13] += pnl
+
+
+def _get_grid_kernel():
+    """prange 多核版（numba parallel）；不可用 → None（呼叫端用同一份 Python 程式逐列跑）。"""
+    global _grid_kernel, _grid_one, _sim_kernel
+    if _grid_kernel is not None:
+        return _grid_kernel
+    if _get_fast_kernel() is None:
+        return None
+    try:
+        from numba import njit, prange
+
+        _sim_kernel = _fast_kernel          # 讓 _grid_one 編譯時綁到已 JIT 的狀態機
+        _grid_one = njit(nogil=True)(getattr(_grid_one, 'py_func', _grid_one))
+
+        def _grid_parallel(bars, l_tp_tabs, l_mh_tabs, s_mh_tabs, fps, ips, r_th, use_rblk,
+                           split_bar, metrics):
+            (o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, slope, months, days, scale,
+             sim_start, realistic, slip, l_blk_h, l_blk_d, s_blk_h, s_blk_d) = bars
+            n = len(o)
+            for r in prange(len(fps)):
+                _grid_one(o, h, l, c, pL, pS, brk_up, brk_dn, hours, dows, slope, months, days,
+                          scale, sim_start, realistic, slip, l_blk_h, l_blk_d, s_blk_h, s_blk_d,
+                          l_tp_tabs[r], l_mh_tabs[r], s_mh_tabs[r], fps[r], ips[r],
+                          r_th[r, 0], r_th[r, 1], use_rblk, split_bar, n, metrics[r])
+
+        _grid_kernel = njit(parallel=True)(_grid_parallel)
+    except Exception:
+        _grid_kernel = None
+    return _grid_kernel
+
+
+def simulate_grid(ind, param_table, datetimes=None, start_bar=None,
+                  realistic=False, slip_bps=0.0, margin_schedule=None, split_bar=None):
+    """N 組參數一次模擬，回傳每組績效表（pandas DataFrame，一列一組）。
+
+    Args:
+        ind: compute_indicators(df) 的結果（指標只算一次；BRK lookback 以 ind 為準）
+        param_table: DataFrame 或 list[dict]，欄位見上方說明
+        datetimes: 只有 margin_schedule 需要（依日期決定保證金）
+        split_bar: IS/OOS 分界（依進場 bar）；預設 n//2（與研究腳本一致）
+    Returns:
+        param_table 各欄 + GRID_METRICS + win_rate / profit_factor
+        （pnl 為未四捨五入值；單組結果與 simulate_v14_fast 交易加總一致到分以下）
+    """
+    table = pd.DataFrame(param_table).reset_index(drop=True)
+    k = len(table)
+    base = _fast_inputs(ind, datetimes if datetimes is not None else np.zeros(len(ind['c'])),
+                        start_bar, realistic, slip_bps, margin_schedule)
+    n = len(base['o'])
+    bars = tuple(base[key] for key in (
+        'o', 'h', 'l', 'c', 'pL', 'pS', 'brk_up', 'brk_dn', 'hours', 'dows', 'slope',
+        'months', 'days', 'scale', 'sim_start', 'realistic', 'slip',
+        'l_blk_h', 'l_blk_d', 's_blk_h', 's_blk_d'))
+
+    rows = table.to_dict('records')
+    per = [_param_arrays(row) for row in rows]
+    l_tp_tabs = np.array([p['l_tp_tab'] for p in per]).reshape(k, len(_REGIME_NAMES))
+    l_mh_tabs = np.array([p['l_mh_tab'] for p in per], dtype=np.int64).reshape(k, len(_REGIME_NAMES))
+    s_mh_tabs = np.array([p['s_mh_tab'] for p in per], dtype=np.int64).reshape(k, len(_REGIME_NAMES))
+    fps = np.array([p['fp'] for p in per]).reshape(k, len(_FP_NAMES) + 2)
+    ips = np.array([p['ip'] for p in per], dtype=np.int64).reshape(k, len(_IP_NAMES))
+    r_th = np.array([[_given(row, 'R_TH_UP', R_TH_UP), _given(row, 'R_TH_SIDE', R_TH_SIDE)]
+                     for row in rows], dtype=np.float64).reshape(k, 2)
+    use_rblk = ind.get('regime_block_l') is not None and ind.get('slope') is not None
+    split = int(split_bar) if split_bar is not None else n // 2
+    metrics = np.zeros((k, len(GRID_METRICS)))
+
+    if k:
+        kernel = _get_grid_kernel()
+        if kernel is not None:
+            kernel(bars, l_tp_tabs, l_mh_tabs, s_mh_tabs, fps, ips, r_th, use_rblk, split, metrics)
+        else:
+            _grid_rows(bars, l_tp_tabs, l_mh_tabs, s_mh_tabs, fps, ips, r_th, use_rblk, split,
+                       0, k, metrics)
+
+    res = pd.concat([table, pd.DataFrame(metrics, columns=list(GRID_METRICS))], axis=1)
+    for col in ('n', 'n_l', 'n_s', 'wins', 'n_is', 'n_oos'):
+        res[col] = res[col].astype(int)
+    res['win_rate'] = np.where(res['n'] > 0, res['wins'] / res['n'].clip(lower=1) * 100, 0.0)
+    res['profit_factor'] = np.where(res['gross_loss'] > 0,
+                                    res['gross_win'] / res['gross_loss'].where(res['gross_loss'] > 0, 1),
+                                    999.0)
+    return res
+
+
 if __name__ == '__main__':
+    import time
+
     filepath = os.path.join(DATA_DIR, 'ETHUSDT_1h_latest730d.csv')
     df = pd.read_csv(filepath)
     print(f"ETHUSDT: {len(df)} bars, {df['datetime'].iloc[0]} ~ {df['datetime'].iloc[-1]}")
 
     ind = compute_indicators(df)
     datetimes = df['datetime'].values
+
+    if '--parity' in sys.argv:
+        # 編譯核心 vs Python 參考版（理想化 / 貼近實盤+滑價+保證金表 三種組合）
+        sched = [("2000-01-01", 200), (str(datetimes[len(df) // 2])[:10], 500)]
+        for kw in ({}, {'realistic': True}, {'realistic': True, 'slip_bps': 3.0,
+                                             'margin_schedule': sched}):
+            simulate_v14_fast(ind, datetimes, **kw)  # 暖機（JIT）
+            t0 = time.perf_counter()
+            simulate_v14_detailed(ind, datetimes, **kw)
+            t_ref = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            simulate_v14_fast(ind, datetimes, **kw)
+            t_fast = time.perf_counter() - t0
+            diffs = check_fast_parity(ind, datetimes, **kw)
+            print(f"{kw or 'ideal'}: {'PARITY OK' if not diffs else diffs[:5]} "
+                  f"| ref {t_ref*1000:.1f}ms fast {t_fast*1000:.2f}ms (x{t_ref/max(t_fast,1e-9):.0f})")
+        sys.exit(0)
     trades = simulate_v14_detailed(ind, datetimes)
 
     print(f"Total trades: {len(trades)}")
@@ -10,8 +10,8 @@ Usage: python backtest/research/v19_r0_download_data.py
 
 import requests
 import pandas as pd
-import time
 import os
+import sys
 from datetime import datetime, timedelta
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,6 +20,12 @@ BINANCE_BASE = "https://fapi.binance.com"
 SYMBOL = "ETHUSDT"
 DAYS_BACK = 730
 
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', '..'))
+import kline_downloader  # noqa: E402
+
+# /futures/data/* 另有 IP 限制（1000 次 / 5 分鐘），與 klines 的 weight 額度分開計
+_DATA_BUCKET = kline_downloader.TokenBucket(rate_per_min=200, capacity=20)
+
 
 # =========================================================================
 # Part A: Binance Futures Market Data
@@ -34,7 +40,6 @@ def download_binance_series(endpoint, symbol, period, label, days_back=DAYS_BACK
     end_ms = int(datetime.utcnow().timestamp() * 1000)
     start_ms = int((datetime.utcnow() - timedelta(days=days_back)).timestamp() * 1000)
     cursor = start_ms
-    retries = 0
 
     while cursor < end_ms:
         params = {
@@ -42,24 +47,11 @@ def download_binance_series(endpoint, symbol, period, label, days_back=DAYS_BACK
             'limit': 500, 'startTime': cursor, 'endTime': end_ms,
         }
         try:
-            resp = requests.get(url, params=params, timeout=30)
+            data = kline_downloader.request_json(url, params, _DATA_BUCKET, max_retries=4,
+                                                 timeout=30)
         except Exception as e:
-            print(f"  Request error: {e}")
-            retries += 1
-            if retries > 3:
-                break
-            time.sleep(2)
-            continue
-
-        if resp.status_code == 429:
-            print("  Rate limited, waiting 60s...")
-            time.sleep(60)
-            continue
-        if resp.status_code != 200:
-            print(f"  Error {resp.status_code}: {resp.text[:200]}")
+            print(f"  Error: {str(e)[:200]}")
             break
-
-        data = resp.json()
         if not data:
             break
 
@@ -67,7 +59,6 @@ def download_binance_series(endpoint, symbol, period, label, days_back=DAYS_BACK
         cursor = data[-1].get('timestamp', 0) + 1
         if len(data) < 500:
             break
-        time.sleep(0.3)
 
     if not all_data:
         print(f"  NO DATA returned")
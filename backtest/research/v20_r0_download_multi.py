@@ -4,75 +4,35 @@ V20 R0: Download multi-asset 1h klines from Binance Futures
 Downloads 730 days of 1h data for 10 candidate symbols.
 """
 
-import requests
 import pandas as pd
-import time
 import os
-from datetime import datetime, timedelta
+import sys
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data')
-BASE_URL = "https://fapi.binance.com"
 DAYS_BACK = 730
 
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', '..'))
+import kline_downloader  # noqa: E402
+
 SYMBOLS = [
     'SOLUSDT', 'BNBUSDT', 'XRPUSDT', 'DOGEUSDT', 'ADAUSDT',
     'AVAXUSDT', 'LINKUSDT', 'MATICUSDT', 'LTCUSDT', 'BCHUSDT',
 ]
 
 
-def download_klines(symbol, days_back=DAYS_BACK):
-    """Download 1h klines with pagination (1500 bars/request)."""
-    url = f"{BASE_URL}/fapi/v1/klines"
-    all_data = []
-    end_ms = int(datetime.utcnow().timestamp() * 1000)
-    start_ms = int((datetime.utcnow() - timedelta(days=days_back)).timestamp() * 1000)
-    cursor = start_ms
-
-    while cursor < end_ms:
-        params = {'symbol': symbol, 'interval': '1h', 'limit': 1500,
-                  'startTime': cursor, 'endTime': end_ms}
-        try:
-            resp = requests.get(url, params=params, timeout=30)
-        except Exception as e:
-            print(f"  Request error: {e}")
-            break
-
-        if resp.status_code == 429:
-            print("  Rate limited, waiting 30s...")
-            time.sleep(30)
-            continue
-        if resp.status_code != 200:
-            print(f"  Error {resp.status_code}: {resp.text[:150]}")
-            return None
-
-        data = resp.json()
-        if not data:
-            break
-
-        all_data.extend(data)
-        cursor = data[-1][0] + 1
-        if len(data) < 1500:
-            break
-        time.sleep(0.3)
-
-    if not all_data:
+def download_klines(symbol, days_back=DAYS_BACK, prefetched=None):
+    """1h klines via kline_downloader (concurrent pages, shared rate limit, resumable)."""
+    res = (prefetched or {}).get((symbol, '1h'))
+    if res is None:
+        res = kline_downloader.download_many([symbol], ['1h'], days_back)[(symbol, '1h')]
+    if isinstance(res, Exception):
+        print(f"  Error: {res}")
+        return None
+    df = kline_downloader.history_frame(res, days_back)
+    if df.empty:
         print(f"  NO DATA for {symbol}")
         return None
-
-    df = pd.DataFrame(all_data, columns=[
-        'open_time', 'open', 'high', 'low', 'close', 'volume',
-        'close_time', 'quote_volume', 'trades', 'taker_buy_volume',
-        'taker_buy_quote_volume', 'ignore'])
-
-    df['datetime'] = pd.to_datetime(df['open_time'], unit='ms') + pd.Timedelta(hours=8)
-    df['datetime'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-    for col in ['open', 'high', 'low', 'close', 'volume', 'taker_buy_volume']:
-        df[col] = df[col].astype(float)
-
-    df = df[['open', 'high', 'low', 'close', 'volume', 'taker_buy_volume', 'datetime']]
-    df = df.drop_duplicates(subset=['datetime']).sort_values('datetime').reset_index(drop=True)
     return df
 
 
@@ -80,6 +40,13 @@ if __name__ == '__main__':
     print(f"V20 R0: Download Multi-Asset 1h Data ({DAYS_BACK} days)")
     print(f"Output: {os.path.abspath(DATA_DIR)}\n")
 
+    # 缺的幣種一次並行抓完（MATIC 已改名 POL，一併預抓）
+    missing = [s for s in SYMBOLS
+               if not os.path.exists(os.path.join(DATA_DIR, f'{s}_1h_latest730d.csv'))]
+    if 'MATICUSDT' in missing:
+        missing.append('POLUSDT')
+    fetched = kline_downloader.download_many(missing, ['1h'], DAYS_BACK) if missing else {}
+
     results = {}
     for symbol in SYMBOLS:
         filename = f'{symbol}_1h_latest730d.csv'
@@ -92,7 +59,7 @@ if __name__ == '__main__':
             continue
 
         print(f"{symbol}: downloading...", end=' ', flush=True)
-        df = download_klines(symbol)
+        df = download_klines(symbol, prefetched=fetched)
         if df is not None:
             df.to_csv(filepath, index=False)
             days = len(df) / 24
@@ -102,7 +69,7 @@ if __name__ == '__main__':
             # Try alternative symbol name (e.g., MATIC → POL)
             if symbol == 'MATICUSDT':
                 print("  Trying POLUSDT instead...")
-                df = download_klines('POLUSDT')
+                df = download_klines('POLUSDT', prefetched=fetched)
                 if df is not None:
                     alt_path = os.path.join(DATA_DIR, 'POLUSDT_1h_latest730d.csv')
                     df.to_csv(alt_path, index=False)
@@ -17,6 +17,8 @@ import numpy as np
 import pandas as pd
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import funding_store  # noqa: E402
 from v25_engine import (load_data, build_slope, build_r_gate, run_v25, stats_from)
 
 # V25-D 線上參數
@@ -30,32 +32,41 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'data')
 
 
+def _load_funding():
+    """本地 funding_store（只讀不連網）；庫是空的才退回 v30_r0 輸出的 CSV"""
+    store = funding_store.open_store('ETHUSDT')
+    if len(store):
+        return np.array(store.times()), np.array(store.rates())
+    fu = pd.read_csv(os.path.join(DATA_DIR, 'ETHUSDT_funding.csv'))
+    return fu['funding_time_ms'].values, fu['rate'].values  # UTC ms
+
+
 def build_funding_features(dt_utc8):
     """回傳與 1h bars 對齊的 fr_last / fr_ma21 / fr_pct（bar close 時已知）"""
-    fu = pd.read_csv(os.path.join(DATA_DIR, 'ETHUSDT_funding.csv'))
-    f_ts = fu['funding_time_ms'].values  # UTC ms
-    f_rate = fu['rate'].values
+    f_ts, f_rate = _load_funding()
 
     # bar close (UTC ms) = open(UTC+8) - 8h + 1h
     close_ms = ((dt_utc8 - pd.Timedelta(hours=8) + pd.Timedelta(hours=1))
                 .astype('datetime64[ms]').astype('int64')).values
 
-    n = len(close_ms)
-    fr_last = np.full(n, np.nan)
-    fr_ma21 = np.full(n, np.nan)
-    fr_pct = np.full(n, np.nan)
-    j = -1  # index of last funding event with ts <= close
-    for i in range(n):
-        while j + 1 < len(f_ts) and f_ts[j + 1] <= close_ms[i]:
-            j += 1
-        if j < 0:
-            continue
-        fr_last[i] = f_rate[j]
-        if j >= 20:
-            fr_ma21[i] = f_rate[j - 20:j + 1].mean()
-        if j >= 269:
-            win = f_rate[j - 269:j + 1]
-            fr_pct[i] = (win <= f_rate[j]).sum() / len(win) * 100
+    # 先在 funding 序列上算每一筆的特徵，再用 as-of index（searchsorted）貼到 bar
+    m = len(f_rate)
+    ev_ma21 = np.full(m, np.nan)
+    ev_pct = np.full(m, np.nan)
+    if m >= 21:
+        ev_ma21[20:] = np.lib.stride_tricks.sliding_window_view(f_rate, 21).mean(axis=1)
+    if m >= 270:
+        win = np.lib.stride_tricks.sliding_window_view(f_rate, 270)
+        ev_pct[269:] = (win <= win[:, -1:]).sum(axis=1) / 270 * 100
+
+    j = np.searchsorted(f_ts, close_ms, side='right') - 1  # last funding event with ts <= close
+    ok = j >= 0
+    fr_last = np.full(len(close_ms), np.nan)
+    fr_ma21 = np.full(len(close_ms), np.nan)
+    fr_pct = np.full(len(close_ms), np.nan)
+    fr_last[ok] = f_rate[j[ok]]
+    fr_ma21[ok] = ev_ma21[j[ok]]
+    fr_pct[ok] = ev_pct[j[ok]]
     return fr_last, fr_ma21, fr_pct
 
 
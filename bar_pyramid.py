@@ -0,0 +1,186 @@
+"""
+多時框 K 線金字塔 — 只下載一個細粒度基底（預設 15m），30m / 1h / 2h / 4h … 由它向量化重取樣。
+
+研究要 15m、30m、2h、4h 的 ETH bar（v10_r6、v13_r1、v18_r1、ETHUSDT_4h_latest730d.csv），
+原本每個時框各抓各的、各存一份 CSV，彼此可能對不上（抓的時間點不同、缺口不同）。
+
+  - 基底：kline_store 的 <SYM>_<base> 庫（kline_downloader 並行補齊）
+  - 衍生：cache/pyramid/from_<base>/<SYM>_<target>/，同樣是 KlineStore 欄位檔
+  - 對齊：bucket = open_time - open_time % target（epoch / UTC 對齊，同 Binance 原生 K 線；
+          2h / 4h 在 UTC+8 也剛好對齊整點）
+  - 聚合：open=第一根、high=max、low=min、close=最後一根、volume / taker_buy_volume=加總
+          （np.*.reduceat，一次處理整段）
+  - 增量：只重取樣衍生庫最後一根之後的基底 bar；最後一個 bucket 還沒收完（基底最後一根
+          沒收到 bucket 結尾）就先不寫，下次再補 → 衍生 bar 永遠是完整、定稿的
+  - 基底缺口（Binance 停機）照樣聚合成一根，與 Binance 原生 K 線行為一致
+  - 基底被重建（起點往前延伸）→ 衍生庫自動重建
+
+用法：
+    python bar_pyramid.py ETHUSDT --base 15m --targets 30m 1h 2h 4h --days 730
+    python bar_pyramid.py ETHUSDT --targets 4h --csv          # 另輸出 data/ETHUSDT_4h_latest730d.csv
+    python bar_pyramid.py ETHUSDT --base 15m --check 1h       # 與 Binance 原生 1h 庫逐根比對
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import paths
+import kline_store
+from kline_store import KlineStore, interval_ms
+
+logger = logging.getLogger("bar_pyramid")
+
+BASE_INTERVAL = os.getenv("PYRAMID_BASE", "15m")
+PYRAMID_DIR = os.path.join(paths.CODE_DIR, "cache", "pyramid")
+
+_FIELDS = ("open_time", "open", "high", "low", "close", "volume", "taker_buy_volume")
+
+
+def resample_columns(cols: dict, base_step: int, target_step: int) -> tuple:
+    """
+    基底欄位陣列（open_time 遞增）→ 衍生時框欄位陣列。
+
+    Returns:
+        (out, last_complete)：out 為 {欄位: 陣列}；last_complete=False 表示最後一個 bucket 尚未收完
+    """
+    if target_step % base_step:
+        raise ValueError(f"target {target_step}ms is not a multiple of base {base_step}ms")
+    ot = np.asarray(cols["open_time"], dtype=np.int64)
+    if not len(ot):
+        return {f: np.empty(0, dtype=np.int64 if f == "open_time" else np.float64) for f in _FIELDS}, True
+    bucket = ot - ot % target_step
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(ot)] - 1
+    out = {
+        "open_time": bucket[starts],
+        "open": np.asarray(cols["open"], dtype=np.float64)[starts],
+        "high": np.maximum.reduceat(np.asarray(cols["high"], dtype=np.float64), starts),
+        "low": np.minimum.reduceat(np.asarray(cols["low"], dtype=np.float64), starts),
+        "close": np.asarray(cols["close"], dtype=np.float64)[ends],
+        "volume": np.add.reduceat(np.asarray(cols["volume"], dtype=np.float64), starts),
+        "taker_buy_volume": np.add.reduceat(np.asarray(cols["taker_buy_volume"], dtype=np.float64), starts),
+    }
+    last_complete = bool(ot[-1] + base_step >= bucket[-1] + target_step)
+    return out, last_complete
+
+
+def _slice(cols: dict, lo: int, hi: int = None) -> dict:
+    return {f: cols[f][lo:hi] for f in _FIELDS}
+
+
+_derived = {}
+
+
+def derived_store(symbol: str, target: str, base: str = None) -> KlineStore:
+    """衍生時框庫（進程內共用，不更新）"""
+    base = base or BASE_INTERVAL
+    key = (symbol, target, base)
+    if key not in _derived:
+        _derived[key] = KlineStore(symbol, target, root=os.path.join(PYRAMID_DIR, f"from_{base}"))
+    return _derived[key]
+
+
+def update(symbol: str, target: str, base: str = None, base_store: KlineStore = None) -> KlineStore:
+    """
+    以基底庫增量更新衍生時框庫；target == base 直接回傳基底庫。
+    只讀基底庫，不連網（基底由 kline_downloader / top_up 負責）。
+    """
+    base = base or BASE_INTERVAL
+    src = base_store or kline_store.open_store(symbol, base)
+    if target == base:
+        return src
+    step, tstep = interval_ms(base), interval_ms(target)
+    dst = derived_store(symbol, target, base)
+    cols = {f: src.column(f) for f in _FIELDS}
+    ot = cols["open_time"]
+    if not len(ot):
+        return dst
+
+    first_full = -(-int(ot[0]) // tstep) * tstep  # 基底涵蓋的第一個完整 bucket
+    d_first, d_last = dst.first_open_time, dst.last_open_time
+    if d_first is not None and (d_first > first_full or d_last > int(ot[-1])):
+        logger.info(f"{symbol} {target} (from {base}) out of sync with base store → rebuild")
+        dst.reset()
+        d_last = None
+
+    lo = int(np.searchsorted(ot, first_full if d_last is None else d_last + tstep, side="left"))
+    if lo >= len(ot):
+        return dst
+    out, last_complete = resample_columns(_slice(cols, lo), step, tstep)
+    if not last_complete:
+        out = {f: a[:-1] for f, a in out.items()}
+    n = dst.append_columns(out)
+    if n:
+        logger.debug(f"{symbol} {target} (from {base}): +{n} bars")
+    return dst
+
+
+def frame(symbol: str, target: str, base: str = None, start=None, end=None,
+          tail: int = None, str_datetime: bool = False) -> pd.DataFrame:
+    """衍生時框 DataFrame（先增量更新；格式同 KlineStore.to_frame / 回測 CSV）"""
+    return update(symbol, target, base).to_frame(start=start, end=end, tail=tail,
+                                                 str_datetime=str_datetime)
+
+
+def build(symbol: str, targets, base: str = None, days: int = 730, download: bool = True) -> dict:
+    """下載（或只讀）基底，再更新所有 targets。回傳 {target: KlineStore}"""
+    base = base or BASE_INTERVAL
+    if download:
+        import kline_downloader
+        kline_downloader.download(symbol, base, days)
+    src = kline_store.open_store(symbol, base)
+    return {t: update(symbol, t, base, src) for t in targets}
+
+
+def compare(a: KlineStore, b: KlineStore, rtol: float = 1e-9) -> dict:
+    """兩個同時框庫在共同 open_time 上逐欄比對（衍生 vs Binance 原生），回傳各欄不一致根數"""
+    ta, tb = a.column("open_time"), b.column("open_time")
+    common, ia, ib = np.intersect1d(ta, tb, return_indices=True)
+    res = {"bars": len(common)}
+    for f in _FIELDS[1:]:
+        x, y = np.asarray(a.column(f))[ia], np.asarray(b.column(f))[ib]
+        res[f] = int((~np.isclose(x, y, rtol=rtol, atol=1e-12)).sum())
+    return res
+
+
+def main():
+    try:
+        sys.stdout.reconfigure(encoding="utf-8")
+    except (AttributeError, ValueError):
+        pass
+    ap = argparse.ArgumentParser(description="由單一基底時框重取樣出多時框 K 線")
+    ap.add_argument("symbols", nargs="*", default=["ETHUSDT"])
+    ap.add_argument("--base", default=BASE_INTERVAL)
+    ap.add_argument("--targets", nargs="+", default=["30m", "1h", "2h", "4h"])
+    ap.add_argument("--days", type=int, default=730)
+    ap.add_argument("--offline", action="store_true", help="不下載，只用現有基底庫")
+    ap.add_argument("--csv", action="store_true", help="另輸出 data/<SYM>_<target>_latest730d.csv")
+    ap.add_argument("--check", help="與 Binance 原生庫（kline_store）比對的時框，例如 1h")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    for sym in args.symbols:
+        t0 = time.time()
+        stores = build(sym, args.targets, args.base, args.days, download=not args.offline)
+        print(f"{sym}（基底 {args.base}，{time.time() - t0:.1f}s）")
+        for t, st in stores.items():
+            line = f"  {t}: {len(st)} 根"
+            if args.csv:
+                import kline_downloader
+                df = kline_downloader.history_frame(st, args.days)
+                os.makedirs(kline_downloader.DATA_DIR, exist_ok=True)
+                df.to_csv(kline_downloader.csv_path(sym, t), index=False)
+                line += f" → {kline_downloader.csv_path(sym, t)}"
+            print(line)
+        if args.check:
+            res = compare(update(sym, args.check, args.base), kline_store.open_store(sym, args.check))
+            print(f"  {args.check} 衍生 vs 原生：{res}")
+
+
+if __name__ == "__main__":
+    main()
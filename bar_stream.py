@@ -0,0 +1,255 @@
+"""
+K 線 WebSocket 收盤觸發 — 訂閱 <symbol>@kline_<interval>，收到 x=true（該根已收盤）事件就喚醒主循環。
+
+原本主循環睡到整點 +10s 再打 REST，進出場比回測假設的收盤價晚 10–15 秒成交；
+改成收盤事件一到（通常整點後 < 1s）就跑 cycle。
+
+  - 選用：BAR_STREAM=1 才啟用；websocket-client 沒裝（binance-futures-connector 會帶）→ 不啟用
+  - fail-open：斷線 / 事件遺失 → 主循環最晚在整點 +offset 照原 REST 時程跑，絕不漏 bar
+  - 去重：同一根 bar（重連後重送）只觸發一次；主循環再對 executor.last_bar_time 比一次
+  - 收盤事件的 K 線轉成 REST 陣列格式（可直接 kline_store.append）
+
+離線驗證（不連網，用 CSV / K 線庫重播成 WS 訊息）：
+    python bar_stream.py --replay data/ETHUSDT_1h_latest730d.csv --bars 5 --speed 3600
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+
+import pandas as pd
+
+try:
+    import websocket  # websocket-client（binance-futures-connector 依賴）
+except ImportError:
+    websocket = None
+
+logger = logging.getLogger("bar_stream")
+
+WS_BASE = "wss://fstream.binance.com/ws"
+_RECONNECT_MAX = 60  # 重連退避上限（秒）
+
+UTC8_MS = 8 * 3600 * 1000
+
+
+def enabled() -> bool:
+    """BAR_STREAM=1 且 websocket-client 可用"""
+    return os.getenv("BAR_STREAM", "0").strip() == "1" and websocket is not None
+
+
+def kline_from_event(k: dict) -> list:
+    """WS kline 物件 → REST /fapi/v1/klines 陣列格式"""
+    return [int(k["t"]), k["o"], k["h"], k["l"], k["c"], k["v"], int(k["T"]),
+            k.get("q", "0"), int(k.get("n", 0)), k.get("V", "0"), k.get("Q", "0"), "0"]
+
+
+def bar_time_str(kline: list) -> str:
+    """K 線 open_time → UTC+8 字串（與主循環 executor.last_bar_time 同格式）"""
+    return str(pd.Timestamp(int(kline[0]) + UTC8_MS, unit="ms"))
+
+
+class WsStream:
+    """Binance 單一串流的 WebSocket 連線（背景執行緒、斷線指數退避重連）；子類別實作 feed(msg)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._stop = threading.Event()
+        self._thread = None
+        self._ws = None
+        self.connected = False
+        self.last_msg_ts = 0.0
+
+    def feed(self, msg):
+        raise NotImplementedError
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        try:
+            if self._ws is not None:
+                self._ws.close()
+        except Exception:
+            pass
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self._ws = websocket.WebSocketApp(
+                    self.url,
+                    on_open=lambda ws: self._set_connected(True),
+                    on_message=lambda ws, m: self.feed(m),
+                    on_close=lambda ws, *a: self._set_connected(False),
+                    on_error=lambda ws, e: logger.warning(f"stream error {self.url}: {e}"),
+                )
+                t0 = time.time()
+                # Binance 每 3 分鐘 ping，websocket-client 自動回 pong；24h 會被斷線 → 重連
+                self._ws.run_forever()
+                if time.time() - t0 > 60:
+                    backoff = 1
+            except Exception as e:
+                logger.warning(f"stream crashed {self.url}: {e}")
+            self._set_connected(False)
+            if self._stop.wait(backoff):
+                break
+            backoff = min(backoff * 2, _RECONNECT_MAX)
+
+    def _set_connected(self, ok: bool):
+        if ok != self.connected:
+            logger.info(f"stream {'connected' if ok else 'disconnected'}: {self.url}")
+        self.connected = ok
+
+
+class BarCloseStream(WsStream):
+    """收盤事件接收器：feed() 吃 WS 訊息，wait_closed() 等下一根未消化的收盤 bar"""
+
+    def __init__(self, symbol: str = "ETHUSDT", interval: str = "1h", url: str = None):
+        super().__init__(url or f"{WS_BASE}/{symbol.lower()}@kline_{interval}")
+        self.symbol = symbol
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending = None       # 尚未被主循環取走的最新收盤 bar
+        self._last_open = -1       # 已收過的最大 open_time（去重）
+
+    # ── 事件處理（WS 與 replay 共用）──
+
+    def feed(self, msg):
+        """處理一則 WS 訊息；是新的收盤 bar 就回傳 REST 格式陣列，否則 None"""
+        self.last_msg_ts = time.time()
+        if isinstance(msg, (str, bytes)):
+            try:
+                msg = json.loads(msg)
+            except ValueError:
+                return None
+        k = (msg or {}).get("k")
+        if not k or not k.get("x"):
+            return None
+        kline = kline_from_event(k)
+        with self._cond:
+            if kline[0] <= self._last_open:
+                return None  # 重連重送 / 重複事件
+            self._last_open = kline[0]
+            self._pending = kline
+            self._cond.notify_all()
+        return kline
+
+    def wait_closed(self, deadline: float):
+        """等到有未消化的收盤 bar（回傳並清除）或到 deadline（epoch 秒，回傳 None）"""
+        with self._cond:
+            while self._pending is None:
+                remain = deadline - time.time()
+                if remain <= 0:
+                    return None
+                self._cond.wait(min(remain, 5.0))
+            k, self._pending = self._pending, None
+            return k
+
+
+def hour_deadline(offset_seconds: float = 10) -> float:
+    """下一個整點 + offset_seconds 的 epoch 秒"""
+    now = time.time()
+    return (now // 3600 + 1) * 3600 + offset_seconds
+
+
+def wait_bar_close(stream, last_bar_time: str = None, offset_seconds: float = 10):
+    """
+    等下一根未處理的收盤事件，最晚到整點 + offset_seconds。
+    stream 為 None → 直接睡到該時間。
+
+    Returns:
+        收盤 bar（REST 陣列格式）；逾時 / 無 stream 為 None（呼叫端照 REST 時程）
+    """
+    deadline = hour_deadline(offset_seconds)
+    if stream is None:
+        time.sleep(max(0.0, deadline - time.time()))
+        return None
+    while True:
+        k = stream.wait_closed(deadline)
+        if k is None:
+            logger.warning(f"No bar-close event by {offset_seconds}s after the hour "
+                           f"(stream {'up' if stream.connected else 'down'}), using REST schedule")
+            return None
+        if bar_time_str(k) == last_bar_time:
+            continue  # 已處理過（重啟 / 重連重送）
+        lag = time.time() - (int(k[6]) + 1) / 1000
+        logger.info(f"Bar-close event {bar_time_str(k)} UTC+8 (+{lag:.2f}s after close)")
+        return k
+
+
+class ReplayBarStream(BarCloseStream):
+    """離線替身：把已收盤 K 線依序轉成 WS kline 訊息餵進 feed()。
+
+    每根 bar 先送一則 x=false（形成中）再送 x=true（收盤），
+    兩根之間睡 interval / speed 秒（speed=3600 → 1h bar 每秒一根）。
+    """
+
+    def __init__(self, klines: list, symbol: str = "ETHUSDT", interval: str = "1h",
+                 speed: float = 3600.0, step_ms: int = 3_600_000):
+        super().__init__(symbol, interval, url="replay://")
+        self.klines = klines
+        self.speed = speed
+        self.step_ms = step_ms
+
+    def _run(self):
+        self._set_connected(True)
+        for k in self.klines:
+            if self._stop.wait(self.step_ms / 1000 / self.speed):
+                break
+            ev = {"t": int(k[0]), "T": int(k[6]), "o": str(k[1]), "h": str(k[2]), "l": str(k[3]),
+                  "c": str(k[4]), "v": str(k[5]), "V": str(k[9]), "n": 0}
+            self.feed({"e": "kline", "s": self.symbol, "k": dict(ev, x=False)})
+            self.feed({"e": "kline", "s": self.symbol, "k": dict(ev, x=True)})
+        self._set_connected(False)
+
+
+def klines_from_frame(df: pd.DataFrame, step_ms: int = 3_600_000) -> list:
+    """回測 CSV / K 線庫 DataFrame（datetime 為 UTC+8）→ REST 陣列格式"""
+    ot = (pd.to_datetime(df["datetime"]).astype("datetime64[ms]").astype("int64") - UTC8_MS).tolist()
+    tbv = df["taker_buy_volume"].tolist() if "taker_buy_volume" in df.columns else [0.0] * len(df)
+    return [[t, o, h, l, c, v, t + step_ms - 1, "0", 0, b, "0", "0"]
+            for t, o, h, l, c, v, b in zip(ot, df["open"].tolist(), df["high"].tolist(),
+                                            df["low"].tolist(), df["close"].tolist(),
+                                            df["volume"].tolist(), tbv)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="收盤事件觸發（離線重播 / 連線測試）")
+    ap.add_argument("--replay", help="用 CSV 重播（不連網）；不給則連 Binance 等下一根收盤")
+    ap.add_argument("--bars", type=int, default=5)
+    ap.add_argument("--speed", type=float, default=3600.0)
+    ap.add_argument("--symbol", default="ETHUSDT")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.replay:
+        df = pd.read_csv(args.replay).tail(args.bars)
+        stream = ReplayBarStream(klines_from_frame(df), args.symbol, speed=args.speed).start()
+        deadline_pad = 3600 / args.speed + 5
+    else:
+        if websocket is None:
+            raise SystemExit("websocket-client 未安裝")
+        stream = BarCloseStream(args.symbol).start()
+        deadline_pad = 3700
+
+    for _ in range(args.bars):
+        k = stream.wait_closed(time.time() + deadline_pad)
+        if k is None:
+            print("timeout（無收盤事件）")
+            break
+        if args.replay:
+            lag = f"事件→喚醒 {time.time() - stream.last_msg_ts:+.3f}s"
+        else:
+            lag = f"收盤後 {time.time() - (int(k[6]) + 1) / 1000:+.3f}s"
+        print(f"closed {bar_time_str(k)} UTC+8  C={float(k[4]):.2f}  ({lag})")
+    stream.stop()
+
+
+if __name__ == "__main__":
+    main()
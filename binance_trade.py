@@ -3,10 +3,17 @@ Binance Futures 下單模組 (binance_trade.py)
 - 支援 Testnet / 正式環境切換
 - 市價下單 + Algo Order SL/TP
 - 部分平倉（TP1 10%）
+- 下單回應用 newOrderRespType=RESULT：成交量 / 均價直接在回應裡，不必再 query_order
+- 手續費不在下單路徑上查：get_user_trades 每小時一次批次對帳（executor.reconcile_commissions）
+- 同 bar 多筆市價單合併成一支 batchOrders（run_batched，ORDER_BATCH=0 關閉）
+- 掛單鏡像：SL / TP 與一般掛單在本機維護，取消 / 改價 / 心跳檢查不再每次列出全部掛單
 """
 import os
 import time
+import re
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from binance.um_futures import UMFutures
 from telegram_notify import send_telegram_message
@@ -181,6 +188,20 @@ def get_wallet_balance():
         return 0.0
 
 
+def get_user_trades(symbol, start_ms, end_ms=None, limit=1000):
+    """一次查詢 [start_ms, end_ms] 的成交明細（/fapi/v1/userTrades，區間上限 7 天）。失敗回 None"""
+    global client
+    _ensure_session()
+    params = {"symbol": symbol, "startTime": int(start_ms), "limit": int(limit)}
+    if end_ms is not None:
+        params["endTime"] = int(end_ms)
+    try:
+        return client.sign_request("GET", "/fapi/v1/userTrades", params)
+    except Exception as e:
+        print(f"get_user_trades error: {e}")
+        return None
+
+
 def get_order_commission(symbol, order_id):
     """查詢訂單的實際手續費（從 userTrades 加總）"""
     global client
@@ -226,6 +247,9 @@ def round_to_lot(qty, qty_step, min_qty):
 
 
 # ── 下單 ─────────────────────────────────────────────────────
+# 開倉成交後的 SL / TP 掛單在背景送出（place_order(wait_stops=False) 時），不擋呼叫端記帳
+_STOP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stop_order")
+
 # Timeout 判別關鍵字（HTTP 408 + Binance code -1007）
 _TIMEOUT_MARKERS = ("-1007", "408", "Timeout waiting for response", "Send status unknown")
 # Hedge Mode 不匹配判別關鍵字（Binance code -4061）
@@ -272,54 +296,64 @@ def _send_market_order_with_timeout_recovery(params, position_side, expected_qty
     Raises:
         Exception: 其他錯誤（非 timeout、非 -4061）— 由呼叫端處理
     """
-    global client
-    symbol = params["symbol"]
     try:
         return client.new_order(**params)
     except Exception as e:
-        # ── -4061 路徑：Hedge Mode 被改回 one-way ──
-        if _looks_like_position_side_mismatch(e):
-            print(f"[ORDER -4061] {params['side']} {expected_qty} {symbol} "
-                  f"({position_side}) — Hedge Mode mismatch, attempting reset")
-            was_fixed = _try_reset_hedge_mode()
-            if was_fixed:
+        return _recover_market_order(e, params, position_side, expected_qty,
+                                     poll_count=poll_count, poll_initial_delay=poll_initial_delay)
+
+
+def _recover_market_order(e, params, position_side, expected_qty,
+                          poll_count=4, poll_initial_delay=0.5):
+    """
+    MARKET 單送出失敗（例外 e）後的恢復：單筆下單與 batchOrders 的個別腿共用。
+    回傳 / 例外同 _send_market_order_with_timeout_recovery；非 -4061 / timeout 的錯誤原樣 raise。
+    """
+    global client
+    symbol = params["symbol"]
+    # ── -4061 路徑：Hedge Mode 被改回 one-way ──
+    if _looks_like_position_side_mismatch(e):
+        print(f"[ORDER -4061] {params['side']} {expected_qty} {symbol} "
+              f"({position_side}) — Hedge Mode mismatch, attempting reset")
+        was_fixed = _try_reset_hedge_mode()
+        if was_fixed:
+            try:
+                res = client.new_order(**params)
+                print(f"[ORDER -4061 RECOVERED] retry succeeded after Hedge Mode reset")
                 try:
-                    res = client.new_order(**params)
-                    print(f"[ORDER -4061 RECOVERED] retry succeeded after Hedge Mode reset")
-                    try:
-                        send_telegram_message(
-                            f"<b>⚠️ Hedge Mode 自動修復後下單成功</b>\n"
-                            f"{params['side']} {expected_qty} {symbol} ({position_side})\n"
-                            f"偵測 dualSidePosition=false，已切回 true 並重試"
-                        )
-                    except Exception:
-                        pass
-                    return res
-                except Exception as retry_e:
-                    print(f"[ORDER -4061 RETRY FAILED] {retry_e}")
-                    try:
-                        send_telegram_message(
-                            f"<b>🚨 Hedge Mode 修復後重試仍失敗</b>\n"
-                            f"{params['side']} {expected_qty} {symbol} ({position_side})\n"
-                            f"重試錯誤：{retry_e}\n"
-                            f"本根 bar 跳過進場，請手動檢查"
-                        )
-                    except Exception:
-                        pass
-                    return None
-            else:
+                    send_telegram_message(
+                        f"<b>⚠️ Hedge Mode 自動修復後下單成功</b>\n"
+                        f"{params['side']} {expected_qty} {symbol} ({position_side})\n"
+                        f"偵測 dualSidePosition=false，已切回 true 並重試"
+                    )
+                except Exception:
+                    pass
+                return res
+            except Exception as retry_e:
+                print(f"[ORDER -4061 RETRY FAILED] {retry_e}")
                 try:
                     send_telegram_message(
-                        f"<b>🚨 -4061 但 Hedge Mode reset 失敗</b>\n"
+                        f"<b>🚨 Hedge Mode 修復後重試仍失敗</b>\n"
                         f"{params['side']} {expected_qty} {symbol} ({position_side})\n"
-                        f"dualSidePosition 查詢/設定失敗或已為 true，請手動檢查 Binance 帳戶\n"
-                        f"本根 bar 跳過進場"
+                        f"重試錯誤：{retry_e}\n"
+                        f"本根 bar 跳過進場，請手動檢查"
                     )
                 except Exception:
                     pass
                 return None
-        if not _looks_like_timeout(e):
-            raise
+        else:
+            try:
+                send_telegram_message(
+                    f"<b>🚨 -4061 但 Hedge Mode reset 失敗</b>\n"
+                    f"{params['side']} {expected_qty} {symbol} ({position_side})\n"
+                    f"dualSidePosition 查詢/設定失敗或已為 true，請手動檢查 Binance 帳戶\n"
+                    f"本根 bar 跳過進場"
+                )
+            except Exception:
+                pass
+            return None
+    if not _looks_like_timeout(e):
+        raise e
 
     # ── Timeout 路徑：訂單實際狀態未知 ──
     print(f"[ORDER TIMEOUT -1007] {params['side']} {expected_qty} {symbol} ({position_side}) — poll position")
@@ -365,8 +399,167 @@ def _send_market_order_with_timeout_recovery(params, position_side, expected_qty
     return None
 
 
+# ── 同 bar 批次下單（batchOrders）──────────────────────────
+# 同一根 bar 的 L 出場 + S 進場、雙邊同時出場：各動作在自己的執行緒跑 executor 的開 / 平倉，
+# place_order 送單那一步改成登記到批次，全部到齊（或沒送單就結束）後由最後到的那條送一支
+# POST /fapi/v1/batchOrders；每條腿拿回自己的結果後照單筆流程走完（-4061 / -1007 恢復、SL 掛單）
+ORDER_BATCH = os.getenv("ORDER_BATCH", "1").strip() != "0"
+BATCH_MAX_LEGS = 5         # Binance batchOrders 單次上限
+BATCH_WAIT = 3.0           # 第一條腿登記後最多等其他腿幾秒（超過就先送已到的）
+_SOLO = object()           # 批次只成形一條腿 → 呼叫端照單筆送
+# 批次綁在 run_batched 的工作執行緒上：同時段其他執行緒的下單（exit_watcher、Telegram /cleanup）不會混進來
+_batch_ctx = threading.local()
+
+
+class BatchLegError(Exception):
+    """batchOrders 回應中單一腿的錯誤（{"code": -4061, "msg": ...}）"""
+
+    def __init__(self, code, msg):
+        super().__init__(f"({code}) {msg}")
+        self.code = code
+
+
+class OrderBatch:
+    """
+    一根 bar 的下單批次。participants = 參與的動作數；每個動作結束時（不論有沒有送單）
+    都要呼叫 finish()，沒送單的動作才不會讓其他腿白等到 BATCH_WAIT。
+    """
+
+    def __init__(self, participants: int):
+        self.expected = participants
+        self.legs = []          # [params]
+        self.results = {}       # 腿序號 -> 回應 dict / BatchLegError / 整批例外 / _SOLO
+        self.joined = set()     # 已登記的執行緒 id
+        self.closed = False
+        self.cond = threading.Condition()
+        self.t_first = None
+        self.sent_ms = None     # 整批送出到回應的毫秒數（log 用）
+
+    def _should_send(self) -> bool:
+        """持 cond 時呼叫：到齊 / 逾時 → 由呼叫端送出（只會回傳 True 一次）"""
+        if self.closed or not self.legs:
+            return False
+        if len(self.legs) >= self.expected or time.time() - self.t_first >= BATCH_WAIT:
+            self.closed = True
+            return True
+        return False
+
+    def submit(self, params):
+        """登記一條腿並等結果。回傳回應 dict / 例外物件 / _SOLO（批次已送出或只有這一條）"""
+        with self.cond:
+            if self.closed:
+                return _SOLO  # 批次送出後才來的（平倉重試等）→ 單筆
+            idx = len(self.legs)
+            self.legs.append(params)
+            self.joined.add(threading.get_ident())
+            if self.t_first is None:
+                self.t_first = time.time()
+            lead = self._should_send()
+            while not lead and idx not in self.results:
+                self.cond.wait(timeout=0.05)
+                lead = self._should_send()
+        if lead:
+            self._send()
+        with self.cond:
+            while idx not in self.results:
+                self.cond.wait()
+            return self.results[idx]
+
+    def finish(self):
+        """動作結束；沒登記過腿（冷卻 / 防疊倉 / 倉位已平等提早返回）→ 其他腿不再等它"""
+        with self.cond:
+            if threading.get_ident() in self.joined:
+                return
+            self.expected -= 1
+            lead = self._should_send()
+            self.cond.notify_all()
+        if lead:
+            self._send()
+
+    def _send(self):
+        legs = list(self.legs)
+        out = {}
+        try:
+            if len(legs) == 1:
+                out[0] = _SOLO
+            else:
+                t0 = time.time()
+                for start in range(0, len(legs), BATCH_MAX_LEGS):
+                    chunk = legs[start:start + BATCH_MAX_LEGS]
+                    try:
+                        resp = client.new_batch_order(
+                            batchOrders=[{k: str(v) for k, v in p.items()} for p in chunk])
+                        if not isinstance(resp, list):
+                            raise BatchLegError("?", f"unexpected batchOrders response: {resp}")
+                        for i, r in enumerate(resp[:len(chunk)]):
+                            if not isinstance(r, dict):
+                                out[start + i] = BatchLegError("?", f"unexpected leg response: {r}")
+                            elif r.get("code") not in (None, 200) and "orderId" not in r:
+                                out[start + i] = BatchLegError(r.get("code"), r.get("msg", ""))
+                            else:
+                                out[start + i] = r
+                    except Exception as e:
+                        for i in range(len(chunk)):
+                            out[start + i] = e  # 整批失敗（含 -1007 timeout）→ 每條腿各自走恢復
+                self.sent_ms = round((time.time() - t0) * 1000, 1)
+                print(f"[BATCH] {len(legs)} legs in one batchOrders ({self.sent_ms} ms)")
+        finally:
+            # 每條腿都要拿到結果（缺的 = 失敗），等結果的執行緒才不會卡住
+            for i in range(len(legs)):
+                out.setdefault(i, BatchLegError("?", "missing from batchOrders response"))
+            with self.cond:
+                self.results.update(out)
+                self.cond.notify_all()
+
+
+def run_batched(actions):
+    """
+    同一根 bar 的多個下單動作（無參數 callable）。ORDER_BATCH 開且 ≥ 2 個 → 各自一條執行緒、
+    市價單合併成一支 batchOrders；否則依序執行（同原本）。
+
+    Returns:
+        list: 與 actions 同順序，每項為回傳值或動作拋出的例外物件
+    """
+    if not ORDER_BATCH or len(actions) < 2:
+        out = []
+        for fn in actions:
+            try:
+                out.append(fn())
+            except Exception as e:
+                out.append(e)
+        return out
+
+    batch = OrderBatch(len(actions))
+
+    def _run(fn):
+        _batch_ctx.batch = batch
+        try:
+            return fn()
+        except Exception as e:
+            return e
+        finally:
+            _batch_ctx.batch = None
+            batch.finish()
+
+    with ThreadPoolExecutor(max_workers=len(actions), thread_name_prefix="order_batch") as pool:
+        return list(pool.map(_run, actions))
+
+
+def _send_market_order(params, position_side, expected_qty):
+    """place_order 的送單步驟：本執行緒屬於進行中的批次就登記進去，個別腿的錯誤走同一套恢復"""
+    batch = getattr(_batch_ctx, "batch", None)
+    if batch is None:
+        return _send_market_order_with_timeout_recovery(params, position_side, expected_qty)
+    res = batch.submit(params)
+    if res is _SOLO:
+        return _send_market_order_with_timeout_recovery(params, position_side, expected_qty)
+    if isinstance(res, Exception):
+        return _recover_market_order(res, params, position_side, expected_qty)
+    return res
+
+
 def place_order(symbol, side, qty=None, stop_loss=None, take_profit=None,
-                reduce_only=False, strategy_id="v3", position_side=None):
+                reduce_only=False, strategy_id="v3", position_side=None, wait_stops=True):
     """
     市價下單（Hedge Mode）。
     side: "BUY" or "SELL"
@@ -377,6 +570,9 @@ def place_order(symbol, side, qty=None, stop_loss=None, take_profit=None,
     position_side: "LONG" or "SHORT"（Hedge Mode 必填）
                    None 時自動推導：BUY 開倉→LONG, SELL 開倉→SHORT,
                    BUY 平倉→SHORT, SELL 平倉→LONG
+    wait_stops: False → 成交後 SL / TP 交給背景送出、立刻回傳；
+                回傳值的 "stop_futures" 為 [(類型, Future)]，呼叫端記完帳再確認結果
+    回傳值另含 "latency"：{"fill": 送單到拿到成交秒數, "stops": 掛 SL/TP 秒數（wait_stops 時）}
     """
     global client, last_trade_time
 
@@ -422,11 +618,11 @@ def place_order(symbol, side, qty=None, stop_loss=None, take_profit=None,
             "type": "MARKET",
             "quantity": qty,
             "positionSide": position_side,
+            "newOrderRespType": "RESULT",  # 回應直接帶 executedQty / avgPrice（成交後才回）
         }
 
-        res = _send_market_order_with_timeout_recovery(
-            params, position_side, expected_qty=qty,
-        )
+        t_send = time.time()
+        res = _send_market_order(params, position_side, expected_qty=qty)
         if res is None:
             # 確認未成交（已 alert）— 視為下單失敗
             return None
@@ -434,8 +630,7 @@ def place_order(symbol, side, qty=None, stop_loss=None, take_profit=None,
         avg_price = float(res.get("avgPrice", 0))
         exec_qty = float(res.get("executedQty", 0))
 
-        # Testnet 的 MARKET order 可能回傳 status=NEW, avgPrice=0
-        # 需要等成交後再查詢一次
+        # RESULT 回應通常已含成交；Testnet 偶爾仍回 status=NEW, avgPrice=0 → 等成交後再查詢一次
         if (avg_price == 0 or exec_qty == 0) and order_id != "?":
             for _poll in range(5):
                 time.sleep(0.5)
@@ -458,13 +653,23 @@ def place_order(symbol, side, qty=None, stop_loss=None, take_profit=None,
 
         if not reduce_only:
             last_trade_time[(strategy_id, symbol)] = now
+        res["latency"] = {"fill": round(time.time() - t_send, 3)}
 
-        # 掛 SL/TP（僅開倉單）
+        # 掛 SL/TP（僅開倉單）：成交一確認就送
         if not reduce_only:
-            if stop_loss:
-                _place_stop_order(symbol, side, qty, stop_loss, "STOP_MARKET", tick_size, position_side)
-            if take_profit:
-                _place_stop_order(symbol, side, qty, take_profit, "TAKE_PROFIT_MARKET", tick_size, position_side)
+            stops = [(t, p) for t, p in (("STOP_MARKET", stop_loss), ("TAKE_PROFIT_MARKET", take_profit)) if p]
+            if wait_stops:
+                t_stop = time.time()
+                for order_type, price in stops:
+                    _place_protective_stop(symbol, side, qty, price, order_type, tick_size, position_side)
+                if stops:
+                    res["latency"]["stops"] = round(time.time() - t_stop, 3)
+            else:
+                res["stop_futures"] = [
+                    (order_type, _STOP_POOL.submit(_place_protective_stop, symbol, side, qty, price,
+                                                   order_type, tick_size, position_side))
+                    for order_type, price in stops
+                ]
 
         return res
 
@@ -475,6 +680,157 @@ def place_order(symbol, side, qty=None, stop_loss=None, take_profit=None,
         return None
 
 
+# ── 掛單鏡像 ─────────────────────────────────────────────────
+# 本機保存 open algo 條件單（SL / TP）與一般掛單：掛單 / 取消的回應直接更新，
+# 超過 ORDER_MIRROR_MAX_AGE 秒（或從沒同步過，例如剛啟動）才整批查 openAlgoOrders + openOrders 對帳。
+# cancel_all_orders / update_stop_loss 依鏡像逐筆指定 id 取消；鏡像不可用 → 退回查 openAlgoOrders 清單再取消，
+# 不會跳過取消。get_active_sl_sides（心跳）讀鏡像，algo 部分超過 ORDER_SL_VERIFY_AGE 才補查一支 openAlgoOrders
+# （抓已觸發 / 被手動取消的停損）。
+ORDER_MIRROR_MAX_AGE = int(os.getenv("ORDER_MIRROR_MAX_AGE", "14400"))
+ORDER_SL_VERIFY_AGE = int(os.getenv("ORDER_SL_VERIFY_AGE", "7200"))
+_mirror_lock = threading.Lock()
+_algo_orders = {}      # algoId -> {"symbol", "positionSide", "orderType", "side", "triggerPrice", "algoStatus"}
+_open_orders = {}      # orderId -> {"symbol", "positionSide", "status"}
+_mirror_synced = {}    # symbol -> 上次整批對帳（algo + 一般掛單）epoch 秒
+_algo_synced = {}      # symbol -> 上次查 openAlgoOrders epoch 秒（整批對帳也算）
+
+# 取消時回報「單已不存在」（已觸發 / 已被取消）→ 從鏡像移除即可。只認錯誤碼：
+# -2011 Unknown order sent（含 algo 單取消時 id 不存在）、-2013 Order does not exist
+_UNKNOWN_ORDER_CODES = (-2011, -2013)
+
+
+def _is_unknown_order(exc: Exception) -> bool:
+    code = getattr(exc, "error_code", None)  # binance ClientError
+    if code is not None:
+        try:
+            return int(code) in _UNKNOWN_ORDER_CODES
+        except (TypeError, ValueError):
+            return False
+    msg = str(exc)
+    return any(re.search(rf"(?<![\d-]){c}(?!\d)", msg) for c in _UNKNOWN_ORDER_CODES)
+
+
+def _fetch_algo_orders(symbol) -> list:
+    """GET openAlgoOrders（一支請求）；失敗拋例外"""
+    return client.sign_request("GET", "/fapi/v1/openAlgoOrders", {
+        "symbol": symbol,
+        "algoType": "CONDITIONAL",
+    })
+
+
+def _replace_algo_mirror(symbol, algo, t_fetch):
+    """以查詢結果取代鏡像中該 symbol 的 algo 單（查詢途中才掛上的單保留）。持 _mirror_lock 呼叫。回傳差異 id"""
+    old = {k for k, v in _algo_orders.items() if v["symbol"] == symbol}
+    for k in old:
+        if _algo_orders[k].get("placed_at", 0) < t_fetch:
+            del _algo_orders[k]
+    _algo_orders.update({
+        o["algoId"]: {
+            "symbol": symbol,
+            "positionSide": o.get("positionSide"),
+            "orderType": o.get("orderType"),
+            "side": o.get("side"),
+            "triggerPrice": float(o.get("triggerPrice") or 0),
+            "algoStatus": o.get("algoStatus"),
+        }
+        for o in algo
+    })
+    _algo_synced[symbol] = time.time()
+    return old ^ {k for k, v in _algo_orders.items() if v["symbol"] == symbol}
+
+
+def reconcile_orders(symbol=None) -> bool:
+    """查交易所的 open algo / 一般掛單，整批取代鏡像中該 symbol 的部分。回傳是否成功"""
+    symbol = symbol or SYMBOL
+    global client
+    _ensure_session()
+    t_fetch = time.time()
+    try:
+        algo = _fetch_algo_orders(symbol)
+        regular = client.get_orders(symbol=symbol)
+    except Exception as e:
+        print(f"reconcile_orders error: {e}")
+        client = new_session()
+        return False
+    with _mirror_lock:
+        first = symbol not in _mirror_synced
+        drift = _replace_algo_mirror(symbol, algo, t_fetch)
+        for k in [k for k, v in _open_orders.items() if v["symbol"] == symbol]:
+            del _open_orders[k]
+        _open_orders.update({
+            o["orderId"]: {"symbol": symbol, "positionSide": o.get("positionSide"), "status": o.get("status")}
+            for o in regular if o.get("status") == "NEW"
+        })
+        _mirror_synced[symbol] = time.time()
+
+    if drift and not first:
+        print(f"[ORDER MIRROR] {symbol} algo orders drifted from mirror: {sorted(drift, key=str)}")
+    return True
+
+
+def sync_algo_orders(symbol=None) -> bool:
+    """只查 openAlgoOrders（一支請求）刷新鏡像的 algo 部分。回傳是否成功"""
+    symbol = symbol or SYMBOL
+    global client
+    _ensure_session()
+    t_fetch = time.time()
+    try:
+        algo = _fetch_algo_orders(symbol)
+    except Exception as e:
+        print(f"sync_algo_orders error: {e}")
+        client = new_session()
+        return False
+    with _mirror_lock:
+        first = symbol not in _algo_synced
+        drift = _replace_algo_mirror(symbol, algo, t_fetch)
+    if drift and not first:
+        print(f"[ORDER MIRROR] {symbol} algo orders drifted from mirror: {sorted(drift, key=str)}")
+    return True
+
+
+def _mirror_ready(symbol) -> bool:
+    """鏡像太舊 / 沒同步過 → 先對帳。回傳鏡像是否可用（至少成功同步過一次）"""
+    with _mirror_lock:
+        synced = _mirror_synced.get(symbol)
+    if synced is None or time.time() - synced > ORDER_MIRROR_MAX_AGE:
+        return reconcile_orders(symbol) or synced is not None
+    return True
+
+
+def _mirror_algo(symbol, position_side=None, order_type=None) -> list:
+    """鏡像中的 algo 單 [(algoId, info)]，可依方向 / 類型過濾"""
+    with _mirror_lock:
+        return [(k, dict(v)) for k, v in _algo_orders.items()
+                if v["symbol"] == symbol
+                and (position_side is None or v["positionSide"] == position_side)
+                and (order_type is None or v["orderType"] == order_type)]
+
+
+def _algo_targets(symbol, position_side=None, order_type=None, fresh=False):
+    """
+    要處理的 algo 單 [(algoId, info)]。鏡像可用 → 讀鏡像；鏡像不可用或 fresh=True → 查 openAlgoOrders 清單
+    （同時刷新鏡像）。清單也查不到 → None（呼叫端仍以鏡像現有內容盡力處理並告警）。
+    """
+    if fresh or not _mirror_ready(symbol):
+        if not sync_algo_orders(symbol):
+            return None
+    return _mirror_algo(symbol, position_side, order_type)
+
+
+def _cancel_algo(algo_id, label="algo order") -> bool:
+    """指定 id 取消一張 algo 單並更新鏡像；單已不存在也算成功"""
+    try:
+        client.sign_request("DELETE", "/fapi/v1/algoOrder", {"algoId": algo_id})
+    except Exception as e:
+        if not _is_unknown_order(e):
+            print(f"  Cancel {label} {algo_id} error: {e}")
+            return False
+    with _mirror_lock:
+        info = _algo_orders.pop(algo_id, None)
+    print(f"  Cancelled {label} {algo_id} ({(info or {}).get('positionSide')})")
+    return True
+
+
 def _place_stop_order(symbol, entry_side, qty, price, order_type, tick_size,
                       position_side=None):
     """掛止損/止盈單（Algo Order API + Hedge Mode positionSide）"""
@@ -500,12 +856,44 @@ def _place_stop_order(symbol, entry_side, qty, price, order_type, tick_size,
         label = "SL" if "STOP" in order_type else "TP"
         algo_id = res.get("algoId", "?")
         print(f"  {label} algo placed: {close_side} at {price} positionSide={position_side} (algoId={algo_id})")
+        if algo_id != "?":
+            with _mirror_lock:
+                _algo_orders[algo_id] = {
+                    "symbol": symbol, "positionSide": position_side, "orderType": order_type,
+                    "side": close_side, "triggerPrice": float(price),
+                    "algoStatus": res.get("algoStatus", "NEW"), "placed_at": time.time(),
+                }
         return res
     except Exception as e:
         print(f"  Algo stop order error ({order_type}): {e}")
         return None
 
 
+STOP_RETRIES = 2          # 開倉後 SL / TP 掛單失敗的重試次數
+
+
+def _place_protective_stop(symbol, entry_side, qty, price, order_type, tick_size, position_side=None):
+    """開倉後掛 SL / TP：失敗重試 STOP_RETRIES 次，仍失敗 → 立刻 Telegram 告警（不等心跳檢查）"""
+    for attempt in range(STOP_RETRIES + 1):
+        if attempt:
+            time.sleep(0.5 * attempt)
+        res = _place_stop_order(symbol, entry_side, qty, price, order_type, tick_size, position_side)
+        if res is not None:
+            if attempt:
+                print(f"  {order_type} placed on retry {attempt}")
+            return res
+    label = "SafeNet 停損" if "STOP" in order_type else "止盈"
+    try:
+        send_telegram_message(
+            f"<b>🚨 {label}掛單失敗（重試 {STOP_RETRIES} 次）</b>\n"
+            f"{symbol} {position_side} {order_type} @ {price}\n"
+            f"倉位可能沒有停損保護，請立即手動檢查 / 掛單"
+        )
+    except Exception:
+        pass
+    return None
+
+
 def close_position(symbol=None, side=None):
     """平倉指定方向的持倉（Hedge Mode）"""
     symbol = symbol or SYMBOL
@@ -522,92 +910,120 @@ def close_position(symbol=None, side=None):
 def cancel_all_orders(symbol=None, position_side=None):
     """
     取消掛單（含 algo orders）。
-    position_side: "LONG"/"SHORT" 只取消該方向，None 取消全部。
+    position_side: "LONG"/"SHORT" 只取消該方向（依掛單鏡像逐筆指定 id，鏡像不可用 → 查清單）；
+                   None 取消全部（一般掛單整批取消 + 查 openAlgoOrders 清單逐筆取消，交易所上不留任何單）。
     """
     symbol = symbol or SYMBOL
     global client
+    _ensure_session()
+    ready = _mirror_ready(symbol)
 
     # 取消一般掛單
     try:
         if position_side:
             # 只取消特定 positionSide 的掛單
-            open_orders = client.get_orders(symbol=symbol)
-            for order in open_orders:
-                if order.get("positionSide") == position_side and order.get("status") == "NEW":
-                    client.cancel_order(symbol=symbol, orderId=order["orderId"])
-                    print(f"  Cancelled order {order['orderId']} ({position_side})")
+            if ready:
+                with _mirror_lock:
+                    ids = [k for k, v in _open_orders.items()
+                           if v["symbol"] == symbol and v["positionSide"] == position_side]
+            else:
+                ids = [o["orderId"] for o in client.get_orders(symbol=symbol)
+                       if o.get("positionSide") == position_side and o.get("status") == "NEW"]
+            for order_id in ids:
+                try:
+                    client.cancel_order(symbol=symbol, orderId=order_id)
+                except Exception as e:
+                    if not _is_unknown_order(e):
+                        raise
+                with _mirror_lock:
+                    _open_orders.pop(order_id, None)
+                print(f"  Cancelled order {order_id} ({position_side})")
         else:
             client.cancel_open_orders(symbol=symbol)
+            with _mirror_lock:
+                for k in [k for k, v in _open_orders.items() if v["symbol"] == symbol]:
+                    del _open_orders[k]
             print(f"All open orders cancelled for {symbol}")
     except Exception as e:
         if "No open orders" not in str(e):
             print(f"cancel_all_orders: {e}")
 
-    # 取消 algo orders
-    try:
-        algo_orders = client.sign_request("GET", "/fapi/v1/openAlgoOrders", {
-            "symbol": symbol,
-            "algoType": "CONDITIONAL",
-        })
-        for order in algo_orders:
-            if position_side and order.get("positionSide") != position_side:
-                continue
-            algo_id = order["algoId"]
-            client.sign_request("DELETE", "/fapi/v1/algoOrder", {"algoId": algo_id})
-            print(f"  Cancelled algo order {algo_id} ({order.get('positionSide')})")
-    except Exception as e:
-        print(f"cancel algo orders error: {e}")
+    # 取消 algo orders（全部取消時一律以交易所清單為準）
+    targets = _algo_targets(symbol, position_side, fresh=position_side is None)
+    if targets is None:
+        targets = _mirror_algo(symbol, position_side)
+        print(f"cancel_all_orders: cannot list algo orders for {symbol}, cancelling {len(targets)} mirrored")
+        send_telegram_message(
+            f"<b>🚨 取消掛單：查不到 algo 掛單清單</b>\n"
+            f"{symbol} {position_side or '全部'}：只取消本機記得的 {len(targets)} 張\n"
+            f"交易所上可能仍有 SL/TP 掛單，請手動檢查"
+        )
+    failed = [algo_id for algo_id, _info in targets if not _cancel_algo(algo_id)]
+    if failed:
+        send_telegram_message(
+            f"<b>🚨 取消 algo 掛單失敗</b>\n"
+            f"{symbol} {position_side or '全部'}：{', '.join(str(i) for i in failed)}\n"
+            f"請手動檢查（殘留的停損單觸發時可能開出新倉）"
+        )
 
 
 def get_active_sl_sides(symbol=None):
     """回傳目前掛著有效 STOP_MARKET 停損的 positionSide 集合（如 {"LONG","SHORT"}）。
 
-    唯讀，心跳自檢用：驗證每個持倉方向都有停損掛單保護。
+    唯讀，心跳自檢用：驗證每個持倉方向都有停損掛單保護。讀掛單鏡像；鏡像的 algo 部分超過
+    ORDER_SL_VERIFY_AGE 秒才補查一支 openAlgoOrders（抓已觸發 / 被手動取消的停損）。
     回傳 None = 查詢失敗（與「空集合 = 確定沒掛單」區分，避免誤報）。
     """
     symbol = symbol or SYMBOL
-    global client
-    _ensure_session()
-    try:
-        algo_orders = client.sign_request("GET", "/fapi/v1/openAlgoOrders", {
-            "symbol": symbol,
-            "algoType": "CONDITIONAL",
-        })
-        sides = set()
-        for order in algo_orders:
-            if (order.get("orderType") == "STOP_MARKET"
-                    and order.get("algoStatus") == "NEW"):
-                sides.add(order.get("positionSide"))
-        return sides
-    except Exception as e:
-        print(f"get_active_sl_sides error: {e}")
-        client = new_session()
+    if not _mirror_ready(symbol):
         return None
+    with _mirror_lock:
+        algo_synced = _algo_synced.get(symbol, 0)
+    if time.time() - algo_synced > ORDER_SL_VERIFY_AGE and not sync_algo_orders(symbol):
+        return None
+    return {info["positionSide"] for _, info in _mirror_algo(symbol, order_type="STOP_MARKET")
+            if info.get("algoStatus") == "NEW"}
 
 
 def update_stop_loss(symbol, new_sl, side):
-    """更新止損：取消舊的 algo STOP_MARKET，掛新的（Hedge Mode）"""
+    """更新止損（Hedge Mode）：價位沒變 → 不動；否則依鏡像指定 id 取消舊 SL、掛新的。
+
+    closePosition 停損同方向只能掛一張（-4130），只能先取消再掛；新單掛失敗時補掛回原價位。
+    鏡像不可用 → 查 openAlgoOrders 清單取得舊 SL；清單也查不到仍照掛新 SL（舊單還在會被 -4130 擋下）並告警。
+    """
     global client
     tick_size, _, _ = get_symbol_info(symbol)
     position_side = "LONG" if side == "long" else "SHORT"
+    entry_side = "BUY" if side == "long" else "SELL"
+    new_sl = round_to_tick(new_sl, tick_size)
 
     try:
-        # 取消該 positionSide 的現有 algo stop orders
-        algo_orders = client.sign_request("GET", "/fapi/v1/openAlgoOrders", {
-            "symbol": symbol,
-            "algoType": "CONDITIONAL",
-        })
-        for order in algo_orders:
-            if (order.get("orderType") == "STOP_MARKET"
-                    and order.get("positionSide") == position_side
-                    and order.get("algoStatus") == "NEW"):
-                algo_id = order["algoId"]
-                client.sign_request("DELETE", "/fapi/v1/algoOrder", {"algoId": algo_id})
-                print(f"  Cancelled old algo SL {algo_id}")
-
-        # 掛新的
-        entry_side = "BUY" if side == "long" else "SELL"
-        _place_stop_order(symbol, entry_side, 0, new_sl, "STOP_MARKET", tick_size, position_side)
+        current = _algo_targets(symbol, position_side, "STOP_MARKET")
+        listed = current is not None
+        if not listed:
+            current = _mirror_algo(symbol, position_side, "STOP_MARKET")
+            print(f"update_stop_loss: cannot list algo orders for {symbol}, using {len(current)} mirrored")
+        current = [(k, v) for k, v in current if v.get("algoStatus") == "NEW"]
+        if listed and len(current) == 1 and abs(current[0][1]["triggerPrice"] - new_sl) < tick_size / 2:
+            return  # 價位相同：不必動
+
+        old_price = None
+        for algo_id, info in current:
+            if _cancel_algo(algo_id, label="old algo SL"):
+                old_price = info["triggerPrice"]
+
+        if _place_stop_order(symbol, entry_side, 0, new_sl, "STOP_MARKET",
+                             tick_size, position_side) is None:
+            restored = False
+            if old_price:
+                print(f"  New SL failed, restoring previous SL at {old_price}")
+                restored = _place_stop_order(symbol, entry_side, 0, old_price, "STOP_MARKET",
+                                             tick_size, position_side) is not None
+            send_telegram_message(
+                f"<b>⚠️ 移動停損失敗</b>\n"
+                f"{symbol} {position_side} 新 SL {new_sl} 掛單失敗"
+                + (f"，已補回原價位 {old_price}" if restored else "，請確認停損掛單是否還在")
+            )
     except Exception as e:
         print(f"update_stop_loss error: {e}")
         client = new_session()
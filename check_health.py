@@ -1,7 +1,7 @@
 """
 每日健康報告
 
-讀取 trades.csv + bar_snapshots.csv + daily_summary.csv，
+讀取交易帳本（trades.db）+ bar_snapshots.csv + daily_summary.csv，
 輸出策略健康狀態，標記異常指標。
 
 用法：python check_health.py [--days 30] [--telegram]
@@ -19,10 +19,9 @@ import strategy
 
 
 def load_trades() -> pd.DataFrame:
-    """載入 trades.csv"""
-    if not os.path.exists(recorder.TRADES_CSV):
-        return pd.DataFrame()
-    df = pd.read_csv(recorder.TRADES_CSV)
+    """載入交易帳本（型別同 pd.read_csv(trades.csv)）"""
+    import trade_ledger
+    df = trade_ledger.frame(recorder.DATA_DIR)
     if "entry_time_utc8" in df.columns:
         df["entry_time_utc8"] = pd.to_datetime(df["entry_time_utc8"], errors="coerce")
     if "exit_time_utc8" in df.columns:
@@ -11,7 +11,6 @@
     .venv/bin/python check_signal.py --paper    # 強制讀模擬狀態
 """
 import os
-import json
 import argparse
 
 from dotenv import load_dotenv
@@ -20,6 +19,7 @@ import paths  # 多實例路徑；必須最先 import（會優先載入 INSTANCE
 import data_feed
 import strategy
 import signal_status
+import state_journal
 
 load_dotenv()
 
@@ -42,8 +42,7 @@ def main():
 
     st = {}
     if os.path.exists(state_path):
-        with open(state_path, "r", encoding="utf-8") as f:
-            raw = json.load(f)
+        raw = state_journal.load_state(state_path)  # 快照 + 日誌重放
         cb = raw.get("circuit_breaker", {})
         st = {
             "bar_counter": raw.get("bar_counter", 0),
@@ -62,7 +61,10 @@ def main():
     eth_df, _ = data_feed.fetch_eth_and_btc()
     df = strategy.compute_indicators(eth_df)
     idx = len(df) - 2  # 最新已收盤 bar
-    print(signal_status.build_signal_status(df, idx, st, html=False))
+    plan = strategy.trigger_plan(
+        strategy.next_bar_features(eth_df), st.get("positions", {}), st.get("last_exits", {}),
+        st.get("bar_counter", 0) + 1, st.get("monthly_pnl"), st.get("monthly_entries"))
+    print(signal_status.build_signal_status(df, idx, st, html=False, plan=plan))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+"""
+每小時 cycle 的並行預取 — 收盤前幾秒先暖連線，收盤一到把互不相依的 REST 讀取同時發出，
+決策段（出場 / 進場判斷）開始時資料都已在記憶體。
+
+原本 cycle 依序阻塞：fetch_eth_and_btc（ETH 500 根 → BTC 30 根）→ _sync_balance（account）
+→ get_positions（孤兒 / 幽靈巡檢），收盤到下單要好幾秒。
+
+  - 暖機：收盤前 WARM_LEAD 秒，背景執行緒 ping K 線連線池（kline_store.HTTP）與下單 client，
+          順便做 _ensure_session（30 分鐘重建 + 對時）與商品規格快取 → 這些都不落在收盤後
+  - 預取：ThreadPoolExecutor 同時發 ETH K 線、BTC K 線、錢包餘額、持倉；總耗時 ≈ 最慢的一支
+  - 計時：每支呼叫各自計時；主迴圈用 CycleClock 打點各階段，cycle 結束印一行延遲預算
+  - 失敗：任何一支失敗只記進 errors，主迴圈對該項退回原本的序列呼叫（fail-open）
+  - 下單（place_order）仍在決策後依序送；成交回應直接帶均價（RESULT），手續費改每小時批次對帳
+    （executor.reconcile_commissions），餘額同步不在收盤→送單路徑上
+
+CYCLE_PREFETCH=0 關閉，完全回到原本序列流程。
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger("cycle_prefetch")
+
+ENABLED = os.getenv("CYCLE_PREFETCH", "1").strip() != "0"
+WARM_LEAD = float(os.getenv("PREFETCH_WARM_LEAD", "5"))  # 收盤前幾秒暖連線
+TIMEOUT = 30.0  # 預取整體上限（秒）；逾時的項目視為失敗，由主迴圈序列重抓
+
+PING_URL = "https://fapi.binance.com/fapi/v1/ping"
+
+_warm_timer = None
+_warm_for = None
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 暖機
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def warm_connections(symbol: str = None, market: bool = True) -> dict:
+    """ping 行情連線池與下單 client（建好 keep-alive 連線）。回傳 {項目: 秒數或錯誤字串}"""
+    out = {}
+
+    def _timed(name, fn):
+        t0 = time.time()
+        try:
+            fn()
+            out[name] = round(time.time() - t0, 3)
+        except Exception as e:
+            out[name] = f"error: {e}"
+
+    if market:
+        import kline_store
+        _timed("klines", lambda: kline_store.HTTP.get(PING_URL, timeout=5).raise_for_status())
+
+    def _trade():
+        import binance_trade
+        binance_trade._ensure_session()  # 到期重建（含對時）放在收盤前做
+        binance_trade.get_symbol_info(symbol)
+        binance_trade.client.ping()
+
+    _timed("trade", _trade)
+    return out
+
+
+def schedule_warmup(bar_close: float, symbol: str = None, market: bool = True):
+    """在 bar_close - WARM_LEAD 背景暖機；同一個整點只排一次，已經過了就不排"""
+    global _warm_timer, _warm_for
+    if not ENABLED or _warm_for == bar_close:
+        return
+    delay = bar_close - WARM_LEAD - time.time()
+    if delay < 0:
+        return
+
+    def _run():
+        res = warm_connections(symbol, market)
+        logger.debug(f"Warm-up: {res}")
+
+    if _warm_timer is not None:
+        _warm_timer.cancel()
+    _warm_timer = threading.Timer(delay, _run)
+    _warm_timer.daemon = True
+    _warm_timer.start()
+    _warm_for = bar_close
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 並行預取
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class Prefetch:
+    """一次預取的結果：results / errors / timings（各支秒數）/ elapsed（整體秒數）"""
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+        self.elapsed = 0.0
+
+    def ok(self, name: str) -> bool:
+        return name in self.results
+
+    def get(self, name: str, default=None):
+        return self.results.get(name, default)
+
+
+def run(calls: dict, timeout: float = TIMEOUT) -> Prefetch:
+    """calls = {名稱: 無參數函式}，全部同時送出，等到都回來或逾時"""
+    pf = Prefetch()
+    if not calls:
+        return pf
+    t0 = time.time()
+
+    def _call(name, fn):
+        s = time.time()
+        try:
+            return fn()
+        finally:
+            pf.timings[name] = time.time() - s
+
+    pool = ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="prefetch")
+    futures = {name: pool.submit(_call, name, fn) for name, fn in calls.items()}
+    wait(futures.values(), timeout=timeout)
+    for name, fut in futures.items():
+        if not fut.done():
+            pf.errors[name] = TimeoutError(f"{name} not done after {timeout:.0f}s")
+            continue
+        try:
+            pf.results[name] = fut.result()
+        except Exception as e:
+            pf.errors[name] = e
+    pool.shutdown(wait=False, cancel_futures=True)  # 卡住的那支留在背景，不擋 cycle
+    pf.elapsed = time.time() - t0
+    for name, e in pf.errors.items():
+        logger.warning(f"Prefetch {name} failed: {e}")
+    return pf
+
+
+def cycle_reads(symbol: str, market: bool = True, eth_limit: int = 500) -> Prefetch:
+    """
+    收盤時的獨立讀取：ETH / BTC 1h K 線（market=False 時略過，訂閱端由快照提供）、
+    錢包餘額、持倉。各項語意同原本序列呼叫（data_feed.fetch_klines / get_wallet_balance /
+    get_positions），主迴圈直接取用。
+    """
+    import data_feed
+
+    def _balance():
+        import binance_trade
+        return binance_trade.get_wallet_balance()
+
+    def _positions():
+        import binance_trade
+        return binance_trade.get_positions(symbol)
+
+    calls = {}
+    if market:
+        calls["eth"] = lambda: data_feed.fetch_klines("ETHUSDT", "1h", eth_limit)
+        calls["btc"] = lambda: data_feed.fetch_klines("BTCUSDT", "1h", 30)
+    calls["balance"] = _balance
+    calls["positions"] = _positions
+    return run(calls)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 階段計時
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class CycleClock:
+    """
+    一個 cycle 的計時：
+      - mark()：依序打點，每段 = 與上一個打點的差（第一段從整點收盤 bar_close 起算）
+      - span()：包住某個動作累加秒數（可與階段重疊，例如 fetch / indicators 都在 data 段內）
+    """
+
+    def __init__(self, bar_close: float = None):
+        now = time.time()
+        self.bar_close = bar_close if bar_close is not None else now // 3600 * 3600
+        self.marks = []
+        self.spans = {}
+
+    def mark(self, name: str):
+        self.marks.append((name, time.time()))
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name: str):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def stages(self) -> dict:
+        """{階段: 秒數}，依打點順序；每段 = 與上一個打點（第一段為收盤）的差"""
+        out = {}
+        prev = self.bar_close
+        for name, t in self.marks:
+            out[name] = t - prev
+            prev = t
+        return out
+
+    def since_close(self, name: str):
+        """收盤到某個打點的秒數；沒打過為 None"""
+        for n, t in self.marks:
+            if n == name:
+                return t - self.bar_close
+        return None
+
+
+def budget_line(clock: CycleClock, pf: Prefetch = None, until: str = "orders") -> str:
+    """一行延遲預算：各階段秒數 + 收盤→until + 預取各支秒數"""
+    parts = [f"{k} {v:.2f}s" for k, v in clock.stages().items()]
+    total = clock.since_close(until)
+    line = " | ".join(parts)
+    if total is not None:
+        line += f" | close→{until} {total:.2f}s"
+    if pf is not None and pf.timings:
+        calls = " ".join(f"{k} {v:.2f}" for k, v in pf.timings.items())
+        line += f" | prefetch {pf.elapsed:.2f}s ({calls})"
+    return line
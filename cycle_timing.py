@@ -0,0 +1,140 @@
+"""
+每小時 cycle 的階段計時帳 — 每個 cycle 一列寫進 logs/cycle_timing.csv，
+/perf 指令與儀表板讀最近 N 列算各階段 p50 / p95 / max，慢的整點在漏單之前就看得到。
+
+欄位（秒；沒跑到的階段留空）：
+  bar_time, ts（寫入時 epoch 秒）
+  wake        整點收盤 → 主迴圈醒來
+  data        取資料 + 指標（含預取、REST 追不上重抓）
+  sync        餘額同步 + 倉位巡檢
+  exits       出場檢查（只決定要平哪些倉）
+  orders      進場評估 + 本 bar 出場 / 進場下單（同一批送出）
+  recorder    bar snapshot 寫檔
+  save_state  日結 + 狀態 / 指標狀態存檔
+  heartbeat   心跳組裝 + 發送
+  fetch / indicators / telegram   跨階段累計（K 線抓取、指標計算、Telegram 發送）
+  close_to_orders   收盤 → 下單完成
+  total             收盤 → cycle 結束
+
+檔案只增不改；超過 MAX_ROWS 兩倍時截回最近 MAX_ROWS 列（約 7 個月）。
+"""
+import os
+import csv
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+
+import paths
+
+logger = logging.getLogger("cycle_timing")
+
+TIMING_FILE = os.path.join(paths.logs_dir(), "cycle_timing.csv")
+MAX_ROWS = 5000
+
+STAGES = ("wake", "data", "sync", "exits", "orders", "recorder", "save_state", "heartbeat")
+SPANS = ("fetch", "indicators", "telegram")
+TOTALS = ("close_to_orders", "total")
+COLUMNS = ("bar_time", "ts") + STAGES + SPANS + TOTALS
+
+STAGE_LABELS = {
+    "wake": "收盤→醒來", "data": "取資料+指標", "sync": "餘額/倉位同步", "exits": "出場",
+    "orders": "評估+下單", "recorder": "快照寫檔", "save_state": "存檔", "heartbeat": "心跳",
+    "fetch": "K線抓取", "indicators": "指標計算", "telegram": "Telegram",
+    "close_to_orders": "收盤→下單完成", "total": "收盤→結束",
+}
+
+
+def row_from_clock(clock, bar_time: str) -> dict:
+    """CycleClock → 一列（秒數取 3 位小數）"""
+    now = time.time()
+    row = {"bar_time": bar_time, "ts": int(now)}
+    row.update(clock.stages())
+    row.update(clock.spans)
+    row["close_to_orders"] = clock.since_close("orders")
+    row["total"] = now - clock.bar_close
+    return {c: (round(v, 3) if isinstance(v, float) else v) for c, v in row.items() if c in COLUMNS}
+
+
+def record(clock, bar_time: str, path: str = None) -> dict:
+    """追加一列；任何錯誤只記 log（fail-open，不擋交易）"""
+    path = path or TIMING_FILE
+    row = row_from_clock(clock, bar_time)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", newline="", encoding="utf-8") as fh:
+            w = csv.DictWriter(fh, fieldnames=COLUMNS)
+            if new:
+                w.writeheader()
+            w.writerow(row)
+        _trim(path)
+    except Exception as e:
+        logger.warning(f"cycle timing write failed: {e}")
+    return row
+
+
+def _trim(path: str):
+    with open(path, "r", encoding="utf-8") as fh:
+        lines = fh.readlines()
+    if len(lines) - 1 <= 2 * MAX_ROWS:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.writelines([lines[0]] + lines[-MAX_ROWS:])
+    os.replace(tmp, path)
+
+
+def load(n: int = 168, path: str = None) -> pd.DataFrame:
+    """最近 n 列（預設一週）；沒有檔案 → 空 DataFrame"""
+    path = path or TIMING_FILE
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=COLUMNS)
+    try:
+        df = pd.read_csv(path)
+    except Exception as e:
+        logger.warning(f"cycle timing read failed: {e}")
+        return pd.DataFrame(columns=COLUMNS)
+    return df.tail(n).reset_index(drop=True)
+
+
+def summarize(df: pd.DataFrame) -> dict:
+    """{欄位: {"n", "p50", "p95", "max", "max_bar"}}，只含有數值的欄位"""
+    out = {}
+    for col in STAGES + SPANS + TOTALS:
+        if col not in df.columns:
+            continue
+        v = pd.to_numeric(df[col], errors="coerce")
+        ok = v.notna().to_numpy()
+        if not ok.any():
+            continue
+        x = v.to_numpy()[ok]
+        i = int(np.argmax(x))
+        out[col] = {
+            "n": int(ok.sum()),
+            "p50": float(np.percentile(x, 50)),
+            "p95": float(np.percentile(x, 95)),
+            "max": float(x[i]),
+            "max_bar": str(df["bar_time"].to_numpy()[ok][i]) if "bar_time" in df.columns else "",
+        }
+    return out
+
+
+def format_perf(summary: dict, n_cycles: int) -> str:
+    """/perf 回覆（HTML）：各階段 p50 / p95 / max"""
+    if not summary:
+        return "⏱ 尚無 cycle 計時資料（logs/cycle_timing.csv）"
+    lines = [f"<b>⏱ Cycle 計時（最近 {n_cycles} 根）</b>", "━━━━━━━━━━━━━━━",
+             f"<code>{'stage':<15} {'p50':>5}  {'p95':>5}  {'max':>5}</code>"]
+    for col in STAGES + SPANS + TOTALS:
+        s = summary.get(col)
+        if s is None:
+            continue
+        if col == SPANS[0] or col == TOTALS[0]:
+            lines.append("")
+        lines.append(f"<code>{col:<15} {s['p50']:>5.2f}  {s['p95']:>5.2f}  {s['max']:>5.2f}</code>")
+    worst = summary.get("close_to_orders") or summary.get("total")
+    if worst:
+        lines.append(f"\n🐢 最慢：{worst['max']:.2f}s @ {worst['max_bar']}")
+    return "\n".join(lines)
@@ -31,6 +31,8 @@ from pydantic import BaseModel, Field
 import uvicorn
 from dotenv import load_dotenv
 from telegram_notify import send_telegram_message as _tg_send
+import state_journal
+import trade_ledger
 
 load_dotenv(ROOT_DIR / ".env")
 
@@ -40,9 +42,11 @@ _bt_spec = importlib.util.spec_from_file_location(
     str(Path(__file__).resolve().parent.parent / "backtest" / "research" / "v14_export_trades.py"),
 )
 _bt_mod = importlib.util.module_from_spec(_bt_spec)
+sys.modules[_bt_spec.name] = _bt_mod  # 讓 numba 磁碟快取能以模組名重新載入（見 _get_fast_kernel）
 _bt_spec.loader.exec_module(_bt_mod)
 bt_compute = _bt_mod.compute_indicators
-bt_simulate = _bt_mod.simulate_v14_detailed
+bt_compute_cached = _bt_mod.compute_indicators_cached  # 磁碟快取（同資料同參數不重算）
+bt_simulate = _bt_mod.simulate_v14_fast  # 編譯核心（無 numba 自動退回 Python 參考版）
 
 app = FastAPI(title="CryptoBot Dashboard")
 
@@ -78,6 +82,14 @@ def read_csv_safe(filepath, **kwargs):
     return pd.DataFrame()
 
 
+def _read_trades(paths, **kwargs):
+    """交易帳本（trades.db）→ DataFrame（型別同讀 trades.csv）；kwargs 同 trade_ledger.rows 的篩選"""
+    try:
+        return trade_ledger.frame(str(paths["data_dir"]), **kwargs)
+    except Exception:
+        return pd.DataFrame()
+
+
 def clean_value(v):
     """把 NaN / Inf 轉成 None（JSON 不接受）"""
     if v is None:
@@ -171,8 +183,7 @@ async def api_status(mode: str = Query("paper")):
     state_path = paths["state"]
     if os.path.exists(state_path):
         try:
-            with open(state_path, "r", encoding="utf-8") as f:
-                state = json.load(f)
+            state = state_journal.load_state(str(state_path))  # 快照 + 日誌重放
             # 餘額 fallback：若幣安 API 沒拿到，用 state 檔
             if result["account_balance"] == 0:
                 result["account_balance"] = state.get("account_balance", 0)
@@ -522,8 +533,7 @@ async def api_status(mode: str = Query("paper")):
             }
 
     # 最近 5 筆交易（給 Status 頁迷你表格用）
-    trades_csv = paths["data_dir"] / "trades.csv"
-    trades_df = read_csv_safe(trades_csv)
+    trades_df = _read_trades(paths, last=5)
     recent_trades = []
     if len(trades_df) > 0:
         last5 = trades_df.tail(5).iloc[::-1]  # 最新的在前
@@ -608,82 +618,79 @@ async def api_klines(limit: int = Query(1500, ge=50, le=1500)):
     L_GK = float(getattr(strategy, "L_GK_THRESH", 25))
     S_GK = float(getattr(strategy, "S_GK_THRESH", 35))
 
+    # 候選 bar：GK + breakout + session 三關（不看 regime / 狀態），一次向量化算完
+    market = strategy.GATE_GK | strategy.GATE_BREAKOUT | strategy.GATE_SESSION
+    sig = strategy.evaluate_signals_vectorized(df)
+    cand_l = ((sig["L"]["gates"] & market) == market).tolist()
+    cand_s = ((sig["S"]["gates"] & market) == market).tolist()
+
+    # 逐欄轉成 Python list，迴圈內不再 df.iloc 取列
+    col = {k: df[k].tolist() for k in ("datetime", "open", "high", "low", "close",
+                                       "volume", "ema20", "gk_pctile", "gk_pctile_s", "sma_slope")}
+
     last_regime = None
     seg_start = None
     seg_start_val = None
 
     for i in range(len(df)):
-        row = df.iloc[i]
-        ts = utc8_to_ts(row["datetime"])
+        ts = utc8_to_ts(col["datetime"][i])
         if ts <= 0:
             continue
-        op = float(row["open"]); cl = float(row["close"])
+        op = float(col["open"][i]); cl = float(col["close"][i])
+        hi = float(col["high"][i]); lo = float(col["low"][i])
         candles.append({
             "time": ts, "open": round(op, 2),
-            "high": round(float(row["high"]), 2),
-            "low": round(float(row["low"]), 2),
+            "high": round(hi, 2),
+            "low": round(lo, 2),
             "close": round(cl, 2),
         })
         # 成交量（漲綠/跌紅 半透明）
-        v = clean_value(row.get("volume"))
+        v = clean_value(col["volume"][i])
         if v is not None:
             color = "rgba(38,166,154,0.55)" if cl >= op else "rgba(239,83,80,0.55)"
             volume.append({"time": ts, "value": round(v, 2), "color": color})
-        e = clean_value(row.get("ema20"))
+        e = clean_value(col["ema20"][i])
         if e is not None:
             ema20.append({"time": ts, "value": round(e, 2)})
-        g = clean_value(row.get("gk_pctile"))
+        g = clean_value(col["gk_pctile"][i])
         if g is not None:
             gk_pctile.append({"time": ts, "value": round(g, 2)})
-        gs = clean_value(row.get("gk_pctile_s"))
+        gs = clean_value(col["gk_pctile_s"][i])
         if gs is not None:
             gk_pctile_s.append({"time": ts, "value": round(gs, 2)})
-        s = clean_value(row.get("sma_slope"))
+        s = clean_value(col["sma_slope"][i])
         if s is not None:
             sma_slope.append({"time": ts, "value": round(s * 100, 3)})
 
             # Regime 連續區段（用百分比閾值與 strategy.classify_regime 對齊）
-            r = strategy.classify_regime(row.get("sma_slope"))
+            r = strategy.classify_regime(col["sma_slope"][i])
             if r != last_regime:
                 if last_regime is not None and seg_start is not None:
                     regime_segs.append({"from": seg_start, "to": ts, "regime": last_regime})
                 seg_start = ts; last_regime = r
         # L 候選：GK<25 + breakout_long + session_ok_l
-        if g is not None and g < L_GK and bool(row.get("breakout_long")) and bool(row.get("session_ok_l")):
-            candidates_l.append({"time": ts, "price": round(float(row["low"]) * 0.997, 2)})
+        if cand_l[i]:
+            candidates_l.append({"time": ts, "price": round(lo * 0.997, 2)})
         # S 候選：GK_S<35 + breakout_short + session_ok_s
-        if gs is not None and gs < S_GK and bool(row.get("breakout_short")) and bool(row.get("session_ok_s")):
-            candidates_s.append({"time": ts, "price": round(float(row["high"]) * 1.003, 2)})
+        if cand_s[i]:
+            candidates_s.append({"time": ts, "price": round(hi * 1.003, 2)})
 
     # flush 最後一個 regime 區段
     if last_regime is not None and seg_start is not None and len(candles) > 0:
         regime_segs.append({"from": seg_start, "to": candles[-1]["time"], "regime": last_regime})
 
-    # ── 資金費率（Binance Futures 每 8h 一筆，最多 1000 筆 ≈ 333 天）──
-    # 對齊到 candle 時間：每根 bar 取「最近一次已生效」的費率（stepped line 用）
+    # ── 資金費率（本地 funding_store，每 8h 背景增量補；請求路徑不連網）──
+    # 對齊到 candle 時間：每根 bar 取開盤當下「最近一次已生效」的費率（stepped line 用）
     funding_rate = []
     try:
-        import requests
-        fr_resp = requests.get(
-            "https://fapi.binance.com/fapi/v1/fundingRate",
-            params={"symbol": "ETHUSDT", "limit": 1000},
-            timeout=5,
-        )
-        if fr_resp.ok:
-            fr_data = fr_resp.json()
-            # fr_data: [{ symbol, fundingTime(ms), fundingRate("0.0001") }, ...] 已升冪
-            fr_pts = [(int(x["fundingTime"]) // 1000, float(x["fundingRate"])) for x in fr_data]
-            if fr_pts:
-                fr_pts.sort(key=lambda p: p[0])
-                fi = 0
-                last_fr = None
-                for c in candles:
-                    ct = c["time"]
-                    while fi < len(fr_pts) and fr_pts[fi][0] <= ct:
-                        last_fr = fr_pts[fi][1]
-                        fi += 1
-                    if last_fr is not None:
-                        funding_rate.append({"time": ct, "value": round(last_fr * 100, 4)})  # 轉百分比
+        import funding_store
+        funding_store.refresh_async("ETHUSDT")
+        if candles:
+            ct = np.fromiter((c["time"] for c in candles), dtype=np.int64, count=len(candles))
+            # candle time 是 UTC+8 牆鐘秒數 → 轉回 UTC ms 再 as-of join
+            fr = funding_store.open_store("ETHUSDT").rate_asof((ct - 8 * 3600) * 1000)
+            funding_rate = [{"time": int(t), "value": round(float(v) * 100, 4)}  # 轉百分比
+                            for t, v in zip(ct, fr) if not math.isnan(v)]
     except Exception:
         funding_rate = []
 
@@ -709,8 +716,7 @@ async def api_klines(limit: int = Query(1500, ge=50, le=1500)):
 async def api_trades(mode: str = Query("paper")):
     """全部交易記錄"""
     paths = get_paths(mode)
-    csv_path = paths["data_dir"] / "trades.csv"
-    df = read_csv_safe(csv_path)
+    df = _read_trades(paths)
 
     if len(df) == 0:
         return {"trades": [], "total": 0}
@@ -778,8 +784,7 @@ async def api_daily(mode: str = Query("paper")):
 async def api_analytics(mode: str = Query("paper")):
     """收益統計"""
     paths = get_paths(mode)
-    csv_path = paths["data_dir"] / "trades.csv"
-    df = read_csv_safe(csv_path)
+    df = _read_trades(paths)
 
     result = {
         "total_pnl": 0,
@@ -1025,8 +1030,7 @@ async def api_percentile_vs_oos(mode: str = Query("paper"),
     refresh=true 強制重算 OOS 分佈（否則 24h 內走快取）。
     """
     paths = get_paths(mode)
-    trades_file = paths["data_dir"] / "trades.csv"
-    df = read_csv_safe(trades_file)
+    df = _read_trades(paths, closed=True)
 
     result = {
         "month": {"pnl": 0.0, "percentile": None, "n_trades": 0, "label": None},
@@ -1153,10 +1157,21 @@ def _get_bt_data(symbol: str = "ETHUSDT"):
     _refresh_symbol_data(symbol)
 
     if symbol not in _bt_df_cache:
-        filepath = ROOT_DIR / "data" / f"{symbol}_1h_latest730d.csv"
-        if not filepath.exists():
-            raise ValueError(f"No data file for {symbol}")
-        _bt_df_cache[symbol] = pd.read_csv(filepath)
+        df = None
+        try:
+            import kline_store
+            store = kline_store.open_store(symbol, "1h")
+            if len(store):
+                # memmap 直接取欄位（毫秒級），datetime 轉成與 CSV 相同的字串格式
+                df = store.to_frame(str_datetime=True)
+        except Exception:
+            df = None
+        if df is None:
+            filepath = ROOT_DIR / "data" / f"{symbol}_1h_latest730d.csv"
+            if not filepath.exists():
+                raise ValueError(f"No data file for {symbol}")
+            df = pd.read_csv(filepath)
+        _bt_df_cache[symbol] = df
     return _bt_df_cache[symbol].copy()
 
 
@@ -1195,7 +1210,7 @@ def _run_backtest(params: BacktestParams):
         for k, v in patch_map.items():
             originals[k] = getattr(_bt_mod, k)
             setattr(_bt_mod, k, v)
-        ind = bt_compute(df)
+        ind = bt_compute_cached(df)
         datetimes = df['datetime'].values
 
         # 若有 start_date，找到對應的 bar index，模擬從該時間點啟動
@@ -1223,6 +1238,31 @@ def _run_backtest(params: BacktestParams):
 
 
 def _refresh_symbol_data(symbol: str):
+    """K 線庫（kline_store）補到最新：startTime=last+1，不再整檔讀 CSV 判斷新舊。
+    有新 bar 時同步輸出 CSV（研究腳本仍讀 data/*.csv）；庫不可用 → 退回 CSV 增量補齊。"""
+    try:
+        import kline_store
+        store = kline_store.open_store(symbol, "1h")
+        last = store.last_open_time
+        if last is not None and time.time() * 1000 - last < 2 * 3600 * 1000:
+            return  # Fresh enough
+        n0 = len(store)
+        if last is None:
+            kline_store.ensure_history(symbol, "1h", 730)
+        else:
+            store.top_up()
+        if len(store) != n0:
+            _bt_df_cache.pop(symbol, None)
+            filepath = ROOT_DIR / "data" / f"{symbol}_1h_latest730d.csv"
+            filepath.parent.mkdir(exist_ok=True)
+            store.to_frame(str_datetime=True).to_csv(filepath, index=False)
+        return
+    except Exception:
+        pass
+    _refresh_symbol_csv(symbol)
+
+
+def _refresh_symbol_csv(symbol: str):
     """If cached CSV is stale (>6h since last bar), auto-fetch latest from Binance."""
     filepath = ROOT_DIR / "data" / f"{symbol}_1h_latest730d.csv"
     if not filepath.exists():
@@ -1349,7 +1389,7 @@ async def api_backtest_audit(params: BacktestParams):
             originals_saved[k] = getattr(_bt_mod, k)
             setattr(_bt_mod, k, v)
 
-        ind_clean = bt_compute(df)
+        ind_clean = bt_compute_cached(df)
 
         df_corrupt = df.copy()
         rng = np.random.RandomState(42)
@@ -1413,7 +1453,7 @@ async def api_backtest_audit(params: BacktestParams):
         for k, v in full_patch.items():
             originals_saved2[k] = getattr(_bt_mod, k)
             setattr(_bt_mod, k, v)
-        ind = bt_compute(df)
+        ind = bt_compute_cached(df)
         datetimes = df['datetime'].values
         trades = bt_simulate(ind, datetimes)
     finally:
@@ -1513,7 +1553,7 @@ async def api_backtest_audit(params: BacktestParams):
     # === G7: Walk-forward 6 folds（依 bar index 等分）===
     try:
         saved_wf = _apply_full_patch()
-        ind_wf = bt_compute(df)
+        ind_wf = bt_compute_cached(df)
         dt_wf = df['datetime'].values
         n_bars = len(df)
         K = 6
@@ -1544,7 +1584,7 @@ async def api_backtest_audit(params: BacktestParams):
     try:
         saved_rev = _apply_full_patch()
         # 正向 PnL 作為 baseline
-        ind_fwd = bt_compute(df)
+        ind_fwd = bt_compute_cached(df)
         fwd_trades = bt_simulate(ind_fwd, df['datetime'].values)
         fwd_pnl = sum(float(t['pnl_usd']) for t in fwd_trades)
 
@@ -1709,7 +1749,7 @@ def _read_bot_state():
         paper = os.getenv("PAPER_TRADING", "true").lower() == "true"
         sf = ROOT_DIR / ("eth_state.json" if paper else "eth_state_live.json")
         if sf.exists():
-            state = json.loads(sf.read_text(encoding="utf-8"))
+            state = state_journal.load_state(str(sf))
             bal = state.get("account_balance", 0)
             positions = state.get("positions", {})
             lc = sum(1 for p in positions.values() if p.get("sub_strategy") == "L")
@@ -1864,6 +1904,22 @@ async def api_logs(file: str = Query("system"), lines: int = Query(200, ge=10, l
         return {"file": file, "lines": [f"Error: {e}"], "total": 0}
 
 
+@app.get("/api/perf")
+async def api_perf(n: int = Query(168, ge=1, le=5000)):
+    """最近 N 根 cycle 的各階段耗時 p50 / p95 / max（logs/cycle_timing.csv）"""
+    import cycle_timing
+    df = cycle_timing.load(n, path=str(ROOT_DIR / "logs" / "cycle_timing.csv"))
+    summary = cycle_timing.summarize(df)
+    return {
+        "cycles": len(df),
+        "stages": [
+            {"stage": k, "label": cycle_timing.STAGE_LABELS.get(k, k),
+             **{m: round(v, 3) if isinstance(v, float) else v for m, v in summary[k].items()}}
+            for k in cycle_timing.STAGES + cycle_timing.SPANS + cycle_timing.TOTALS if k in summary
+        ],
+    }
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 啟動
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -1661,6 +1661,33 @@ async function loadAnalytics() {
         setConnStatus(false);
         $('analytics-cards').innerHTML = `<div class="loading">載入失敗: ${e.message}</div>`;
     }
+    try {
+        renderPerf(await api('/api/perf?n=168'));
+    } catch (e) {
+        $('perf-table').innerHTML = `<div class="loading">載入失敗: ${e.message}</div>`;
+    }
+}
+
+// 每小時 cycle 各階段耗時（p95 > 5s 標紅：收盤到下單太慢會漏掉收盤價附近的成交）
+function renderPerf(d) {
+    const el = $('perf-table');
+    if (!d.stages || d.stages.length === 0) { el.innerHTML = '<div class="loading">尚無資料 (No Data)</div>'; return; }
+    const sec = v => v == null ? '-' : v.toFixed(2) + 's';
+    let html = `<table class="strat-table"><thead><tr>
+        <th>階段 (Stage)</th><th>p50</th><th>p95</th><th>max</th><th>最慢 bar (Slowest)</th>
+    </tr></thead><tbody>`;
+    for (const s of d.stages) {
+        const slow = s.p95 > 5 ? ' class="pnl-neg"' : '';
+        html += `<tr>
+            <td><b>${s.label}</b> <span style="opacity:.6">${s.stage}</span></td>
+            <td>${sec(s.p50)}</td>
+            <td${slow}>${sec(s.p95)}</td>
+            <td>${sec(s.max)}</td>
+            <td>${s.max_bar ? fmtTime(s.max_bar) : '-'}</td>
+        </tr>`;
+    }
+    html += `</tbody></table><div style="opacity:.6;margin-top:6px">共 ${d.cycles} 根 cycle</div>`;
+    el.innerHTML = html;
 }
 
 // 進場 Regime 說明（collapsible）：讓沒看過研究文件的使用者也能理解
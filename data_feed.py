@@ -5,16 +5,17 @@ Binance K線資料擷取模組
 - 使用正式端點（非 testnet，testnet K 線資料不完整）
 - 3 次重試 + 指數退避
 - 55 秒記憶體快取（避免同 cycle 重複呼叫）
+- 已收盤 K 線存進 kline_store（memmap），每小時只補 startTime=last+1 之後的 1–2 根
 - datetime 轉 UTC+8（匹配回測 CSV 格式）
 """
 import os
 import time
 import logging
-import requests
 import pandas as pd
 from datetime import timedelta
 
 import paths  # 多實例：共用 K 線快取放程式目錄（所有實例共用）
+import kline_store
 
 logger = logging.getLogger("data_feed")
 
@@ -23,6 +24,9 @@ FUTURES_KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
 _cache = {}
 _CACHE_TTL = 55  # 進程內快取：略短於 60s，確保每小時 cycle 拿到新資料
 
+# K 線庫（kline_store）：KLINE_STORE=0 可關閉，回到每次整段 REST
+_USE_STORE = os.getenv("KLINE_STORE", "1").strip() != "0"
+
 # ── 跨實例共用 K 線快取 ──
 # 多實例（有設 INSTANCE_DIR）時，同一份 ETH/BTC 1h K 線對所有人相同 → 只讓一個實例去抓、
 # 其他實例讀共用檔，避免 N 個實例每小時各打一次 Binance。用 flock 去重；任何問題一律
@@ -69,7 +73,7 @@ def _fetch_from_binance(symbol, interval, limit, max_retries):
     last_err = None
     for attempt in range(max_retries):
         try:
-            resp = requests.get(FUTURES_KLINES_URL, params=params, timeout=15)
+            resp = kline_store.HTTP.get(FUTURES_KLINES_URL, params=params, timeout=15)
             resp.raise_for_status()
             data = resp.json()
             break
@@ -96,6 +100,32 @@ def _fetch_from_binance(symbol, interval, limit, max_retries):
     return df
 
 
+def _fetch_incremental(symbol, interval, limit, max_retries):
+    """K 線庫補到最新後取最後 limit-1 根已收盤 + 1 根未收盤（格式同 _fetch_from_binance）。
+    庫不可用、缺未收盤 bar 或根數不足 → 退回整段 REST（fail-open）。"""
+    if not _USE_STORE:
+        return _fetch_from_binance(symbol, interval, limit, max_retries)
+    try:
+        store = kline_store.open_store(symbol, interval)
+        now_ms = int(time.time() * 1000)
+        # 空庫：從 limit 根前開始建；否則 startTime=last+1（停機很久就多翻幾頁）
+        store.top_up(start_ms=now_ms - limit * store.step, max_retries=max_retries)
+        if store.forming is None or len(store) < limit - 1:
+            raise ValueError(f"store not ready ({len(store)} bars, forming={store.forming is not None})")
+        df = store.to_frame(tail=limit - 1)
+        k = store.forming
+        forming = pd.DataFrame([{
+            "open": float(k[1]), "high": float(k[2]), "low": float(k[3]), "close": float(k[4]),
+            "volume": float(k[5]), "taker_buy_volume": float(k[9]),
+            "datetime": pd.to_datetime(int(k[0]), unit="ms") + timedelta(hours=8),
+        }])
+        df = pd.concat([df, forming], ignore_index=True)
+        return df[["open", "high", "low", "close", "volume", "taker_buy_volume", "datetime"]]
+    except Exception as e:
+        logger.warning(f"kline store fetch failed ({e}), using full REST")
+        return _fetch_from_binance(symbol, interval, limit, max_retries)
+
+
 def _shared_fetch(symbol, interval, limit, max_retries):
     """多實例共用抓取：先讀共用檔；沒有就搶 flock 去抓，其他實例讀檔。
     任何共用快取異常都退回直接抓（fail-open）。"""
@@ -126,7 +156,7 @@ def _shared_fetch(symbol, interval, limit, max_retries):
                 try:
                     df = _read_shared(csv_path, limit)  # 拿到鎖再確認一次
                     if df is None:
-                        df = _fetch_from_binance(symbol, interval, limit, max_retries)
+                        df = _fetch_incremental(symbol, interval, limit, max_retries)
                         _write_shared(df, csv_path)
                     return df
                 finally:
@@ -137,7 +167,7 @@ def _shared_fetch(symbol, interval, limit, max_retries):
         logger.debug(f"shared fetch fallback: {e}")
 
     # 拿不到鎖且檔還沒好，或非 Linux → 自己抓（保底）
-    df = _fetch_from_binance(symbol, interval, limit, max_retries)
+    df = _fetch_incremental(symbol, interval, limit, max_retries)
     if _SHARED:
         _write_shared(df, csv_path)
     return df
@@ -163,12 +193,31 @@ def fetch_klines(symbol: str = "ETHUSDT", interval: str = "1h",
     if _SHARED:
         df = _shared_fetch(symbol, interval, limit, max_retries)
     else:
-        df = _fetch_from_binance(symbol, interval, limit, max_retries)
+        df = _fetch_incremental(symbol, interval, limit, max_retries)
 
     _cache[cache_key] = {"time": now, "df": df}
     return df.copy()
 
 
+def ingest_closed_kline(symbol: str, interval: str, kline: list) -> bool:
+    """WS 收盤事件的 K 線（REST 陣列格式）直接寫進 K 線庫，並讓進程內快取失效。
+    之後的 fetch_klines 只需向 REST 拿未收盤那根。失敗回 False（fail-open）。"""
+    _cache.pop((symbol, interval), None)
+    if not _USE_STORE:
+        return False
+    try:
+        kline_store.open_store(symbol, interval).append([kline])
+        return True
+    except Exception as e:
+        logger.debug(f"ingest closed kline failed: {e}")
+        return False
+
+
+def invalidate_cache():
+    """清進程內 55s 快取（收盤事件觸發後重抓用）"""
+    _cache.clear()
+
+
 def fetch_eth_and_btc(eth_limit: int = 500) -> tuple:
     """
     同時抓 ETHUSDT + BTCUSDT 1h K 線。
@@ -14,7 +14,7 @@
 Edge 強度項「獲利中不觸紅」：窗口平均 >0 時最低 🟡（弱≠死），轉虧才可能 🔴——
 歷史 2 年滾動回放校準：🔴 率 0.4~2%（僅真虧損窗口）、🟡 率 15~21%，
 與 V29（2 年零紅燈、誤報 24%）同哲學；🟡 的行動本來就只是「觀察/連續兩月才凍結加碼」。
-掛載點：analyze.py（實盤/模擬 trades.csv）與 run_backtest.py（回測明細）輸出尾端。
+掛載點：analyze.py（實盤/模擬交易帳本 trades.db）與 run_backtest.py（回測明細）輸出尾端。
 所有入口 fail-open：檢查失敗只印一行原因，不影響主報告。
 
 基準常數來自 2 年貼近實盤回測（--flat 200U 基準），重算方式：
@@ -22,7 +22,6 @@ Edge 強度項「獲利中不觸紅」：窗口平均 >0 時最低 🟡（弱≠
     （總 PnL / 交易數 / 出場分佈 → 更新下方 BASE_* 常數並註記日期）
 """
 import os
-import csv
 from datetime import datetime, timedelta
 
 import labels
@@ -165,10 +164,10 @@ def _check_fidelity(live_rows):
                       f"{last_exit[:16]}（run_backtest.py --refresh 後可用）")
 
     eng = _load_engine()
-    ind = eng.compute_indicators(df)
-    bt = eng.simulate_v14_detailed(ind, df["datetime"].values, start_bar=None,
-                                   realistic=True, slip_bps=0.0,
-                                   margin_schedule=MARGIN_SCHEDULE)
+    ind = eng.compute_indicators_cached(df)
+    bt = eng.simulate_v14_fast(ind, df["datetime"].values, start_bar=None,
+                               realistic=True, slip_bps=0.0,
+                               margin_schedule=MARGIN_SCHEDULE)
     # 成交時刻（= 訊號 bar 開盤 +1h）當比對鍵
     lo = min(analysis_report.to_exec_time(r["entry_time_utc8"]) for r in rows)
     hi = max(analysis_report.to_exec_time(r["entry_time_utc8"]) for r in rows)
@@ -230,20 +229,13 @@ def _render(items, n, scope_note, schedule_start: str = None) -> str:
 
 
 def build_check_live(data_dir: str, recent: int = 30) -> str:
-    """analyze.py 掛載點：讀 trades.csv 最近 N 筆已平倉交易做四項檢查。"""
+    """analyze.py 掛載點：讀交易帳本最近 N 筆已平倉交易做四項檢查。"""
     try:
-        trades_path = os.path.join(data_dir, "trades.csv")
-        if not os.path.exists(trades_path):
-            return ""
-        rows = []
-        with open(trades_path, "r", encoding="utf-8") as f:
-            for row in csv.DictReader(f):
-                if str(row.get("net_pnl_usd", "") or "").strip() == "":
-                    continue
-                rows.append(row)
+        import trade_ledger
+        rows = [r for r in trade_ledger.rows(data_dir, closed=True, order="exit")
+                if str(r.get("net_pnl_usd", "") or "").strip() != ""]
         if not rows:
             return ""
-        rows.sort(key=lambda r: str(r.get("exit_time_utc8", "")))
         recent_rows = rows[-recent:]
 
         pnls_R, codes = [], []
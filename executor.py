@@ -13,19 +13,21 @@ Live mode:  呼叫 binance_trade.py 下單
   連虧 4 筆 → 24 bar 冷卻
 
 V14 新增：L 持倉新增 running_mfe / mh_reduced 欄位（MFE Trailing + Conditional MH）。
-狀態持久化到 eth_state.json，重啟後可恢復。
+狀態持久化到 eth_state.json + eth_state.journal（state_journal：每次只追加變動，定期合併快照），重啟後可恢復。
+讀取端（Telegram 指令、觸價計畫）用 snapshot() 唯讀快照不拿鎖；狀態鎖 _lock 不跨交易所 / 磁碟 I/O。
 """
 import os
-import json
-import copy
 import logging
+import time
 import random
 import threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 import strategy
 import recorder
+import state_journal
 import labels  # 中文(英文)詞彙對照
 import paths  # 多實例路徑（INSTANCE_DIR 分流狀態檔）
 from telegram_notify import send_telegram_message, wrap_private
@@ -35,6 +37,9 @@ load_dotenv()
 PAPER_TRADING = os.getenv("PAPER_TRADING", "true").lower() == "true"
 SYMBOL = os.getenv("SYMBOL", "ETHUSDT")
 INITIAL_BALANCE = float(os.getenv("INITIAL_BALANCE", "1000.0"))
+# 下單當下以「名目 × 費率」估計手續費記帳；實際值由 reconcile_commissions 每小時批次對帳補正
+COMMISSION_RATE = float(os.getenv("TAKER_FEE_RATE", "0.0005"))
+RECONCILE_SECONDS = 3600
 logger = logging.getLogger("executor")
 
 ENTRY_NOTIFICATION_HEADERS = (
@@ -53,6 +58,38 @@ LOSS_NOTIFICATION_HEADERS = (
     "🎮 殘念，這關沒有通過…",
 )
 
+
+@dataclass(frozen=True, slots=True)
+class StateSnapshot:
+    """
+    Executor 狀態的唯讀複本（Telegram /status /balance /pnl /signal /cb、觸價計畫用）。
+
+    每次狀態變動後在 _lock 內重建、以單一參照替換發布（copy-on-write）；
+    讀取端拿 executor.snapshot() 不必持鎖，開平倉卡在交易所 I/O 時也能立刻回覆。
+    positions / daily_stats 等容器都是複本，讀取端不可（也不必）回寫。
+    """
+    positions: dict
+    last_exits: dict
+    account_balance: float
+    bar_counter: int
+    trade_number: int
+    daily_stats: dict
+    monthly_pnl: dict
+    monthly_entries: dict
+    monthly_key: str
+    daily_pnl: float
+    consec_losses: int
+    consec_loss_cooldown_until: int
+    paused: bool
+    edge_cusum: float
+    edge_level: str
+    busy_sides: frozenset    # 正在交易所下單中的方向（"LONG" / "SHORT"）
+
+    def edge_health_pct(self) -> float:
+        s = self.edge_cusum if self.edge_cusum is not None else 0.0
+        return max(0.0, (strategy.EDGE_CUSUM_RED - s) / strategy.EDGE_CUSUM_RED * 100)
+
+
 class Executor:
     def __init__(self, state_path: str = None):
         if state_path is None:
@@ -83,31 +120,44 @@ class Executor:
         self.last_daily_date = None                    # 最後一次 daily_summary flush 的 UTC+8 日期 (YYYY-MM-DD)
 
         # V29 策略健康度（Edge 衰退警報，CUSUM；200U 基準 R 單位，doc/v29_research.md）
-        self.edge_cusum = None                         # None = 尚未初始化（state 或 trades.csv 回放）
+        self.edge_cusum = None                         # None = 尚未初始化（state 或交易帳本回放）
         self.edge_level = "green"                      # green / yellow / red
 
-        # Thread safety: main loop 與 Telegram listener daemon thread 並發存取
-        # positions/daily_stats/paused 等狀態。RLock 允許同一 thread 重入
-        # （例如 open_position 內呼叫 save_state）。
+        # Thread safety：
+        #   _lock        狀態鎖（寫入端）：只包住記憶體內的讀改寫，絕不跨網路 / 磁碟 I/O。
+        #                RLock 允許同一 thread 重入（例如 record_close 內呼叫 _ensure_daily）。
+        #   _order_locks 每個方向一把：同方向的開倉 / 平倉（下單、查倉、撤 SL）依序進行，
+        #                SL 只掛第一筆、最後一筆才撤單的判斷不會被另一邊插隊；持有期間不持 _lock。
+        #   _snapshot    唯讀複本（StateSnapshot），狀態變動後在 _lock 內發布；讀取端不拿鎖。
+        #   鎖順序：_order_locks → _lock（持 _lock 時不可呼叫 open_position / close_position）。
         self._lock = threading.RLock()
+        self._order_locks = {"LONG": threading.Lock(), "SHORT": threading.Lock()}
+        self._busy_sides = set()
+        self._last_reconcile = 0.0                     # 上次手續費對帳（epoch 秒）
+        self._snapshot = None
 
+        self._journal = state_journal.Journal(self.state_path)
         self._load_state()
         if self.edge_cusum is None:
-            self._init_edge_from_history()  # 首次啟用：從 trades.csv 回放重建
+            self._init_edge_from_history()  # 首次啟用：從交易帳本回放重建
         self._init_balance()
+        self._publish()
 
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     # 狀態持久化
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
     def _load_state(self):
-        """從 eth_state.json 載入狀態"""
-        if not os.path.exists(self.state_path):
-            logger.info("No state file found, starting fresh")
-            return
+        """從 eth_state.json 快照 + eth_state.journal 日誌重放載入狀態"""
         try:
-            with open(self.state_path, "r", encoding="utf-8") as f:
-                state = json.load(f)
+            state, seq, replayed = state_journal.load(self.state_path)
+            if state is None:
+                logger.info("No state file found, starting fresh")
+                return
+            self._journal = state_journal.Journal(self.state_path, state, seq, replayed)
+            if replayed:
+                logger.info(f"State journal replayed: {replayed} entries (seq {seq})")
+                self._journal.compact()  # 重放過的日誌併回快照，日誌從空檔重新開始
             self.positions = state.get("positions", {})
             self.account_balance = state.get("account_balance", None)
             self.bar_counter = state.get("bar_counter", 0)
@@ -197,32 +247,34 @@ class Executor:
             if self.account_balance is None:
                 self.account_balance = 0.0
 
-    def _sync_balance(self):
-        """同步幣安實際錢包餘額"""
+    def _sync_balance(self, balance=None):
+        """同步幣安實際錢包餘額（balance 為 cycle 預取值時不再打 API；查詢不持 _lock）"""
         try:
-            import binance_trade
-            balance = binance_trade.get_wallet_balance()
+            if balance is None:
+                import binance_trade
+                balance = binance_trade.get_wallet_balance()
             if balance > 0:
-                old = self.account_balance
-                self.account_balance = balance
+                with self._lock:
+                    old = self.account_balance
+                    self.account_balance = balance
+                    self._publish()
                 logger.info(f"Balance synced: ${old:.2f} → ${balance:.2f}")
         except Exception as e:
             logger.error(f"Balance sync failed: {e}")
 
     def save_state(self):
-        """儲存狀態到 eth_state.json（持鎖深拷貝 + atomic replace）"""
-        # 持鎖 deepcopy 兩層嵌套 dict（positions / daily_stats value 都是 dict），
-        # 避免鎖外 json.dump 期間其他 thread 改 pos 內部欄位污染序列化結果。
-        # 其他 dict value 都是 primitive，淺拷貝 dict(...) 已足夠。
+        """儲存狀態：只把與上次存檔的差異追加到日誌（state_journal），定期合併成 eth_state.json 快照"""
+        # 比對與深拷貝變動在鎖內完成（其他 thread 不會在中途改 pos 內部欄位），
+        # 順便發布唯讀快照；寫檔 + fsync 在鎖外（Journal.flush 依 seq 順序寫）。
         with self._lock:
             state = {
-                "positions": copy.deepcopy(self.positions),
+                "positions": self.positions,
                 "last_exits": dict(self.last_exits),
                 "account_balance": round(self.account_balance, 4),
                 "bar_counter": self.bar_counter,
                 "last_bar_time": self.last_bar_time,
                 "trade_number": self.trade_number,
-                "daily_stats": copy.deepcopy(self.daily_stats),
+                "daily_stats": self.daily_stats,
                 "circuit_breaker": {
                     "monthly_pnl": dict(self.monthly_pnl),
                     "monthly_entries": dict(self.monthly_entries),
@@ -239,10 +291,55 @@ class Executor:
                     "level": self.edge_level,
                 },
             }
-        tmp_path = self.state_path + ".tmp"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2, ensure_ascii=False, default=str)
-        os.replace(tmp_path, self.state_path)
+            self._journal.stage(state)
+            self._publish()
+        self._journal.flush()
+
+    # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    # 唯讀快照
+    # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+    def _publish(self) -> StateSnapshot:
+        """重建唯讀快照並替換參照（取 _lock；RLock，呼叫端已持鎖也可）"""
+        with self._lock:
+            self._snapshot = StateSnapshot(
+                positions={tid: dict(p) for tid, p in self.positions.items()},
+                last_exits=dict(self.last_exits),
+                account_balance=self.account_balance,
+                bar_counter=self.bar_counter,
+                trade_number=self.trade_number,
+                daily_stats={k: dict(v) for k, v in self.daily_stats.items()},
+                monthly_pnl=dict(self.monthly_pnl),
+                monthly_entries=dict(self.monthly_entries),
+                monthly_key=self.monthly_key,
+                daily_pnl=self.daily_pnl,
+                consec_losses=self.consec_losses,
+                consec_loss_cooldown_until=self.consec_loss_cooldown_until,
+                paused=self.paused,
+                edge_cusum=self.edge_cusum,
+                edge_level=self.edge_level,
+                busy_sides=frozenset(self._busy_sides),
+            )
+            return self._snapshot
+
+    def snapshot(self) -> StateSnapshot:
+        """最近一次發布的唯讀狀態（不拿鎖；單一參照讀取）"""
+        return self._snapshot
+
+    def order_lock(self, position_side: str) -> threading.Lock:
+        """同方向下單鎖（"LONG" / "SHORT"）；/cleanup 等直接下單的路徑也要先拿"""
+        return self._order_locks[position_side]
+
+    def advance_bar(self, bar_time: str) -> bool:
+        """主循環推進一根 bar：bar_counter +1、記 last_bar_time 並發布快照。
+        同一根 bar 已處理過 → 不動、回 False（防重複）。"""
+        with self._lock:
+            if self.last_bar_time == bar_time:
+                return False
+            self.bar_counter += 1
+            self.last_bar_time = bar_time
+            self._publish()
+            return True
 
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     # V29 策略健康度（Edge 衰退警報，doc/v29_research.md）
@@ -262,20 +359,16 @@ class Executor:
         return "green"
 
     def _init_edge_from_history(self):
-        """首次啟用：從 trades.csv 回放已平倉交易重建 CUSUM。
+        """首次啟用：從交易帳本回放已平倉交易重建 CUSUM。
         正規化：net_pnl_pct 是「pnl / 平倉當時保證金」×100 → ×2 即 200U 基準 R。"""
         self.edge_cusum = 0.0
         try:
-            import csv as _csv
-            path = os.path.join(paths.data_dir(PAPER_TRADING), "trades.csv")
+            import trade_ledger
             rows = []
-            if os.path.exists(path):
-                with open(path, "r", encoding="utf-8") as f:
-                    for r in _csv.DictReader(f):
-                        pct = (r.get("net_pnl_pct") or "").strip()
-                        if pct and (r.get("exit_type") or "").strip():
-                            rows.append((r.get("exit_time_utc8") or "", float(pct)))
-            rows.sort(key=lambda x: x[0])
+            for r in trade_ledger.rows(paths.data_dir(PAPER_TRADING), closed=True, order="exit"):
+                pct = (r.get("net_pnl_pct") or "").strip()
+                if pct and (r.get("exit_type") or "").strip():
+                    rows.append((r.get("exit_time_utc8") or "", float(pct)))
             s = 0.0
             for _, pct in rows:
                 s = max(0.0, s + (strategy.EDGE_CUSUM_K - pct * 2.0))
@@ -284,7 +377,7 @@ class Executor:
             logger.info(f"Edge health initialized from {len(rows)} closed trades: "
                         f"S={s:.1f} → {self.edge_health_pct():.0f}% ({self.edge_level})")
         except Exception as e:
-            logger.warning(f"Edge health init from trades.csv failed, start S=0: {e}")
+            logger.warning(f"Edge health init from trade ledger failed, start S=0: {e}")
             self.edge_level = "green"
 
     def _update_edge_health(self, pnl_usd, entry_price, qty):
@@ -334,7 +427,11 @@ class Executor:
         """更新月/日 key，跨月/日時重置計數器"""
         month_key = dt_utc8.strftime("%Y-%m")
         day_key = dt_utc8.strftime("%Y-%m-%d")
+        with self._lock:
+            self._roll_period_keys(month_key, day_key)
+            self._publish()  # 跨月 / 跨日歸零的計數，讀取端一併看到
 
+    def _roll_period_keys(self, month_key: str, day_key: str):
         if self.monthly_key != month_key:
             if self.monthly_key is not None:
                 logger.info(f"Month rollover: {self.monthly_key} → {month_key} | "
@@ -351,52 +448,103 @@ class Executor:
             self.daily_key = day_key
             self.daily_pnl = 0.0
 
-    def check_circuit_breaker(self, side: str) -> tuple:
+    def check_circuit_breaker(self, side: str, projected: list = None) -> tuple:
         """
         檢查風控熔斷是否允許進場。
 
         Args:
             side: "L" or "S"
+            projected: 本 bar 尚未成交的出場 [(sub_strategy, 估計 pnl_usd)]；
+                       進場與出場同批送出時，先當作這些出場已記帳再判斷（同 _close_position_io 的累計方式）
 
         Returns:
             (allowed: bool, reason: str)
         """
+        with self._lock:
+            consec_losses = self.consec_losses
+            cooldown_until = self.consec_loss_cooldown_until
+            daily_pnl = self.daily_pnl
+            monthly_pnl = dict(self.monthly_pnl)
+            monthly_entries = dict(self.monthly_entries)
+            bar_counter = self.bar_counter
+        for sub, pnl in projected or ():
+            daily_pnl += pnl
+            monthly_pnl[sub] = monthly_pnl.get(sub, 0.0) + pnl
+            if pnl < 0:
+                consec_losses += 1
+                if consec_losses >= strategy.CONSEC_LOSS_PAUSE:
+                    cooldown_until = bar_counter + strategy.CONSEC_LOSS_COOLDOWN
+            else:
+                consec_losses = 0
+
         # 1. 連虧冷卻
-        if self.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
-            if self.bar_counter < self.consec_loss_cooldown_until:
-                remaining = self.consec_loss_cooldown_until - self.bar_counter
-                return False, f"連虧{self.consec_losses}筆冷卻中（剩{remaining}bar）"
+        if consec_losses >= strategy.CONSEC_LOSS_PAUSE:
+            if bar_counter < cooldown_until:
+                remaining = cooldown_until - bar_counter
+                return False, f"連虧{consec_losses}筆冷卻中（剩{remaining}bar）"
 
         # 2. 日虧上限
-        if self.daily_pnl <= strategy.DAILY_LOSS_LIMIT:
-            return False, f"日虧${self.daily_pnl:.0f}已達上限${strategy.DAILY_LOSS_LIMIT}"
+        if daily_pnl <= strategy.DAILY_LOSS_LIMIT:
+            return False, f"日虧${daily_pnl:.0f}已達上限${strategy.DAILY_LOSS_LIMIT}"
 
         # 3. 月虧上限（per-strategy）
         if side == "L":
             cap = strategy.L_MONTHLY_LOSS_CAP
-            pnl = self.monthly_pnl.get("L", 0.0)
+            pnl = monthly_pnl.get("L", 0.0)
         else:
             cap = strategy.S_MONTHLY_LOSS_CAP
-            pnl = self.monthly_pnl.get("S", 0.0)
+            pnl = monthly_pnl.get("S", 0.0)
         if pnl <= cap:
             return False, f"{side}月虧${pnl:.0f}已達上限${cap}"
 
         # 4. 月度進場上限
         if side == "L":
             entry_cap = strategy.L_MONTHLY_ENTRY_CAP
-            entries = self.monthly_entries.get("L", 0)
+            entries = monthly_entries.get("L", 0)
         else:
             entry_cap = strategy.S_MONTHLY_ENTRY_CAP
-            entries = self.monthly_entries.get("S", 0)
+            entries = monthly_entries.get("S", 0)
         if entries >= entry_cap:
             return False, f"{side}月進場{entries}筆已達上限{entry_cap}"
 
         return True, ""
 
+    def project_exit_pnl(self, trade_id: str, exit_price: float) -> float:
+        """以策略出場價估算平倉淨損益（出場手續費用 COMMISSION_RATE 估）；倉位不在回 0"""
+        with self._lock:
+            pos = self.positions.get(trade_id)
+            if not pos:
+                return 0.0
+            entry_price = pos["entry_price"]
+            qty = pos.get("qty", strategy.NOTIONAL / entry_price)
+            if pos["side"] == "long":
+                gross = (exit_price - entry_price) * qty
+            else:
+                gross = (entry_price - exit_price) * qty
+            fees = pos.get("entry_commission", 0.0) + qty * exit_price * COMMISSION_RATE
+        return round(gross - fees, 4)
+
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     # 持倉操作
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
+    def run_orders(self, actions: list) -> list:
+        """
+        同一根 bar 的開 / 平倉動作（無參數 callable，包 open_position / close_position）。
+        Live 交給 binance_trade.run_batched：各動作並行、市價單合併成一支 batchOrders；
+        Paper 依序執行。回傳與 actions 同順序的結果（動作拋出的例外以例外物件回傳）。
+        """
+        if not PAPER_TRADING:
+            import binance_trade
+            return binance_trade.run_batched(actions)
+        out = []
+        for fn in actions:
+            try:
+                out.append(fn())
+            except Exception as e:
+                out.append(e)
+        return out
+
     def open_position(self, side: str, sub_strategy: str, entry_price: float,
                       bar_counter: int, signal_indicators: dict,
                       bar_data: dict, btc_context: dict) -> str:
@@ -415,14 +563,23 @@ class Executor:
         Returns:
             trade_id or None
         """
-        with self._lock:
+        position_side = "LONG" if side == "long" else "SHORT"
+        with self._order_locks[position_side]:
             return self._open_position_locked(side, sub_strategy, entry_price,
                                               bar_counter, signal_indicators,
                                               bar_data, btc_context)
 
     def _open_position_locked(self, side, sub_strategy, entry_price, bar_counter,
                                signal_indicators, bar_data, btc_context):
-        self.trade_number += 1
+        """持該方向 _order_locks 執行；_lock 只在標記方向忙碌、寫入持倉（含配發交易編號）兩段短暫持有"""
+        order_side = "BUY" if side == "long" else "SELL"
+        position_side = "LONG" if side == "long" else "SHORT"
+        with self._lock:
+            # 同方向內部持倉數：持方向鎖期間不會有同方向的開平倉插進來
+            internal_same = sum(1 for p in self.positions.values()
+                                if ("LONG" if p["side"] == "long" else "SHORT") == position_side)
+            self._busy_sides.add(position_side)
+            self._publish()
         dt_utc8 = bar_data["datetime"]
         dt_utc = dt_utc8 - timedelta(hours=8) if isinstance(dt_utc8, datetime) else dt_utc8
         trade_id = f"{dt_utc8.strftime('%Y%m%d_%H%M%S')}_{sub_strategy}"
@@ -437,20 +594,18 @@ class Executor:
             safenet_pct = strategy.S_SAFENET_PCT
             safenet_price = entry_price * (1 + safenet_pct)
 
-        # 實際下單
+        # 實際下單（不持 _lock：/status 等讀取端與存檔不等交易所回應）
+        t_start = time.time()
         try:
             import binance_trade
-            order_side = "BUY" if side == "long" else "SELL"
-            position_side = "LONG" if side == "long" else "SHORT"
 
             # 防疊倉：檢查 Binance 實際倉位
             bn_positions = binance_trade.get_positions(SYMBOL)
+            t_check = time.time() - t_start
             bn_same_side = [p for p in bn_positions
                            if p.get("position_side") == position_side and p["size"] > 0]
             if bn_same_side:
                 bn_size = bn_same_side[0]["size"]
-                internal_same = sum(1 for p in self.positions.values()
-                                   if ("LONG" if p["side"] == "long" else "SHORT") == position_side)
                 if internal_same == 0:
                     # Binance 有倉位但內部沒有 → 孤兒倉位，不可開新倉
                     logger.error(
@@ -464,37 +619,32 @@ class Executor:
                         f"❌ 內部狀態無此倉位\n"
                         f"🔧 需手動清理後才能開新倉"
                     )
-                    self.trade_number -= 1
+                    self._abort_open(position_side)
                     return None
 
             # 只有該方向第一筆持倉時才掛 SL（closePosition=true 覆蓋整個方向）
-            existing_same_side = sum(1 for p in self.positions.values()
-                                    if ("LONG" if p["side"] == "long" else "SHORT") == position_side)
-            sl_price = safenet_price if existing_same_side == 0 else None
+            sl_price = safenet_price if internal_same == 0 else None
+            # SL 在成交確認後由背景送出，記帳不等 algo order 回應（下面記完帳再確認）
             result = binance_trade.place_order(
                 SYMBOL, order_side, qty=qty, stop_loss=sl_price,
                 strategy_id=f"eth_v10_{sub_strategy}",
                 position_side=position_side,
+                wait_stops=False,
             )
             if result is None:
                 logger.error(f"Order failed for {trade_id}")
-                self.trade_number -= 1
+                self._abort_open(position_side)
                 return None
             avg_price = float(result.get("avgPrice", 0))
             if avg_price > 0:
                 entry_price = avg_price
             qty = float(result.get("executedQty", qty))
-            # 取得實際手續費
+            # 手續費先用估計值（不在下單路徑上查 userTrades），reconcile_commissions 對帳後更新
             entry_order_id = result.get("orderId")
-            entry_commission = 0.0
-            if entry_order_id:
-                comm = binance_trade.get_order_commission(SYMBOL, entry_order_id)
-                if comm is not None:
-                    entry_commission = comm
-                    logger.info(f"Entry commission: ${comm:.4f}")
+            entry_commission = round(qty * entry_price * COMMISSION_RATE, 6)
         except Exception as e:
             logger.error(f"Order exception: {e}")
-            self.trade_number -= 1
+            self._abort_open(position_side)
             return None
 
         # 計算進場指標（V13: S 用自己的 GK）
@@ -521,10 +671,6 @@ class Executor:
         btc_close = btc_context.get("btc_close")
         eth_btc = entry_price / btc_close if btc_close and btc_close > 0 else None
         eth_24h = bar_data.get("eth_24h_change_pct")
-        bars_since = bar_counter - self.last_exits.get(sub_strategy, -9999)
-
-        # 更新月度進場計數
-        self.monthly_entries[sub_strategy] = self.monthly_entries.get(sub_strategy, 0) + 1
 
         # V25-D: 判定 entry regime（出場參數查表用）
         entry_regime = strategy.classify_regime(signal_indicators.get("sma_slope"))
@@ -552,13 +698,22 @@ class Executor:
             "entry_order_id": entry_order_id,
             "entry_commission": entry_commission,
         }
-        self.positions[trade_id] = position
-
-        # 記錄到 trades.csv
+        with self._lock:
+            # 交易編號在成交入帳時才配發：L/S 同時開倉、其中一邊失敗也不會重號或跳號
+            self.trade_number += 1
+            trade_number = self.trade_number
+            bars_since = bar_counter - self.last_exits.get(sub_strategy, -9999)
+            # 更新月度進場計數
+            self.monthly_entries[sub_strategy] = self.monthly_entries.get(sub_strategy, 0) + 1
+            self.positions[trade_id] = position
+            self._busy_sides.discard(position_side)
+            self._publish()
+
+        # 記錄到交易帳本（trades.db）
         exit_cd = strategy.L_EXIT_CD if sub_strategy == "L" else strategy.S_EXIT_CD
         trade_record = {
             "trade_id": trade_id,
-            "trade_number": self.trade_number,
+            "trade_number": trade_number,
             "entry_time_utc": str(dt_utc),
             "entry_time_utc8": str(dt_utc8),
             "entry_weekday": dt_utc8.weekday() if isinstance(dt_utc8, datetime) else "",
@@ -583,6 +738,9 @@ class Executor:
             "entry_regime": entry_regime,
         }
         recorder.record_trade_open(trade_record)
+        t_booked = time.time() - t_start
+        self._record_fill(entry_order_id, trade_id, "entry", entry_commission)
+        self._log_order_path(trade_id, t_check, result, t_booked)
 
         # 同步幣安實際餘額
         self._sync_balance()
@@ -616,7 +774,7 @@ class Executor:
             f"🛡 安全網 (SafeNet)：${sn_price:.2f}（{safenet_pct*100:.1f}%）\n"
             f"📊 進場趨勢：{labels.regime_label(entry_regime)}\n"
             f"🔋 壓縮能量：{gk_pctile:.1f}\n"
-            f"📝 第 {self.trade_number} 筆" + wrap_private(f" ｜ 💰 金庫 ${self.account_balance:.2f}")
+            f"📝 第 {trade_number} 筆" + wrap_private(f" ｜ 💰 金庫 ${self.account_balance:.2f}")
         )
         # 開單是群組需要知道的事件；後續心跳由主循環在仍有持倉時送到群組。
         send_telegram_message(msg, include_groups=True)
@@ -625,26 +783,56 @@ class Executor:
         self.save_state()
         return trade_id
 
+    def _abort_open(self, position_side: str):
+        """開倉未成：解除該方向的忙碌標記"""
+        with self._lock:
+            self._busy_sides.discard(position_side)
+            self._publish()
+
     def close_position(self, trade_id: str, exit_price: float, exit_reason: str,
                        bar_counter: int, bar_data: dict,
                        btc_context: dict) -> dict:
-        """平倉。平倉失敗時保留持倉狀態，下一 bar 重試。"""
-        with self._lock:
-            return self._close_position_locked(trade_id, exit_price, exit_reason,
-                                               bar_counter, bar_data, btc_context)
+        """平倉。平倉失敗時保留持倉狀態，下一 bar 重試。
 
-    def _close_position_locked(self, trade_id, exit_price, exit_reason,
-                                bar_counter, bar_data, btc_context):
+        主循環與盤中出場監看可能同時要平同一筆：持方向鎖依序進行，
+        後到的那邊看到持倉已不在 → 回 None。
+        """
         pos = self.positions.get(trade_id)
         if pos is None:
             logger.warning(f"close_position: {trade_id} not found")
             return None
+        position_side = "LONG" if pos["side"] == "long" else "SHORT"
+        with self._order_locks[position_side]:
+            return self._close_position_locked(trade_id, exit_price, exit_reason,
+                                               bar_counter, bar_data, btc_context)
 
-        side = pos["side"]
-        sub_strategy = pos.get("sub_strategy", "L")
-        entry_price = pos["entry_price"]
+    def _close_position_locked(self, trade_id, exit_price, exit_reason,
+                                bar_counter, bar_data, btc_context):
+        """持該方向 _order_locks 執行；_lock 只在讀持倉、標記 pending_exit、結算三段短暫持有"""
+        with self._lock:
+            pos = self.positions.get(trade_id)
+            if pos is None:
+                logger.warning(f"close_position: {trade_id} already closed")
+                return None
+            side = pos["side"]
+            sub_strategy = pos.get("sub_strategy", "L")
+            entry_price = pos["entry_price"]
+            qty = pos["qty"]
+            position_side = "LONG" if side == "long" else "SHORT"
+            self._busy_sides.add(position_side)
+            self._publish()
+        try:
+            return self._close_position_io(trade_id, pos, side, sub_strategy, entry_price, qty,
+                                           exit_price, exit_reason, bar_counter, bar_data)
+        finally:
+            with self._lock:
+                self._busy_sides.discard(position_side)
+                self._publish()
 
-        # 實際平倉（含重試）
+    def _close_position_io(self, trade_id, pos, side, sub_strategy, entry_price, qty,
+                           exit_price, exit_reason, bar_counter, bar_data):
+
+        # 實際平倉（含重試；不持 _lock）
         actual_exit_price = exit_price  # fallback: 策略計算價
         exit_commission = 0.0
         close_confirmed = False
@@ -658,7 +846,7 @@ class Executor:
             close_result = None
             for attempt in range(2):
                 close_result = binance_trade.place_order(
-                    SYMBOL, close_side, qty=pos["qty"], reduce_only=True,
+                    SYMBOL, close_side, qty=qty, reduce_only=True,
                     strategy_id=f"eth_v10_{sub_strategy}",
                     position_side=position_side,
                 )
@@ -688,7 +876,8 @@ class Executor:
                     )
                     # 標記本倉位為 pending_exit，下一 bar main loop 會直接以 MARKET
                     # 強制平倉、不再檢查策略條件（避免 TP 區間已偏離導致漏接出場）
-                    pos["pending_exit"] = exit_reason
+                    with self._lock:
+                        pos["pending_exit"] = exit_reason
                     self.save_state()
                     return None  # 不刪除持倉，不取消 SL，下一 bar 重試
                 else:
@@ -701,24 +890,24 @@ class Executor:
                 close_confirmed = True
 
             # 使用實際成交價
+            close_order_id = None
             if close_result:
                 avg = float(close_result.get("avgPrice", 0))
                 if avg > 0:
                     actual_exit_price = avg
                     logger.info(f"Actual exit price: ${avg:.4f} (strategy: ${exit_price:.4f})")
-                # 查詢實際手續費
                 close_order_id = close_result.get("orderId")
-                if close_order_id:
-                    comm = binance_trade.get_order_commission(SYMBOL, close_order_id)
-                    if comm is not None:
-                        exit_commission = comm
-                        logger.info(f"Exit commission: ${comm:.4f}")
+                logger.info(f"Close order path {trade_id}: "
+                            f"fill {close_result.get('latency', {}).get('fill', 0):.3f}s")
+            # 手續費先用估計值，reconcile_commissions 對帳後補正帳本列
+            exit_commission = round(qty * actual_exit_price * COMMISSION_RATE, 6)
 
-            # 只有平倉確認後才取消 SL
+            # 只有平倉確認後才取消 SL（持方向鎖 → 同方向持倉數在這段期間不會變）
             if close_confirmed:
-                remaining = sum(1 for p in self.positions.values()
-                               if p.get("trade_id") != trade_id
-                               and (("LONG" if p["side"] == "long" else "SHORT") == position_side))
+                with self._lock:
+                    remaining = sum(1 for p in self.positions.values()
+                                   if p.get("trade_id") != trade_id
+                                   and (("LONG" if p["side"] == "long" else "SHORT") == position_side))
                 if remaining == 0:
                     binance_trade.cancel_all_orders(SYMBOL, position_side=position_side)
         except Exception as e:
@@ -739,29 +928,35 @@ class Executor:
         pnl_pct = round(pnl_usd / strategy.MARGIN * 100, 4)
         bars_held = bar_counter - pos["entry_bar_counter"]
 
-        # 同步幣安實際餘額
+        # 同步幣安實際餘額（查詢在鎖外）
         self._sync_balance()
-        self.last_exits[sub_strategy] = bar_counter
 
-        # 更新風控熔斷狀態
-        self.daily_pnl += pnl_usd
-        self.monthly_pnl[sub_strategy] = self.monthly_pnl.get(sub_strategy, 0.0) + pnl_usd
+        with self._lock:
+            self.last_exits[sub_strategy] = bar_counter
+
+            # 更新風控熔斷狀態
+            self.daily_pnl += pnl_usd
+            self.monthly_pnl[sub_strategy] = self.monthly_pnl.get(sub_strategy, 0.0) + pnl_usd
 
-        # V29 策略健康度更新（出場時才動；R 正規化依該筆實際名目）
-        edge_old, edge_new = self._update_edge_health(pnl_usd, entry_price, actual_qty)
+            # V29 策略健康度更新（出場時才動；R 正規化依該筆實際名目）
+            edge_old, edge_new = self._update_edge_health(pnl_usd, entry_price, actual_qty)
 
-        if pnl_usd < 0:
-            self.consec_losses += 1
-            if self.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
-                self.consec_loss_cooldown_until = bar_counter + strategy.CONSEC_LOSS_COOLDOWN
-                logger.warning(f"連虧 {self.consec_losses} 筆！冷卻至 bar {self.consec_loss_cooldown_until}")
-        else:
-            self.consec_losses = 0
+            if pnl_usd < 0:
+                self.consec_losses += 1
+                if self.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
+                    self.consec_loss_cooldown_until = bar_counter + strategy.CONSEC_LOSS_COOLDOWN
+                    logger.warning(f"連虧 {self.consec_losses} 筆！冷卻至 bar {self.consec_loss_cooldown_until}")
+            else:
+                self.consec_losses = 0
+
+            self.positions.pop(trade_id, None)
+            # 通知 / log 用這一刻的值（鎖外可能又被別的 thread 改）
+            snap = self._publish()
 
         dt_utc8 = bar_data["datetime"]
         dt_utc = dt_utc8 - timedelta(hours=8) if isinstance(dt_utc8, datetime) else dt_utc8
 
-        # 更新 trades.csv
+        # 更新交易帳本（單列 UPDATE）
         exit_data = {
             "exit_time_utc": str(dt_utc),
             "exit_time_utc8": str(dt_utc8),
@@ -785,6 +980,7 @@ class Executor:
             "win_loss": "WIN" if pnl_usd > 0 else ("LOSS" if pnl_usd < 0 else "BREAKEVEN"),
         }
         recorder.record_trade_close(trade_id, exit_data)
+        self._record_fill(close_order_id, trade_id, "exit", exit_commission)
 
         # Telegram
         env = "模擬" if PAPER_TRADING else "實戰"
@@ -821,20 +1017,20 @@ class Executor:
 
         cb_info = ""
         # 進場冷卻（連虧 24h 優先；否則顯示同側 L=6h / S=8h）
-        if self.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
+        if snap.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
             cd_bars = strategy.CONSEC_LOSS_COOLDOWN
-            cb_info = f"\n⚠️ 連虧{self.consec_losses}筆，L+S 冷卻 {cd_bars}h"
+            cb_info = f"\n⚠️ 連虧{snap.consec_losses}筆，L+S 冷卻 {cd_bars}h"
         else:
             exit_cd = strategy.L_EXIT_CD if sub_strategy == "L" else strategy.S_EXIT_CD
             cb_info = f"\n⏱ {sub_strategy} 進場冷卻 {exit_cd}h（避免反覆進出）"
-        if self.daily_pnl <= strategy.DAILY_LOSS_LIMIT:
+        if snap.daily_pnl <= strategy.DAILY_LOSS_LIMIT:
             cb_info += (
                 "\n🚫 日虧"
-                + wrap_private(f"${self.daily_pnl:.0f}，")
+                + wrap_private(f"${snap.daily_pnl:.0f}，")
                 + "已達上限，今日停工"
             )
 
-        edge_emoji = {"green": "💚", "yellow": "💛", "red": "🔴"}.get(self.edge_level, "💚")
+        edge_emoji = {"green": "💚", "yellow": "💛", "red": "🔴"}.get(snap.edge_level, "💚")
         msg = (
             f"<b>{result_header}（{env}）</b>\n"
             f"━━━━━━━━━━━━━━━\n"
@@ -842,8 +1038,8 @@ class Executor:
             f"📋 {exit_text}\n"
             f"💰 {result_text}\n"
             f"⏱ 抱了 {bars_held}h ｜ 最慘 -{abs(pos.get('mae_pct', 0)):.1f}%\n"
-            + wrap_private(f"🏦 金庫：${self.account_balance:.2f}\n")
-            + f"{edge_emoji} 策略健康度 {self.edge_health_pct():.0f}%{cb_info}"
+            + wrap_private(f"🏦 金庫：${snap.account_balance:.2f}\n")
+            + f"{edge_emoji} 策略健康度 {snap.edge_health_pct():.0f}%{cb_info}"
         )
         # 平倉是群組需要知道的交易事件；與進場通知一致發送到群組。
         send_telegram_message(msg, include_groups=True)
@@ -852,10 +1048,9 @@ class Executor:
         if edge_new != edge_old:
             self._notify_edge_transition(edge_old, edge_new)
 
-        del self.positions[trade_id]
         logger.info(f"Closed {trade_id} | {exit_reason} | PnL ${pnl_usd:.2f} | "
-                    f"consec_losses={self.consec_losses} daily=${self.daily_pnl:.2f} "
-                    f"monthly_L=${self.monthly_pnl['L']:.2f} monthly_S=${self.monthly_pnl['S']:.2f}")
+                    f"consec_losses={snap.consec_losses} daily=${snap.daily_pnl:.2f} "
+                    f"monthly_L=${snap.monthly_pnl['L']:.2f} monthly_S=${snap.monthly_pnl['S']:.2f}")
         self.save_state()
 
         return {"pnl_usd": pnl_usd, "pnl_pct": pnl_pct, "exit_reason": exit_reason,
@@ -901,6 +1096,135 @@ class Executor:
         """回傳所有持倉的 list"""
         return list(self.positions.values())
 
+    # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    # 下單延遲 / 手續費對帳
+    # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+    def _log_order_path(self, trade_id, t_check, result, t_booked):
+        """開倉路徑延遲：防疊倉查詢 / 送單到成交 / 記完帳，再等背景 SL 回應"""
+        fill = (result.get("latency") or {}).get("fill", 0.0)
+        sl_text = "no SL"
+        t0 = time.time()
+        for order_type, fut in result.get("stop_futures", []):
+            try:
+                ok = fut.result(timeout=10) is not None
+            except Exception as e:
+                ok = False
+                logger.error(f"{order_type} for {trade_id} raised: {e}")
+            if not ok:
+                logger.error(f"{order_type} for {trade_id} NOT placed after retries — Telegram alert sent")
+            sl_text = f"SL {'ok' if ok else 'FAILED'} +{time.time() - t0:.3f}s after booking"
+        logger.info(f"Order path {trade_id}: check {t_check:.3f}s | fill {fill:.3f}s | "
+                    f"booked {t_booked:.3f}s | {sl_text}")
+
+    def _record_fill(self, order_id, trade_id, leg, est_commission):
+        """成交記進 fills 表待對帳；沒有真實 orderId（逾時恢復 / 查無回應）→ 維持估計值"""
+        if not order_id or not str(order_id).isdigit():
+            return
+        try:
+            recorder.record_fill(order_id, trade_id, leg, est_commission)
+        except Exception as e:
+            logger.warning(f"record_fill {trade_id} {leg} failed: {e}")
+
+    def reconcile_commissions(self, force: bool = False) -> int:
+        """
+        每小時一次：一支 userTrades 批次查回待對帳成交的實際手續費。
+          - 未平倉的進場腿 → 直接更新持倉 entry_commission（之後平倉 PnL 用實際值）
+          - 已平倉的 → trade_ledger.settle_fill 把差額補進帳本列（commission / net_pnl / win_loss），
+            同一差額也補進熔斷計數（daily_pnl / monthly_pnl / 健康度，見 _apply_fee_delta）
+        回傳對帳筆數。
+        """
+        now = time.time()
+        if not force and now - self._last_reconcile < RECONCILE_SECONDS:
+            return 0
+        self._last_reconcile = now
+        import trade_ledger
+        data_dir = paths.data_dir(PAPER_TRADING)
+        try:
+            pending = trade_ledger.pending_fills(data_dir)
+            if not pending:
+                return 0
+            import binance_trade
+            start = pending[0]["ts_ms"] - 60_000
+            end = min(start + 7 * 86400_000 - 1, int(now * 1000))  # userTrades 區間上限 7 天
+            t0 = time.time()
+            trades = binance_trade.get_user_trades(SYMBOL, start, end)
+            if trades is None:
+                return 0
+            actual = {}
+            adjusted = False
+            for t in trades:
+                oid = str(t.get("orderId"))
+                actual[oid] = actual.get(oid, 0.0) + float(t.get("commission", 0))
+            n = 0
+            for f in pending:
+                comm = actual.get(f["order_id"])
+                if comm is None:
+                    if f["ts_ms"] < end - 6 * 86400_000:  # 快出查詢窗還查不到 → 放棄，保留估計值
+                        trade_ledger.settle_fill(data_dir, f["order_id"], f["est"], adjust_row=False)
+                    continue
+                comm = round(comm, 6)
+                if f["leg"] == "entry" and self._settle_open_entry(f["trade_id"], comm):
+                    trade_ledger.settle_fill(data_dir, f["order_id"], comm, adjust_row=False)
+                else:
+                    delta = trade_ledger.settle_fill(data_dir, f["order_id"], comm, margin=strategy.MARGIN)
+                    if delta:
+                        adjusted |= self._apply_fee_delta(trade_ledger.get_row(data_dir, f["trade_id"]), delta)
+                n += 1
+            logger.info(f"Commission reconcile: {n}/{len(pending)} fill(s) settled from "
+                        f"{len(trades)} userTrades in {time.time() - t0:.2f}s")
+            if adjusted:
+                self.save_state()
+            return n
+        except Exception as e:
+            logger.warning(f"Commission reconcile failed: {e}")
+            return 0
+
+    def _apply_fee_delta(self, row, delta) -> bool:
+        """
+        已平倉交易的手續費差額（實際 - 估計）補進熔斷計數：平倉當下是用估計值記的。
+          - daily_pnl / monthly_pnl：該筆出場仍在目前的日 / 月才補（已換日 / 換月的計數已歸零）
+          - 健康度 CUSUM：同 _update_edge_health 的 R 正規化（名目用 strategy.NOTIONAL）
+        連虧計數不回頭改（差額只有幾分錢，不重判輸贏）。回傳是否有改動。
+        """
+        if not row or not (row.get("exit_time_utc8") or "").strip():
+            return False
+        exit_t = row["exit_time_utc8"]
+        sub = row.get("sub_strategy") or ""
+        with self._lock:
+            changed = False
+            edge_old = self.edge_level
+            if self.daily_key and exit_t.startswith(self.daily_key):
+                self.daily_pnl -= delta
+                changed = True
+            if self.monthly_key and exit_t.startswith(self.monthly_key) and sub in self.monthly_pnl:
+                self.monthly_pnl[sub] -= delta
+                changed = True
+            if self.edge_cusum is not None:
+                self.edge_cusum = max(0.0, self.edge_cusum + delta * (4000.0 / strategy.NOTIONAL))
+                self.edge_level = self._edge_level_of(self.edge_cusum)
+                changed = True
+            if changed:
+                self._publish()
+            edge_new = self.edge_level
+        if changed:
+            logger.info(f"Fee delta {delta:+.6f} for {row.get('trade_id')} applied to circuit-breaker counters")
+        if edge_new != edge_old:
+            self._notify_edge_transition(edge_old, edge_new)
+        return changed
+
+    def _settle_open_entry(self, trade_id, commission) -> bool:
+        """持倉仍在 → 更新 entry_commission 並回 True（持方向鎖：平倉不會在中途讀到舊值）"""
+        pos = self.positions.get(trade_id)
+        if pos is None:
+            return False
+        with self._order_locks["LONG" if pos["side"] == "long" else "SHORT"]:
+            with self._lock:
+                if trade_id not in self.positions:
+                    return False
+                self.positions[trade_id]["entry_commission"] = commission
+                return True
+
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     # 每日統計
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -925,18 +1249,25 @@ class Executor:
             }
 
     def record_signal(self, fired: bool):
-        self._ensure_daily()
-        key = self._today_key()
-        if fired:
-            self.daily_stats[key]["signals_fired"] += 1
-        else:
-            self.daily_stats[key]["signals_blocked"] += 1
+        with self._lock:
+            self._ensure_daily()
+            key = self._today_key()
+            if fired:
+                self.daily_stats[key]["signals_fired"] += 1
+            else:
+                self.daily_stats[key]["signals_blocked"] += 1
 
     def record_open(self):
-        self._ensure_daily()
-        self.daily_stats[self._today_key()]["trades_opened"] += 1
+        with self._lock:
+            self._ensure_daily()
+            self.daily_stats[self._today_key()]["trades_opened"] += 1
 
     def record_close(self, pnl_usd: float, exit_reason: str, hold_bars: int, commission: float = 0.0):
+        # 主循環與盤中出場監看都會呼叫 → 持 _lock 讀改寫 daily_stats
+        with self._lock:
+            self._record_close(pnl_usd, exit_reason, hold_bars, commission)
+
+    def _record_close(self, pnl_usd, exit_reason, hold_bars, commission):
         self._ensure_daily()
         d = self.daily_stats[self._today_key()]
         d["total_commission"] = d.get("total_commission", 0) + commission
@@ -999,6 +1330,11 @@ class Executor:
             "system_alerts": 0,
         }
         recorder.record_daily_summary(stats)
+        # 每日把交易帳本匯出成 trades.csv 副本（出場只做單列 UPDATE，不再每筆重寫 CSV）
+        try:
+            recorder.export_trades_csv()
+        except Exception as e:
+            logger.warning(f"trades.csv export failed: {e}")
         # 刪除已 flush 的日期，避免跨午夜重啟時被 startup 邏輯重複寫入 CSV
         # （record_daily_summary 是純 append，無 dedup）
         with self._lock:
@@ -0,0 +1,309 @@
+"""
+盤中出場監看 — 選用背景執行緒，訂閱 mark price（或 aggTrade）串流，
+價格一觸及持倉的 TP / SafeNet / BE 價位就走 executor.close_position 平倉（秒級反應）。
+
+原本出場只在整點由收盤 bar 的 high/low/close 判斷：:05 碰到 TP，要等下一個整點才平，
+價格可能已經回頭；回測卻假設在 TP 價位成交。
+
+  - 選用：EXIT_WATCH=1 才啟用；websocket-client 沒裝 → 不啟用（整點檢查照舊，不受影響）
+  - 價位：strategy.intrabar_exit_levels（與 check_exit_long / check_exit_short 同一組參數），
+          主循環每個 cycle 結束後 refresh_levels() 重算（新倉、延長期 BE 都在 cycle 內發生）
+  - MFE-trail / MaxHold 依收盤價判斷 → 仍由整點 cycle 處理，盤中不觸發（與回測一致）
+  - 鎖：觸價後短暫持 executor._lock 確認倉位仍在、沒有 pending_exit 才平倉（下單時不持）；
+        close_position 內持該方向下單鎖再確認一次 → 與主循環同時觸發時只有先到的一邊平倉
+  - 平倉 bar_counter 用「目前形成中那根」的序號（= 整點 cycle 在該根收盤時會用的值）
+  - 串流：EXIT_WATCH_STREAM=markPrice（預設，每秒一筆）或 aggTrade（逐筆成交，與 K 線 high/low 同源）
+
+離線重播（不連網、不下單；用較細時框 K 線模擬盤中路徑，量反應延遲與出場價差）：
+    python exit_watcher.py --replay data/ETHUSDT_15m_latest730d.csv --bars 2000
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import strategy
+import bar_stream
+
+logger = logging.getLogger("exit_watcher")
+
+STREAM_KIND = os.getenv("EXIT_WATCH_STREAM", "markPrice").strip()
+
+
+def enabled() -> bool:
+    """EXIT_WATCH=1 且 websocket-client 可用"""
+    return os.getenv("EXIT_WATCH", "0").strip() == "1" and bar_stream.websocket is not None
+
+
+def stream_url(symbol: str, kind: str = None) -> str:
+    kind = kind or STREAM_KIND
+    name = "markPrice@1s" if kind == "markPrice" else "aggTrade"
+    return f"{bar_stream.WS_BASE}/{symbol.lower()}@{name}"
+
+
+def price_from_event(msg):
+    """markPriceUpdate / aggTrade 事件 → (價格, 事件時間 ms)；其他訊息 None"""
+    if isinstance(msg, (str, bytes)):
+        try:
+            msg = json.loads(msg)
+        except ValueError:
+            return None
+    if not isinstance(msg, dict) or "p" not in msg:
+        return None
+    try:
+        return float(msg["p"]), int(msg.get("E") or msg.get("T") or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _hit(sub: str, reason: str, level: float, price: float) -> bool:
+    """L：SafeNet / BE 向下觸、TP 向上觸；S 相反"""
+    up = (reason == "TP") == (sub == "L")
+    return price >= level if up else price <= level
+
+
+class ExitWatcher(bar_stream.WsStream):
+    """持有每筆持倉的觸價出場價位；feed() 每收一筆價格就比對，觸價即平倉"""
+
+    def __init__(self, executor, symbol: str = "ETHUSDT", url: str = None, on_exit=None):
+        super().__init__(url or stream_url(symbol))
+        self.executor = executor
+        self.symbol = symbol
+        self.on_exit = on_exit                  # 平倉成功後回呼 on_exit(result, pos, reason, price)
+        self._levels = {}                       # trade_id → (sub, [(reason, level), ...])
+        self._levels_lock = threading.Lock()
+        self.last_price = None
+        self.ticks = 0
+        self.fired = []                         # [(trade_id, reason, level, price, 反應秒數)]
+
+    # ── 價位 ──
+
+    def refresh_levels(self):
+        """依 executor.positions 重算所有持倉的觸價價位（主循環每 cycle 結束呼叫）"""
+        levels = {}
+        with self.executor._lock:
+            for tid, pos in self.executor.positions.items():
+                ep = pos.get("entry_price") or 0
+                if ep <= 0 or pos.get("pending_exit"):
+                    continue  # 無效倉 / 等下一根強制平倉的交給主循環
+                sub = pos.get("sub_strategy", "L")
+                lv = strategy.intrabar_exit_levels(sub, ep, pos.get("entry_regime", "NA"),
+                                                   pos.get("extension_active", False))
+                # 同一筆價格同時觸多個價位時，照 check_exit_* 的優先順序：SafeNet → TP → BE
+                levels[tid] = (sub, [(r, lv[r]) for r in ("SafeNet", "TP", "BE") if lv[r] is not None])
+        with self._levels_lock:
+            self._levels = levels
+        return levels
+
+    def levels(self) -> dict:
+        with self._levels_lock:
+            return dict(self._levels)
+
+    # ── 價格事件 ──
+
+    def feed(self, msg):
+        """WS 訊息進來（或 replay 直接呼叫 on_price）"""
+        self.last_msg_ts = time.time()
+        ev = price_from_event(msg)
+        if ev is not None:
+            self.on_price(*ev)
+
+    def on_price(self, price: float, event_ms: int = 0):
+        self.last_price = price
+        self.ticks += 1
+        with self._levels_lock:
+            items = list(self._levels.items())
+        for tid, (sub, lv) in items:
+            for reason, level in lv:
+                if _hit(sub, reason, level, price):
+                    self._fire(tid, reason, level, price, event_ms)
+                    break
+
+    def _fire(self, trade_id, reason, level, price, event_ms):
+        ex = self.executor
+        t0 = time.time()
+        with ex._lock:
+            pos = ex.positions.get(trade_id)
+            skip = pos is None or pos.get("pending_exit")
+        if skip:
+            with self._levels_lock:
+                self._levels.pop(trade_id, None)
+            return None
+        bar_counter = self.live_bar_counter()
+        logger.info(f"Intra-hour {reason} for {trade_id} @ {price:.2f} (level {level:.2f})")
+        result = ex.close_position(
+            trade_id=trade_id,
+            exit_price=level,
+            exit_reason=reason,
+            bar_counter=bar_counter,
+            bar_data=self._tick_bar(price),
+            btc_context={},
+        )
+        if result:
+            ex.record_close(result["pnl_usd"], result["exit_reason"], result["bars_held"],
+                            commission=result.get("commission", 0.0))
+            ex.save_state()
+        with self._levels_lock:
+            # 成功 → 移除；失敗（pending_exit）/ 主循環已先平 → 也移除，交給下一根主循環
+            self._levels.pop(trade_id, None)
+        lag = time.time() - (event_ms / 1000 if event_ms else t0)
+        self.fired.append((trade_id, reason, level, price, lag))
+        if result and self.on_exit is not None:
+            try:
+                self.on_exit(result, pos, reason, price)
+            except Exception as e:
+                logger.warning(f"on_exit callback failed: {e}")
+        return result
+
+    # ── 平倉參數 ──
+
+    def live_bar_counter(self) -> int:
+        """目前形成中那根 bar 的序號：last_bar_time 之後每過一個整點 +1"""
+        ex = self.executor
+        try:
+            last = pd.Timestamp(ex.last_bar_time)
+            now8 = pd.Timestamp(datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=8))
+            return ex.bar_counter + max(1, int((now8.floor("h") - last) / pd.Timedelta(hours=1)))
+        except Exception:
+            return ex.bar_counter + 1
+
+    def _tick_bar(self, price: float) -> dict:
+        now8 = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=8)
+        return {"datetime": pd.Timestamp(now8).floor("s"), "open": price, "high": price,
+                "low": price, "close": price, "volume": 0.0, "taker_buy_volume": 0.0}
+
+
+def start(executor, symbol: str = "ETHUSDT", log=None, **kw):
+    """EXIT_WATCH=1 時啟動（背景執行緒）；未啟用 / 失敗回 None"""
+    log = log or logger
+    if not enabled():
+        return None
+    try:
+        w = ExitWatcher(executor, symbol, **kw)
+        w.refresh_levels()
+        w.start()
+        log.info(f"Intra-hour exit watcher enabled: {w.url}")
+        return w
+    except Exception as e:
+        log.warning(f"Exit watcher start failed ({e}), exits checked hourly only")
+        return None
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 離線重播（benchmark）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def ticks_from_frame(df: pd.DataFrame, ticks_per_bar: int = 4) -> tuple:
+    """
+    細時框 K 線 → 盤中價格路徑：每根 bar 走 open → (low, high 依收盤方向排序) → close，
+    中間線性插值 ticks_per_bar 點。回傳 (價格陣列, 每點所屬 bar 的 UTC+8 datetime)。
+    """
+    o, h, l, c = (df[k].to_numpy(dtype=float) for k in ("open", "high", "low", "close"))
+    up = c >= o
+    a = np.where(up, l, h)
+    b = np.where(up, h, l)
+    knots = np.stack([o, a, b, c], axis=1)              # (n, 4)
+    seg = np.linspace(0, 1, ticks_per_bar + 1)[:-1]
+    path = (knots[:, :-1, None] + (knots[:, 1:, None] - knots[:, :-1, None]) * seg).reshape(len(df), -1)
+    path = np.concatenate([path, c[:, None]], axis=1)
+    dt = np.repeat(pd.to_datetime(df["datetime"]).to_numpy(), path.shape[1])
+    return path.ravel(), dt
+
+
+class _ReplayExecutor:
+    """重播用的替身：只有 positions / _lock / close_position / record_close / save_state"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.positions = {}
+        self.bar_counter = 0
+        self.last_bar_time = None
+        self.closed = []
+
+    def close_position(self, trade_id, exit_price, exit_reason, bar_counter, bar_data, btc_context):
+        pos = self.positions.pop(trade_id, None)
+        if pos is None:
+            return None
+        pnl, _ = strategy.compute_pnl(pos["entry_price"], exit_price,
+                                      "long" if pos["sub_strategy"] == "L" else "short")
+        res = {"pnl_usd": pnl, "exit_reason": exit_reason, "bars_held": bar_counter - pos["entry_bar_counter"]}
+        self.closed.append((trade_id, exit_reason, exit_price, bar_data["close"]))
+        return res
+
+    def record_close(self, *a, **kw):
+        pass
+
+    def save_state(self):
+        pass
+
+
+def replay(df: pd.DataFrame, bars_per_hour: int = 4, entry_every: int = 24, ticks_per_bar: int = 4) -> dict:
+    """
+    重播細時框 K 線：每 entry_every 小時在整點開一對 L/S 測試倉，盤中價格逐點餵 on_price。
+    回傳處理速度、平均反應時間，以及觸價出場相對「等整點收盤」的價格差。
+    """
+    ex = _ReplayExecutor()
+    w = ExitWatcher(ex, url="replay://")
+    prices, dts = ticks_from_frame(df, ticks_per_bar)
+    per_hour = bars_per_hour * (ticks_per_bar * 3 + 1)
+    n_hours = len(prices) // per_hour
+    hourly_close = prices[per_hour - 1::per_hour]
+    opened = 0
+    exit_hour = []  # 每筆出場發生在第幾小時
+    t0 = time.perf_counter()
+    for hr in range(n_hours):
+        seg = prices[hr * per_hour:(hr + 1) * per_hour]
+        ex.bar_counter = hr
+        if hr % entry_every == 0:
+            for sub in ("L", "S"):
+                tid = f"replay_{sub}_{hr}"
+                ex.positions[tid] = {"trade_id": tid, "sub_strategy": sub, "entry_price": float(seg[0]),
+                                     "entry_bar_counter": hr, "entry_regime": "NA"}
+                opened += 1
+            w.refresh_levels()
+        for p in seg:
+            w.on_price(float(p))
+        exit_hour += [hr] * (len(ex.closed) - len(exit_hour))
+    elapsed = time.perf_counter() - t0
+
+    # 觸價出場價 vs 整點 cycle 才出場（市價單 ≈ 該小時收盤）的價差（正 = 盤中出場較有利）
+    gains = []
+    for (tid, reason, level, _), hr in zip(ex.closed, exit_hour):
+        diff = (level - hourly_close[hr]) if tid.split("_")[1] == "L" else (hourly_close[hr] - level)
+        gains.append(diff / level * 100)
+    n_ticks = n_hours * per_hour
+    return {
+        "ticks": n_ticks,
+        "ticks_per_sec": n_ticks / elapsed if elapsed > 0 else float("inf"),
+        "avg_reaction_ms": float(np.mean([f[4] for f in w.fired]) * 1000) if w.fired else 0.0,
+        "positions": opened,
+        "exits": len(ex.closed),
+        "by_reason": pd.Series([c[1] for c in ex.closed]).value_counts().to_dict(),
+        "avg_gain_vs_hourly_pct": float(np.mean(gains)) if gains else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="盤中出場監看（離線重播 benchmark）")
+    ap.add_argument("--replay", required=True, help="細時框 K 線 CSV（例如 15m）")
+    ap.add_argument("--bars", type=int, default=None, help="只用最後 N 根")
+    ap.add_argument("--per-hour", type=int, default=4, help="每小時幾根（15m=4）")
+    ap.add_argument("--every", type=int, default=24, help="每幾小時開一對測試倉")
+    args = ap.parse_args()
+    df = pd.read_csv(args.replay)
+    if args.bars:
+        df = df.tail(args.bars)
+    df = df.iloc[:len(df) - len(df) % args.per_hour].reset_index(drop=True)
+    res = replay(df, args.per_hour, args.every)
+    for k, v in res.items():
+        print(f"{k:>24}: {v}")
+
+
+if __name__ == "__main__":
+    main()
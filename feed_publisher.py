@@ -0,0 +1,299 @@
+"""
+多實例共用行情發布 — 一個進程抓 K 線、算指標與 L/S 行情 gate，發布成帶序號的二進位快照；
+各實例 mmap 直接讀（零拷貝），不再各自抓 Binance、各自 compute_indicators。
+
+原本多實例只共用一份 CSV（data_feed._shared_fetch 的 flock），每個實例仍要 read_csv +
+parse_dates + 整段指標重算 → CPU / 記憶體 / Binance request weight 隨實例數線性成長。
+
+  發布端（單一進程，deploy/cryptobot-feed.service）：
+      python feed_publisher.py
+    每根收盤（BAR_STREAM=1 時用 WS 收盤事件，否則整點 +5s）→ 抓 ETH/BTC → 增量指標
+    → evaluate_signals_vectorized 行情 gate → 寫 tmp 檔 + os.replace 原子換檔（seq +1）
+
+  訂閱端（各實例，.env 設 FEED_MODE=subscribe）：
+    main_eth 等快照 seq 前進（50ms 輪詢 16 bytes 檔頭），拿到就直接用快照的 DataFrame；
+    整點 +FEED_WAIT 秒內沒等到（發布端掛了）→ 自己抓、自己算（fail-open，絕不漏 bar）
+
+快照格式（little-endian）：
+    magic(8) | seq(uint64) | header_len(uint64) | header JSON | 8-byte 對齊的欄位區塊
+    每張表（eth / btc）是 column-major float64 矩陣；datetime 存 UTC+8 的 epoch ms
+    bool / int 欄位讀回時還原型別；gate bitmask 存在 eth 表的 gates_l / gates_s 欄
+
+檢查目前快照：
+    python feed_publisher.py --show
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import paths
+import strategy
+
+logger = logging.getLogger("feed_publisher")
+
+FEED_DIR = os.path.join(paths.CODE_DIR, "cache", "feed")  # 所有實例共用
+MAGIC = b"CBFEED01"
+_HEAD = struct.Struct("<8sQQ")  # magic, seq, header_len
+FEED_WAIT = float(os.getenv("FEED_WAIT", 30))  # 訂閱端最多等到整點 + N 秒
+PUBLISH_OFFSET = 5  # 發布端無 WS 時：整點 +5s 抓（比實例的 +10s 早）
+
+_BOOL_COLS = set(strategy._FEATURE_BOOLS)
+_INT_COLS = set(strategy._FEATURE_INTS) | {"gates_l", "gates_s"}
+
+
+def enabled() -> bool:
+    """此實例是否為訂閱端（FEED_MODE=subscribe）"""
+    return os.getenv("FEED_MODE", "").strip().lower() == "subscribe"
+
+
+def snapshot_path(symbol: str = "ETHUSDT", interval: str = "1h") -> str:
+    return os.path.join(FEED_DIR, f"{symbol}_{interval}.snap")
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 寫入
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def _table_matrix(df: pd.DataFrame):
+    """DataFrame → (欄名, float64 column-major 矩陣)；datetime → epoch ms（UTC+8 naive）"""
+    cols, arrs = [], []
+    for c in df.columns:
+        s = df[c]
+        if c == "datetime":
+            v = pd.to_datetime(s).astype("datetime64[ms]").astype("int64").to_numpy(dtype=np.float64)
+        else:
+            v = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        cols.append(c)
+        arrs.append(v)
+    return cols, np.ascontiguousarray(np.vstack(arrs)) if arrs else np.empty((0, 0))
+
+
+def publish(tables: dict, seq: int, path: str, meta: dict = None) -> int:
+    """原子發布：寫 tmp → fsync → os.replace。回傳寫入 bytes。"""
+    header = {"seq": seq, "published_at": time.time(), "tables": {}}
+    header.update(meta or {})
+    blocks = []
+    for name, df in tables.items():
+        cols, mat = _table_matrix(df)
+        header["tables"][name] = {"rows": len(df), "cols": cols}
+        blocks.append(mat)
+    # 先用最大位數的 offset 佔位算出 header 長度，實際 offset 較短 → 右補空白到同長度
+    offset_placeholder = 10 ** 12
+    for name in header["tables"]:
+        header["tables"][name]["offset"] = offset_placeholder
+    hlen = len(json.dumps(header).encode())
+    pos = _HEAD.size + hlen
+    pos += (-pos) % 8
+    for name, mat in zip(header["tables"], blocks):
+        header["tables"][name]["offset"] = pos
+        pos += mat.nbytes
+    hjson = json.dumps(header).encode().ljust(hlen)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as fh:
+        fh.write(_HEAD.pack(MAGIC, seq, hlen))
+        fh.write(hjson)
+        fh.write(b"\0" * ((-(_HEAD.size + hlen)) % 8))
+        for mat in blocks:
+            fh.write(mat.tobytes())
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    return pos
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 讀取（零拷貝）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class Snapshot:
+    """一份已發布快照：欄位是 mmap 上的唯讀 numpy view（換檔後舊 mmap 仍有效）"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.seq, hlen = _HEAD.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"bad feed snapshot magic: {magic!r}")
+        self.header = json.loads(bytes(self._mm[_HEAD.size:_HEAD.size + hlen]))
+        self.bar_time = self.header.get("bar_time")
+        self.published_at = self.header.get("published_at", 0.0)
+
+    def _matrix(self, table: str) -> tuple:
+        t = self.header["tables"][table]
+        n, cols = t["rows"], t["cols"]
+        mat = np.frombuffer(self._mm, dtype=np.float64, count=n * len(cols), offset=t["offset"])
+        return cols, mat.reshape(len(cols), n)
+
+    def column(self, table: str, name: str) -> np.ndarray:
+        """單一欄位（零拷貝 float64 view）"""
+        cols, mat = self._matrix(table)
+        return mat[cols.index(name)]
+
+    def frame(self, table: str = "eth") -> pd.DataFrame:
+        """還原成與 compute_indicators / fetch_klines 相同欄位與型別的 DataFrame（複製一份）"""
+        cols, mat = self._matrix(table)
+        data = {}
+        for c, v in zip(cols, mat):
+            if c == "datetime":
+                data[c] = pd.to_datetime(v.astype(np.int64), unit="ms").astype("datetime64[us]")
+            elif c in _BOOL_COLS:
+                data[c] = v == 1.0
+            elif c in _INT_COLS:
+                data[c] = np.nan_to_num(v, nan=-1).astype(np.int64)
+            else:
+                data[c] = v.copy()
+        return pd.DataFrame(data)
+
+    def gates(self, side: str) -> np.ndarray:
+        """L / S 行情 gate bitmask（同 evaluate_signals_vectorized，狀態類 gate 視為通過）"""
+        return self.column("eth", f"gates_{side.lower()}").astype(np.uint16)
+
+
+def read_seq(path: str) -> int:
+    """只讀 16 bytes 檔頭拿 seq（輪詢用）；檔不存在 / 壞掉回 -1"""
+    try:
+        with open(path, "rb") as fh:
+            magic, seq, _ = _HEAD.unpack(fh.read(_HEAD.size))
+        return seq if magic == MAGIC else -1
+    except (OSError, struct.error):
+        return -1
+
+
+def read_snapshot(path: str = None):
+    """讀最新快照；沒有 / 壞掉回 None（fail-open）"""
+    path = path or snapshot_path()
+    try:
+        return Snapshot(path)
+    except Exception as e:
+        logger.debug(f"read snapshot failed: {e}")
+        return None
+
+
+def wait_snapshot(last_bar_time: str, deadline: float, not_before: float = 0.0,
+                  path: str = None, poll: float = 0.05):
+    """
+    等新快照：bar_time 晚於 last_bar_time 且在 not_before（epoch 秒，通常是本次整點）之後發布。
+    最晚到 deadline；逾時回 None。
+    """
+    path = path or snapshot_path()
+    seen = -1
+    while True:
+        seq = read_seq(path)
+        if seq != seen:
+            seen = seq
+            snap = read_snapshot(path) if seq >= 0 else None
+            if (snap is not None and snap.published_at >= not_before
+                    and (last_bar_time is None or (snap.bar_time or "") > last_bar_time)):
+                return snap
+        if time.time() >= deadline:
+            return None
+        time.sleep(poll)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 發布端主循環
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def build_tables(eth_df: pd.DataFrame, btc_df: pd.DataFrame, ind_state=None) -> tuple:
+    """抓好的 ETH/BTC → (tables, meta)；指標用增量狀態（有給）或全量重算"""
+    from indicator_state import compute_incremental
+
+    df = compute_incremental(ind_state, eth_df) if ind_state is not None \
+        else strategy.compute_indicators(eth_df)
+    sig = strategy.evaluate_signals_vectorized(df)
+    df = df.assign(gates_l=sig["L"]["gates"], gates_s=sig["S"]["gates"])
+    idx = len(df) - 2  # 最新已收盤 bar（最後一列為未收盤）
+    meta = {"bar_time": str(df["datetime"].iloc[idx]), "idx": idx}
+    return {"eth": df, "btc": btc_df}, meta
+
+
+def run_publisher(symbol: str = "ETHUSDT", interval: str = "1h"):
+    import bar_stream
+    import data_feed
+    from indicator_state import IndicatorState
+
+    path = snapshot_path(symbol, interval)
+    state_path = os.path.join(FEED_DIR, f"{symbol}_{interval}_indicators.json")
+    ind_state = IndicatorState.load(state_path)
+    stream = bar_stream.BarCloseStream(symbol, interval).start() if bar_stream.enabled() else None
+    seq = max(read_seq(path), 0)
+    last_bar = None
+    snap = read_snapshot(path)
+    if snap is not None:
+        last_bar = snap.bar_time
+    logger.info(f"Feed publisher started: {path} (seq={seq}, last bar={last_bar}, "
+                f"trigger={'websocket' if stream else 'hourly REST'})")
+
+    while True:
+        try:
+            k = bar_stream.wait_bar_close(stream, last_bar, PUBLISH_OFFSET)
+            event_bar = None
+            if k is not None:
+                data_feed.ingest_closed_kline(symbol, interval, k)
+                event_bar = bar_stream.bar_time_str(k)
+            t0 = time.time()
+            for attempt in range(5):
+                eth_df, btc_df = data_feed.fetch_eth_and_btc()
+                tables, meta = build_tables(eth_df, btc_df, ind_state)
+                if event_bar is None or meta["bar_time"] >= event_bar:
+                    break
+                time.sleep(1)
+                data_feed.invalidate_cache()
+            if meta["bar_time"] == last_bar:
+                logger.warning(f"Duplicate bar {last_bar}, not republishing")
+                continue
+            seq += 1
+            nbytes = publish(tables, seq, path, meta)
+            last_bar = meta["bar_time"]
+            logger.info(f"Published seq={seq} bar={last_bar} ({nbytes / 1024:.0f} KB, "
+                        f"{(time.time() - t0) * 1000:.0f} ms)")
+            try:
+                ind_state.save(state_path)
+            except Exception as e:
+                logger.warning(f"Indicator state save failed: {e}")
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            logger.error(f"Publish cycle failed: {e}")
+            time.sleep(30)
+
+
+def main():
+    try:
+        sys.stdout.reconfigure(encoding="utf-8")
+    except (AttributeError, ValueError):
+        pass
+    ap = argparse.ArgumentParser(description="多實例共用行情發布")
+    ap.add_argument("--show", action="store_true", help="顯示目前快照內容後結束")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    if args.show:
+        snap = read_snapshot()
+        if snap is None:
+            raise SystemExit(f"沒有快照：{snapshot_path()}")
+        age = time.time() - snap.published_at
+        print(f"seq={snap.seq} bar={snap.bar_time} UTC+8（{age:.0f}s 前發布）")
+        for name, t in snap.header["tables"].items():
+            print(f"  {name}: {t['rows']} 列 × {len(t['cols'])} 欄")
+        idx = snap.header.get("idx", -1)
+        for side in ("L", "S"):
+            g = int(snap.gates(side)[idx])
+            fails = [f for f in strategy.gate_failures(g) if f in ("GK 壓縮", "15-bar 突破", "交易時段", "Regime gate")]
+            print(f"  {side}: gates=0b{g:08b} {'行情 4 關全過' if not fails else '卡在 ' + '、'.join(fails)}")
+        return
+    run_publisher()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 回測資料下載器 — 在 VPS（或任何乾淨環境）上補齊 backtest/research 需要的 K 線快取。
 
 data/ 整個目錄被 gitignore，所以 fresh clone / VPS 上沒有 ETHUSDT_1h_latest730d.csv。
-本腳本用 Binance Futures 公開端點（與 data_feed.py 同源，不需 API key）分頁抓取
+本腳本用 Binance Futures 公開端點（與 data_feed.py 同源，不需 API key）抓取
 730 天 1h K 線，輸出成研究腳本期望的格式：
 
     欄位：open,high,low,close,volume,taker_buy_volume,datetime（datetime 為 UTC+8）
@@ -12,6 +12,14 @@ data/ 整個目錄被 gitignore，所以 fresh clone / VPS 上沒有 ETHUSDT_1h_
     .venv/bin/python fetch_backtest_data.py --days 365      # 只抓 365 天
     .venv/bin/python fetch_backtest_data.py --symbols ETHUSDT  # 只抓 ETH
     .venv/bin/python fetch_backtest_data.py --interval 4h   # 改時框（輸出 *_4h_*.csv）
+    .venv/bin/python fetch_backtest_data.py --symbols ETHUSDT SOLUSDT --interval 1h 15m  # 多組一次抓
+    .venv/bin/python fetch_backtest_data.py --rebuild       # 清掉 K 線庫整段重抓
+    .venv/bin/python fetch_backtest_data.py --base 15m --interval 15m 30m 2h 4h  # 只抓 15m，其餘重取樣
+
+K 線先存進 kline_store（cache/klines/，memmap 欄位檔），由 kline_downloader 並行分頁、
+共用 rate-limit 額度補齊；重跑時只補缺的區間，中斷後從已寫入的最後一根續抓。
+給 --base 時只下載該基底時框，其他時框由 bar_pyramid 重取樣（各時框保證一致）。
+K 線庫不可用時退回直接分頁抓。
 """
 import os
 import sys
@@ -22,6 +30,10 @@ from datetime import datetime, timedelta, timezone
 import requests
 import pandas as pd
 
+import kline_store
+import kline_downloader
+import bar_pyramid
+
 FUTURES_KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
 PAGE_LIMIT = 1500  # Binance Futures 單次上限
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
@@ -33,6 +45,20 @@ except (AttributeError, ValueError):
 
 
 def fetch_history(symbol: str, interval: str, days: int) -> pd.DataFrame:
+    """[now-days, now] 的已收盤 K 線：K 線庫補到最新後切區間（O(log n)）；失敗退回分頁抓。"""
+    try:
+        start_ms = int(datetime.now(timezone.utc).timestamp() * 1000) - days * 86_400_000
+        store = kline_store.ensure_history(symbol, interval, days)
+        gaps = store.gaps()
+        if gaps:
+            print(f"  ⚠️ {symbol} {interval}: K 線庫有 {len(gaps)} 處缺口（Binance 停機等，照原樣輸出）")
+        return store.to_frame(start=start_ms)
+    except Exception as e:
+        print(f"  K 線庫不可用（{e}），改為直接分頁抓取")
+        return _fetch_history_rest(symbol, interval, days)
+
+
+def _fetch_history_rest(symbol: str, interval: str, days: int) -> pd.DataFrame:
     """分頁抓取 [now-days, now] 的 K 線，回傳與快取 CSV 同格式的 DataFrame。"""
     now_utc = datetime.now(timezone.utc)
     end_ms = int(now_utc.timestamp() * 1000)
@@ -92,22 +118,44 @@ def fetch_history(symbol: str, interval: str, days: int) -> pd.DataFrame:
 def main():
     ap = argparse.ArgumentParser(description="下載 backtest 用的 K 線快取")
     ap.add_argument("--symbols", nargs="+", default=["ETHUSDT", "BTCUSDT"])
-    ap.add_argument("--interval", default="1h")
+    ap.add_argument("--interval", "--intervals", nargs="+", default=["1h"], dest="intervals")
     ap.add_argument("--days", type=int, default=730)
+    ap.add_argument("--rebuild", action="store_true", help="清掉 K 線庫整段重抓")
+    ap.add_argument("--base", help="只下載此基底時框（例如 15m），其他時框由它重取樣")
     args = ap.parse_args()
 
     os.makedirs(DATA_DIR, exist_ok=True)
+    t0 = time.time()
+    print(f"下載 {' '.join(args.symbols)} × {' '.join(args.intervals)}（{args.days} 天）…")
+    try:
+        stores = kline_downloader.download_many(args.symbols, [args.base] if args.base else args.intervals,
+                                                args.days, rebuild=args.rebuild)
+        if args.base:
+            stores = {(sym, iv): (bar_pyramid.update(sym, iv, args.base, base)
+                                  if isinstance(base, kline_store.KlineStore) else base)
+                      for (sym, _), base in stores.items() for iv in args.intervals}
+    except Exception as e:
+        print(f"  K 線庫不可用（{e}），改為直接分頁抓取")
+        stores = {}
+    start_ms = int(datetime.now(timezone.utc).timestamp() * 1000) - args.days * 86_400_000
     for sym in args.symbols:
-        print(f"下載 {sym} {args.interval}（{args.days} 天）…")
-        df = fetch_history(sym, args.interval, args.days)
-        # 命名對齊研究腳本：<SYM>_<interval>_latest730d.csv（沿用既有慣例）
-        fname = f"{sym}_{args.interval}_latest730d.csv"
-        path = os.path.join(DATA_DIR, fname)
-        df.to_csv(path, index=False)
-        span = f"{df['datetime'].iloc[0]} ~ {df['datetime'].iloc[-1]}" if len(df) else "空"
-        print(f"  ✓ 寫入 {path}（{len(df)} 根，{span}）\n")
-
-    print("完成。現在可以執行 backtest/research/ 內的腳本了。")
+        for iv in args.intervals:
+            store = stores.get((sym, iv))
+            if isinstance(store, kline_store.KlineStore):
+                if store.gaps():
+                    print(f"  ⚠️ {sym} {iv}: K 線庫有 {len(store.gaps())} 處缺口（Binance 停機等，照原樣輸出）")
+                df = store.to_frame(start=start_ms)
+            else:
+                if store is not None:
+                    print(f"  {sym} {iv} 下載失敗（{store}），改為直接分頁抓取")
+                df = _fetch_history_rest(sym, iv, args.days)
+            # 命名對齊研究腳本：<SYM>_<interval>_latest730d.csv（沿用既有慣例）
+            path = kline_downloader.csv_path(sym, iv)
+            df.to_csv(path, index=False)
+            span = f"{df['datetime'].iloc[0]} ~ {df['datetime'].iloc[-1]}" if len(df) else "空"
+            print(f"  ✓ 寫入 {path}（{len(df)} 根，{span}）")
+
+    print(f"\n完成（{time.time() - t0:.1f}s）。現在可以執行 backtest/research/ 內的腳本了。")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+"""
+資金費率本地庫 — 每個 symbol 一個 append-only 定長記錄檔，每 8 小時增量補一次，
+查詢用 searchsorted 做 as-of join（每根 bar 當下生效的費率），請求路徑不連網。
+
+原本 dashboard /api/klines 每次載入圖表都在 async handler 裡同步打 /fapi/v1/fundingRate
+（limit 1000），再用 Python while 迴圈逐根對齊；v30 研究另存一份 CSV 自己重新 join。
+
+  - 磁碟格式：cache/funding/<SYMBOL>.bin，記錄 = (funding_time int64 ms UTC, rate float64)
+  - 補資料：startTime = 最後一筆 + 1（分頁 1000 筆）；距上一筆未滿 8h 不打 API
+  - refresh_async()：背景執行緒補（同 symbol 同時只跑一個），呼叫端直接讀現有資料
+  - as-of：rate_asof(t) = funding_time <= t 的最後一筆費率（t 之前沒有資料 → NaN）
+  - 多實例共用（放程式目錄）；寫到一半中斷 → 下次開啟截到完整記錄
+
+用法：
+    python funding_store.py ETHUSDT BTCUSDT --days 790     # 建立 / 補齊
+    python funding_store.py ETHUSDT --csv                   # 另輸出 data/ETHUSDT_funding.csv（v30 格式）
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+import paths
+from kline_store import _FileLock
+
+logger = logging.getLogger("funding_store")
+
+FUNDING_URL = "https://fapi.binance.com/fapi/v1/fundingRate"
+PAGE_LIMIT = 1000
+FUNDING_INTERVAL_MS = 8 * 3600 * 1000
+FUNDING_DIR = os.path.join(paths.CODE_DIR, "cache", "funding")
+_RETRY_GAP = 600  # 到期但 Binance 還沒公布 → 10 分鐘內不重打
+
+_DTYPE = np.dtype([("t", "<i8"), ("rate", "<f8")])
+
+_bucket = None  # /fapi/v1/fundingRate 與 fundingInfo 共用 500 次 / 5 分鐘
+
+
+def _get_bucket():
+    global _bucket
+    if _bucket is None:
+        import kline_downloader
+        _bucket = kline_downloader.TokenBucket(rate_per_min=90, capacity=10)
+    return _bucket
+
+
+class FundingStore:
+    """單一 symbol 的資金費率序列（只增不改）"""
+
+    def __init__(self, symbol: str = "ETHUSDT", root: str = None):
+        self.symbol = symbol
+        root = root or FUNDING_DIR
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f"{symbol}.bin")
+        self._lock_path = self.path + ".lock"
+        self._map = None
+        self._mapped_n = -1
+        self._last_attempt = 0.0
+        self._repair()
+
+    def _repair(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size % _DTYPE.itemsize:
+            with _FileLock(self._lock_path):
+                with open(self.path, "r+b") as fh:
+                    fh.truncate(size - size % _DTYPE.itemsize)
+            logger.warning(f"{self.symbol} funding store repaired: dropped partial record")
+
+    def __len__(self):
+        return (os.path.getsize(self.path) if os.path.exists(self.path) else 0) // _DTYPE.itemsize
+
+    def _records(self) -> np.ndarray:
+        n = len(self)
+        if n != self._mapped_n:
+            self._map = (np.memmap(self.path, dtype=_DTYPE, mode="r", shape=(n,)) if n
+                         else np.empty(0, dtype=_DTYPE))
+            self._mapped_n = n
+        return self._map
+
+    def times(self) -> np.ndarray:
+        return self._records()["t"]
+
+    def rates(self) -> np.ndarray:
+        return self._records()["rate"]
+
+    @property
+    def last_time(self):
+        t = self.times()
+        return int(t[-1]) if len(t) else None
+
+    # ── 寫入 ──
+
+    def append(self, rows) -> int:
+        """rows: Binance fundingRate 回應（dict 串列）或 (ms, rate) 串列；只寫晚於最後一筆的"""
+        recs = []
+        for r in rows:
+            if isinstance(r, dict):
+                recs.append((int(r["fundingTime"]), float(r["fundingRate"])))
+            else:
+                recs.append((int(r[0]), float(r[1])))
+        if not recs:
+            return 0
+        recs.sort()
+        with _FileLock(self._lock_path):
+            self._mapped_n = -1
+            last = self.last_time
+            out = []
+            for t, rate in recs:
+                if last is None or t > last:
+                    out.append((t, rate))
+                    last = t
+            if out:
+                with open(self.path, "ab") as fh:
+                    fh.write(np.array(out, dtype=_DTYPE).tobytes())
+            self._mapped_n = -1
+        return len(out)
+
+    def reset(self):
+        """清空（要補的區間早於庫內第一筆時用；只增不改，無法往前插）"""
+        with _FileLock(self._lock_path):
+            with open(self.path, "wb"):
+                pass
+        self._map = None
+        self._mapped_n = -1
+
+    def top_up(self, start_ms: int = None, max_pages: int = None) -> int:
+        """補到最新（startTime = 最後一筆 + 1；空庫用 start_ms）。網路錯誤拋出，呼叫端自行 fail-open"""
+        import kline_downloader
+        last = self.last_time
+        cursor = last + 1 if last is not None else start_ms
+        if cursor is None:
+            raise ValueError("empty funding store needs start_ms")
+        self._last_attempt = time.time()
+        added = page = 0
+        while True:
+            data = kline_downloader.request_json(FUNDING_URL, {
+                "symbol": self.symbol, "startTime": int(cursor), "limit": PAGE_LIMIT,
+            }, _get_bucket())
+            page += 1
+            if not data:
+                break
+            added += self.append(data)
+            nxt = int(data[-1]["fundingTime"]) + 1
+            if len(data) < PAGE_LIMIT or nxt <= cursor or (max_pages and page >= max_pages):
+                break
+            cursor = nxt
+        return added
+
+    def due(self, now_ms: int = None) -> bool:
+        """空庫或距上一筆已滿 8h（且 10 分鐘內沒試過）→ 該補了"""
+        if time.time() - self._last_attempt < _RETRY_GAP:
+            return False
+        last = self.last_time
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        return last is None or now_ms - last >= FUNDING_INTERVAL_MS
+
+    # ── 查詢 ──
+
+    def asof_index(self, times_ms) -> np.ndarray:
+        """每個時間點「已生效」的最後一筆位置（funding_time <= t）；之前沒有資料為 -1"""
+        return np.searchsorted(self.times(), np.asarray(times_ms, dtype=np.int64), side="right") - 1
+
+    def rate_asof(self, times_ms) -> np.ndarray:
+        """每個時間點當下生效的費率（小數，例如 0.0001）；之前沒有資料為 NaN"""
+        idx = self.asof_index(times_ms)
+        rates = self.rates()
+        out = np.full(len(idx), np.nan)
+        ok = idx >= 0
+        out[ok] = rates[idx[ok]]
+        return out
+
+    def to_frame(self) -> pd.DataFrame:
+        """v30 CSV 格式：funding_time_ms, funding_time_utc, rate"""
+        t = np.array(self.times())
+        return pd.DataFrame({
+            "funding_time_ms": t,
+            "funding_time_utc": pd.to_datetime(t, unit="ms").strftime("%Y-%m-%d %H:%M:%S"),
+            "rate": np.array(self.rates()),
+        })
+
+
+_stores = {}
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+
+def open_store(symbol: str = "ETHUSDT") -> FundingStore:
+    """進程內共用同一個 FundingStore（memmap 重用）"""
+    if symbol not in _stores:
+        _stores[symbol] = FundingStore(symbol)
+    return _stores[symbol]
+
+
+def refresh(symbol: str = "ETHUSDT", days: int = 790, force: bool = False) -> int:
+    """到期才補；空庫從 days 天前開始抓（預設 730 天 K 線 + 60 天暖機）"""
+    store = open_store(symbol)
+    if not force and not store.due():
+        return 0
+    start_ms = int(time.time() * 1000) - days * 86_400_000
+    return store.top_up(start_ms=start_ms)
+
+
+def refresh_async(symbol: str = "ETHUSDT", days: int = 790):
+    """背景補資料（不阻塞呼叫端）；未到期 / 已在跑 → 什麼都不做"""
+    store = open_store(symbol)
+    if not store.due():
+        return
+    with _refresh_lock:
+        if symbol in _refreshing:
+            return
+        _refreshing.add(symbol)
+
+    def _run():
+        try:
+            n = refresh(symbol, days)
+            if n:
+                logger.info(f"{symbol} funding +{n}")
+        except Exception as e:
+            logger.warning(f"{symbol} funding refresh failed: {e}")
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(symbol)
+
+    threading.Thread(target=_run, name=f"funding_{symbol}", daemon=True).start()
+
+
+def main():
+    try:
+        sys.stdout.reconfigure(encoding="utf-8")
+    except (AttributeError, ValueError):
+        pass
+    ap = argparse.ArgumentParser(description="建立 / 補齊資金費率庫")
+    ap.add_argument("symbols", nargs="*", default=["ETHUSDT"])
+    ap.add_argument("--days", type=int, default=790)
+    ap.add_argument("--csv", action="store_true", help="另輸出 data/<SYM>_funding.csv")
+    args = ap.parse_args()
+    for sym in args.symbols:
+        n = refresh(sym, args.days, force=True)
+        store = open_store(sym)
+        t = store.times()
+        span = (f"{pd.to_datetime(t[0], unit='ms')} ~ {pd.to_datetime(t[-1], unit='ms')} UTC"
+                if len(t) else "空")
+        line = f"{sym}: +{n} 筆，共 {len(store)} 筆（{span}）"
+        if args.csv:
+            out = os.path.join(paths.CODE_DIR, "data", f"{sym}_funding.csv")
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            store.to_frame().to_csv(out, index=False, float_format="%.8f")
+            line += f" → {out}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
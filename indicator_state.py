@@ -0,0 +1,538 @@
+"""
+增量指標引擎 — 每根已收盤 bar O(1) / O(log w) 更新，取代每小時整段重算 500 bar。
+
+與 strategy.compute_indicators 產出「同名、同語意」的指標欄位（逐 bar 對齊）：
+  - ema20：pandas ewm(span=20, adjust=True) 同一遞推式
+  - GK mean(5/20)、mean(10/30)、SMA200：running sum（定期以 fsum 重算防浮點漂移）
+  - breakout_15bar_max/min：單調 deque（close.shift(1).rolling(15)）
+  - gk_pctile / gk_pctile_s：排序窗口（bisect）做 rank percentile（嚴格 <、/(n-1)）
+  - sma_slope：SMA200 100-bar 相對斜率，shift(1) 防前瞻
+
+狀態持久化在狀態檔旁（paths.indicator_state_file）：重啟後直接續算，不必重新暖機 310 bar。
+任何不連續（缺 bar、狀態檔損毀、K 線時間倒退）都退回「用本次抓到的整段 K 線重建」，
+與 compute_indicators 結果一致（fail-open，絕不擋交易）。
+
+對照驗證（與 pandas 版逐欄比對）：
+    python indicator_state.py                         # 預設 data/ETHUSDT_1h_latest730d.csv
+    python indicator_state.py --csv path/to/file.csv
+"""
+import os
+import json
+import math
+import bisect
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import strategy
+
+logger = logging.getLogger("indicator_state")
+
+STATE_VERSION = 1
+BAR_DELTA = timedelta(hours=1)
+_RESYNC_EVERY = 500        # running sum 每 N bar 以 fsum 重算一次，避免長期累積誤差
+_HISTORY_LEN = 600         # 保留最近 N 根輸出（對齊回 DataFrame 用，不持久化）
+
+INDICATOR_COLUMNS = [
+    "ema20", "gk_ratio", "gk_ratio_s", "gk_pctile", "gk_pctile_s",
+    "breakout_15bar_max", "breakout_15bar_min", "breakout_long", "breakout_short",
+    "hour_utc8", "weekday_utc8", "session_ok_l", "session_ok_s",
+    "sma200", "sma_slope", "regime_block_l", "regime_block_s",
+]
+
+_NAN = float("nan")
+_GK_K = 2 * np.log(2) - 1
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 滾動視窗元件
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class _RollingMean:
+    """固定窗口滾動平均（running sum）；窗口未滿或含 NaN 時回 NaN（同 pandas min_periods=window）。"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.buf = deque(maxlen=window)
+        self.total = 0.0
+        self.nan_count = 0
+        self.pushes = 0
+
+    def push(self, x: float) -> float:
+        if len(self.buf) == self.window:
+            old = self.buf[0]
+            if math.isnan(old):
+                self.nan_count -= 1
+            else:
+                self.total -= old
+        self.buf.append(x)
+        if math.isnan(x):
+            self.nan_count += 1
+        else:
+            self.total += x
+        self.pushes += 1
+        if self.pushes % _RESYNC_EVERY == 0:
+            self.total = math.fsum(v for v in self.buf if not math.isnan(v))
+        if len(self.buf) < self.window or self.nan_count:
+            return _NAN
+        return self.total / self.window
+
+    def to_dict(self) -> dict:
+        return {"buf": list(self.buf)}
+
+    def load(self, d: dict):
+        for x in d.get("buf", [])[-self.window:]:
+            self.push(float(x))
+
+
+class _RollingExtreme:
+    """單調 deque 滾動 max / min（O(1) 均攤）。"""
+
+    def __init__(self, window: int, is_max: bool):
+        self.window = window
+        self.is_max = is_max
+        self.dq = deque()   # (seq, value)，value 單調
+        self.seq = 0
+
+    def push(self, x: float) -> float:
+        if self.is_max:
+            while self.dq and self.dq[-1][1] <= x:
+                self.dq.pop()
+        else:
+            while self.dq and self.dq[-1][1] >= x:
+                self.dq.pop()
+        self.dq.append((self.seq, x))
+        while self.dq[0][0] <= self.seq - self.window:
+            self.dq.popleft()
+        self.seq += 1
+        if self.seq < self.window:
+            return _NAN
+        return self.dq[0][1]
+
+    def peek(self, x: float) -> float:
+        """push(x) 會回傳的值（不改狀態）"""
+        if self.seq + 1 < self.window:
+            return _NAN
+        vals = [v for s, v in self.dq if s > self.seq - self.window]
+        vals.append(x)
+        return max(vals) if self.is_max else min(vals)
+
+    def to_dict(self) -> dict:
+        return {"dq": [list(p) for p in self.dq], "seq": self.seq}
+
+    def load(self, d: dict):
+        self.dq = deque((int(s), float(v)) for s, v in d.get("dq", []))
+        self.seq = int(d.get("seq", 0))
+
+
+class _RankWindow:
+    """排序窗口 rank percentile：最新值在窗口內嚴格小於它的比例（/(n-1)×100）。
+
+    語意同 strategy.compute_indicators 的 rolling(GK_WIN).apply(_rank_pctile)：
+    窗口未滿或含 NaN → NaN。排序串列用 bisect 定位（O(log w) 查詢）。
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.buf = deque(maxlen=window)
+        self.sorted = []
+        self.nan_count = 0
+
+    def push(self, x: float) -> float:
+        if len(self.buf) == self.window:
+            old = self.buf[0]
+            if math.isnan(old):
+                self.nan_count -= 1
+            else:
+                del self.sorted[bisect.bisect_left(self.sorted, old)]
+        self.buf.append(x)
+        if math.isnan(x):
+            self.nan_count += 1
+        else:
+            bisect.insort(self.sorted, x)
+        n = len(self.buf)
+        if n < self.window or self.nan_count:
+            return _NAN
+        if n <= 1:
+            return 50
+        return bisect.bisect_left(self.sorted, x) / (n - 1) * 100
+
+    def peek(self, x: float) -> float:
+        """push(x) 會回傳的值（不改狀態）"""
+        full = len(self.buf) == self.window
+        old = self.buf[0] if full else _NAN
+        n = len(self.buf) if full else len(self.buf) + 1
+        nan_count = self.nan_count + math.isnan(x) - (full and math.isnan(old))
+        if n < self.window or nan_count:
+            return _NAN
+        if n <= 1:
+            return 50
+        cnt = bisect.bisect_left(self.sorted, x)
+        if full and old < x:
+            cnt -= 1
+        return cnt / (n - 1) * 100
+
+    def to_dict(self) -> dict:
+        return {"buf": list(self.buf)}
+
+    def load(self, d: dict):
+        for x in d.get("buf", [])[-self.window:]:
+            self.push(float(x))
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# IndicatorState
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class IndicatorState:
+    """逐 bar 增量指標狀態。update() 吃一根已收盤 bar，回傳該 bar 的指標 dict。
+
+    history（最近 _HISTORY_LEN 根的輸出）不持久化：重啟 load() 後只有之後 ingest 的 bar 在 history 裡，
+    apply() 對回 df 時更早的列指標為 NaN。主迴圈只讀最後收盤列（idx），所以不受影響；
+    若要讀整段歷史指標，改用 strategy.compute_indicators。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_dt = None           # 最後吃進的 bar datetime（UTC+8）
+        self.bars = 0
+        # EMA20（pandas ewm adjust=True 遞推）
+        self._ema = _NAN
+        self._ema_old_wt = 1.0
+        # GK rolling means
+        self._gk_sl = _RollingMean(strategy.L_GK_SHORT)
+        self._gk_ll = _RollingMean(strategy.L_GK_LONG)
+        self._gk_ss = _RollingMean(strategy.S_GK_SHORT)
+        self._gk_ls = _RollingMean(strategy.S_GK_LONG)
+        # GK pctile：窗口存「前一根以前」的 ratio（shift(1)）
+        self._prev_ratio_l = _NAN
+        self._prev_ratio_s = _NAN
+        self._rank_l = _RankWindow(strategy.GK_WIN)
+        self._rank_s = _RankWindow(strategy.GK_WIN)
+        # Breakout：窗口存前一根以前的 close（shift(1)）
+        self._prev_close = _NAN
+        self._brk_max = _RollingExtreme(strategy.BRK_LOOK, is_max=True)
+        self._brk_min = _RollingExtreme(strategy.BRK_LOOK, is_max=False)
+        # SMA200 + 100-bar 斜率
+        self._sma = _RollingMean(strategy.R_SMA_WIN)
+        self._sma_hist = deque(maxlen=strategy.R_SLOPE_WIN + 1)
+        self._prev_slope = _NAN
+        # 最近輸出（不持久化）
+        self.history = deque(maxlen=_HISTORY_LEN)
+
+    # ── 單 bar 更新 ──
+
+    def update(self, dt, o: float, h: float, l: float, c: float) -> dict:
+        """吃進一根已收盤 bar（須與 last_dt 相隔 1h；呼叫端負責連續性檢查）。"""
+        dt = pd.Timestamp(dt).to_pydatetime()
+        o, h, l, c = float(o), float(h), float(l), float(c)
+
+        # EMA20
+        if self.bars == 0:
+            self._ema = c
+            self._ema_old_wt = 1.0
+        else:
+            self._ema_old_wt *= 1 - 2.0 / (20 + 1)
+            if self._ema != c:
+                self._ema = (self._ema_old_wt * self._ema + c) / (self._ema_old_wt + 1.0)
+            self._ema_old_wt += 1.0
+
+        # GK
+        ln_hl = np.log(h / l)
+        ln_co = np.log(c / o)
+        gk = float(0.5 * ln_hl ** 2 - _GK_K * ln_co ** 2)
+        ratio_l = _div(self._gk_sl.push(gk), self._gk_ll.push(gk))
+        ratio_s = _div(self._gk_ss.push(gk), self._gk_ls.push(gk))
+
+        # GK pctile（shift(1)：本 bar 用到前一根為止的 ratio）
+        pctile_l = self._rank_l.push(self._prev_ratio_l) if self.bars else _NAN
+        pctile_s = self._rank_s.push(self._prev_ratio_s) if self.bars else _NAN
+        self._prev_ratio_l = ratio_l
+        self._prev_ratio_s = ratio_s
+
+        # Breakout（shift(1)）
+        if self.bars:
+            brk_max = self._brk_max.push(self._prev_close)
+            brk_min = self._brk_min.push(self._prev_close)
+        else:
+            brk_max = brk_min = _NAN
+        self._prev_close = c
+
+        # SMA200 + 斜率（shift(1)）
+        sma = self._sma.push(c)
+        self._sma_hist.append(sma)
+        sma_slope = self._prev_slope
+        if len(self._sma_hist) == self._sma_hist.maxlen:
+            base = self._sma_hist[0]
+            self._prev_slope = (sma - base) / base
+        else:
+            self._prev_slope = _NAN
+
+        hour, wd = dt.hour, dt.weekday()
+        row = {
+            "datetime": dt,
+            "ema20": self._ema,
+            "gk_ratio": ratio_l,
+            "gk_ratio_s": ratio_s,
+            "gk_pctile": pctile_l,
+            "gk_pctile_s": pctile_s,
+            "breakout_15bar_max": brk_max,
+            "breakout_15bar_min": brk_min,
+            "breakout_long": bool(c > brk_max),
+            "breakout_short": bool(c < brk_min),
+            "hour_utc8": hour,
+            "weekday_utc8": wd,
+            "session_ok_l": not (hour in strategy.BLOCK_H or wd in strategy.L_BLOCK_D),
+            "session_ok_s": not (hour in strategy.BLOCK_H or wd in strategy.S_BLOCK_D),
+            "sma200": sma,
+            "sma_slope": sma_slope,
+            "regime_block_l": bool(sma_slope > strategy.R_TH_UP),
+            "regime_block_s": bool(abs(sma_slope) < strategy.R_TH_SIDE),
+        }
+        self.bars += 1
+        self.last_dt = dt
+        self.history.append(row)
+        return row
+
+    def peek_next(self) -> dict:
+        """
+        下一根 bar（last_dt + 1h，尚未收盤）收盤前就能定案的指標（strategy.PLAN_FIELDS）：
+        GK pctile / 15-bar 高低 / SMA 斜率都是 shift(1)，時段看開盤時間。不改狀態；未吃過 bar 回 None。
+        """
+        if self.bars == 0:
+            return None
+        dt = self.last_dt + BAR_DELTA
+        hour, wd = dt.hour, dt.weekday()
+        sma_slope = self._prev_slope
+        return {
+            "datetime": dt,
+            "gk_pctile": self._rank_l.peek(self._prev_ratio_l),
+            "gk_pctile_s": self._rank_s.peek(self._prev_ratio_s),
+            "breakout_15bar_max": self._brk_max.peek(self._prev_close),
+            "breakout_15bar_min": self._brk_min.peek(self._prev_close),
+            "hour_utc8": hour,
+            "weekday_utc8": wd,
+            "session_ok_l": not (hour in strategy.BLOCK_H or wd in strategy.L_BLOCK_D),
+            "session_ok_s": not (hour in strategy.BLOCK_H or wd in strategy.S_BLOCK_D),
+            "sma_slope": sma_slope,
+            "regime_block_l": bool(sma_slope > strategy.R_TH_UP),
+            "regime_block_s": bool(abs(sma_slope) < strategy.R_TH_SIDE),
+        }
+
+    # ── DataFrame 對接（主迴圈用）──
+
+    def warmed_up(self) -> bool:
+        return self.bars >= strategy.WARMUP_BARS
+
+    def ingest(self, df: pd.DataFrame, upto: int) -> int:
+        """把 df[:upto+1] 中比 last_dt 新的已收盤 bar 依序吃進；不連續則用整段重建。
+
+        Returns: 新吃進的 bar 數
+        """
+        dts = list(pd.to_datetime(df["datetime"]).dt.to_pydatetime())
+        o = df["open"].to_numpy(dtype=float)
+        h = df["high"].to_numpy(dtype=float)
+        l = df["low"].to_numpy(dtype=float)
+        c = df["close"].to_numpy(dtype=float)
+
+        start = 0
+        if self.last_dt is not None:
+            new_pos = [i for i in range(upto + 1) if dts[i] > self.last_dt]
+            if not new_pos:
+                return 0
+            first = new_pos[0]
+            if (dts[first] - self.last_dt == BAR_DELTA and first > 0
+                    and dts[first - 1] == self.last_dt):
+                start = first
+            else:
+                logger.warning(
+                    f"IndicatorState gap: last={self.last_dt} next={dts[first]} → rebuild"
+                )
+                self.reset()
+
+        for i in range(start, upto + 1):
+            if i > start and dts[i] - dts[i - 1] != BAR_DELTA:
+                # 抓到的 K 線本身有洞：從洞之後重建（與 pandas 版逐列 rolling 不同，洞前資料不可信）
+                logger.warning(f"IndicatorState kline gap at {dts[i]} → restart from here")
+                self.reset()
+            self.update(dts[i], o[i], h[i], l[i], c[i])
+        return upto + 1 - start
+
+    def apply(self, df: pd.DataFrame, upto: int = None) -> pd.DataFrame:
+        """取代 strategy.compute_indicators(df)：只增量吃新 bar，再把指標欄位對回 df。
+
+        upto：最後一根已收盤 bar 的位置（預設 len(df)-2，最後一列為未收盤 bar，不吃進狀態）。
+        未收盤 bar 與早於狀態歷史的列，指標欄位為 NaN（主迴圈只讀 idx 列）。
+        """
+        if upto is None:
+            upto = len(df) - 2
+        self.ingest(df, upto)
+
+        d = df.copy()
+        by_dt = {r["datetime"]: r for r in self.history}
+        keys = list(pd.to_datetime(d["datetime"]).dt.to_pydatetime())
+        rows = [by_dt.get(k) for k in keys]
+        for col in INDICATOR_COLUMNS:
+            d[col] = [r[col] if r is not None else np.nan for r in rows]
+        return d
+
+    # ── 持久化 ──
+
+    def to_dict(self) -> dict:
+        return {
+            "version": STATE_VERSION,
+            "params": _param_key(),
+            "last_dt": self.last_dt.strftime("%Y-%m-%d %H:%M:%S") if self.last_dt else None,
+            "bars": self.bars,
+            "ema": self._ema,
+            "ema_old_wt": self._ema_old_wt,
+            "gk_sl": self._gk_sl.to_dict(),
+            "gk_ll": self._gk_ll.to_dict(),
+            "gk_ss": self._gk_ss.to_dict(),
+            "gk_ls": self._gk_ls.to_dict(),
+            "prev_ratio_l": self._prev_ratio_l,
+            "prev_ratio_s": self._prev_ratio_s,
+            "rank_l": self._rank_l.to_dict(),
+            "rank_s": self._rank_s.to_dict(),
+            "prev_close": self._prev_close,
+            "brk_max": self._brk_max.to_dict(),
+            "brk_min": self._brk_min.to_dict(),
+            "sma": self._sma.to_dict(),
+            "sma_hist": list(self._sma_hist),
+            "prev_slope": self._prev_slope,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "IndicatorState":
+        st = cls()
+        if d.get("version") != STATE_VERSION or d.get("params") != _param_key():
+            return st  # 參數改過 → 舊狀態作廢，下次 ingest 自動重建
+        if not d.get("last_dt"):
+            return st
+        st.last_dt = datetime.strptime(d["last_dt"], "%Y-%m-%d %H:%M:%S")
+        st.bars = int(d.get("bars", 0))
+        st._ema = float(d["ema"])
+        st._ema_old_wt = float(d["ema_old_wt"])
+        st._gk_sl.load(d["gk_sl"])
+        st._gk_ll.load(d["gk_ll"])
+        st._gk_ss.load(d["gk_ss"])
+        st._gk_ls.load(d["gk_ls"])
+        st._prev_ratio_l = float(d["prev_ratio_l"])
+        st._prev_ratio_s = float(d["prev_ratio_s"])
+        st._rank_l.load(d["rank_l"])
+        st._rank_s.load(d["rank_s"])
+        st._prev_close = float(d["prev_close"])
+        st._brk_max.load(d["brk_max"])
+        st._brk_min.load(d["brk_min"])
+        st._sma.load(d["sma"])
+        st._sma_hist.extend(float(x) for x in d["sma_hist"])
+        st._prev_slope = float(d["prev_slope"])
+        return st
+
+    def save(self, path: str):
+        """原子寫入（tmp + replace，同 Executor.save_state）。"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IndicatorState":
+        """讀不到 / 壞檔 → 空狀態（下次 ingest 用整段 K 線重建）。"""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except Exception as e:
+            logger.warning(f"Indicator state load failed ({e}), rebuilding from klines")
+            return cls()
+
+
+def compute_incremental(state: IndicatorState, df: pd.DataFrame, log=None) -> pd.DataFrame:
+    """增量指標（只吃新收盤 bar）；任何異常退回 pandas 全量重算（fail-open）。"""
+    log = log or logger
+    try:
+        out = state.apply(df)
+        if state.warmed_up():
+            return out
+        log.warning(f"Indicator state not warmed up ({state.bars} bars), using full recompute")
+    except Exception as e:
+        log.warning(f"Incremental indicators failed ({e}), using full recompute")
+        state.reset()
+    return strategy.compute_indicators(df)
+
+
+def _div(a: float, b: float) -> float:
+    """同 pandas 除法語意：分母 0 → ±inf / NaN，不丟 ZeroDivisionError。"""
+    if b == 0:
+        if a == 0 or math.isnan(a):
+            return _NAN
+        return math.copysign(math.inf, a)
+    return a / b
+
+
+def _param_key() -> list:
+    """影響指標的參數組合；任一改變則持久化狀態作廢。"""
+    return [strategy.L_GK_SHORT, strategy.L_GK_LONG, strategy.S_GK_SHORT, strategy.S_GK_LONG,
+            strategy.GK_WIN, strategy.BRK_LOOK, strategy.R_SMA_WIN, strategy.R_SLOPE_WIN]
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 對照驗證（與 strategy.compute_indicators 逐欄比對）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def parity_report(df: pd.DataFrame, split: int = None, tol: float = 1e-9) -> dict:
+    """pandas 全量 vs 增量（可選在 split 處存檔→讀檔續算，模擬重啟）逐欄比對。
+
+    Returns: {欄位: 不一致列數}（全 0 = 一致）
+    """
+    df = df.copy()
+    df["datetime"] = pd.to_datetime(df["datetime"])
+    ref = strategy.compute_indicators(df)
+
+    st = IndicatorState()
+    rows = []
+    for i in range(len(df)):
+        if split is not None and i == split:
+            st = IndicatorState.from_dict(json.loads(json.dumps(st.to_dict())))
+        r = df.iloc[i]
+        rows.append(st.update(r["datetime"], r["open"], r["high"], r["low"], r["close"]))
+    inc = pd.DataFrame(rows)
+
+    report = {}
+    for col in INDICATOR_COLUMNS:
+        a = ref[col].to_numpy()
+        b = inc[col].to_numpy()
+        if a.dtype == bool or b.dtype == bool:
+            bad = (a.astype(bool) != b.astype(bool))
+        else:
+            a = a.astype(float)
+            b = b.astype(float)
+            both_nan = np.isnan(a) & np.isnan(b)
+            close = np.isclose(a, b, rtol=tol, atol=tol)
+            bad = ~(both_nan | close)
+        report[col] = int(bad.sum())
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="增量指標 vs pandas compute_indicators 對照")
+    ap.add_argument("--csv", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  "data", "ETHUSDT_1h_latest730d.csv"))
+    args = ap.parse_args()
+
+    data = pd.read_csv(args.csv)
+    t0 = time.perf_counter()
+    rep = parity_report(data, split=len(data) // 2)
+    bad = {k: v for k, v in rep.items() if v}
+    print(f"bars={len(data)} elapsed={time.perf_counter() - t0:.1f}s")
+    print("PARITY OK" if not bad else f"PARITY MISMATCH: {bad}")
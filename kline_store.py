@@ -0,0 +1,367 @@
+"""
+K 線持久化儲存 — 每個 symbol/interval 一組 append-only、memory-mapped 欄位檔。
+
+取代「每小時抓 500 根 REST」與「每次回測重新分頁下載 / 解析 730 天 CSV」：
+  - 磁碟格式：cache/klines/<SYMBOL>_<interval>/<欄位>.bin，little-endian 定長陣列
+      open_time（int64, ms UTC）+ open/high/low/close/volume/taker_buy_volume（float64）
+  - 只存已收盤 bar；open_time 嚴格遞增（時間索引），區間查詢用 searchsorted → O(log n)
+  - 補資料：startTime = 最後一根 open_time + 1，分頁抓到最新（live 每小時只拉 1–2 根）；
+    大段歷史由 kline_downloader 並行分頁補齊
+  - 缺口偵測：gaps() 列出相鄰 open_time 差 > 1 個 interval 的位置（Binance 維護停機等）
+  - 多實例共用（放程式目錄）：append 期間 flock 互斥；非 Linux 無 fcntl → 直接寫
+  - 寫到一半中斷（各欄長度不一）→ 下次開啟時截到最短欄位長度自動修復
+
+輸出 DataFrame 與 data_feed.fetch_klines / 回測 CSV 同格式：
+    [open, high, low, close, volume, taker_buy_volume, datetime]（datetime 為 UTC+8）
+
+用法：
+    python kline_store.py ETHUSDT --days 730     # 建立 / 補齊並列出缺口
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+import requests
+
+import paths
+
+logger = logging.getLogger("kline_store")
+
+FUTURES_KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
+PAGE_LIMIT = 1500  # Binance Futures 單次上限
+STORE_DIR = os.path.join(paths.CODE_DIR, "cache", "klines")  # 所有實例共用
+
+UTC8_MS = 8 * 3600 * 1000
+
+# 公開行情共用連線池（keep-alive）：整點前 cycle_prefetch 先 ping 一次，收盤時不用重新握手
+HTTP = requests.Session()
+
+# (欄位, dtype, Binance kline 陣列位置)
+_COLUMNS = (
+    ("open_time", "<i8", 0),
+    ("open", "<f8", 1),
+    ("high", "<f8", 2),
+    ("low", "<f8", 3),
+    ("close", "<f8", 4),
+    ("volume", "<f8", 5),
+    ("taker_buy_volume", "<f8", 9),
+)
+_ITEM = 8  # 每欄每列 8 bytes
+
+_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+
+
+def interval_ms(interval: str) -> int:
+    """'1h' → 3600000"""
+    return int(interval[:-1]) * _UNIT_MS[interval[-1]]
+
+
+def _to_ms(t) -> int:
+    """int(ms UTC) 原樣；datetime / 字串視為 UTC+8（與 K 線 datetime 欄位一致）"""
+    if t is None:
+        return None
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    return int(pd.Timestamp(t).value // 1_000_000) - UTC8_MS
+
+
+class _FileLock:
+    """flock 互斥（append / 修復用）；沒有 fcntl（Windows）就不鎖"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        self.fh = open(self.path, "w")
+        fcntl.flock(self.fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fh is not None:
+            import fcntl
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+            self.fh.close()
+            self.fh = None
+
+
+class KlineStore:
+    """單一 symbol/interval 的欄位式 K 線庫（只增不改）"""
+
+    def __init__(self, symbol: str = "ETHUSDT", interval: str = "1h", root: str = None):
+        self.symbol = symbol
+        self.interval = interval
+        self.step = interval_ms(interval)
+        self.dir = os.path.join(root or STORE_DIR, f"{symbol}_{interval}")
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock_path = os.path.join(self.dir, ".lock")
+        self._maps = {}
+        self._mapped_n = -1
+        self.forming = None  # 最近一次 top_up 看到的未收盤 bar（Binance 原始陣列）
+        self._repair()
+
+    # ── 檔案層 ──
+
+    def _path(self, col):
+        return os.path.join(self.dir, f"{col}.bin")
+
+    def _file_rows(self):
+        return [os.path.getsize(self._path(c)) // _ITEM if os.path.exists(self._path(c)) else 0
+                for c, _, _ in _COLUMNS]
+
+    def _repair(self):
+        """各欄長度不一（append 中途中斷）→ 全部截到最短長度"""
+        rows = self._file_rows()
+        if len(set(rows)) == 1:
+            return
+        with _FileLock(self._lock_path):
+            rows = self._file_rows()
+            n = min(rows)
+            for (c, _, _), r in zip(_COLUMNS, rows):
+                if r != n:
+                    with open(self._path(c), "r+b" if os.path.exists(self._path(c)) else "wb") as fh:
+                        fh.truncate(n * _ITEM)
+            logger.warning(f"{self.symbol} {self.interval} store repaired: truncated to {n} bars")
+
+    def __len__(self):
+        return min(self._file_rows())
+
+    def _arrays(self) -> dict:
+        """目前長度的 memmap（唯讀）；長度有變才重新映射"""
+        n = len(self)
+        if n != self._mapped_n:
+            self._maps = {}
+            for c, dt, _ in _COLUMNS:
+                if n == 0:
+                    self._maps[c] = np.empty(0, dtype=dt)
+                else:
+                    self._maps[c] = np.memmap(self._path(c), dtype=dt, mode="r", shape=(n,))
+            self._mapped_n = n
+        return self._maps
+
+    def column(self, name: str) -> np.ndarray:
+        return self._arrays()[name]
+
+    @property
+    def first_open_time(self):
+        ot = self.column("open_time")
+        return int(ot[0]) if len(ot) else None
+
+    @property
+    def last_open_time(self):
+        ot = self.column("open_time")
+        return int(ot[-1]) if len(ot) else None
+
+    @property
+    def covered_from(self):
+        """已確認抓過的起點（ms UTC）：晚上市的 symbol 第一根會晚於此，不必每次重建；沒記錄則用第一根"""
+        try:
+            with open(os.path.join(self.dir, "meta.json"), encoding="utf-8") as fh:
+                return min(int(json.load(fh)["covered_from"]), self.first_open_time or 2 ** 62)
+        except (OSError, ValueError, KeyError, TypeError):
+            return self.first_open_time
+
+    def mark_covered(self, start_ms: int):
+        """記錄 [start_ms, 最後一根] 已完整抓過（kline_downloader 一組下載完成時呼叫）"""
+        with open(os.path.join(self.dir, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump({"covered_from": int(start_ms)}, fh)
+
+    # ── 寫入 ──
+
+    def append(self, klines: list, now_ms: int = None) -> int:
+        """
+        追加 Binance 原始 kline 陣列。只收已收盤（close_time <= now）且晚於最後一根的 bar；
+        未收盤那根記在 self.forming。回傳實際寫入根數。
+        """
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        closed = []
+        for k in klines:
+            if int(k[6]) <= now_ms:
+                closed.append(k)
+            else:
+                self.forming = k
+        if not closed:
+            return 0
+
+        with _FileLock(self._lock_path):
+            self._mapped_n = -1  # 其他實例可能剛寫過 → 以檔案為準
+            last = self.last_open_time
+            rows = []
+            for k in closed:
+                t = int(k[0])
+                if last is not None and t <= last:
+                    continue
+                if last is not None and t - last != self.step:
+                    logger.warning(f"{self.symbol} {self.interval} gap: "
+                                   f"{(t - last) // self.step - 1} bars missing before {t}")
+                rows.append(k)
+                last = t
+            if not rows:
+                return 0
+            for c, dt, pos in _COLUMNS:
+                conv = int if dt == "<i8" else float
+                arr = np.asarray([conv(k[pos]) for k in rows], dtype=dt)
+                with open(self._path(c), "ab") as fh:
+                    fh.write(arr.tobytes())
+            self._mapped_n = -1
+        return len(rows)
+
+    def append_columns(self, cols: dict) -> int:
+        """向量版 append：{欄位: 陣列}（皆為已收盤 bar、open_time 遞增），只寫晚於最後一根的部分"""
+        ot = np.asarray(cols["open_time"], dtype="<i8")
+        if not len(ot):
+            return 0
+        with _FileLock(self._lock_path):
+            self._mapped_n = -1
+            last = self.last_open_time
+            keep = ot > last if last is not None else np.ones(len(ot), dtype=bool)
+            n = int(keep.sum())
+            if n == 0:
+                return 0
+            for c, dt, _ in _COLUMNS:
+                arr = np.asarray(cols[c], dtype=dt)[keep]
+                with open(self._path(c), "ab") as fh:
+                    fh.write(arr.tobytes())
+            self._mapped_n = -1
+        return n
+
+    def reset(self):
+        """清空（要補的區間早於庫內第一根時用；只增不改，無法往前插）"""
+        with _FileLock(self._lock_path):
+            for c, _, _ in _COLUMNS:
+                with open(self._path(c), "wb"):
+                    pass
+            try:
+                os.remove(os.path.join(self.dir, "meta.json"))
+            except OSError:
+                pass
+        self._maps = {}
+        self._mapped_n = -1
+
+    def top_up(self, start_ms: int = None, max_retries: int = 3, max_pages: int = None) -> int:
+        """
+        從 Binance 補到最新：startTime = 最後一根 + 1（空庫則用 start_ms）。
+        回傳寫入根數；網路錯誤在重試後拋出（呼叫端自行 fail-open）。
+        """
+        last = self.last_open_time
+        cursor = last + 1 if last is not None else _to_ms(start_ms)
+        if cursor is None:
+            raise ValueError("empty store needs start_ms")
+        added = 0
+        page = 0
+        self.forming = None
+        while True:
+            data = _get_klines(self.symbol, self.interval, cursor, max_retries)
+            page += 1
+            if not data:
+                break
+            added += self.append(data)
+            nxt = int(data[-1][0]) + 1
+            if len(data) < PAGE_LIMIT or nxt <= cursor:
+                break
+            if max_pages is not None and page >= max_pages:
+                break
+            cursor = nxt
+            time.sleep(0.25)  # 輕量限速，避免觸發 Binance rate limit
+        return added
+
+    # ── 讀取 ──
+
+    def index_range(self, start=None, end=None) -> tuple:
+        """[start, end] 時間區間（含兩端）對應的 (lo, hi) 位置，hi 為開區間"""
+        ot = self.column("open_time")
+        lo = 0 if start is None else int(np.searchsorted(ot, _to_ms(start), side="left"))
+        hi = len(ot) if end is None else int(np.searchsorted(ot, _to_ms(end), side="right"))
+        return lo, max(lo, hi)
+
+    def to_frame(self, start=None, end=None, tail: int = None, str_datetime: bool = False) -> pd.DataFrame:
+        """
+        取區間 / 最後 tail 根成 DataFrame（資料複製出來，不持有 memmap）。
+        str_datetime=True → datetime 為 'YYYY-MM-DD HH:MM:SS' 字串（同回測 CSV 讀進來的樣子）
+        """
+        lo, hi = self.index_range(start, end)
+        if tail is not None:
+            lo = max(lo, hi - tail)
+        a = self._arrays()
+        df = pd.DataFrame({c: np.array(a[c][lo:hi]) for c, _, _ in _COLUMNS[1:]})
+        dt = pd.to_datetime(np.array(a["open_time"][lo:hi]) + UTC8_MS, unit="ms")
+        df["datetime"] = dt.strftime("%Y-%m-%d %H:%M:%S") if str_datetime else dt
+        return df
+
+    def gaps(self) -> list:
+        """[(前一根 open_time, 下一根 open_time, 缺幾根), ...]"""
+        ot = self.column("open_time")
+        if len(ot) < 2:
+            return []
+        d = np.diff(ot)
+        pos = np.nonzero(d != self.step)[0]
+        return [(int(ot[i]), int(ot[i + 1]), int(d[i] // self.step) - 1) for i in pos]
+
+
+def _get_klines(symbol, interval, start_ms, max_retries=3, limit=PAGE_LIMIT):
+    last_err = None
+    for attempt in range(max_retries):
+        try:
+            resp = HTTP.get(FUTURES_KLINES_URL, params={
+                "symbol": symbol, "interval": interval,
+                "startTime": int(start_ms), "limit": limit,
+            }, timeout=20)
+            resp.raise_for_status()
+            return resp.json()
+        except Exception as e:
+            last_err = e
+            if attempt < max_retries - 1:
+                time.sleep(2 ** attempt)
+    raise ConnectionError(f"Failed to fetch {symbol} {interval} since {start_ms}: {last_err}")
+
+
+_stores = {}
+
+
+def open_store(symbol: str = "ETHUSDT", interval: str = "1h") -> KlineStore:
+    """進程內共用同一個 KlineStore 物件（memmap 重用）"""
+    key = (symbol, interval)
+    if key not in _stores:
+        _stores[key] = KlineStore(symbol, interval)
+    return _stores[key]
+
+
+def ensure_history(symbol: str, interval: str, days: int) -> KlineStore:
+    """確保庫內涵蓋最近 days 天並補到最新（並行分頁，見 kline_downloader）；要求的起點早於涵蓋起點 → 重建"""
+    import kline_downloader
+    return kline_downloader.download(symbol, interval, days)
+
+
+def main():
+    try:
+        sys.stdout.reconfigure(encoding="utf-8")
+    except (AttributeError, ValueError):
+        pass
+    ap = argparse.ArgumentParser(description="建立 / 補齊 K 線庫並檢查缺口")
+    ap.add_argument("symbols", nargs="*", default=["ETHUSDT", "BTCUSDT"])
+    ap.add_argument("--interval", default="1h")
+    ap.add_argument("--days", type=int, default=730)
+    args = ap.parse_args()
+    for sym in args.symbols:
+        t0 = time.time()
+        store = ensure_history(sym, args.interval, args.days)
+        gaps = store.gaps()
+        print(f"{sym} {args.interval}: {len(store)} 根，缺口 {len(gaps)} 處（{time.time() - t0:.1f}s）")
+        for a, b, n in gaps[:20]:
+            a_s = pd.to_datetime(a + UTC8_MS, unit="ms")
+            b_s = pd.to_datetime(b + UTC8_MS, unit="ms")
+            print(f"  {a_s} → {b_s}（缺 {n} 根）")
+
+
+if __name__ == "__main__":
+    main()
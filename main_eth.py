@@ -27,18 +27,27 @@ import paths  # 多實例路徑；必須最先 import（會優先載入 INSTANCE
 import strategy
 import signal_status
 import data_feed
+import bar_stream
+import cycle_prefetch
+import cycle_timing
+import exit_watcher
+import feed_publisher
+import telegram_poller
 import recorder
 import labels  # 中文(英文)詞彙對照
 from executor import Executor
-from telegram_notify import (send_telegram_message, get_pending_commands,
+from indicator_state import IndicatorState, compute_incremental
+from telegram_notify import (send_telegram_message, get_pending_commands, thread_send_seconds,
                              skip_old_updates, get_admin_ids, set_reply_target,
-                             wrap_private)
+                             wrap_private, start_outbox, flush_outbox)
 
 load_dotenv()
 
 PAPER_TRADING = os.getenv("PAPER_TRADING", "true").lower() == "true"
 SYMBOL = os.getenv("SYMBOL_ETH", "ETHUSDT")
 HEARTBEAT_INTERVAL = 1  # 每小時發一次心跳
+# Telegram 指令 getUpdates 長輪詢秒數；0 = 舊的每 10 秒短輪詢
+TG_LONG_POLL = int(os.getenv("TELEGRAM_LONG_POLL", "25"))
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOGS_DIR = paths.logs_dir()  # 多實例：INSTANCE_DIR/logs；未設則程式目錄/logs
@@ -120,12 +129,46 @@ def sleep_until_next_hour(offset_seconds=10):
         time.sleep(wait)
 
 
+def wait_for_bar_close(stream, last_bar_time, offset_seconds=10):
+    """
+    有 bar_stream：等下一根 x=true 收盤事件（整點後通常 < 1s）就回傳；
+    最晚等到整點 + offset_seconds（斷線 / 事件遺失 → 照原 REST 時程）。
+    沒有 stream → 與 sleep_until_next_hour 相同。
+
+    Returns:
+        收盤事件那根 bar 的 UTC+8 時間字串；REST fallback 時為 None
+    """
+    if stream is None:
+        sleep_until_next_hour(offset_seconds)
+        return None
+    k = bar_stream.wait_bar_close(stream, last_bar_time, offset_seconds)
+    if k is None:
+        return None
+    data_feed.ingest_closed_kline(SYMBOL, "1h", k)
+    return bar_stream.bar_time_str(k)
+
+
+def _start_bar_stream(logger):
+    """BAR_STREAM=1 時啟動收盤事件 WebSocket（背景執行緒）；未啟用回 None"""
+    if not bar_stream.enabled():
+        return None
+    try:
+        stream = bar_stream.BarCloseStream(SYMBOL, "1h").start()
+        logger.info(f"Bar-close WebSocket trigger enabled: {stream.url}")
+        return stream
+    except Exception as e:
+        logger.warning(f"Bar stream start failed ({e}), using hourly REST schedule")
+        return None
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # Bar 資料提取工具
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 def bar_to_dict(df_row) -> dict:
-    """把 DataFrame row 轉成 dict"""
+    """把 DataFrame row（或 strategy.BarFeatures）轉成 dict"""
+    if isinstance(df_row, strategy.BarFeatures):
+        return df_row.bar_dict()
     return {
         "datetime": df_row["datetime"],
         "open": float(df_row["open"]),
@@ -138,9 +181,14 @@ def bar_to_dict(df_row) -> dict:
 
 
 def indicators_to_dict(df_row) -> dict:
-    """從指標 DataFrame row 提取指標值"""
+    """從指標 DataFrame row（或 strategy.BarFeatures）提取指標值"""
     import numpy as np
 
+    if isinstance(df_row, strategy.BarFeatures):
+        ind = df_row.indicators()
+        ind["close_shift1"] = None
+        return ind
+
     def safe(val):
         if val is None:
             return None
@@ -187,8 +235,9 @@ def calc_eth_24h_change(df, idx) -> float:
     """計算 ETH 24h 漲跌幅"""
     if idx < 24:
         return None
-    close_now = float(df.iloc[idx]["close"])
-    close_24h = float(df.iloc[idx - 24]["close"])
+    closes = df["close"].to_numpy()
+    close_now = float(closes[idx])
+    close_24h = float(closes[idx - 24])
     if close_24h == 0:
         return None
     return (close_now - close_24h) / close_24h * 100
@@ -203,8 +252,10 @@ def _handle_cleanup(executor, cmd_logger):
     try:
         import binance_trade
         bn_positions = binance_trade.get_positions(SYMBOL)
-        internal_sides = set()
-        for p in executor.positions.values():
+        snap = executor.snapshot()
+        # 正在下單中的方向也算內部持倉（開倉剛成交、還沒寫進持倉的那幾秒不是孤兒）
+        internal_sides = set(snap.busy_sides)
+        for p in snap.positions.values():
             internal_sides.add("LONG" if p["side"] == "long" else "SHORT")
 
         orphans = [bp for bp in bn_positions
@@ -219,20 +270,26 @@ def _handle_cleanup(executor, cmd_logger):
             ps = bp["position_side"]
             size = bp["size"]
             close_side = "SELL" if ps == "LONG" else "BUY"
-            cmd_logger.info(f"Cleaning orphan: {ps} {size} ETH")
+            # 持該方向下單鎖：開倉不會在清理途中成交；拿到鎖後再確認一次內部仍無此方向
+            with executor.order_lock(ps):
+                if any(("LONG" if p["side"] == "long" else "SHORT") == ps
+                       for p in executor.snapshot().positions.values()):
+                    results.append(f"⏭ {ps} 已有內部持倉，略過")
+                    continue
+                cmd_logger.info(f"Cleaning orphan: {ps} {size} ETH")
 
-            # 先取消該方向所有訂單（包括 SL）
-            try:
-                binance_trade.cancel_all_orders(SYMBOL, position_side=ps)
-            except Exception:
-                pass
+                # 先取消該方向所有訂單（包括 SL）
+                try:
+                    binance_trade.cancel_all_orders(SYMBOL, position_side=ps)
+                except Exception:
+                    pass
 
-            # 市價平倉
-            result = binance_trade.place_order(
-                SYMBOL, close_side, qty=size, reduce_only=True,
-                strategy_id="cleanup",
-                position_side=ps,
-            )
+                # 市價平倉
+                result = binance_trade.place_order(
+                    SYMBOL, close_side, qty=size, reduce_only=True,
+                    strategy_id="cleanup",
+                    position_side=ps,
+                )
             if result is not None:
                 avg = float(result.get("avgPrice", 0))
                 results.append(f"✅ {ps} {size} ETH 已平倉 @ ${avg:.2f}")
@@ -252,14 +309,15 @@ def _handle_status(executor, cmd_logger):
     """回報內部狀態 vs Binance 實際倉位。"""
     try:
         import binance_trade
+        snap = executor.snapshot()  # 唯讀快照：開平倉下單中也不等
         bn_positions = binance_trade.get_positions(SYMBOL)
 
         lines = ["<b>📊 倉位同步狀態</b>\n"]
 
         # 內部持倉
-        if executor.positions:
+        if snap.positions:
             lines.append("<b>內部持倉：</b>")
-            for tid, p in executor.positions.items():
+            for tid, p in snap.positions.items():
                 ps = "LONG" if p["side"] == "long" else "SHORT"
                 lines.append(f"  {ps} {p.get('qty', 0):.4f} ETH @ ${p['entry_price']:.2f}")
         else:
@@ -280,7 +338,7 @@ def _handle_status(executor, cmd_logger):
 
         # 比對
         internal_sides = {("LONG" if p["side"] == "long" else "SHORT")
-                         for p in executor.positions.values()}
+                         for p in snap.positions.values()}
         bn_sides = {bp["position_side"] for bp in bn_positions if bp["size"] > 0}
         orphans = bn_sides - internal_sides
         ghosts = internal_sides - bn_sides
@@ -288,10 +346,12 @@ def _handle_status(executor, cmd_logger):
             lines.append(f"\n⚠️ 孤兒：{', '.join(orphans)}（/cleanup 可清理）")
         if ghosts:
             lines.append(f"\n⚠️ 幽靈：{', '.join(ghosts)}（內部有 Binance 無）")
-        if not orphans and not ghosts:
+        if snap.busy_sides:
+            lines.append(f"\n⏳ 下單處理中：{', '.join(sorted(snap.busy_sides))}")
+        elif not orphans and not ghosts:
             lines.append("\n✅ 內部與 Binance 同步正常")
 
-        lines.append(wrap_private(f"\n💰 餘額：${executor.account_balance:.2f}"))
+        lines.append(wrap_private(f"\n💰 餘額：${snap.account_balance:.2f}"))
         send_telegram_message("\n".join(lines))
     except Exception as e:
         cmd_logger.error(f"Status error: {e}")
@@ -302,13 +362,14 @@ def _handle_balance(executor, cmd_logger):
     """回報餘額 + 未實現損益。"""
     try:
         import binance_trade
+        snap = executor.snapshot()
         bn_positions = binance_trade.get_positions(SYMBOL)
         unrealized = sum(bp.get("unrealized_pnl", 0) for bp in bn_positions if bp["size"] > 0)
-        total = executor.account_balance + unrealized
+        total = snap.account_balance + unrealized
 
         lines = [
             "<b>💰 帳戶概覽</b>",
-            f"🏦 錢包餘額：${executor.account_balance:.2f}",
+            f"🏦 錢包餘額：${snap.account_balance:.2f}",
         ]
         if unrealized != 0:
             emoji = "📈" if unrealized > 0 else "📉"
@@ -316,7 +377,7 @@ def _handle_balance(executor, cmd_logger):
             lines.append(f"💎 淨值：${total:.2f}")
 
         # 保證金使用
-        active = sum(1 for _ in executor.positions)
+        active = len(snap.positions)
         margin_used = active * strategy.MARGIN
         lines.append(f"🔒 保證金佔用：${margin_used:.0f} / ${strategy.MARGIN * 2:.0f}")
 
@@ -329,9 +390,10 @@ def _handle_balance(executor, cmd_logger):
 def _handle_pnl(executor, cmd_logger):
     """回報今日 + 本月 PnL。"""
     try:
+        snap = executor.snapshot()
         # 今日（UTC+8，對齊 executor.daily_stats key）
         today_key = (datetime.utcnow() + timedelta(hours=8)).strftime("%Y-%m-%d")
-        today = executor.daily_stats.get(today_key, {})
+        today = snap.daily_stats.get(today_key, {})
         today_pnl = today.get("pnl", 0.0)
         today_trades = today.get("trades_closed", 0)
         today_wins = today.get("wins", 0)
@@ -339,38 +401,25 @@ def _handle_pnl(executor, cmd_logger):
         today_wr = (today_wins / today_trades * 100) if today_trades > 0 else 0
 
         # 本月
-        l_pnl = executor.monthly_pnl.get("L", 0.0)
-        s_pnl = executor.monthly_pnl.get("S", 0.0)
+        l_pnl = snap.monthly_pnl.get("L", 0.0)
+        s_pnl = snap.monthly_pnl.get("S", 0.0)
         month_total = l_pnl + s_pnl
-        l_entries = executor.monthly_entries.get("L", 0)
-        s_entries = executor.monthly_entries.get("S", 0)
+        l_entries = snap.monthly_entries.get("L", 0)
+        s_entries = snap.monthly_entries.get("S", 0)
 
         # 最近 7 天彙總
         # 注意：不能用 executor.daily_stats — flush_daily_summary() 每日 rollover
         # 會 pop 掉已結算的日期，記憶體中通常只剩「今天」，導致近 7 天恆為 $0。
-        # 改從持久化的 trades.csv 讀取，依 exit_time_utc8 過濾最近 7 天。
-        import csv as _csv
+        # 改從持久化的交易帳本讀取，依 exit_time_utc8 過濾最近 7 天（索引範圍查詢，不掃全部歷史）。
+        import trade_ledger
         week_pnl = 0.0
         week_trades = 0
         data_dir = paths.data_dir(PAPER_TRADING)  # 多實例：INSTANCE_DIR 下
-        trades_path = os.path.join(data_dir, "trades.csv")
-        cutoff = (datetime.utcnow() + timedelta(hours=8)) - timedelta(days=7)
-        if os.path.exists(trades_path):
-            with open(trades_path, "r", encoding="utf-8") as f:
-                for row in _csv.DictReader(f):
-                    if not row.get("exit_type"):
-                        continue  # 未平倉
-                    exit_t = row.get("exit_time_utc8", "")
-                    try:
-                        exit_dt = datetime.strptime(exit_t[:19], "%Y-%m-%d %H:%M:%S")
-                    except (ValueError, TypeError):
-                        try:
-                            exit_dt = datetime.strptime(exit_t[:10], "%Y-%m-%d")
-                        except (ValueError, TypeError):
-                            continue
-                    if exit_dt >= cutoff:
-                        week_pnl += float(row.get("net_pnl_usd", 0) or 0)
-                        week_trades += 1
+        for row in trade_ledger.rows(data_dir, closed=True, days=7):
+            if not row.get("exit_type"):
+                continue  # 未平倉
+            week_pnl += float(row.get("net_pnl_usd", 0) or 0)
+            week_trades += 1
 
         lines = [
             "<b>📊 損益報表</b>",
@@ -379,7 +428,7 @@ def _handle_pnl(executor, cmd_logger):
             f"  💵 PnL：${today_pnl:+.2f}",
             f"  📝 交易：{today_trades} 筆（{today_wins}W {today_losses}L，WR {today_wr:.0f}%）",
             "",
-            f"<b>本月</b>（{executor.monthly_key or 'N/A'}）",
+            f"<b>本月</b>（{snap.monthly_key or 'N/A'}）",
             f"  💵 合計：${month_total:+.2f}",
             f"  📈 L 做多：${l_pnl:+.2f}（{l_entries} 筆）",
             f"  📉 S 做空：${s_pnl:+.2f}（{s_entries} 筆）",
@@ -426,20 +475,32 @@ def _handle_signal(executor, cmd_logger):
     """即時開單條件檢查（L/S 每個 gate 的 ✅/❌ + 可開單時段）。"""
     try:
         import signal_status
-        eth_df, _btc_df = data_feed.fetch_eth_and_btc()
-        df = strategy.compute_indicators(eth_df)
+        snap = feed_publisher.read_snapshot() if feed_publisher.enabled() else None
+        if snap is not None and time.time() - snap.published_at < 3600:
+            df = snap.frame("eth")  # 發布端本小時已算好
+        else:
+            eth_df, _btc_df = data_feed.fetch_eth_and_btc()
+            df = strategy.compute_indicators(eth_df)
         idx = len(df) - 2  # 最新已收盤 bar，與主迴圈一致
+        snap = executor.snapshot()
         st = {
-            "bar_counter": executor.bar_counter,
-            "last_exits": executor.last_exits,
-            "monthly_pnl": executor.monthly_pnl,
-            "monthly_entries": executor.monthly_entries,
-            "positions": executor.positions,
-            "consec_losses": executor.consec_losses,
-            "consec_loss_cooldown_until": executor.consec_loss_cooldown_until,
-            "paused": executor.paused,
+            "bar_counter": snap.bar_counter,
+            "last_exits": snap.last_exits,
+            "monthly_pnl": snap.monthly_pnl,
+            "monthly_entries": snap.monthly_entries,
+            "positions": snap.positions,
+            "consec_losses": snap.consec_losses,
+            "consec_loss_cooldown_until": snap.consec_loss_cooldown_until,
+            "paused": snap.paused,
         }
-        msg = signal_status.build_signal_status(df, idx, st, html=True)
+        plan = None
+        try:
+            plan = strategy.trigger_plan(
+                strategy.next_bar_features(df), snap.positions, snap.last_exits,
+                snap.bar_counter + 1, snap.monthly_pnl, snap.monthly_entries)
+        except Exception as e:
+            cmd_logger.debug(f"Trigger plan failed: {e}")
+        msg = signal_status.build_signal_status(df, idx, st, html=True, plan=plan)
         send_telegram_message(msg)
     except Exception as e:
         cmd_logger.error(f"Signal error: {e}")
@@ -449,21 +510,14 @@ def _handle_signal(executor, cmd_logger):
 def _handle_trades(executor, cmd_logger):
     """回報最近 5 筆交易。"""
     try:
-        import csv
+        import trade_ledger
         data_dir = paths.data_dir(PAPER_TRADING)  # 多實例：INSTANCE_DIR 下
-        trades_path = os.path.join(data_dir, "trades.csv")
-        if not os.path.exists(trades_path):
+        if not trade_ledger.exists(data_dir):
             send_telegram_message("📭 尚無交易記錄")
             return
 
-        # 讀取最後 5 筆已平倉交易
-        rows = []
-        with open(trades_path, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("exit_type"):  # 已平倉
-                    rows.append(row)
-        recent = rows[-5:]
+        # 讀取最後 5 筆已平倉交易（rowid 倒序 LIMIT，不讀全部歷史）
+        recent = [r for r in trade_ledger.rows(data_dir, closed=True, last=5) if r.get("exit_type")]
 
         if not recent:
             send_telegram_message("📭 尚無已平倉交易")
@@ -491,17 +545,18 @@ def _handle_trades(executor, cmd_logger):
 def _handle_circuit_breaker(executor, cmd_logger):
     """回報風控熔斷狀態。"""
     try:
-        l_pnl = executor.monthly_pnl.get("L", 0.0)
-        s_pnl = executor.monthly_pnl.get("S", 0.0)
-        l_entries = executor.monthly_entries.get("L", 0)
-        s_entries = executor.monthly_entries.get("S", 0)
+        snap = executor.snapshot()
+        l_pnl = snap.monthly_pnl.get("L", 0.0)
+        s_pnl = snap.monthly_pnl.get("S", 0.0)
+        l_entries = snap.monthly_entries.get("L", 0)
+        s_entries = snap.monthly_entries.get("S", 0)
 
         lines = [
             "<b>🛡 風控熔斷狀態</b>",
             "━━━━━━━━━━━━━━━",
             f"<b>日虧限額</b>",
-            f"  今日 PnL：${executor.daily_pnl:+.2f} / ${strategy.DAILY_LOSS_LIMIT}",
-            f"  {'🔴 已觸發！' if executor.daily_pnl <= strategy.DAILY_LOSS_LIMIT else '🟢 正常'}",
+            f"  今日 PnL：${snap.daily_pnl:+.2f} / ${strategy.DAILY_LOSS_LIMIT}",
+            f"  {'🔴 已觸發！' if snap.daily_pnl <= strategy.DAILY_LOSS_LIMIT else '🟢 正常'}",
             "",
             f"<b>月虧限額</b>",
             f"  L：${l_pnl:+.2f} / ${strategy.L_MONTHLY_LOSS_CAP}",
@@ -514,20 +569,20 @@ def _handle_circuit_breaker(executor, cmd_logger):
             f"  S：{s_entries} / {strategy.S_MONTHLY_ENTRY_CAP}",
             "",
             f"<b>連虧</b>",
-            f"  連虧筆數：{executor.consec_losses} / {strategy.CONSEC_LOSS_PAUSE}",
+            f"  連虧筆數：{snap.consec_losses} / {strategy.CONSEC_LOSS_PAUSE}",
         ]
 
-        if executor.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
-            remaining = executor.consec_loss_cooldown_until - executor.bar_counter
+        if snap.consec_losses >= strategy.CONSEC_LOSS_PAUSE:
+            remaining = snap.consec_loss_cooldown_until - snap.bar_counter
             if remaining > 0:
                 lines.append(f"  🔴 冷卻中，剩餘 {remaining} bar")
             else:
                 lines.append("  🟢 冷卻已結束")
 
         # V29 策略健康度（Edge 衰退警報）
-        eh_pct = executor.edge_health_pct()
-        eh_emoji = {"green": "💚", "yellow": "💛", "red": "🔴"}.get(executor.edge_level, "💚")
-        eh_s = executor.edge_cusum if executor.edge_cusum is not None else 0.0
+        eh_pct = snap.edge_health_pct()
+        eh_emoji = {"green": "💚", "yellow": "💛", "red": "🔴"}.get(snap.edge_level, "💚")
+        eh_s = snap.edge_cusum if snap.edge_cusum is not None else 0.0
         lines += [
             "",
             f"<b>策略健康度（Edge 警報）</b>",
@@ -536,7 +591,7 @@ def _handle_circuit_breaker(executor, cmd_logger):
         ]
 
         # 暫停狀態
-        if getattr(executor, "paused", False):
+        if snap.paused:
             lines.append("\n⏸ <b>手動暫停中</b>（/resume 恢復）")
 
         send_telegram_message("\n".join(lines))
@@ -547,7 +602,8 @@ def _handle_circuit_breaker(executor, cmd_logger):
 
 def _handle_pause(executor, cmd_logger):
     """暫停開新倉（持倉出場不受影響）。"""
-    executor.paused = True
+    with executor._lock:
+        executor.paused = True
     executor.save_state()
     cmd_logger.info("Trading PAUSED by Telegram command")
     send_telegram_message(
@@ -561,7 +617,8 @@ def _handle_pause(executor, cmd_logger):
 
 def _handle_resume(executor, cmd_logger):
     """恢復交易。"""
-    executor.paused = False
+    with executor._lock:
+        executor.paused = False
     executor.save_state()
     cmd_logger.info("Trading RESUMED by Telegram command")
     send_telegram_message(
@@ -613,6 +670,20 @@ def _handle_alerts(cmd_logger):
     send_telegram_message("\n".join(lines))
 
 
+def _handle_perf(cmd_logger, cmd: str = ""):
+    """最近 N 根 cycle 的各階段 p50 / p95 / max（/perf 72 = 最近 72 根，預設 168）。"""
+    parts = cmd.split()
+    n = 168
+    if len(parts) > 1 and parts[1].isdigit():
+        n = max(1, min(int(parts[1]), cycle_timing.MAX_ROWS))
+    try:
+        df = cycle_timing.load(n)
+        send_telegram_message(cycle_timing.format_perf(cycle_timing.summarize(df), len(df)))
+    except Exception as e:
+        cmd_logger.error(f"Perf read error: {e}")
+        send_telegram_message(f"❌ 讀取失敗：{str(e)[:200]}")
+
+
 def _handle_help():
     """回傳可用指令列表。"""
     send_telegram_message(
@@ -628,6 +699,7 @@ def _handle_help():
         "/trades — 最近 5 筆交易\n"
         "/alerts — 今日告警日誌（別名 /warn）\n"
         "/cb — 風控熔斷狀態 + 策略健康度\n"
+        "/perf — 每小時 cycle 各階段耗時 p50 / p95 / max（/perf 72 = 最近 72 根）\n"
         "/help — 顯示此說明\n"
         "\n<b>控制（管理員限定）</b>\n"
         "/pause — 暫停開新倉\n"
@@ -636,6 +708,47 @@ def _handle_help():
     )
 
 
+PLAN_LEAD = 60  # 收盤前幾秒算下一根的觸價計畫
+
+
+def _plan_features(ind_state, last_df):
+    """下一根 bar 收盤前可定案的特徵：增量指標狀態優先（O(1)），否則用上一輪的 K 線重算。"""
+    if ind_state.warmed_up():
+        nxt = ind_state.peek_next()
+        if nxt is not None:
+            return strategy.BarFeatures.from_mapping(nxt)
+    if last_df is not None:
+        return strategy.next_bar_features(last_df)
+    return None
+
+
+def _schedule_plan(executor, ind_state, plan_box, logger):
+    """收盤前 PLAN_LEAD 秒（背景計時器）算好下一根的觸價計畫，存進 plan_box；同一整點只排一次。"""
+    deadline = bar_stream.hour_deadline(0)
+    if plan_box.get("scheduled_for") == deadline:
+        return
+
+    def _run():
+        try:
+            f = _plan_features(ind_state, plan_box.get("df"))
+            if f is None:
+                return
+            snap = executor.snapshot()
+            plan = strategy.trigger_plan(
+                f, snap.positions, snap.last_exits, snap.bar_counter + 1,
+                snap.monthly_pnl, snap.monthly_entries)
+            plan_box["features"] = f
+            plan_box["plan"] = plan
+            logger.info(f"Trigger plan {plan['bar_time']}: {signal_status.plan_summary(plan)}")
+        except Exception as e:
+            logger.warning(f"Trigger plan failed: {e}")
+
+    t = threading.Timer(max(0.0, deadline - PLAN_LEAD - time.time()), _run)
+    t.daemon = True
+    t.start()
+    plan_box["scheduled_for"] = deadline
+
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 主循環
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -653,11 +766,21 @@ def main():
     logger.info(f"  Symbol: {SYMBOL} | Notional: ${strategy.NOTIONAL} | Fee: ${strategy.FEE}")
     logger.info(f"=" * 60)
 
+    # Telegram 非阻塞寄件匣：之後的通知只入佇列，背景送（含上次關機沒送完的）
+    if start_outbox() is not None:
+        logger.info("Telegram outbox started")
+
     # 初始化 Executor
     executor = Executor()
     logger.info(f"Executor loaded: {len(executor.positions)} positions, "
                 f"balance=${executor.account_balance:.2f}")
 
+    # 增量指標狀態：重啟後從狀態檔續算（免 310 bar 暖機），缺 bar 則自動用整段 K 線重建
+    ind_state_path = paths.indicator_state_file(PAPER_TRADING)
+    ind_state = IndicatorState.load(ind_state_path)
+    if ind_state.last_dt is not None:
+        logger.info(f"Indicator state resumed: last bar {ind_state.last_dt} ({ind_state.bars} bars)")
+
     # 設定槓桿 + 確認 Hedge Mode（Paper=testnet, Live=production）
     try:
         import binance_trade
@@ -713,18 +836,41 @@ def main():
     send_telegram_message(startup_msg)
 
     # ── Telegram 指令監聽（背景執行緒）──
-    skip_old_updates()  # 跳過啟動前的舊訊息
+    shared_inbox = telegram_poller.enabled()
+    if shared_inbox:
+        telegram_poller.clear_inbox()  # 共用接收端模式：清掉啟動前的舊指令
+    if not (shared_inbox and telegram_poller.poller_alive()):
+        skip_old_updates()  # 跳過啟動前的舊訊息（接收端在收時不去搶 getUpdates，免得打斷它的長輪詢）
+
+    def _next_commands():
+        """取下一批指令：共用接收端收件匣（接收端心跳過期就退回自己收）/ 長輪詢 / 短輪詢"""
+        if shared_inbox and telegram_poller.poller_alive():
+            commands = telegram_poller.read_inbox()
+            if not commands:
+                time.sleep(telegram_poller.INBOX_POLL)
+            return commands
+        if TG_LONG_POLL <= 0:
+            commands = get_pending_commands()
+            if not commands:
+                time.sleep(10)
+            return commands
+        t0 = time.time()
+        commands = get_pending_commands(timeout=TG_LONG_POLL)
+        # 長輪詢空手秒回 = 出錯（網路 / 409）→ 稍等，避免空轉狂打 API
+        if not commands and time.time() - t0 < 1.0:
+            time.sleep(5)
+        return commands
 
     def telegram_command_listener():
-        """每 10 秒輪詢 Telegram 指令。
+        """接收 Telegram 指令（長輪詢，有訊息立刻處理）。
 
-        所有 dispatch 都持 executor._lock，避免與主迴圈並發寫
-        positions / paused / daily_stats（包含 save_state 的 json.dump）。
+        查詢類指令讀 executor.snapshot()（唯讀快照，不拿鎖）：主循環下單卡在交易所時也立刻回覆；
+        /pause /resume 只在改旗標時短暫持 executor._lock，/cleanup 下單前持該方向的下單鎖。
         """
         cmd_logger = logging.getLogger("telegram_cmd")
         while True:
             try:
-                commands = get_pending_commands()
+                commands = _next_commands()
                 for cmd, from_id, origin_chat in commands:
                     # 取第一個字（忽略參數）並剝掉群組的 @bot名 後綴（/status@MyBot → /status）
                     cmd_lower = cmd.lower().split()[0].split("@")[0]
@@ -745,46 +891,52 @@ def main():
                     # 回覆導向：處理期間本執行緒發的訊息只回原聊天室（不打擾其他群組）
                     set_reply_target(origin_chat)
                     try:
-                        with executor._lock:
-                            if cmd_lower in ("/cleanup", "/clean"):
-                                _handle_cleanup(executor, cmd_logger)
-                            elif cmd_lower in ("/status", "/pos"):
-                                _handle_status(executor, cmd_logger)
-                            elif cmd_lower in ("/bal", "/balance"):
-                                # 餘額屬敏感資訊：群組裡不顯示，導向私聊
-                                if str(origin_chat).startswith("-"):
-                                    send_telegram_message("🔒 餘額資訊僅私聊顯示，請私訊 bot 使用 /bal")
-                                else:
-                                    _handle_balance(executor, cmd_logger)
-                            elif cmd_lower == "/pnl":
-                                _handle_pnl(executor, cmd_logger)
-                            elif cmd_lower in ("/analysis", "/stats", "/report"):
-                                _handle_analysis(executor, cmd_logger, cmd)
-                            elif cmd_lower in ("/signal", "/cond", "/check"):
-                                _handle_signal(executor, cmd_logger)
-                            elif cmd_lower == "/trades":
-                                _handle_trades(executor, cmd_logger)
-                            elif cmd_lower in ("/alerts", "/warn"):
-                                _handle_alerts(cmd_logger)
-                            elif cmd_lower == "/cb":
-                                _handle_circuit_breaker(executor, cmd_logger)
-                            elif cmd_lower == "/pause":
-                                _handle_pause(executor, cmd_logger)
-                            elif cmd_lower == "/resume":
-                                _handle_resume(executor, cmd_logger)
-                            elif cmd_lower == "/help":
-                                _handle_help()
+                        if cmd_lower in ("/cleanup", "/clean"):
+                            _handle_cleanup(executor, cmd_logger)
+                        elif cmd_lower in ("/status", "/pos"):
+                            _handle_status(executor, cmd_logger)
+                        elif cmd_lower in ("/bal", "/balance"):
+                            # 餘額屬敏感資訊：群組裡不顯示，導向私聊
+                            if str(origin_chat).startswith("-"):
+                                send_telegram_message("🔒 餘額資訊僅私聊顯示，請私訊 bot 使用 /bal")
                             else:
-                                send_telegram_message(f"❓ 未知指令：{cmd}\n輸入 /help 查看可用指令")
+                                _handle_balance(executor, cmd_logger)
+                        elif cmd_lower == "/pnl":
+                            _handle_pnl(executor, cmd_logger)
+                        elif cmd_lower in ("/analysis", "/stats", "/report"):
+                            _handle_analysis(executor, cmd_logger, cmd)
+                        elif cmd_lower in ("/signal", "/cond", "/check"):
+                            _handle_signal(executor, cmd_logger)
+                        elif cmd_lower == "/trades":
+                            _handle_trades(executor, cmd_logger)
+                        elif cmd_lower in ("/alerts", "/warn"):
+                            _handle_alerts(cmd_logger)
+                        elif cmd_lower == "/cb":
+                            _handle_circuit_breaker(executor, cmd_logger)
+                        elif cmd_lower == "/perf":
+                            _handle_perf(cmd_logger, cmd)
+                        elif cmd_lower == "/pause":
+                            _handle_pause(executor, cmd_logger)
+                        elif cmd_lower == "/resume":
+                            _handle_resume(executor, cmd_logger)
+                        elif cmd_lower == "/help":
+                            _handle_help()
+                        else:
+                            send_telegram_message(f"❓ 未知指令：{cmd}\n輸入 /help 查看可用指令")
                     finally:
                         set_reply_target(None)
             except Exception as e:
                 cmd_logger.debug(f"Command listener error: {e}")
-            time.sleep(10)
+                time.sleep(5)
 
     cmd_thread = threading.Thread(target=telegram_command_listener, daemon=True)
     cmd_thread.start()
-    logger.info("Telegram command listener started (10s polling)")
+    if shared_inbox:
+        logger.info("Telegram command listener started (shared poller inbox)")
+    elif TG_LONG_POLL > 0:
+        logger.info(f"Telegram command listener started (long polling {TG_LONG_POLL}s)")
+    else:
+        logger.info("Telegram command listener started (10s polling)")
 
     last_heartbeat_bar = executor.bar_counter
     # last_daily_date 從 state 載入（持久化），而非每次啟動重置為 None。
@@ -793,47 +945,105 @@ def main():
     # - 小於 today：跨午夜重啟漏 flush，主迴圈會自動補 flush
     last_daily_date = executor.last_daily_date
 
+    # 多實例共用行情（FEED_MODE=subscribe）：等發布端快照，不自己抓 / 算
+    feed_sub = feed_publisher.enabled()
+    if feed_sub:
+        logger.info(f"Feed subscriber: {feed_publisher.snapshot_path()} "
+                    f"(fallback to own fetch after +{feed_publisher.FEED_WAIT:.0f}s)")
+    # 收盤事件觸發（選用，BAR_STREAM=1）：沒啟用 / 斷線時照原本整點 +10s REST 時程
+    stream = None if feed_sub else _start_bar_stream(logger)
+    # 盤中觸價出場（選用，EXIT_WATCH=1）：TP / SafeNet / BE 秒級平倉，同一條 close_position 路徑
+    def _log_watcher_exit(result, pos, reason, price):
+        sig_logger.info(f"EXIT {pos.get('sub_strategy', 'L')} {pos['side'].upper()} | "
+                        f"{reason} (intra-hour) @ ${price:.2f} | PnL ${result['pnl_usd']:.2f}")
+
+    watcher = exit_watcher.start(executor, SYMBOL, logger, on_exit=_log_watcher_exit)
+    # 下一根的觸價計畫（收盤前一分鐘算好；/signal 另外即時算）
+    plan_box = {}
+
     # ── 主循環 ──
     while True:
         try:
-            sleep_until_next_hour(offset_seconds=10)
+            # 收盤前幾秒暖連線（CYCLE_PREFETCH=1，預設開）
+            cycle_prefetch.schedule_warmup(bar_stream.hour_deadline(0), SYMBOL, market=not feed_sub)
+            _schedule_plan(executor, ind_state, plan_box, logger)
+            snap = None
+            if feed_sub:
+                hour = bar_stream.hour_deadline(0)
+                snap = feed_publisher.wait_snapshot(
+                    executor.last_bar_time, hour + feed_publisher.FEED_WAIT, not_before=hour)
+                if snap is None:
+                    logger.warning("No feed snapshot in time, fetching klines directly")
+                event_bar = None
+            else:
+                event_bar = wait_for_bar_close(stream, executor.last_bar_time, offset_seconds=10)
 
             cycle_start = time.time()
+            clock = cycle_prefetch.CycleClock()
+            clock.mark("wake")
+            tg_start = thread_send_seconds()
             t_utc8 = now_utc8()
             logger.info(f"── Cycle {executor.bar_counter + 1} | {t_utc8.strftime('%Y-%m-%d %H:%M')} UTC+8 ──")
 
-            # ── 1. 取資料 ──
-            eth_df, btc_df = data_feed.fetch_eth_and_btc()
-            df = strategy.compute_indicators(eth_df)
-            idx = len(df) - 2  # 最新已收盤 bar
+            # ── 0. 並行預取（K 線 / 餘額 / 持倉同時發；失敗的項目下面照原本序列重抓）──
+            pf = (cycle_prefetch.cycle_reads(SYMBOL, market=snap is None)
+                  if cycle_prefetch.ENABLED else None)
+            if pf is not None:
+                clock.add("fetch", max(pf.timings.get("eth", 0.0), pf.timings.get("btc", 0.0)))
 
-            bar_time = df.iloc[idx]["datetime"]
+            # ── 1. 取資料 ──
+            for attempt in range(5):
+                if snap is not None:
+                    # 發布端已抓好 + 算好（與自己算結果相同），直接用
+                    df = snap.frame("eth")
+                    btc_df = snap.frame("btc")
+                    idx = len(df) - 2
+                    feat = strategy.BarFeatures.from_frame(df, idx)
+                    break
+                if attempt == 0 and pf is not None and pf.ok("eth") and pf.ok("btc"):
+                    eth_df, btc_df = pf.get("eth"), pf.get("btc")
+                else:
+                    with clock.span("fetch"):
+                        eth_df, btc_df = data_feed.fetch_eth_and_btc()
+                with clock.span("indicators"):
+                    df = compute_incremental(ind_state, eth_df, logger)
+                idx = len(df) - 2  # 最新已收盤 bar
+                # 本 bar 的價格 + 指標只取一次，後面訊號 / 紀錄 / 通知共用
+                feat = strategy.BarFeatures.from_frame(df, idx)
+                # 收盤事件比 REST 快：REST 還沒出現新的未收盤 bar 時稍等重抓
+                if event_bar is None or str(feat.datetime) >= event_bar:
+                    break
+                logger.info(f"REST not caught up with {event_bar} (got {feat.datetime}), retry")
+                time.sleep(1)
+                data_feed.invalidate_cache()
+
+            clock.mark("data")
+            plan_box["df"] = df  # 下一根計畫的備援來源（增量指標狀態未暖機時）
+            bar_time = feat.datetime
             bar_time_str = str(bar_time)
 
-            # 防止重複處理同一根 bar
-            if executor.last_bar_time == bar_time_str:
+            # 遞增 bar counter（同一根 bar 已處理過 → 跳過）
+            if not executor.advance_bar(bar_time_str):
                 logger.warning(f"Duplicate bar: {bar_time_str}, skipping")
                 continue
 
-            # 遞增 bar counter
-            executor.bar_counter += 1
-            executor.last_bar_time = bar_time_str
-
-            bar_data = bar_to_dict(df.iloc[idx])
-            ind = indicators_to_dict(df.iloc[idx])
+            bar_data = bar_to_dict(feat)
+            ind = indicators_to_dict(feat)
             btc_context = data_feed.get_btc_context(btc_df)
 
             gk_str = f"{ind['gk_pctile']:.1f}" if ind['gk_pctile'] is not None else "NaN"
             logger.info(f"Bar: {bar_time_str} | C={bar_data['close']:.2f} | GK={gk_str}")
 
             # ── 2. 同步幣安餘額 + 更新風控熔斷 ──
-            executor._sync_balance()
+            executor._sync_balance(pf.get("balance") if pf is not None else None)
             executor.update_period_keys(t_utc8)
 
             # ── 2.5 每小時倉位同步巡檢 ──
             try:
-                import binance_trade as _bt
-                bn_pos = _bt.get_positions(SYMBOL)
+                bn_pos = pf.get("positions") if pf is not None else None
+                if bn_pos is None:
+                    import binance_trade as _bt
+                    bn_pos = _bt.get_positions(SYMBOL)
                 # 建立內部狀態的方向集合
                 internal_sides = {}
                 for p in executor.positions.values():
@@ -869,10 +1079,14 @@ def main():
                         )
             except Exception as e:
                 logger.warning(f"Position sync check failed: {e}")
+            clock.mark("sync")
 
             # ── 3. 檢查持倉出場 ──
-            exits_this_bar = []
-            ema20 = float(df.iloc[idx]["ema20"])
+            # 這裡只決定要平哪些倉（exit_orders），與本 bar 進場一起在 4.5 送單。
+            # 不持 executor._lock：close_position 內持該方向下單鎖並重新確認持倉仍在，
+            # 盤中出場監看（exit_watcher）先平掉的倉位送單時會拿到 None，不會重複平
+            exit_orders = []
+            ema20 = feat.ema20
             for pos in list(executor.get_open_positions()):
                 trade_id = pos["trade_id"]
                 side = pos["side"]
@@ -891,26 +1105,11 @@ def main():
                 if pos.get("pending_exit"):
                     pending_reason = pos["pending_exit"]
                     logger.warning(f"Retrying pending close for {trade_id} (reason: {pending_reason})")
-                    result = executor.close_position(
-                        trade_id=trade_id,
-                        exit_price=bar_data["close"],  # 重試用本根收盤價
-                        exit_reason=pending_reason,
-                        bar_counter=executor.bar_counter,
-                        bar_data=bar_data,
-                        btc_context=btc_context,
-                    )
-                    if result:
-                        executor.record_close(
-                            result["pnl_usd"],
-                            result["exit_reason"],
-                            result["bars_held"],
-                            commission=result.get("commission", 0.0),
-                        )
-                        exits_this_bar.append(result)
-                        sig_logger.info(
-                            f"EXIT {sub} {side.upper()} | {pending_reason} (retry) "
-                            f"@ ${bar_data['close']:.2f} | PnL ${result['pnl_usd']:.2f}"
-                        )
+                    exit_orders.append({
+                        "trade_id": trade_id, "sub": sub, "side": side,
+                        "exit_price": bar_data["close"],  # 重試用本根收盤價
+                        "reason": pending_reason, "retry": True,
+                    })
                     # 無論重試成功與否，本 bar 這筆倉位就不再跑策略出場檢查
                     continue
 
@@ -933,8 +1132,9 @@ def main():
                         entry_regime=pos.get("entry_regime", "NA"),
                     )
                     # V14: 更新 running_mfe 和 mh_reduced 到持倉狀態
-                    executor.positions[trade_id]["running_mfe"] = exit_result.get("running_mfe", 0.0)
-                    executor.positions[trade_id]["mh_reduced"] = exit_result.get("mh_reduced", False)
+                    with executor._lock:
+                        pos["running_mfe"] = exit_result.get("running_mfe", 0.0)
+                        pos["mh_reduced"] = exit_result.get("mh_reduced", False)
                 else:  # S
                     exit_result = strategy.check_exit_short(
                         entry_price=pos["entry_price"],
@@ -950,8 +1150,9 @@ def main():
 
                 # V14: 處理延長期啟動
                 if exit_result.get("start_extension") and not ext_active:
-                    executor.positions[trade_id]["extension_active"] = True
-                    executor.positions[trade_id]["extension_start_bar"] = executor.bar_counter
+                    with executor._lock:
+                        pos["extension_active"] = True
+                        pos["extension_start_bar"] = executor.bar_counter
                     logger.info(f"Extension started for {trade_id} ({sub})")
                     ext_price = pos["entry_price"]
                     if sub == "L":
@@ -978,32 +1179,32 @@ def main():
                 )
 
                 if exit_result["exit"]:
-                    result = executor.close_position(
-                        trade_id=trade_id,
-                        exit_price=exit_result["exit_price"],
-                        exit_reason=exit_result["reason"],
-                        bar_counter=executor.bar_counter,
-                        bar_data=bar_data,
-                        btc_context=btc_context,
-                    )
-                    if result:
-                        executor.record_close(
-                            result["pnl_usd"],
-                            result["exit_reason"],
-                            result["bars_held"],
-                            commission=result.get("commission", 0.0),
-                        )
-                        exits_this_bar.append(result)
-                        sig_logger.info(
-                            f"EXIT {sub} {side.upper()} | {exit_result['reason']} "
-                            f"@ ${exit_result['exit_price']:.2f} | "
-                            f"PnL ${result['pnl_usd']:.2f}"
-                        )
+                    exit_orders.append({
+                        "trade_id": trade_id, "sub": sub, "side": side,
+                        "exit_price": exit_result["exit_price"],
+                        "reason": exit_result["reason"], "retry": False,
+                    })
+
+            clock.mark("exits")
 
             # ── 4. 評估進場信號 ──
+            # 出場還沒送單：同方向剛出場的本來就被持倉上限 / 出場冷卻擋下，兩邊只透過熔斷互相影響，
+            # 所以熔斷改用「本 bar 出場以策略價成交」的估計損益先記帳再判斷（projected）
             bar_data_for_entry = dict(bar_data)
             bar_data_for_entry["eth_24h_change_pct"] = calc_eth_24h_change(df, idx)
             any_signal = False
+            entry_orders = []
+            projected = [(o["sub"], executor.project_exit_pnl(o["trade_id"], o["exit_price"]))
+                         for o in exit_orders]
+
+            # 觸價計畫（收盤前算好、/signal 顯示用）：進場一律由 evaluate_long / evaluate_short 決定，
+            # 計畫只拿來對照，兩邊結論不一致就記 WARNING（計畫偏差不會擋掉或多送任何進場）
+            plan = None
+            pre = plan_box.get("features")
+            if pre is not None and str(pre.datetime) == bar_time_str:
+                plan = strategy.trigger_plan(
+                    pre, executor.positions, executor.last_exits, executor.bar_counter,
+                    executor.monthly_pnl, executor.monthly_entries)
 
             # 暫停檢查（/pause 指令）
             trading_paused = getattr(executor, "paused", False)
@@ -1011,19 +1212,22 @@ def main():
                 logger.info("Trading PAUSED — skipping entry signals")
 
             # L 信號
-            l_cb_ok, l_cb_reason = executor.check_circuit_breaker("L")
+            l_cb_ok, l_cb_reason = executor.check_circuit_breaker("L", projected)
             long_sig = None
             if trading_paused:
                 pass
             elif l_cb_ok:
-                long_sig = strategy.evaluate_long_signal(
-                    df=df, idx=idx,
+                long_sig = strategy.evaluate_long(
+                    feat,
                     open_positions=executor.positions,
                     last_exits=executor.last_exits,
                     bar_counter=executor.bar_counter,
                     monthly_pnl_l=executor.monthly_pnl.get("L", 0.0),
                     monthly_entries_l=executor.monthly_entries.get("L", 0),
                 )
+                if plan is not None and strategy.plan_fires(plan, "L", feat.close) != bool(long_sig):
+                    logger.warning(f"Trigger plan disagrees with evaluate_long "
+                                   f"(signal={bool(long_sig)}): {plan['L']}")
             elif l_cb_reason:
                 logger.debug(f"L blocked by circuit breaker: {l_cb_reason}")
 
@@ -1031,37 +1235,25 @@ def main():
                 any_signal = True
                 executor.record_signal(fired=True)
                 sig_logger.info(f"SIGNAL BUY L | {long_sig['reason']} | GK={ind.get('gk_pctile')}")
-                try:
-                    fill_price = bar_data["close"]
-                    trade_id = executor.open_position(
-                        side="long",
-                        sub_strategy="L",
-                        entry_price=fill_price,
-                        bar_counter=executor.bar_counter,
-                        signal_indicators=long_sig["indicators"],
-                        bar_data=bar_data_for_entry,
-                        btc_context=btc_context,
-                    )
-                    if trade_id:
-                        executor.record_open()
-                        sig_logger.info(f"ENTRY LONG L @ ${fill_price:.2f} | {trade_id}")
-                except Exception as e:
-                    logger.error(f"L entry failed: {e}")
+                entry_orders.append({"side": "long", "sub": "L", "indicators": long_sig["indicators"]})
 
             # S 信號
-            s_cb_ok, s_cb_reason = executor.check_circuit_breaker("S")
+            s_cb_ok, s_cb_reason = executor.check_circuit_breaker("S", projected)
             short_sig = None
             if trading_paused:
                 pass
             elif s_cb_ok:
-                short_sig = strategy.evaluate_short_signal(
-                    df=df, idx=idx,
+                short_sig = strategy.evaluate_short(
+                    feat,
                     open_positions=executor.positions,
                     last_exits=executor.last_exits,
                     bar_counter=executor.bar_counter,
                     monthly_pnl_s=executor.monthly_pnl.get("S", 0.0),
                     monthly_entries_s=executor.monthly_entries.get("S", 0),
                 )
+                if plan is not None and strategy.plan_fires(plan, "S", feat.close) != bool(short_sig):
+                    logger.warning(f"Trigger plan disagrees with evaluate_short "
+                                   f"(signal={bool(short_sig)}): {plan['S']}")
             elif s_cb_reason:
                 logger.debug(f"S blocked by circuit breaker: {s_cb_reason}")
 
@@ -1069,27 +1261,61 @@ def main():
                 any_signal = True
                 executor.record_signal(fired=True)
                 sig_logger.info(f"SIGNAL SELL S | {short_sig['reason']} | GK_S={ind.get('gk_pctile_s')}")
-                try:
-                    fill_price = bar_data["close"]
-                    trade_id = executor.open_position(
-                        side="short",
-                        sub_strategy="S",
-                        entry_price=fill_price,
-                        bar_counter=executor.bar_counter,
-                        signal_indicators=short_sig["indicators"],
-                        bar_data=bar_data_for_entry,
-                        btc_context=btc_context,
-                    )
-                    if trade_id:
-                        executor.record_open()
-                        sig_logger.info(f"ENTRY SHORT S @ ${fill_price:.2f} | {trade_id}")
-                except Exception as e:
-                    logger.error(f"S entry failed: {e}")
+                entry_orders.append({"side": "short", "sub": "S", "indicators": short_sig["indicators"]})
 
             if not any_signal:
                 executor.record_signal(fired=False)
                 logger.debug("HOLD: no L or S signals")
 
+            # ── 4.5 送單：本 bar 的出場 + 進場（Live 合併成一支 batchOrders，各腿相隔毫秒級）──
+            fill_price = bar_data["close"]
+            actions = [
+                (lambda o=o: executor.close_position(
+                    trade_id=o["trade_id"],
+                    exit_price=o["exit_price"],
+                    exit_reason=o["reason"],
+                    bar_counter=executor.bar_counter,
+                    bar_data=bar_data,
+                    btc_context=btc_context,
+                ))
+                for o in exit_orders
+            ] + [
+                (lambda e=e: executor.open_position(
+                    side=e["side"],
+                    sub_strategy=e["sub"],
+                    entry_price=fill_price,
+                    bar_counter=executor.bar_counter,
+                    signal_indicators=e["indicators"],
+                    bar_data=bar_data_for_entry,
+                    btc_context=btc_context,
+                ))
+                for e in entry_orders
+            ]
+            outcomes = executor.run_orders(actions) if actions else []
+
+            for o, result in zip(exit_orders, outcomes):
+                if isinstance(result, Exception):
+                    logger.error(f"{o['sub']} exit failed: {result}")
+                elif result:
+                    executor.record_close(
+                        result["pnl_usd"],
+                        result["exit_reason"],
+                        result["bars_held"],
+                        commission=result.get("commission", 0.0),
+                    )
+                    sig_logger.info(
+                        f"EXIT {o['sub']} {o['side'].upper()} | {o['reason']}"
+                        f"{' (retry)' if o['retry'] else ''} "
+                        f"@ ${o['exit_price']:.2f} | PnL ${result['pnl_usd']:.2f}"
+                    )
+            for e, trade_id in zip(entry_orders, outcomes[len(exit_orders):]):
+                if isinstance(trade_id, Exception):
+                    logger.error(f"{e['sub']} entry failed: {trade_id}")
+                elif trade_id:
+                    executor.record_open()
+                    sig_logger.info(f"ENTRY {e['side'].upper()} {e['sub']} @ ${fill_price:.2f} | {trade_id}")
+            clock.mark("orders")
+
             # ── 5. 記錄 bar snapshot ──
             pos_state = get_position_state(executor)
             total_unr = 0.0
@@ -1122,6 +1348,10 @@ def main():
                 },
                 position_state=pos_state,
             )
+            clock.mark("recorder")
+
+            # ── 5.5 手續費對帳（每小時一支 userTrades 批次查詢，不在下單路徑上）──
+            executor.reconcile_commissions()
 
             # ── 6. 日結統計 ──
             # 注意：last_daily_date 是「最後一次 flush 到 CSV 的日期」。
@@ -1137,6 +1367,13 @@ def main():
 
             # ── 7. 狀態持久化 ──
             executor.save_state()
+            if watcher is not None:
+                watcher.refresh_levels()  # 新倉 / 平倉 / 延長期 BE → 重算盤中觸價價位
+            try:
+                ind_state.save(ind_state_path)
+            except Exception as e:
+                logger.warning(f"Indicator state save failed: {e}")
+            clock.mark("save_state")
 
             # ── 8. 心跳 ──
             if executor.bar_counter - last_heartbeat_bar >= HEARTBEAT_INTERVAL:
@@ -1286,7 +1523,7 @@ def main():
 
                 entry_status_lines = []
                 for _side in ("L", "S"):
-                    _gates, _ = signal_status._side_gates(_side, df.iloc[idx], gate_state)
+                    _gates, _ = signal_status._side_gates(_side, feat, gate_state)
                     _failed = [(label, detail) for ok, label, detail in _gates if not ok]
                     _cb_ok, _cb_reason = executor.check_circuit_breaker(_side)
                     if (not _cb_ok and "月虧" not in _cb_reason
@@ -1441,8 +1678,13 @@ def main():
                 # 私聊維持每小時心跳；群組只在仍有持倉時收到心跳，平倉後立即停止。
                 send_telegram_message(hb_msg, include_groups=bool(positions))
 
+            clock.mark("heartbeat")
+            clock.add("telegram", thread_send_seconds() - tg_start)
+            cycle_timing.record(clock, bar_time_str)
+
             elapsed = time.time() - cycle_start
             logger.info(f"Cycle done in {elapsed:.1f}s | Balance: ${executor.account_balance:.2f}")
+            logger.info(f"Latency: {cycle_prefetch.budget_line(clock, pf)}")
 
         except KeyboardInterrupt:
             logger.info("Shutdown requested")
@@ -1451,6 +1693,8 @@ def main():
             send_telegram_message(f"<b>🖨 V14 下班了（{env}）</b>\n"
                                   + wrap_private(f"💰 金庫：${executor.account_balance:.2f}\n")
                                   + "🛏 明天繼續印！")
+            if not flush_outbox(5.0):
+                logger.warning("Telegram outbox not drained on shutdown; pending saved for next start")
             break
 
         except Exception as e:
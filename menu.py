@@ -18,7 +18,7 @@ MENU = r"""
  .venv/bin/python check_signal.py        即時開單條件 L/S      /signal
  .venv/bin/python verify_mainnet.py      帳戶/連線/持倉體檢     /status + /bal
  .venv/bin/python check_health.py --days 30   策略健康報告
- cat eth_state_live.json | python3 -m json.tool   持倉/計數器/餘額原始狀態
+ .venv/bin/python state_journal.py       持倉/計數器/餘額原始狀態（快照 + 日誌合併）
 
  旗標：--paper / --live 強制資料來源；analyze.py 第一個數字 = 最近 N 天
 
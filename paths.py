@@ -50,6 +50,11 @@ def state_file(paper: bool) -> str:
     return os.path.join(INSTANCE_DIR, "eth_state.json" if paper else "eth_state_live.json")
 
 
+def indicator_state_file(paper: bool) -> str:
+    """增量指標狀態檔（放狀態檔旁）：paper→ eth_indicators.json，live→ eth_indicators_live.json。"""
+    return os.path.join(INSTANCE_DIR, "eth_indicators.json" if paper else "eth_indicators_live.json")
+
+
 def instance_name() -> str:
     """實例顯示名（Telegram 訊息前綴用，讓多人各自確認查到自己的）。
 
@@ -3,7 +3,8 @@ V14 4 層 CSV 記錄系統
 
 Layer 1: bar_snapshots.csv     — 每小時一行，所有指標 + 信號評估
 Layer 2: position_lifecycle.csv — 持倉期間每 bar 一行，MAE/MFE 追蹤
-Layer 3: trades.csv            — 每筆交易一行，進場到出場完整記錄
+Layer 3: trades.db / trades.csv — 每筆交易一行，進場到出場完整記錄
+                                 （SQLite 帳本 trade_ledger 為準；trades.csv 為每日匯出的同格式副本）
 Layer 4: daily_summary.csv     — 每日一行，當日彙總
 
 原則：有用才記，每個欄位必須能回答一個具體複盤問題。
@@ -338,7 +339,7 @@ def record_position_bar(trade_id: str, position: dict, bar_data: dict,
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# Layer 3: trades.csv
+# Layer 3: trades.db（trade_ledger；trades.csv 由 export_trades_csv 匯出）
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 def record_trade_open(trade: dict):
@@ -354,15 +355,14 @@ def record_trade_open(trade: dict):
         was_cooldown_trade, bars_since_last_exit,
         btc_close_at_entry, eth_btc_ratio_at_entry, eth_24h_change_pct
     """
-    _ensure_csv(TRADES_CSV, TRADES_FIELDS)
+    import trade_ledger
     row = {field: trade.get(field, "") for field in TRADES_FIELDS}
-    _append_row(TRADES_CSV, TRADES_FIELDS, row)
+    trade_ledger.insert_open(DATA_DIR, row)
 
 
 def record_trade_close(trade_id: str, exit_data: dict):
     """
-    出場時更新 trades.csv 中對應 trade_id 的行。
-    使用 read-modify-write（檔案最多幾百行，效能無問題）。
+    出場時更新帳本中對應 trade_id 的列（單列 UPDATE，走 trade_id 索引，成本不隨歷史筆數成長）。
 
     exit_data 需包含:
         exit_time_utc, exit_time_utc8, exit_type, exit_price, exit_trigger_bar,
@@ -372,40 +372,30 @@ def record_trade_close(trade_id: str, exit_data: dict):
         mae_time_bar, mfe_time_bar, pnl_at_bar7, pnl_at_bar12,
         gross_pnl_usd, commission_usd, net_pnl_usd, net_pnl_pct, win_loss
 
-    防禦：若 trade_id 不存在（CSV 被外力清空/header migration 遺失等），
+    防禦：若 trade_id 不存在（帳本被外力清空等），
     過去會靜默丟失出場資料；現改為 ERROR log + append fallback row，
     至少保留 exit_data 不讓資料完全消失。
     """
-    _ensure_csv(TRADES_CSV, TRADES_FIELDS)
-
-    # 讀取所有行，逐行比對 trade_id；命中則以 exit_data 更新
-    rows = []
-    matched = False
-    with open(TRADES_CSV, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["trade_id"] == trade_id:
-                row.update({k: v for k, v in exit_data.items() if k in TRADES_FIELDS})
-                matched = True
-            rows.append(row)
-
-    if not matched:
-        # trade_id 不存在 → 至少記 ERROR 並 append fallback row，避免出場資料完全遺失
+    import trade_ledger
+    if not trade_ledger.update_close(DATA_DIR, trade_id, exit_data):
         import logging
         logging.getLogger("recorder").error(
-            f"record_trade_close: trade_id={trade_id} NOT FOUND in trades.csv, "
-            f"appending fallback row (entry fields will be empty)"
+            f"record_trade_close: trade_id={trade_id} NOT FOUND in trade ledger, "
+            f"appended fallback row (entry fields will be empty)"
         )
-        fallback = {field: "" for field in TRADES_FIELDS}
-        fallback["trade_id"] = trade_id
-        fallback.update({k: v for k, v in exit_data.items() if k in TRADES_FIELDS})
-        rows.append(fallback)
 
-    # 重寫整檔
-    with open(TRADES_CSV, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=TRADES_FIELDS, extrasaction="ignore")
-        writer.writeheader()
-        writer.writerows(rows)
+
+def record_fill(order_id, trade_id: str, leg: str, est_commission: float):
+    """記下一筆成交的 orderId 與估計手續費，待 executor.reconcile_commissions 每小時批次對帳"""
+    import time
+    import trade_ledger
+    trade_ledger.add_fill(DATA_DIR, order_id, trade_id, leg, int(time.time() * 1000), est_commission)
+
+
+def export_trades_csv() -> int:
+    """帳本 → trades.csv（與原本格式逐位元組相同，給試算表 / 研究腳本用）。回傳列數"""
+    import trade_ledger
+    return trade_ledger.export_csv(DATA_DIR)
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -427,12 +417,9 @@ def record_daily_summary(stats: dict):
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 def read_trades() -> list:
-    """讀取 trades.csv，回傳 list of dict"""
-    if not os.path.exists(TRADES_CSV):
-        return []
-    import pandas as pd
-    df = pd.read_csv(TRADES_CSV)
-    return df.to_dict("records")
+    """讀取交易帳本，回傳 list of dict（型別同 pd.read_csv(trades.csv)）"""
+    import trade_ledger
+    return trade_ledger.frame(DATA_DIR).to_dict("records")
 
 
 def read_bar_snapshots() -> list:
@@ -46,6 +46,7 @@ def _load_engine():
     path = os.path.join(ROOT, "backtest", "research", "v14_export_trades.py")
     spec = importlib.util.spec_from_file_location("v14_export_trades", path)
     mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod  # 讓 numba 磁碟快取能以模組名重新載入（見 _get_fast_kernel）
     spec.loader.exec_module(mod)
     return mod
 
@@ -127,7 +128,7 @@ def main():
         )
 
     eng = _load_engine()
-    ind = eng.compute_indicators(df)
+    ind = eng.compute_indicators_cached(df)
     datetimes = df["datetime"].values
 
     # ── 日期過濾（與儀表板 _run_backtest 完全相同）──
@@ -141,9 +142,9 @@ def main():
         print(f"❌ 找不到 {args.start} 之後的 K 線；資料只到 {data_end:%Y-%m-%d %H:%M}")
         print("   請加 --refresh 更新 K 線後再執行")
         return
-    trades = eng.simulate_v14_detailed(ind, datetimes, start_bar=start_bar,
-                                       realistic=realistic, slip_bps=args.slip,
-                                       margin_schedule=schedule)
+    trades = eng.simulate_v14_fast(ind, datetimes, start_bar=start_bar,
+                                   realistic=realistic, slip_bps=args.slip,
+                                   margin_schedule=schedule)
     if args.end:
         trades = [t for t in trades if str(t["entry_dt"]) <= args.end + " 23:59:59"]
 
@@ -46,8 +46,12 @@ def session_windows():
     }
 
 
-def _side_gates(side, row, st):
-    """回傳該側 [(ok, label, detail), ...] 與 fire(bool)。順序對齊 strategy 評估。"""
+def _side_gates(side, row, st, mask=None):
+    """回傳該側 [(ok, label, detail), ...] 與 fire(bool)。順序對齊 strategy 評估。
+
+    mask：strategy.evaluate_signals_vectorized 算好的該 bar gate bitmask；
+    有給就以它為準（與回測 / 圖表同一份判斷），這裡只負責組說明文字。
+    """
     close = float(row["close"])
     bar_counter = st.get("bar_counter", 0)
     positions = st.get("positions", {}) or {}
@@ -110,11 +114,41 @@ def _side_gates(side, row, st):
         (monthly_entries < cap, "月進場上限", f"{monthly_entries}/{cap}"),
         (monthly_pnl > loss_cap, "月虧上限", f"${monthly_pnl:+.2f} / ${loss_cap}"),
     ]
+    if mask is not None:
+        gates = [(bool(int(mask) & bit), label, detail)
+                 for (bit, _), (_, label, detail) in zip(strategy.GATE_LABELS, gates)]
     fire = all(ok for ok, _, _ in gates)
     return gates, fire
 
 
-def build_signal_status(df, idx, st, html: bool = False) -> str:
+def plan_lines(plan, price=None) -> list:
+    """觸價計畫 → 每側一行說明（price = 目前價格，算距觸價的距離）"""
+    out = []
+    for side in ("L", "S"):
+        p = plan[side]
+        tag = "L" if side == "L" else "S"
+        if p["armed"]:
+            word = "收盤 >" if p["op"] == ">" else "收盤 <"
+            gap = ""
+            if price:
+                gap = f"（距現價 {(p['trigger'] - price) / price * 100:+.2f}%）"
+            out.append(f"{tag}：{word} ${p['trigger']:.2f} 即進場{gap}")
+        else:
+            out.append(f"{tag}：本根不會進場（卡在：{'、'.join(p['blocked'])}）")
+    return out
+
+
+def plan_summary(plan) -> str:
+    """一行版（log 用）"""
+    parts = []
+    for side in ("L", "S"):
+        p = plan[side]
+        parts.append(f"{side} fires iff close {p['op']} {p['trigger']:.2f}" if p["armed"]
+                     else f"{side} blocked ({', '.join(p['blocked'])})")
+    return " | ".join(parts)
+
+
+def build_signal_status(df, idx, st, html: bool = False, plan: dict = None) -> str:
     """產生即時開單條件報表。
 
     Args:
@@ -123,6 +157,7 @@ def build_signal_status(df, idx, st, html: bool = False) -> str:
         st: dict — bar_counter / last_exits / monthly_pnl / monthly_entries /
             positions / consec_losses / consec_loss_cooldown_until / paused
         html: True → Telegram HTML；False → 終端機純文字
+        plan: strategy.trigger_plan() 的下一根觸價計畫（有給就列出觸價價位）
     """
     # html 模式用 sentinel 標記粗體，最後統一 escape 內容（避免 < > 被當成 HTML 標籤），
     # 再把 sentinel 還原成 <b></b>。這樣 "（<25）" 之類的 < 不會炸掉 Telegram parser。
@@ -131,7 +166,7 @@ def build_signal_status(df, idx, st, html: bool = False) -> str:
     def b(t):
         return f"{BOLD_L}{t}{BOLD_R}" if html else t
 
-    row = df.iloc[idx]
+    row = strategy.BarFeatures.from_frame(df, idx)
     bar_time = str(row["datetime"])[:16]
     close = float(row["close"])
     slope = row.get("sma_slope")
@@ -163,9 +198,10 @@ def build_signal_status(df, idx, st, html: bool = False) -> str:
     if consec_remain > 0:
         global_block.append(f"🚫 連虧 {consec} 筆冷卻中，剩 {consec_remain}h（L+S 皆停）")
 
+    sig = strategy.evaluate_signals_vectorized(df, st, idx)
     for side in ("L", "S"):
         tag = "📈 L 做多" if side == "L" else "📉 S 做空"
-        gates, fire = _side_gates(side, row, st)
+        gates, fire = _side_gates(side, row, st, sig[side]["gates"][idx])
         lines.append(b(tag))
         for ok, label, detail in gates:
             mark = "✅" if ok else "❌"
@@ -180,6 +216,15 @@ def build_signal_status(df, idx, st, html: bool = False) -> str:
             lines.append(f"  ➡️ ❌ 卡在：{'、'.join(fails)}")
         lines.append("")
 
+    if plan is not None:
+        price = float(df["close"].iloc[idx + 1]) if idx + 1 < len(df) else close
+        close_at = pd.Timestamp(plan["bar_time"]) + pd.Timedelta(hours=1)
+        lines.append(b(f"🎯 下一根觸價計畫（{close_at:%H:%M} 收盤）"))
+        lines += [f"  {t}" for t in plan_lines(plan, price)]
+        if global_block:
+            lines.append(f"  （{'｜'.join(global_block)}，屆時仍不開單）")
+        lines.append("")
+
     sw = session_windows()
     lines += [
         b("⏰ 可開單時段（UTC+8）"),
@@ -0,0 +1,245 @@
+"""
+Executor 狀態的預寫日誌（WAL）— save_state 只把「這次變了什麼」追加成一行 JSON，
+累積到 COMPACT_EVERY 行才合併成一次完整快照（eth_state.json），重啟時快照 + 重放日誌還原。
+
+原本每次開倉 / 平倉 / pending_exit / pause 都持鎖深拷貝 positions + daily_stats，
+再以 indent=2 整檔重寫 eth_state.json：成本隨狀態大小（daily_stats 只在 flush 時才修剪）成長，
+且每次都有一段「整檔重寫」的視窗。
+
+  日誌：狀態檔旁的 *.journal（eth_state.json → eth_state.journal），一行一筆：
+        {"seq": 12, "ops": [["set", ["positions", "L_12"], {...}], ["del", ["positions", "L_11"]],
+                            ["set", ["paused"], true]]}
+        positions / daily_stats 以子鍵為單位比對，其餘頂層欄位整個比對；寫完 flush + fsync
+  快照：與原本相同格式的 eth_state.json，多一個 journal_seq（已併入的最後一筆 seq）；
+        tmp + fsync + os.replace 後才截斷日誌 → 任何時點當機，快照 + 日誌都能還原到最後一次 save
+  重放：seq <= journal_seq 的行略過（快照已含）；壞掉的行（當機時寫一半）略過並記 warning
+  讀取：儀表板 / check_signal / verify_mainnet 一律用 load()，不直接讀 eth_state.json
+
+檢查目前狀態（快照 + 日誌合併後）：
+    python state_journal.py            # 依 PAPER_TRADING
+    python state_journal.py --live
+"""
+import os
+import sys
+import copy
+import json
+import logging
+import argparse
+import threading
+from collections import deque
+
+logger = logging.getLogger("state_journal")
+
+COMPACT_EVERY = int(os.getenv("STATE_COMPACT_EVERY", "200"))  # 日誌累積幾行就寫一次完整快照
+NESTED = ("positions", "daily_stats")  # 以子鍵為單位記錄變動的欄位
+SEQ_KEY = "journal_seq"
+
+
+def journal_path(state_path: str) -> str:
+    return os.path.splitext(state_path)[0] + ".journal"
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 差異 / 套用
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def _same(a, b) -> bool:
+    """相等比對；== 不成立時再比 JSON 字串（NaN / numpy 數值等序列化後相同就算相同）"""
+    if a == b:
+        return True
+    try:
+        return (json.dumps(a, sort_keys=True, default=str)
+                == json.dumps(b, sort_keys=True, default=str))
+    except Exception:
+        return False
+
+
+def diff(old: dict, new: dict) -> list:
+    """old（上次寫入的狀態）→ new（目前狀態）的變動 ops；值都是深拷貝，之後改 new 不影響"""
+    ops = []
+    for key, val in new.items():
+        if key in NESTED and isinstance(val, dict):
+            prev = old.get(key)
+            if not isinstance(prev, dict):
+                ops.append(["set", [key], copy.deepcopy(val)])
+                continue
+            for sub, v in val.items():
+                if sub not in prev or not _same(prev[sub], v):
+                    ops.append(["set", [key, sub], copy.deepcopy(v)])
+            for sub in prev:
+                if sub not in val:
+                    ops.append(["del", [key, sub]])
+        elif key not in old or not _same(old[key], val):
+            ops.append(["set", [key], copy.deepcopy(val)])
+    for key in old:
+        if key not in new and key != SEQ_KEY:
+            ops.append(["del", [key]])
+    return ops
+
+
+def apply(state: dict, ops: list) -> dict:
+    """把 ops 套到 state（就地修改並回傳）"""
+    for op in ops:
+        kind, path = op[0], op[1]
+        parent = state
+        for k in path[:-1]:
+            parent = parent.setdefault(k, {})
+        if kind == "set":
+            parent[path[-1]] = op[2]
+        elif kind == "del":
+            parent.pop(path[-1], None)
+    return state
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 讀寫
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def append(state_path: str, seq: int, ops: list):
+    """追加一筆到日誌（flush + fsync 後才返回）"""
+    line = json.dumps({"seq": seq, "ops": ops}, ensure_ascii=False, default=str)
+    with open(journal_path(state_path), "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_snapshot(state_path: str, state: dict, seq: int):
+    """完整快照（含 journal_seq）原子換檔，成功後截斷日誌"""
+    snap = dict(state)
+    snap[SEQ_KEY] = seq
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snap, f, indent=2, ensure_ascii=False, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_path)
+    # 快照已含全部變動；就算截斷前當機，重放也會依 journal_seq 略過舊行
+    open(journal_path(state_path), "w").close()
+
+
+def load(state_path: str):
+    """快照 + 重放日誌。
+
+    Returns:
+        (state, seq, n_lines)：state 為 None 表示快照與日誌都不存在；
+        seq 為最後套用的 seq；n_lines 為日誌中實際重放的行數
+    """
+    state, seq, n = None, 0, 0
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        seq = int(state.pop(SEQ_KEY, 0) or 0)
+    jp = journal_path(state_path)
+    if not os.path.exists(jp):
+        return state, seq, n
+    with open(jp, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                logger.warning(f"{os.path.basename(jp)}:{lineno} unreadable (torn write?), skipped")
+                continue
+            if rec.get("seq", 0) <= seq:
+                continue
+            if state is None:
+                state = {}
+            apply(state, rec.get("ops", []))
+            seq = rec["seq"]
+            n += 1
+    return state, seq, n
+
+
+def load_state(state_path: str) -> dict:
+    """只要合併後的狀態（外部讀取用）；不存在回 {}"""
+    state, _, _ = load(state_path)
+    return state or {}
+
+
+class Journal:
+    """
+    Executor 用的日誌寫入端。baseline 為上次寫入（快照 + 日誌）後的狀態深拷貝，
+    save(current) 只比對、序列化有變的部分。
+
+    拆成兩段，讓 Executor._lock 不必包住磁碟 I/O：
+      stage(current)：比對 + 深拷貝變動（呼叫端持 Executor._lock），排進待寫佇列
+      flush()：依 seq 順序寫出待寫佇列（自帶 _io_lock，呼叫端不持狀態鎖）
+    """
+
+    def __init__(self, state_path: str, baseline: dict = None, seq: int = 0, lines: int = 0):
+        self.state_path = state_path
+        self.baseline = copy.deepcopy(baseline) if baseline else {}
+        self.seq = seq
+        self.lines = lines
+        self._pending = deque()             # [(seq, ops, 快照或 None)]，stage 的順序即寫入順序
+        self._io_lock = threading.Lock()
+
+    def stage(self, current: dict) -> int:
+        """比對 current 與 baseline，差異排進待寫佇列；回傳 ops 數（0 = 沒變）"""
+        ops = diff(self.baseline, current)
+        if not ops:
+            return 0
+        self.seq += 1
+        apply(self.baseline, ops)
+        snapshot = None
+        if self.lines + 1 >= COMPACT_EVERY or not os.path.exists(self.state_path):
+            snapshot = copy.deepcopy(self.baseline)  # 累積夠多 / 首次存檔（還沒有快照）→ 寫完整快照
+            self.lines = 0
+        else:
+            self.lines += 1
+        self._pending.append((self.seq, ops, snapshot))
+        return len(ops)
+
+    def flush(self):
+        """寫出 stage 排入的變動（多個 thread 同時 flush 時由先拿到 _io_lock 的依序全部寫完）"""
+        with self._io_lock:
+            while self._pending:
+                seq, ops, snapshot = self._pending[0]
+                if snapshot is not None:
+                    write_snapshot(self.state_path, snapshot, seq)
+                else:
+                    append(self.state_path, seq, ops)
+                self._pending.popleft()  # 寫成功才移除；失敗留待下次 flush 重試
+
+    def save(self, current: dict) -> int:
+        """stage + flush（單執行緒 / 不在意持鎖寫檔的呼叫端用）"""
+        n = self.stage(current)
+        self.flush()
+        return n
+
+    def compact(self):
+        with self._io_lock:
+            write_snapshot(self.state_path, self.baseline, self.seq)
+            self._pending.clear()
+            self.lines = 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="顯示快照 + 日誌合併後的 executor 狀態")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--paper", action="store_true")
+    g.add_argument("--live", action="store_true")
+    ap.add_argument("--path", default=None, help="直接指定狀態檔")
+    args = ap.parse_args()
+
+    import paths
+    if args.path:
+        sp = args.path
+    else:
+        paper = (not args.live) if (args.paper or args.live) else \
+            os.getenv("PAPER_TRADING", "true").lower() == "true"
+        sp = paths.state_file(paper)
+    state, seq, n = load(sp)
+    if state is None:
+        print(f"No state at {sp}")
+        return 1
+    print(json.dumps(state, indent=2, ensure_ascii=False, default=str))
+    print(f"# {sp}: journal_seq={seq}, replayed {n} line(s) from {os.path.basename(journal_path(sp))}",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
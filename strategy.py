@@ -17,6 +17,7 @@ V14→V14+R 變更（新增 regime gate，出場邏輯不動）：
     - S 被阻擋：|slope| < 1.0%
 """
 import os
+from dataclasses import dataclass, field
 
 import numpy as np
 import pandas as pd
@@ -147,6 +148,37 @@ def get_s_mh(regime: str) -> int:
     return S_MH_BY_REGIME.get(regime, S_MAX_HOLD)
 
 
+def rolling_rank_pctile(values, window: int = GK_WIN, block: int = 4096) -> np.ndarray:
+    """
+    滾動 rank percentile（向量化 kernel；strategy / 回測引擎 / 儀表板共用）。
+
+    語意與原 rolling(window).apply(_rank_pctile) 逐位元一致：
+      - 窗口內「嚴格小於」最新值的個數 /(n-1) × 100（n = window）
+      - 窗口未滿或含任何 NaN → NaN（同 pandas min_periods=window）
+      - window <= 1 → 50
+    以 sliding_window_view 分塊比較（每塊 block 列），記憶體 O(block × window)。
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    out = np.full(n, np.nan)
+    if window <= 0 or n < window:
+        return out
+    if window == 1:
+        out[~np.isnan(x)] = 50.0
+        return out
+
+    win = sliding_window_view(x, window)
+    for s in range(0, len(win), block):
+        w = win[s:s + block]
+        cnt = (w < w[:, -1:]).sum(axis=1)
+        res = cnt / (window - 1) * 100
+        res[np.isnan(w).any(axis=1)] = np.nan
+        out[window - 1 + s: window - 1 + s + len(w)] = res
+    return out
+
+
 def compute_indicators(df: pd.DataFrame) -> pd.DataFrame:
     """
     計算所有策略指標（V13: L/S 各自 GK 窗口 + 獨立 session filter）。
@@ -178,17 +210,9 @@ def compute_indicators(df: pd.DataFrame) -> pd.DataFrame:
     d["gk_ratio_s"] = gk_short_s / gk_long_s
 
     # GK Percentile: shift(1) BEFORE rolling — 防前瞻
-    # ★ rank percentile（與研究腳本一致）
-    _rank_pctile = lambda s: (
-        ((s < s.iloc[-1]).sum()) / (len(s) - 1) * 100
-        if len(s) > 1 else 50
-    )
-    d["gk_pctile"] = d["gk_ratio"].shift(1).rolling(GK_WIN).apply(
-        _rank_pctile, raw=False
-    )
-    d["gk_pctile_s"] = d["gk_ratio_s"].shift(1).rolling(GK_WIN).apply(
-        _rank_pctile, raw=False
-    )
+    # ★ rank percentile（與研究腳本一致，共用 rolling_rank_pctile kernel）
+    d["gk_pctile"] = rolling_rank_pctile(d["gk_ratio"].shift(1).to_numpy(dtype=float), GK_WIN)
+    d["gk_pctile_s"] = rolling_rank_pctile(d["gk_ratio_s"].shift(1).to_numpy(dtype=float), GK_WIN)
 
     # ── Breakout: L/S 共用 BL15 ──
     # ★ current close 方法（與研究腳本一致）
@@ -214,12 +238,154 @@ def compute_indicators(df: pd.DataFrame) -> pd.DataFrame:
     return d
 
 
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 單根 bar 特徵紀錄（live 每個 cycle 只建一次，訊號 / 紀錄 / 通知共用）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+_FEATURE_FLOATS = (
+    "open", "high", "low", "close", "volume", "taker_buy_volume",
+    "ema20", "gk_ratio", "gk_pctile", "gk_ratio_s", "gk_pctile_s",
+    "breakout_15bar_max", "breakout_15bar_min", "sma200", "sma_slope",
+)
+_FEATURE_BOOLS = (
+    "breakout_long", "breakout_short", "session_ok_l", "session_ok_s",
+    "regime_block_l", "regime_block_s",
+)
+_FEATURE_INTS = ("hour_utc8", "weekday_utc8")
+
+
+def _nan_none(v):
+    """NaN → None（BarFeatures 內的 float 已是原生 float，不必再 pd.isna）"""
+    return None if v != v else v
+
+
+@dataclass(slots=True)
+class BarFeatures:
+    """
+    單根已收盤 bar 的 OHLCV + 全部指標值（compute_indicators 的一列）。
+
+    每個 cycle 只從 DataFrame 取一次列；float 欄位保留 NaN（原生 float），
+    bool / int 欄位已轉好型別，之後的判斷不必再 pd.isna。
+    提供 get() / [] 介面，可直接替代原本傳給 signal_status、
+    main_eth.bar_to_dict / indicators_to_dict 的 pandas row。
+    """
+    datetime: object = None
+    open: float = np.nan
+    high: float = np.nan
+    low: float = np.nan
+    close: float = np.nan
+    volume: float = np.nan
+    taker_buy_volume: float = 0.0
+    ema20: float = np.nan
+    gk_ratio: float = np.nan
+    gk_pctile: float = np.nan
+    gk_ratio_s: float = np.nan
+    gk_pctile_s: float = np.nan
+    breakout_15bar_max: float = np.nan
+    breakout_15bar_min: float = np.nan
+    sma200: float = np.nan
+    sma_slope: float = np.nan
+    breakout_long: bool = False
+    breakout_short: bool = False
+    session_ok_l: bool = False
+    session_ok_s: bool = False
+    regime_block_l: bool = False
+    regime_block_s: bool = False
+    hour_utc8: int = -1
+    weekday_utc8: int = -1
+    _indicators: dict = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, idx: int) -> "BarFeatures":
+        """從 compute_indicators() 結果的第 idx 列建立（缺欄位用預設值）。
+
+        整列只取一次再轉型；pandas 3 下逐欄 df[col].to_numpy() 每欄約 20µs，
+        24 欄反而比單次取列慢。
+        """
+        return cls.from_mapping(df.iloc[idx].to_dict())
+
+    @classmethod
+    def from_mapping(cls, row) -> "BarFeatures":
+        """從 dict / pandas row 建立（例如 IndicatorState.update() 的回傳值）"""
+        f = cls(datetime=row.get("datetime"))
+        for k in _FEATURE_FLOATS:
+            v = _safe_float(row.get(k))
+            if v is not None:
+                setattr(f, k, v)
+        for k in _FEATURE_BOOLS:
+            setattr(f, k, _safe_bool(row.get(k)))
+        for k in _FEATURE_INTS:
+            v = _safe_float(row.get(k))
+            if v is not None:
+                setattr(f, k, int(v))
+        return f
+
+    def get(self, key, default=None):
+        """與 pandas row / dict 相容的取值介面"""
+        if key.startswith("_"):
+            return default
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        if key.startswith("_") or not hasattr(self, key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def bar_dict(self) -> dict:
+        """K 棒原始值（recorder / executor 用的 bar_data 格式）"""
+        return {
+            "datetime": self.datetime,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "taker_buy_volume": self.taker_buy_volume,
+        }
+
+    def indicators(self) -> dict:
+        """指標快照（同 _collect_indicators 格式；NaN → None）。回傳副本，可自由修改。"""
+        if self._indicators is None:
+            self._indicators = {
+                "gk_pctile": _nan_none(self.gk_pctile),
+                "gk_ratio": _nan_none(self.gk_ratio),
+                "gk_pctile_s": _nan_none(self.gk_pctile_s),
+                "gk_ratio_s": _nan_none(self.gk_ratio_s),
+                "ema20": _nan_none(self.ema20),
+                "close": _nan_none(self.close),
+                "breakout_15bar_max": _nan_none(self.breakout_15bar_max),
+                "breakout_15bar_min": _nan_none(self.breakout_15bar_min),
+                "breakout_long": self.breakout_long,
+                "breakout_short": self.breakout_short,
+                "session_ok_l": self.session_ok_l,
+                "session_ok_s": self.session_ok_s,
+                "sma200": _nan_none(self.sma200),
+                "sma_slope": _nan_none(self.sma_slope),
+                "regime_block_l": self.regime_block_l,
+                "regime_block_s": self.regime_block_s,
+                "hour_utc8": self.hour_utc8,
+                "weekday_utc8": self.weekday_utc8,
+            }
+        return dict(self._indicators)
+
+
 def evaluate_long_signal(df: pd.DataFrame, idx: int,
                          open_positions: dict,
                          last_exits: dict,
                          bar_counter: int,
                          monthly_pnl_l: float = 0.0,
                          monthly_entries_l: int = 0) -> dict:
+    """evaluate_long() 的 DataFrame 介面（取 df 第 idx 列）"""
+    return evaluate_long(BarFeatures.from_frame(df, idx), open_positions, last_exits,
+                         bar_counter, monthly_pnl_l, monthly_entries_l)
+
+
+def evaluate_long(f: BarFeatures,
+                  open_positions: dict,
+                  last_exits: dict,
+                  bar_counter: int,
+                  monthly_pnl_l: float = 0.0,
+                  monthly_entries_l: int = 0) -> dict:
     """
     評估 L（做多）進場信號。
 
@@ -229,11 +395,8 @@ def evaluate_long_signal(df: pd.DataFrame, idx: int,
     Returns:
         {action, sub_strategy, reason, indicators} 或 None
     """
-    row = df.iloc[idx]
-    indicators = _collect_indicators(row)
-
-    gp = row["gk_pctile"]
-    if pd.isna(gp):
+    gp = f.gk_pctile
+    if gp != gp:
         return None
 
     # GK 壓縮
@@ -241,15 +404,15 @@ def evaluate_long_signal(df: pd.DataFrame, idx: int,
         return None
 
     # Breakout long
-    if not _safe_bool(row.get("breakout_long")):
+    if not f.breakout_long:
         return None
 
     # Session（V13: L 獨立 session filter）
-    if not _safe_bool(row.get("session_ok_l")):
+    if not f.session_ok_l:
         return None
 
     # V14+R Regime Gate: block L in strong uptrend
-    if _safe_bool(row.get("regime_block_l")):
+    if f.regime_block_l:
         return None
 
     # Cooldown
@@ -274,8 +437,8 @@ def evaluate_long_signal(df: pd.DataFrame, idx: int,
         "action": "BUY",
         "sub_strategy": "L",
         "reason": f"GK={gp:.1f}<{L_GK_THRESH}+BRK{BRK_LOOK}",
-        "indicators": indicators,
-        "entry_regime": classify_regime(row.get("sma_slope")),
+        "indicators": f.indicators(),
+        "entry_regime": classify_regime(_nan_none(f.sma_slope)),
     }
 
 
@@ -285,6 +448,17 @@ def evaluate_short_signal(df: pd.DataFrame, idx: int,
                           bar_counter: int,
                           monthly_pnl_s: float = 0.0,
                           monthly_entries_s: int = 0) -> dict:
+    """evaluate_short() 的 DataFrame 介面（取 df 第 idx 列）"""
+    return evaluate_short(BarFeatures.from_frame(df, idx), open_positions, last_exits,
+                          bar_counter, monthly_pnl_s, monthly_entries_s)
+
+
+def evaluate_short(f: BarFeatures,
+                   open_positions: dict,
+                   last_exits: dict,
+                   bar_counter: int,
+                   monthly_pnl_s: float = 0.0,
+                   monthly_entries_s: int = 0) -> dict:
     """
     評估 S（做空）進場信號。
 
@@ -294,11 +468,8 @@ def evaluate_short_signal(df: pd.DataFrame, idx: int,
     Returns:
         {action, sub_strategy, reason, indicators} 或 None
     """
-    row = df.iloc[idx]
-    indicators = _collect_indicators(row)
-
-    gp = row["gk_pctile_s"]
-    if pd.isna(gp):
+    gp = f.gk_pctile_s
+    if gp != gp:
         return None
 
     # GK 壓縮（V13: S 用自己的 GK pctile, 閾值 35）
@@ -306,15 +477,15 @@ def evaluate_short_signal(df: pd.DataFrame, idx: int,
         return None
 
     # Breakout short
-    if not _safe_bool(row.get("breakout_short")):
+    if not f.breakout_short:
         return None
 
     # Session（V13: S 獨立 session filter）
-    if not _safe_bool(row.get("session_ok_s")):
+    if not f.session_ok_s:
         return None
 
     # V14+R Regime Gate: block S in sideways regime
-    if _safe_bool(row.get("regime_block_s")):
+    if f.regime_block_s:
         return None
 
     # Cooldown
@@ -339,10 +510,219 @@ def evaluate_short_signal(df: pd.DataFrame, idx: int,
         "action": "SELL",
         "sub_strategy": "S",
         "reason": f"GK={gp:.1f}<{S_GK_THRESH}+BRK{BRK_LOOK}",
-        "indicators": indicators,
-        "entry_regime": classify_regime(row.get("sma_slope")),
+        "indicators": f.indicators(),
+        "entry_regime": classify_regime(_nan_none(f.sma_slope)),
+    }
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 整段歷史向量化訊號（每根 bar × 每側一個 gate bitmask）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+# bit 順序與 evaluate_long / evaluate_short 的判斷順序一致
+GATE_GK = 1 << 0             # GK pctile < 閾值
+GATE_BREAKOUT = 1 << 1       # BL15 突破
+GATE_SESSION = 1 << 2        # 交易時段
+GATE_REGIME = 1 << 3         # R gate 未阻擋
+GATE_COOLDOWN = 1 << 4       # 出場冷卻已解除
+GATE_MAX_TOTAL = 1 << 5      # 持倉數 < 上限
+GATE_MONTHLY_ENTRY = 1 << 6  # 月進場數 < 上限
+GATE_MONTHLY_LOSS = 1 << 7   # 月 PnL > 月虧停
+GATE_MARKET = GATE_GK | GATE_BREAKOUT | GATE_SESSION | GATE_REGIME  # 只看行情的 4 關
+GATE_ALL = GATE_MARKET | GATE_COOLDOWN | GATE_MAX_TOTAL | GATE_MONTHLY_ENTRY | GATE_MONTHLY_LOSS
+
+GATE_LABELS = (
+    (GATE_GK, "GK 壓縮"),
+    (GATE_BREAKOUT, "15-bar 突破"),
+    (GATE_SESSION, "交易時段"),
+    (GATE_REGIME, "Regime gate"),
+    (GATE_COOLDOWN, "出場冷卻"),
+    (GATE_MAX_TOTAL, "持倉上限"),
+    (GATE_MONTHLY_ENTRY, "月進場上限"),
+    (GATE_MONTHLY_LOSS, "月虧上限"),
+)
+
+
+def gate_failures(mask: int) -> list:
+    """bitmask → 沒過的 gate 名稱（依判斷順序）"""
+    return [label for bit, label in GATE_LABELS if not (int(mask) & bit)]
+
+
+def _col(df: pd.DataFrame, name: str, dtype=float, fill=np.nan) -> np.ndarray:
+    if name in df.columns:
+        if dtype is bool:
+            return df[name].fillna(False).to_numpy(dtype=bool)
+        return df[name].to_numpy(dtype=dtype)
+    return np.full(len(df), fill, dtype=dtype)
+
+
+def evaluate_signals_vectorized(df: pd.DataFrame, state: dict = None, idx: int = None) -> dict:
+    """
+    一次算出整段 df 每根 bar 的 L/S gate bitmask 與最終進場 mask（O(n) 陣列運算）。
+
+    Args:
+        df: 已過 compute_indicators 的 DataFrame
+        state: 與 signal_status.build_signal_status 相同格式的狀態
+            {bar_counter, positions, last_exits, monthly_pnl, monthly_entries}；
+            last_exits / monthly_pnl / monthly_entries 的值可為純量或長度 n 的陣列。
+            None → 狀態類 gate（冷卻 / 持倉 / 月上限）全部視為通過，只看行情。
+        idx: state["bar_counter"] 對應的 bar 位置（預設最後一列），
+            其他 bar 的 counter 依位置差推回（冷卻用）
+    Returns:
+        {"L": {"gates": uint16[n], "entry": bool[n]}, "S": {...}}
+        entry == (gates == GATE_ALL)，與 evaluate_long / evaluate_short 逐 bar 結果一致
+    """
+    n = len(df)
+    gp_l = _col(df, "gk_pctile")
+    gp_s = _col(df, "gk_pctile_s")
+    # NaN 比較為 False → 暖機中 GK gate 不通過（同 evaluate_* 的 NaN → None）
+    market = {
+        "L": (gp_l < L_GK_THRESH, _col(df, "breakout_long", bool),
+              _col(df, "session_ok_l", bool), ~_col(df, "regime_block_l", bool)),
+        "S": (gp_s < S_GK_THRESH, _col(df, "breakout_short", bool),
+              _col(df, "session_ok_s", bool), ~_col(df, "regime_block_s", bool)),
+    }
+    limits = {
+        "L": (L_EXIT_CD, L_MAX_TOTAL, L_MONTHLY_ENTRY_CAP, L_MONTHLY_LOSS_CAP),
+        "S": (S_EXIT_CD, S_MAX_TOTAL, S_MONTHLY_ENTRY_CAP, S_MONTHLY_LOSS_CAP),
     }
 
+    if state is not None:
+        if idx is None:
+            idx = n - 1
+        counters = state.get("bar_counter", 0) - (idx - np.arange(n))
+        positions = state.get("positions", {}) or {}
+        last_exits = state.get("last_exits", {}) or {}
+        monthly_pnl = state.get("monthly_pnl", {}) or {}
+        monthly_entries = state.get("monthly_entries", {}) or {}
+
+    out = {}
+    for side in ("L", "S"):
+        gates = np.zeros(n, dtype=np.uint16)
+        for bit, ok in zip((GATE_GK, GATE_BREAKOUT, GATE_SESSION, GATE_REGIME), market[side]):
+            gates |= np.where(ok, bit, 0).astype(np.uint16)
+
+        if state is None:
+            gates |= np.uint16(GATE_ALL & ~GATE_MARKET)
+        else:
+            exit_cd, max_total, entry_cap, loss_cap = limits[side]
+            last = np.asarray(last_exits.get(side, -9999))
+            pos_count = sum(1 for p in positions.values() if p.get("sub_strategy") == side)
+            entries = np.asarray(monthly_entries.get(side, 0))
+            pnl = np.asarray(monthly_pnl.get(side, 0.0), dtype=float)
+            for bit, ok in ((GATE_COOLDOWN, (counters - last) >= exit_cd),
+                            (GATE_MAX_TOTAL, pos_count < max_total),
+                            (GATE_MONTHLY_ENTRY, entries < entry_cap),
+                            (GATE_MONTHLY_LOSS, pnl > loss_cap)):
+                gates |= np.broadcast_to(np.where(ok, bit, 0), n).astype(np.uint16)
+
+        out[side] = {"gates": gates, "entry": gates == GATE_ALL}
+    return out
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 觸價計畫（收盤前算好，收盤只剩一個價格比較）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+# 進場 gate 裡只有 breakout 依賴本 bar 收盤價：GK pctile / 15-bar 高低 / SMA 斜率都 shift(1)，
+# 時段看 bar 開盤時間，冷卻 / 持倉 / 月上限是帳上狀態 → 收盤前就能定案
+PLAN_FIELDS = (
+    "gk_pctile", "gk_pctile_s", "breakout_15bar_max", "breakout_15bar_min",
+    "sma_slope", "regime_block_l", "regime_block_s",
+    "session_ok_l", "session_ok_s", "hour_utc8", "weekday_utc8",
+)
+
+
+def next_bar_features(df: pd.DataFrame) -> BarFeatures:
+    """
+    df 最後一列為未收盤 bar（fetch_klines 格式）→ 該 bar 收盤前就能定案的特徵。
+    依賴本 bar OHLC 的欄位（close / ema20 / gk_ratio / breakout_long…）不可用，留預設值。
+    """
+    row = compute_indicators(df).iloc[-1]
+    f = BarFeatures(datetime=row.get("datetime"))
+    for k in PLAN_FIELDS:
+        v = row.get(k)
+        if k in _FEATURE_BOOLS:
+            setattr(f, k, _safe_bool(v))
+        elif k in _FEATURE_INTS:
+            v = _safe_float(v)
+            if v is not None:
+                setattr(f, k, int(v))
+        else:
+            v = _safe_float(v)
+            if v is not None:
+                setattr(f, k, v)
+    return f
+
+
+def _plan_side(side: str, f: BarFeatures, open_positions: dict, last_exits: dict,
+               bar_counter: int, monthly_pnl: float, monthly_entries: int) -> dict:
+    if side == "L":
+        gp, gk_thr, level, op = f.gk_pctile, L_GK_THRESH, f.breakout_15bar_max, ">"
+        session_ok, regime_ok = f.session_ok_l, not f.regime_block_l
+        exit_cd, max_total, entry_cap, loss_cap = L_EXIT_CD, L_MAX_TOTAL, L_MONTHLY_ENTRY_CAP, L_MONTHLY_LOSS_CAP
+    else:
+        gp, gk_thr, level, op = f.gk_pctile_s, S_GK_THRESH, f.breakout_15bar_min, "<"
+        session_ok, regime_ok = f.session_ok_s, not f.regime_block_s
+        exit_cd, max_total, entry_cap, loss_cap = S_EXIT_CD, S_MAX_TOTAL, S_MONTHLY_ENTRY_CAP, S_MONTHLY_LOSS_CAP
+
+    pos_count = sum(1 for p in open_positions.values() if p.get("sub_strategy") == side)
+    mask = GATE_BREAKOUT  # 唯一留到收盤才判的 gate，先當作通過
+    for bit, ok in ((GATE_GK, gp == gp and gp < gk_thr),
+                    (GATE_SESSION, session_ok),
+                    (GATE_REGIME, regime_ok),
+                    (GATE_COOLDOWN, bar_counter - last_exits.get(side, -9999) >= exit_cd),
+                    (GATE_MAX_TOTAL, pos_count < max_total),
+                    (GATE_MONTHLY_ENTRY, monthly_entries < entry_cap),
+                    (GATE_MONTHLY_LOSS, monthly_pnl > loss_cap)):
+        if ok:
+            mask |= bit
+    trigger = _nan_none(level)
+    if trigger is None:
+        mask &= ~GATE_BREAKOUT  # 15-bar 高低還沒暖機完 → 任何收盤價都不會突破
+    return {
+        "armed": mask == GATE_ALL,
+        "trigger": trigger,
+        "op": op,
+        "blocked": gate_failures(mask),
+        "gk_pctile": _nan_none(gp),
+    }
+
+
+def trigger_plan(f: BarFeatures,
+                 open_positions: dict,
+                 last_exits: dict,
+                 bar_counter: int,
+                 monthly_pnl: dict = None,
+                 monthly_entries: dict = None) -> dict:
+    """
+    下一根 bar 的進場計畫：除了收盤價以外的 gate 全部先判完。
+
+    Args:
+        f: next_bar_features() / IndicatorState.peek_next() 的特徵
+        bar_counter: 那根 bar 收盤時的計數（= 目前 bar_counter + 1）
+    Returns:
+        {"bar_time": str, "L": {...}, "S": {...}}；每側
+        armed（其餘 gate 全過）、trigger（突破價位）、op（">" / "<"）、blocked（沒過的 gate）、gk_pctile
+        收盤時 plan_fires(plan, side, close) 與 evaluate_long / evaluate_short 結論一致
+        （前提：計畫之後帳上狀態沒變 — 盤中平倉 / 收盤出場會改冷卻與持倉數，呼叫端需重算或再驗）
+    """
+    monthly_pnl = monthly_pnl or {}
+    monthly_entries = monthly_entries or {}
+    plan = {"bar_time": str(f.datetime)}
+    for side in ("L", "S"):
+        plan[side] = _plan_side(side, f, open_positions, last_exits, bar_counter,
+                                monthly_pnl.get(side, 0.0), monthly_entries.get(side, 0))
+    return plan
+
+
+def plan_fires(plan: dict, side: str, close: float) -> bool:
+    """收盤時的 O(1) 判斷：計畫已就緒且收盤價越過觸價"""
+    p = plan[side]
+    if not p["armed"]:
+        return False
+    return close > p["trigger"] if p["op"] == ">" else close < p["trigger"]
+
 
 def check_exit_long(entry_price: float,
                     entry_bar_counter: int, current_bar_counter: int,
@@ -493,6 +873,25 @@ def check_exit_short(entry_price: float,
             "start_extension": False}
 
 
+def intrabar_exit_levels(sub: str, entry_price: float, entry_regime: str = "NA",
+                         extension_active: bool = False) -> dict:
+    """
+    check_exit_long / check_exit_short 中「盤中一觸價就出場」的價位（回測以該價位成交）：
+    SafeNet、TP（regime 查表）、延長期的 BE。MFE-trail / MaxHold 看收盤價，不在此列。
+
+    Returns:
+        {"SafeNet": float, "TP": float, "BE": float 或 None}
+        L：價格 <= SafeNet / BE 或 >= TP 觸發；S 方向相反
+    """
+    if sub == "L":
+        return {"SafeNet": entry_price * (1 - L_SAFENET_PCT),
+                "TP": entry_price * (1 + get_l_tp(entry_regime)),
+                "BE": entry_price if extension_active else None}
+    return {"SafeNet": entry_price * (1 + S_SAFENET_PCT),
+            "TP": entry_price * (1 - S_TP_PCT),
+            "BE": entry_price if extension_active else None}
+
+
 def compute_pnl(entry_price: float, exit_price: float, side: str) -> tuple:
     """
     計算損益。
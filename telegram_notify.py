@@ -3,16 +3,19 @@ Telegram 通知模組（v7）
 
 功能：
   - 發送通知（進場/出場/告警/心跳）— 支援多個 chat_id（逗號分隔，私聊/群組皆可）
-  - 接收指令（/cleanup /status /help）— 來源限 TELEGRAM_CHAT_ID 清單內的聊天室
+  - 接收指令（/cleanup /status /help）— 來源限 TELEGRAM_CHAT_ID 清單內的聊天室；
+    getUpdates 長輪詢（有訊息立刻回，閒置時一次掛 25 秒）
   - 管理員白名單（TELEGRAM_ADMIN_IDS）— 控制類指令的把關資料由此提供，主程式執行檢查
   - 指令回覆導向：回覆只發回「下指令的那個聊天室」，不廣播（用 thread-local，
     與主循環的廣播通知互不干擾）
+  - 非阻塞寄件匣（telegram_outbox）：常駐機器人呼叫 start_outbox() 後，發送只入佇列就返回
 """
 import os
 import logging
 import html
 import re
 import threading
+import time
 import requests
 from dotenv import load_dotenv
 from datetime import datetime
@@ -29,6 +32,7 @@ _last_update_id = 0
 # 指令回覆導向（thread-local）：指令監聽執行緒設定後，該執行緒發的訊息只回原聊天室；
 # 主循環執行緒從未設定 → 通知照常廣播到所有 chat_id
 _reply_local = threading.local()
+_timing_local = threading.local()
 
 
 def get_chat_ids():
@@ -146,41 +150,100 @@ def send_telegram_message(
     else:
         targets = [cid for cid in chat_ids if not str(cid).strip().startswith("-")]
 
+    t0 = time.monotonic()
+    try:
+        if _outbox is not None:
+            # 寄件匣：各 chat 套好隱私遮罩後入佇列，背景執行緒負責送（不阻塞呼叫端）
+            for cid in targets:
+                _outbox.put(cid, _apply_privacy(message, cid))
+        else:
+            _send_to(url, targets, message)
+    finally:
+        _timing_local.seconds = thread_send_seconds() + time.monotonic() - t0
+
+
+_outbox = None
+
+
+def start_outbox():
+    """常駐進程（main_eth）啟用非阻塞寄件匣；TELEGRAM_OUTBOX=0 或沒設 token 時維持同步發送。"""
+    global _outbox
+    import telegram_outbox
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if _outbox is not None or not telegram_outbox.ENABLED or not token:
+        return _outbox
+    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    _outbox = telegram_outbox.start(lambda cid, text: _deliver(url, cid, text))
+    return _outbox
+
+
+def flush_outbox(timeout: float = 5.0) -> bool:
+    """等寄件匣送完（關機前用）；沒啟用寄件匣直接回 True"""
+    return _outbox.flush(timeout) if _outbox is not None else True
+
+
+def thread_send_seconds() -> float:
+    """本執行緒累計花在 Telegram 發送的秒數（cycle 計時用：前後相減 = 這段期間的發送耗時）"""
+    return getattr(_timing_local, "seconds", 0.0)
+
+
+def _deliver(url, cid, text):
+    """單次送出一則（已套好隱私遮罩）。HTML 解析失敗以純文字保底重送。
+
+    Returns:
+        (status, wait)：status 為 "ok" / "retry"（429 / 5xx / 網路錯誤）/ "drop"（其他錯誤），
+        wait 為 retry 時建議等待秒數（429 用 Telegram 給的 retry_after）
+    """
+    data = {
+        "chat_id": cid,
+        "text": text,
+        "parse_mode": "HTML"  # 使用 HTML 解析模式，更穩定
+    }
+    try:
+        response = requests.post(url, data=data, timeout=10)
+    except Exception as e:
+        logger.debug(f"Telegram post error ({cid}): {e}")
+        return "retry", 1.0
+    if response.status_code == 200:
+        return "ok", 0.0
+    # HTML 解析失敗時以純文字保底重送，避免整點通知整則遺失。
+    if (response.status_code == 400
+            and "can't parse entities" in response.text):
+        try:
+            fallback = requests.post(url, data={"chat_id": cid, "text": _plain_text_fallback(text)},
+                                     timeout=10)
+            if fallback.status_code == 200:
+                logger.warning("Telegram HTML parse failed for %s; sent plain-text fallback", cid)
+                return "ok", 0.0
+        except Exception as e:
+            logger.debug(f"Telegram fallback error ({cid}): {e}")
+    # 429 = rate limit，等 Telegram 指定的秒數再試
+    if response.status_code == 429:
+        try:
+            wait = float(response.json().get("parameters", {}).get("retry_after", 2))
+        except Exception:
+            wait = 2.0
+        return "retry", wait
+    if response.status_code >= 500:
+        return "retry", 1.0
+    # 群組升級 supergroup：chat id 已變更，自動偵測新 id 並通知其他聊天室
+    _check_chat_migrated(cid, response, url)
+    print(f"[TG] failed ({cid}): {response.status_code} {response.text}")
+    return "drop", 0.0
+
+
+def _send_to(url, targets, message):
+    """同步發送（未啟用寄件匣時）：每個 chat 最多 3 次"""
     for cid in targets:
-        data = {
-            "chat_id": cid,
-            "text": _apply_privacy(message, cid),  # 群組隱藏 [[HIDE]] 段（錢包金額等）
-            "parse_mode": "HTML"  # 使用 HTML 解析模式，更穩定
-        }
+        text = _apply_privacy(message, cid)  # 群組隱藏 [[HIDE]] 段（錢包金額等）
         for attempt in range(3):
-            try:
-                response = requests.post(url, data=data, timeout=10)
-                if response.status_code == 200:
-                    break
-                # HTML 解析失敗時以純文字保底重送，避免整點通知整則遺失。
-                if (response.status_code == 400
-                        and "can't parse entities" in response.text):
-                    fallback_data = {
-                        "chat_id": cid,
-                        "text": _plain_text_fallback(data["text"]),
-                    }
-                    fallback = requests.post(url, data=fallback_data, timeout=10)
-                    if fallback.status_code == 200:
-                        logger.warning("Telegram HTML parse failed for %s; sent plain-text fallback", cid)
-                        break
-                # 429 = rate limit，等一下再試
-                if response.status_code == 429:
-                    import time; time.sleep(2)
-                    continue
-                # 群組升級 supergroup：chat id 已變更，自動偵測新 id 並通知其他聊天室
-                _check_chat_migrated(cid, response, url)
-                print(f"[TG] failed ({cid}): {response.status_code} {response.text}")
+            status, wait = _deliver(url, cid, text)
+            if status != "retry":
                 break
-            except Exception as e:
-                if attempt < 2:
-                    import time; time.sleep(1)
-                else:
-                    print(f"[TG] error after 3 attempts ({cid}): {e}")
+            if attempt < 2:
+                time.sleep(min(wait, 5.0))
+            else:
+                print(f"[TG] error after 3 attempts ({cid})")
 
 
 _migration_notified = set()  # 每個舊 id 只提醒一次，避免每則訊息都轟炸
@@ -216,9 +279,53 @@ def _check_chat_migrated(cid, response, url):
 #  Telegram 指令接收
 # ══════════════════════════════════════════════════════════════
 
-def get_pending_commands():
+# getUpdates 專用連線（長輪詢一次掛 25 秒，keep-alive 不必每次重新握手）
+_POLL_HTTP = requests.Session()
+
+
+def poll_updates(token, offset, timeout=0, limit=10, session=None):
+    """一次 getUpdates。timeout>0 為長輪詢：沒有新訊息時 Telegram 最多掛住 timeout 秒才回。
+
+    Returns:
+        list[dict] | None: update 列表；HTTP / API 錯誤（含 409 另一個進程在收）回 None
+    """
+    url = f"https://api.telegram.org/bot{token}/getUpdates"
+    params = {"offset": offset, "timeout": int(timeout), "limit": limit,
+              "allowed_updates": '["message"]'}
+    try:
+        resp = (session or _POLL_HTTP).get(url, params=params, timeout=timeout + 10)
+        if resp.status_code != 200:
+            logger.debug(f"getUpdates HTTP {resp.status_code}: {resp.text[:200]}")
+            return None
+        data = resp.json()
+        if not data.get("ok"):
+            return None
+        return data.get("result", [])
+    except Exception as e:
+        logger.debug(f"getUpdates error: {e}")
+        return None
+
+
+def command_from_update(update, allowed):
+    """update → (指令文字, 發訊人 user id, 來源 chat id)；非指令或非授權聊天室回 None"""
+    msg = update.get("message", {})
+    # 只處理來自授權 chat_id 清單的訊息
+    chat_id = str(msg.get("chat", {}).get("id"))
+    if chat_id not in allowed:
+        return None
+    text = msg.get("text", "").strip()
+    if not text.startswith("/"):
+        return None
+    from_id = str(msg.get("from", {}).get("id", ""))
+    return text, from_id, chat_id
+
+
+def get_pending_commands(timeout=0):
     """輪詢 Telegram getUpdates，回傳新指令列表。
 
+    Args:
+        timeout: 長輪詢秒數（0 = 立即返回的短輪詢）；有新訊息時 Telegram 立刻回，不必等滿
+
     Returns:
         list[tuple[str, str, str]]: (指令文字, 發訊人 user id, 來源 chat id)。
         來源限 TELEGRAM_CHAT_ID 清單內的聊天室；發訊人 id 供主程式做管理員白名單檢查。
@@ -229,33 +336,16 @@ def get_pending_commands():
     if not token or not allowed:
         return []
 
-    url = f"https://api.telegram.org/bot{token}/getUpdates"
-    params = {"offset": _last_update_id + 1, "timeout": 0, "limit": 10}
-    try:
-        resp = requests.get(url, params=params, timeout=5)
-        if resp.status_code != 200:
-            return []
-        data = resp.json()
-        if not data.get("ok"):
-            return []
-
-        commands = []
-        for update in data.get("result", []):
-            uid = update["update_id"]
-            _last_update_id = max(_last_update_id, uid)
-            msg = update.get("message", {})
-            # 只處理來自授權 chat_id 清單的訊息
-            chat_id = str(msg.get("chat", {}).get("id"))
-            if chat_id not in allowed:
-                continue
-            text = msg.get("text", "").strip()
-            if text.startswith("/"):
-                from_id = str(msg.get("from", {}).get("id", ""))
-                commands.append((text, from_id, chat_id))
-        return commands
-    except Exception as e:
-        logger.debug(f"getUpdates error: {e}")
+    updates = poll_updates(token, _last_update_id + 1, timeout)
+    if not updates:
         return []
+    commands = []
+    for update in updates:
+        _last_update_id = max(_last_update_id, update["update_id"])
+        cmd = command_from_update(update, allowed)
+        if cmd is not None:
+            commands.append(cmd)
+    return commands
 
 
 def skip_old_updates():
@@ -264,14 +354,7 @@ def skip_old_updates():
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         return
-    url = f"https://api.telegram.org/bot{token}/getUpdates"
-    try:
-        resp = requests.get(url, params={"offset": -1, "limit": 1}, timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            results = data.get("result", [])
-            if results:
-                _last_update_id = results[-1]["update_id"]
-                logger.info(f"Skipped old Telegram updates, last_id={_last_update_id}")
-    except Exception:
-        pass
\ No newline at end of file
+    results = poll_updates(token, -1, 0, limit=1)
+    if results:
+        _last_update_id = results[-1]["update_id"]
+        logger.info(f"Skipped old Telegram updates, last_id={_last_update_id}")
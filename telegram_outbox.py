@@ -0,0 +1,258 @@
+"""
+Telegram 非阻塞寄件匣 — send_telegram_message 只把訊息丟進有界佇列就返回（微秒級），
+背景執行緒依各聊天室速率限制送出、把塞車期間的連發合併成一則，未送達的訊息存檔、重啟後續送。
+
+原本每則通知對每個 chat 同步 POST、最多 3 次重試夾 time.sleep；主迴圈、指令執行緒，
+甚至 Executor 持 self._lock 時（平倉失敗、健康度轉換告警）都會被 Telegram API 卡住。
+
+  - 佇列：queue.Queue(OUTBOX_MAX)，滿了丟棄並計數（不擋呼叫端）
+  - 速率：同一 chat 兩則間隔 ≥ 1s（群組 3s，Telegram 群組 20 則 / 分鐘）；全域 ≥ 1/25s
+  - 合併：chat 冷卻中累積的訊息，輪到時合併成一則送出（上限 MAX_LEN 字元，超過分批）
+  - 重試：429 依 retry_after、5xx / 網路錯誤指數退避（上限 60s）；其他 4xx 丟棄（同原本只印錯誤）
+  - 持久化：待送清單變動就寫 INSTANCE_DIR/telegram_outbox.json（tmp + replace）；
+            重啟載入，超過 MAX_AGE 的丟棄，其餘加註「重啟前未送出」後照常送
+  - flush(timeout)：關機前等寄件匣清空（atexit 也會呼叫）
+
+只由常駐的機器人進程啟用（telegram_notify.start_outbox()）；一次性腳本 / 儀表板維持同步發送。
+TELEGRAM_OUTBOX=0 關閉。
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+import paths
+
+logger = logging.getLogger("telegram_outbox")
+
+ENABLED = os.getenv("TELEGRAM_OUTBOX", "1").strip() != "0"
+OUTBOX_FILE = os.path.join(paths.INSTANCE_DIR, "telegram_outbox.json")
+OUTBOX_MAX = 500          # 佇列 + 待送合計上限（則）
+MAX_LEN = 4000            # 合併後單則上限（Telegram 4096）
+MAX_AGE = 24 * 3600       # 重啟時丟棄超過此秒數的舊訊息
+CHAT_GAP = 1.0            # 私聊兩則最小間隔（秒）
+GROUP_GAP = 3.0           # 群組兩則最小間隔
+GLOBAL_GAP = 1 / 25       # 全域兩則最小間隔（Telegram 約 30 則 / 秒）
+MAX_BACKOFF = 60.0
+JOIN = "\n\n"
+
+
+class Outbox:
+    """
+    send_fn(chat_id, text) -> (status, wait)：status 為 "ok" / "retry" / "drop"，
+    wait 為 retry 時建議等待秒數（telegram_notify._deliver）。
+    """
+
+    def __init__(self, send_fn, path: str = None, maxsize: int = OUTBOX_MAX):
+        self.send_fn = send_fn
+        self.path = path or OUTBOX_FILE
+        self.maxsize = maxsize
+        self._q = queue.Queue(maxsize=maxsize)
+        self._pending = {}      # chat_id -> deque[(ts, text)]
+        self._next_ok = {}      # chat_id -> 下次可送的 epoch 秒
+        self._backoff = {}      # chat_id -> 目前退避秒數
+        self._last_send = 0.0
+        self._dirty = False
+        self._idle = threading.Event()
+        self._idle.set()
+        self._idle_lock = threading.Lock()  # idle 旗標與 put 互斥，flush 不會在訊息剛進佇列時誤判清空
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.dropped = 0
+        self._load()
+
+    # ── 呼叫端 ──
+
+    def put(self, chat_id, text: str) -> bool:
+        """非阻塞；佇列滿回 False（訊息丟棄）"""
+        try:
+            with self._idle_lock:
+                self._idle.clear()
+                self._q.put_nowait((time.time(), str(chat_id), text))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Telegram outbox full, dropped message to {chat_id}")
+            return False
+
+    def start(self) -> "Outbox":
+        self._thread = threading.Thread(target=self._run, name="telegram_outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self.flush(timeout)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._save()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等到佇列與待送都清空（或逾時）。回傳是否已清空"""
+        return self._idle.wait(timeout)
+
+    def pending_count(self) -> int:
+        return self._q.qsize() + sum(len(d) for d in self._pending.values())
+
+    # ── 背景執行緒 ──
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._drain(self._wait_time())
+                if self._dirty:
+                    self._save()
+                self._send_ready()
+                if self._dirty:
+                    self._save()
+                with self._idle_lock:
+                    if not self._pending and self._q.empty():
+                        self._idle.set()
+            except Exception as e:
+                logger.warning(f"Telegram outbox loop error: {e}")
+                time.sleep(1)
+
+    def _wait_time(self) -> float:
+        """下一個 chat 可送前最多睡多久（有新訊息會提早醒來）"""
+        if not self._pending:
+            return 1.0
+        now = time.time()
+        soonest = min(self._next_ok.get(cid, 0.0) for cid in self._pending)
+        return min(1.0, max(0.0, soonest - now, self._last_send + GLOBAL_GAP - now))
+
+    def _drain(self, timeout: float):
+        try:
+            item = self._q.get(timeout=timeout) if timeout > 0 else self._q.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            ts, cid, text = item
+            self._pending.setdefault(cid, deque()).append((ts, text))
+            self._dirty = True
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                break
+        self._trim()
+
+    def _trim(self):
+        """待送超過上限 → 丟最舊的"""
+        total = sum(len(d) for d in self._pending.values())
+        while total > self.maxsize:
+            cid = min(self._pending, key=lambda c: self._pending[c][0][0])
+            self._pending[cid].popleft()
+            if not self._pending[cid]:
+                del self._pending[cid]
+            self.dropped += 1
+            total -= 1
+
+    def _batch(self, cid) -> tuple:
+        """從 chat 的待送取出可合併的前 k 則：(k, 合併文字)"""
+        dq = self._pending[cid]
+        parts, size = [], 0
+        for _, text in dq:
+            add = len(text) + (len(JOIN) if parts else 0)
+            if parts and size + add > MAX_LEN:
+                break
+            parts.append(text)
+            size += add
+        return len(parts), JOIN.join(parts)
+
+    def _send_ready(self):
+        now = time.time()
+        for cid in list(self._pending):
+            if now < self._next_ok.get(cid, 0.0):
+                continue
+            wait = self._last_send + GLOBAL_GAP - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            k, text = self._batch(cid)
+            try:
+                status, retry_after = self.send_fn(cid, text)
+            except Exception as e:
+                status, retry_after = "retry", 1.0
+                logger.debug(f"Telegram send error ({cid}): {e}")
+            self._last_send = time.time()
+            gap = GROUP_GAP if cid.startswith("-") else CHAT_GAP
+            if status == "retry":
+                back = min(MAX_BACKOFF, max(retry_after or 0.0, self._backoff.get(cid, 0.5) * 2))
+                self._backoff[cid] = back
+                self._next_ok[cid] = self._last_send + back
+                continue
+            # ok / drop：前 k 則都算處理完
+            for _ in range(k):
+                self._pending[cid].popleft()
+            if not self._pending[cid]:
+                del self._pending[cid]
+            if status == "ok":
+                self.sent += k
+            else:
+                self.dropped += k
+            self._backoff.pop(cid, None)
+            self._next_ok[cid] = self._last_send + gap
+            self._dirty = True
+
+    # ── 持久化 ──
+
+    def _save(self):
+        items = [{"chat_id": cid, "ts": ts, "text": text}
+                 for cid, dq in self._pending.items() for ts, text in dq]
+        try:
+            if not items:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+            else:
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as fh:
+                    json.dump(items, fh, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            self._dirty = False
+        except Exception as e:
+            logger.warning(f"Telegram outbox save failed: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                items = json.load(fh)
+        except Exception as e:
+            logger.warning(f"Telegram outbox load failed ({e}), starting empty")
+            return
+        now = time.time()
+        kept = 0
+        for it in items:
+            ts = float(it.get("ts", now))
+            if now - ts > MAX_AGE:
+                self.dropped += 1
+                continue
+            stamp = datetime.fromtimestamp(ts).strftime("%m-%d %H:%M:%S")
+            text = f"⏳ 重啟前未送出（{stamp}）\n{it['text']}"
+            self._pending.setdefault(str(it["chat_id"]), deque()).append((ts, text))
+            kept += 1
+        if kept:
+            self._idle.clear()
+            self._dirty = True
+            logger.info(f"Telegram outbox restored {kept} undelivered message(s)")
+
+
+_outbox = None
+
+
+def start(send_fn) -> Outbox:
+    """啟動進程內唯一的寄件匣（重複呼叫回傳同一個）；關機時 atexit 盡量送完"""
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox(send_fn).start()
+        atexit.register(_outbox.stop)
+    return _outbox
+
+
+def get() -> Outbox:
+    return _outbox
@@ -0,0 +1,234 @@
+"""
+多實例共用 Telegram 指令接收 — 一個進程對每支 bot token 各掛一條 getUpdates 長輪詢，
+依來源 chat id 把指令投遞到對應實例的收件匣；實例不再各自輪詢 Telegram。
+
+原本每個實例的指令執行緒每 10 秒短輪詢一次（timeout=0）：每實例每天 8,640 次空請求，
+/status /pause /signal 最多晚 10 秒才處理。單實例現在改為自己長輪詢（main_eth，TELEGRAM_LONG_POLL），
+多實例可再改由本進程統一接收：
+
+  接收端（單一進程，deploy/cryptobot-telegram.service）：
+      python telegram_poller.py
+    掃 INSTANCES_GLOB 下各實例的 .env（TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID），同 token 的實例合併成
+    一條長輪詢（timeout=25）；收到指令 → 寫進每個授權該 chat 的實例收件匣
+    INSTANCE_DIR/telegram_inbox/<ns>_<update_id>.json（tmp + os.replace）。每 60 秒重掃新實例。
+
+  實例端（.env 設 TELEGRAM_POLL_MODE=shared）：
+    指令執行緒每 0.5 秒看一次收件匣目錄（本機 listdir，不打網路），依序取出、刪檔、照常 dispatch。
+    接收端心跳（cache/telegram_poller.alive）超過 HEARTBEAT_STALE 秒沒更新 → 退回自己長輪詢（fail-open）。
+
+同一支 token 只能有一個 getUpdates 消費者（另一個會收到 409），所以 shared 模式下實例只在接收端掛掉時才自己收。
+
+檢查：
+    python telegram_poller.py --show
+"""
+import os
+import sys
+import json
+import glob
+import time
+import logging
+import argparse
+import threading
+
+import requests
+from dotenv import dotenv_values
+
+import paths
+
+logger = logging.getLogger("telegram_poller")
+
+INSTANCES_GLOB = os.getenv("TELEGRAM_POLLER_INSTANCES", "/home/cryptobot/instances/*")
+LONG_POLL = 25            # getUpdates 長輪詢秒數（Telegram 上限 50）
+RESCAN_SECONDS = 60       # 重掃實例目錄
+HEARTBEAT_FILE = os.path.join(paths.CODE_DIR, "cache", "telegram_poller.alive")  # 所有實例共用
+HEARTBEAT_STALE = 90      # 實例端：心跳超過此秒數未更新 → 視為接收端掛了
+INBOX_POLL = 0.5          # 實例端收件匣檢查間隔
+INBOX_MAX_AGE = 300       # 實例端丟棄超過此秒數的指令（接收端 / 實例停很久後才撿到的舊指令）
+
+
+def enabled() -> bool:
+    """此實例是否改讀共用接收端的收件匣（TELEGRAM_POLL_MODE=shared）"""
+    return os.getenv("TELEGRAM_POLL_MODE", "").strip().lower() == "shared"
+
+
+def inbox_dir(instance_dir: str = None) -> str:
+    return os.path.join(instance_dir or paths.INSTANCE_DIR, "telegram_inbox")
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 實例端
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def poller_alive(path: str = None) -> bool:
+    path = path or HEARTBEAT_FILE
+    try:
+        return time.time() - os.path.getmtime(path) < HEARTBEAT_STALE
+    except OSError:
+        return False
+
+
+def clear_inbox(instance_dir: str = None) -> int:
+    """啟動時清掉收件匣（同 skip_old_updates：不執行啟動前的舊指令）。回傳清掉幾則"""
+    d = inbox_dir(instance_dir)
+    n = 0
+    for name in os.listdir(d) if os.path.isdir(d) else []:
+        try:
+            os.remove(os.path.join(d, name))
+            n += 1
+        except OSError:
+            pass
+    return n
+
+
+def read_inbox(instance_dir: str = None) -> list:
+    """取出收件匣全部指令（依寫入順序），讀完即刪。
+
+    Returns:
+        list[tuple[str, str, str]]: 同 telegram_notify.get_pending_commands
+    """
+    d = inbox_dir(instance_dir)
+    try:
+        names = sorted(n for n in os.listdir(d) if n.endswith(".json"))
+    except OSError:
+        return []
+    commands = []
+    now = time.time()
+    for name in names:
+        path = os.path.join(d, name)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                item = json.load(fh)
+            os.remove(path)
+        except Exception as e:
+            logger.debug(f"inbox read {name} failed: {e}")
+            continue
+        if now - float(item.get("ts", now)) > INBOX_MAX_AGE:
+            logger.info(f"Dropped stale command {item.get('text')!r} from inbox")
+            continue
+        commands.append((item["text"], item["from_id"], item["chat_id"]))
+    return commands
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 接收端
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def discover(pattern: str = None) -> dict:
+    """{token: [(實例目錄, 授權 chat id 集合), ...]}；沒設 token / chat id 的實例略過"""
+    out = {}
+    for inst in sorted(glob.glob(pattern or INSTANCES_GLOB)):
+        env_path = os.path.join(inst, ".env")
+        if not os.path.isfile(env_path):
+            continue
+        env = dotenv_values(env_path)
+        token = (env.get("TELEGRAM_BOT_TOKEN") or "").strip()
+        chats = {c.strip() for c in (env.get("TELEGRAM_CHAT_ID") or "").split(",") if c.strip()}
+        if token and chats:
+            out.setdefault(token, []).append((inst, chats))
+    return out
+
+
+def deliver(update: dict, routes: list) -> list:
+    """把一則 update 投遞到授權該 chat 的每個實例收件匣。回傳收到的實例目錄"""
+    from telegram_notify import command_from_update
+    got = []
+    for inst, chats in routes:
+        cmd = command_from_update(update, chats)
+        if cmd is None:
+            continue
+        text, from_id, chat_id = cmd
+        d = inbox_dir(inst)
+        try:
+            os.makedirs(d, exist_ok=True)
+            path = os.path.join(d, f"{time.time_ns()}_{update['update_id']}.json")
+            with open(path + ".tmp", "w", encoding="utf-8") as fh:
+                json.dump({"text": text, "from_id": from_id, "chat_id": chat_id,
+                           "update_id": update["update_id"], "ts": time.time()},
+                          fh, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            got.append(inst)
+        except Exception as e:
+            logger.warning(f"deliver to {inst} failed: {e}")
+    return got
+
+
+class TokenPoller(threading.Thread):
+    """一支 bot token 一條長輪詢；routes 由主迴圈重掃時更新"""
+
+    def __init__(self, token: str, routes: list):
+        super().__init__(name=f"tg_poll_{token.split(':')[0]}", daemon=True)
+        self.token = token
+        self.routes = routes
+        self.offset = 0
+        self.session = requests.Session()
+
+    def run(self):
+        from telegram_notify import poll_updates
+        last = poll_updates(self.token, -1, 0, limit=1, session=self.session)  # 跳過啟動前的舊訊息
+        if last:
+            self.offset = last[-1]["update_id"] + 1
+        while True:
+            updates = poll_updates(self.token, self.offset, LONG_POLL, limit=100, session=self.session)
+            if updates is None:
+                time.sleep(5)  # 網路錯誤 / 409（實例在自己收）→ 稍後再試
+                continue
+            for update in updates:
+                self.offset = max(self.offset, update["update_id"] + 1)
+                got = deliver(update, self.routes)
+                if got:
+                    logger.info(f"update {update['update_id']} → {[os.path.basename(g) for g in got]}")
+
+
+def _touch(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a"):
+        os.utime(path, None)
+
+
+def serve(pattern: str = None):
+    pollers = {}
+    last_scan = 0.0
+    while True:
+        if time.time() - last_scan >= RESCAN_SECONDS:
+            last_scan = time.time()
+            for token, routes in discover(pattern).items():
+                if token in pollers:
+                    pollers[token].routes = routes
+                    continue
+                pollers[token] = TokenPoller(token, routes)
+                pollers[token].start()
+                logger.info(f"Polling bot {token.split(':')[0]} for "
+                            f"{[os.path.basename(i) for i, _ in routes]}")
+        try:
+            _touch(HEARTBEAT_FILE)
+        except OSError as e:
+            logger.warning(f"heartbeat write failed: {e}")
+        time.sleep(5)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="多實例共用 Telegram 指令接收端")
+    ap.add_argument("--show", action="store_true", help="列出實例 / bot 分組與收件匣待處理數")
+    ap.add_argument("--instances", default=None, help=f"實例目錄 glob（預設 {INSTANCES_GLOB}）")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    if args.show:
+        groups = discover(args.instances)
+        print(f"Heartbeat: {'alive' if poller_alive() else 'stale / missing'} ({HEARTBEAT_FILE})")
+        for token, routes in groups.items():
+            print(f"bot {token.split(':')[0]}:")
+            for inst, chats in routes:
+                d = inbox_dir(inst)
+                n = len(os.listdir(d)) if os.path.isdir(d) else 0
+                print(f"  {os.path.basename(inst):<16} chats={sorted(chats)} inbox={n}")
+        if not groups:
+            print(f"No instances with TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID under {args.instances or INSTANCES_GLOB}")
+        return 0
+
+    serve(args.instances)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
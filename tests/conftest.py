@@ -0,0 +1,25 @@
+"""tests/ 從 repo 根目錄 import 頂層模組（strategy / indicator_state / binance_trade ...）"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_exchange(monkeypatch):
+    """binance_trade 接上假交易所（tests/fake_binance.FakeClient）；鏡像 / 快取 / 冷卻每個測試重置"""
+    import fake_binance
+    bt = fake_binance.load_binance_trade()
+    ex = fake_binance.FakeClient()
+    monkeypatch.setattr(bt, "client", ex)
+    monkeypatch.setattr(bt, "new_session", lambda: ex)
+    monkeypatch.setattr(bt, "send_telegram_message", lambda *a, **k: None)
+    monkeypatch.setattr(bt, "_symbol_info_cache", {})
+    monkeypatch.setattr(bt, "last_trade_time", {})
+    monkeypatch.setattr(bt, "_algo_orders", {})
+    monkeypatch.setattr(bt, "_open_orders", {})
+    monkeypatch.setattr(bt, "_mirror_synced", {})
+    monkeypatch.setattr(bt, "_algo_synced", {})
+    return bt, ex
@@ -0,0 +1,155 @@
+"""
+測試用假交易所：在記憶體裡模擬 Hedge Mode 倉位、市價單 / batchOrders、algo 條件單。
+
+只給 tests/ 用（conftest 的 fake_exchange fixture 把它換進 binance_trade.client）。
+沒裝 binance-futures-connector 時另外在 sys.modules 放最小的 binance 套件殼，讓 binance_trade 能 import。
+"""
+import sys
+import types
+import itertools
+import threading
+import importlib.util
+from unittest import mock
+
+
+def load_binance_trade():
+    """import binance_trade（不連網：sync_time 的 requests.get 直接失敗）"""
+    if "binance_trade" in sys.modules:
+        return sys.modules["binance_trade"]
+    if importlib.util.find_spec("binance") is None:
+        _install_sdk_shell()
+    with mock.patch("requests.get", side_effect=OSError("offline")):
+        import binance_trade
+    return binance_trade
+
+
+def _install_sdk_shell():
+    import time
+
+    def get_timestamp():
+        return int(time.time() * 1000)
+
+    pkg = types.ModuleType("binance")
+    pkg.__path__ = []
+    um = types.ModuleType("binance.um_futures")
+    um.UMFutures = FakeClient
+    lib = types.ModuleType("binance.lib")
+    lib.__path__ = []
+    utils = types.ModuleType("binance.lib.utils")
+    utils.get_timestamp = get_timestamp
+    api = types.ModuleType("binance.api")
+    api.get_timestamp = get_timestamp
+    pkg.um_futures, pkg.lib, pkg.api, lib.utils = um, lib, api, utils
+    sys.modules.update({"binance": pkg, "binance.um_futures": um, "binance.lib": lib,
+                        "binance.lib.utils": utils, "binance.api": api})
+
+
+class FakeClient:
+    """UMFutures 的替身。calls 依序記錄每次 API 呼叫；fail_leg / batch_error 注入錯誤"""
+
+    def __init__(self, key=None, secret=None, base_url=None):
+        self.price = 2000.0
+        self.hedge = True
+        self.positions = {"LONG": 0.0, "SHORT": 0.0}
+        self.calls = []
+        self.batches = []          # 每次 batchOrders 的腿 [(positionSide, quantity)]
+        self.fail_leg = {}         # positionSide -> 錯誤碼：下一次 batchOrders 該腿回錯
+        self.batch_error = None    # 整支 batchOrders 拋出的例外（送出後才拋 = 已成交但回應遺失）
+        self.algo_error = None     # 下一次 POST algoOrder 拋出的例外
+        self.algos = {}            # algoId -> 交易所上的 open algo 單
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1000)
+
+    def _fill(self, p):
+        ps, qty = p["positionSide"], float(p["quantity"])
+        opening = (p["side"] == "BUY") == (ps == "LONG")
+        with self.lock:
+            self.positions[ps] = self.positions[ps] + qty if opening else max(0.0, self.positions[ps] - qty)
+            return {"orderId": next(self._ids), "avgPrice": str(self.price), "executedQty": str(qty),
+                    "status": "FILLED", "positionSide": ps}
+
+    # ── 下單 ──
+    def new_order(self, **p):
+        self.calls.append("new_order")
+        if not self.hedge:
+            raise Exception("(400, -4061, \"Order's position side does not match user's setting.\")")
+        return self._fill(p)
+
+    def new_batch_order(self, batchOrders):
+        self.calls.append("new_batch_order")
+        self.batches.append([(p["positionSide"], p["quantity"]) for p in batchOrders])
+        out = []
+        for p in batchOrders:
+            assert all(isinstance(v, str) for v in p.values())
+            code = self.fail_leg.pop(p["positionSide"], None)
+            if code == -4061:
+                self.hedge = False
+                out.append({"code": -4061, "msg": "Order's position side does not match user's setting."})
+            elif code:
+                out.append({"code": code, "msg": "stub error"})
+            else:
+                out.append(self._fill(p))
+        if self.batch_error is not None:
+            e, self.batch_error = self.batch_error, None
+            raise e
+        return out
+
+    def get_position_mode(self):
+        self.calls.append("get_position_mode")
+        return {"dualSidePosition": self.hedge}
+
+    def change_position_mode(self, dualSidePosition):
+        self.calls.append("change_position_mode")
+        self.hedge = dualSidePosition == "true"
+
+    def get_position_risk(self, symbol):
+        self.calls.append("get_position_risk")
+        return [{"symbol": symbol, "positionSide": ps, "positionAmt": str(q if ps == "LONG" else -q),
+                 "entryPrice": str(self.price), "unRealizedProfit": "0", "markPrice": str(self.price),
+                 "leverage": "20"} for ps, q in self.positions.items()]
+
+    def exchange_info(self):
+        return {"symbols": [{"symbol": "ETHUSDT", "filters": [
+            {"filterType": "PRICE_FILTER", "tickSize": "0.01"},
+            {"filterType": "LOT_SIZE", "stepSize": "0.001", "minQty": "0.001"}]}]}
+
+    def mark_price(self, symbol):
+        return {"markPrice": str(self.price)}
+
+    def query_order(self, symbol, orderId):
+        return {"status": "FILLED"}
+
+    # ── 掛單 ──
+    def get_orders(self, symbol):
+        self.calls.append("get_orders")
+        return []
+
+    def cancel_open_orders(self, symbol):
+        self.calls.append("cancel_open_orders")
+
+    def cancel_order(self, **k):
+        self.calls.append("cancel_order")
+
+    def sign_request(self, method, path, params=None, special=False):
+        self.calls.append(f"{method} {path}")
+        if path == "/fapi/v1/openAlgoOrders":
+            return [dict(v, algoId=k) for k, v in self.algos.items()]
+        if path == "/fapi/v1/userTrades":
+            return []
+        if method == "DELETE":
+            if params["algoId"] not in self.algos:
+                raise Exception("(400, -2011, 'Unknown order sent.')")
+            del self.algos[params["algoId"]]
+            return {}
+        if self.algo_error is not None:
+            e, self.algo_error = self.algo_error, None
+            raise e
+        if any(v["positionSide"] == params["positionSide"] and v["orderType"] == params["type"] == "STOP_MARKET"
+               for v in self.algos.values()):
+            raise Exception("(400, -4130, 'An open stop or take profit order with GTE and closePosition "
+                            "in the direction is existing.')")
+        i = next(self._ids)
+        self.algos[i] = {"orderType": params["type"], "positionSide": params["positionSide"],
+                         "side": params["side"], "triggerPrice": params["triggerPrice"],
+                         "algoStatus": "NEW", "symbol": params["symbol"]}
+        return {"algoId": i, "algoStatus": "NEW"}
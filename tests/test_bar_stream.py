@@ -0,0 +1,67 @@
+"""bar_stream：錄下來的 kline WS 訊息序列 → 收盤偵測、去重、REST 格式轉換、逾時退回 REST 時程"""
+import json
+import time
+
+import bar_stream
+
+H = 3_600_000
+T0 = 1767225600000  # 2026-01-01 00:00 UTC
+
+
+def _msg(open_ms, close, closed, **extra):
+    """Binance <symbol>@kline_1h 推送的原始訊息（字串）"""
+    k = {"t": open_ms, "T": open_ms + H - 1, "s": "ETHUSDT", "i": "1h", "f": 1, "L": 2,
+         "o": "2000.00", "c": f"{close:.2f}", "h": "2010.00", "l": "1990.00", "v": "123.4",
+         "n": 42, "x": closed, "q": "246800.0", "V": "60.1", "Q": "120200.0", "B": "0"}
+    k.update(extra)
+    return json.dumps({"e": "kline", "E": open_ms + H, "s": "ETHUSDT", "k": k})
+
+
+RECORDED = [
+    _msg(T0, 2001.0, False),
+    _msg(T0, 2003.5, False),
+    _msg(T0, 2004.25, True),            # 第一根收盤
+    _msg(T0 + H, 2004.5, False),
+    "not json",                          # 壞訊息
+    json.dumps({"result": None, "id": 1}),  # 訂閱回覆
+    _msg(T0, 2004.25, True),            # 重連後重送同一根
+    _msg(T0 + H, 1999.0, False),
+    _msg(T0 + H, 1998.75, True),        # 第二根收盤
+    _msg(T0 - H, 1990.0, True),         # 更舊的 bar（亂序）
+]
+
+
+def test_recorded_sequence_detects_each_close_once():
+    s = bar_stream.BarCloseStream()
+    fired = [k for k in map(s.feed, RECORDED) if k is not None]
+    assert [k[0] for k in fired] == [T0, T0 + H]
+    assert fired[0][4] == "2004.25" and fired[1][4] == "1998.75"
+    assert fired[0] == [T0, "2000.00", "2010.00", "1990.00", "2004.25", "123.4", T0 + H - 1,
+                        "246800.0", 42, "60.1", "120200.0", "0"]
+    assert bar_stream.bar_time_str(fired[0]) == "2026-01-01 08:00:00"
+    # 主循環只拿最新一根未消化的收盤 bar；取走後就沒有了
+    assert s.wait_closed(time.time() + 1)[0] == T0 + H
+    assert s.wait_closed(time.time() + 0.05) is None
+
+
+def test_wait_bar_close_skips_processed_bar_and_times_out(monkeypatch):
+    monkeypatch.setattr(bar_stream, "hour_deadline", lambda offset_seconds=10: time.time() + 0.2)
+    s = bar_stream.BarCloseStream()
+    s.feed(RECORDED[2])
+    assert bar_stream.wait_bar_close(s, last_bar_time="2026-01-01 08:00:00") is None  # 已處理過 → 等到逾時
+    s.feed(RECORDED[8])
+    k = bar_stream.wait_bar_close(s, last_bar_time="2026-01-01 08:00:00")
+    assert bar_stream.bar_time_str(k) == "2026-01-01 09:00:00"
+
+
+def test_replay_stream_wakes_per_closed_bar():
+    klines = [[T0 + i * H, "2000", "2010", "1990", str(2000 + i), "1", T0 + (i + 1) * H - 1,
+               "0", 0, "0.5", "0", "0"] for i in range(4)]
+    s = bar_stream.ReplayBarStream(klines, speed=3600 * 20).start()  # 每根 0.05 s
+    got = []
+    for _ in klines:
+        k = s.wait_closed(time.time() + 2)
+        assert k is not None
+        got.append(k[0])
+    s.stop()
+    assert got == [k[0] for k in klines]
@@ -0,0 +1,63 @@
+"""Executor 狀態：主循環推進 bar 走鎖並發布快照；state_journal 重放回到當機前狀態"""
+from datetime import datetime
+
+import pytest
+
+import executor as executor_mod
+
+
+@pytest.fixture
+def make_executor(tmp_path, fake_exchange):
+    return lambda: executor_mod.Executor(state_path=str(tmp_path / "eth_state.json"))
+
+
+def test_advance_bar_publishes_snapshot(make_executor):
+    ex = make_executor()
+    snap = ex.snapshot()
+    assert ex.advance_bar("2026-01-01 08:00:00")
+    assert ex.snapshot() is not snap and ex.snapshot().bar_counter == snap.bar_counter + 1
+    assert not ex.advance_bar("2026-01-01 08:00:00")  # 同一根 bar 不重複推進
+    assert ex.bar_counter == snap.bar_counter + 1
+    assert ex.advance_bar("2026-01-01 09:00:00") and ex.snapshot().bar_counter == snap.bar_counter + 2
+
+
+def _state(ex):
+    """save_state 會寫出的欄位（當機前 / 重放後比對用）"""
+    return {k: getattr(ex, k) for k in (
+        "positions", "last_exits", "bar_counter", "last_bar_time", "trade_number", "daily_stats",
+        "monthly_pnl", "monthly_entries", "monthly_key", "daily_pnl", "daily_key",
+        "consec_losses", "consec_loss_cooldown_until", "paused", "last_daily_date")}
+
+
+def test_journal_replay_restores_pre_crash_state(make_executor, monkeypatch, tmp_path):
+    import state_journal
+    monkeypatch.setattr(state_journal, "COMPACT_EVERY", 10_000)  # 全程只追加日誌，不合併快照
+    ex = make_executor()
+    ex.save_state()  # 首次存檔 → 快照
+    for i in range(6):
+        ex.advance_bar(f"2026-01-0{i + 1} 08:00:00")
+        ex.update_period_keys(datetime(2026, 1, i + 1, 8))
+        with ex._lock:
+            ex.trade_number += 1
+            ex.positions[f"t{i}"] = {"side": "long" if i % 2 else "short",
+                                     "sub_strategy": "L" if i % 2 else "S", "entry_regime": "UP",
+                                     "entry_price": 2000.0 + i, "qty": 0.1, "mae_pct": -0.1 * i}
+            ex.positions.pop(f"t{i - 2}", None)
+            ex.last_exits["L"] = ex.bar_counter
+        ex.record_open()
+        ex.record_close(-1.5 * i, "SafeNet", 3, commission=0.2)
+        ex.save_state()
+    with ex._lock:
+        ex.paused = True
+        ex.positions["t5"]["pending_exit"] = {"reason": "TP", "price": 2100.0}
+    ex.save_state()
+    before = _state(ex)
+
+    # 當機：日誌最後一行只寫一半
+    with open(state_journal.journal_path(ex.state_path), "a", encoding="utf-8") as f:
+        f.write('{"seq": 999, "ops": [["set", ["paused"], fal')
+    _, _, n = state_journal.load(ex.state_path)
+    assert n == 7  # 確實是從日誌重放（快照只有首次存檔那份）
+
+    after = _state(make_executor())
+    assert after == before
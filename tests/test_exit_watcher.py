@@ -0,0 +1,92 @@
+"""exit_watcher 盤中觸價 vs 整點收盤 bar 的 check_exit_long / check_exit_short：
+同一段盤中路徑只碰到一個觸價價位時，兩邊出場原因相同、TP / BE 成交價相同"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import strategy
+from exit_watcher import ExitWatcher, _ReplayExecutor, ticks_from_frame
+
+INTRABAR = ("SafeNet", "TP", "BE")
+
+
+def _bar_close_exit(pos, path):
+    """整點 cycle 的判斷：把盤中路徑收成一根 bar（bars_held=0：排除 MFE-trail / MaxHold）"""
+    hi, lo, c = float(np.max(path)), float(np.min(path)), float(path[-1])
+    if pos["sub_strategy"] == "L":
+        return strategy.check_exit_long(pos["entry_price"], 5, 5, hi, lo, c,
+                                        extension_active=pos["extension_active"], extension_start_bar=5,
+                                        entry_regime=pos["entry_regime"])
+    return strategy.check_exit_short(pos["entry_price"], 5, 5, hi, lo, c,
+                                     extension_active=pos["extension_active"], extension_start_bar=5,
+                                     entry_regime=pos["entry_regime"])
+
+
+def _touched(pos, path):
+    lv = strategy.intrabar_exit_levels(pos["sub_strategy"], pos["entry_price"], pos["entry_regime"],
+                                       pos["extension_active"])
+    hi, lo = np.max(path), np.min(path)
+    down = {"L": ("SafeNet", "BE"), "S": ("TP",)}[pos["sub_strategy"]]
+    return {r for r, v in lv.items() if v is not None and (lo <= v if r in down else hi >= v)}
+
+
+def test_watcher_matches_bar_close_exit():
+    rng = np.random.default_rng(21)
+    agree = {r: 0 for r in INTRABAR}
+    for i in range(600):
+        sub = "L" if i % 2 else "S"
+        pos = {"trade_id": f"t{i}", "sub_strategy": sub, "entry_price": 2000.0, "entry_bar_counter": 5,
+               "entry_regime": ["NA", "DOWN", "MILD_UP", "UP"][i % 4], "extension_active": i % 3 == 0}
+        path = 2000.0 * np.exp(np.cumsum(rng.normal(0, 0.004, 120)))
+        ex = _ReplayExecutor()
+        ex.positions[pos["trade_id"]] = dict(pos)
+        w = ExitWatcher(ex, url="replay://")
+        w.refresh_levels()
+        for p in path:
+            w.on_price(float(p))
+        bar = _bar_close_exit(pos, path)
+        touched = _touched(pos, path)
+        if len(touched) != 1:
+            continue  # 碰到多個價位：盤中依時間先後，收盤 bar 依優先順序，本來就可能不同
+        (reason,) = touched
+        assert bar["exit"] and bar["reason"] == reason, (i, bar)
+        assert len(w.fired) == 1 and w.fired[0][1] == reason
+        _, _, level, _ = ex.closed[0]
+        if reason != "SafeNet":  # SafeNet 回測另加 25% 滑價，觸價出場以價位下單
+            assert level == bar["exit_price"]
+        agree[reason] += 1
+    assert all(n >= 10 for n in agree.values()), agree
+
+
+def test_no_touch_no_exit():
+    ex = _ReplayExecutor()
+    ex.positions["t"] = {"sub_strategy": "L", "entry_price": 2000.0, "entry_bar_counter": 0,
+                         "entry_regime": "NA"}
+    w = ExitWatcher(ex, url="replay://")
+    w.refresh_levels()
+    for p in (2000.0, 2050.0, 1940.0, 2069.9):
+        w.on_price(p)
+    assert ex.closed == [] and "t" in ex.positions
+    w.on_price(2070.0)  # TP +3.5%
+    assert [c[1] for c in ex.closed] == ["TP"]
+
+
+def test_pending_exit_left_to_main_loop():
+    ex = _ReplayExecutor()
+    ex.positions["t"] = {"sub_strategy": "S", "entry_price": 2000.0, "entry_bar_counter": 0,
+                         "entry_regime": "NA", "pending_exit": {"reason": "TP"}}
+    w = ExitWatcher(ex, url="replay://")
+    assert w.refresh_levels() == {}
+    w.on_price(1900.0)
+    assert ex.closed == [] and "t" in ex.positions
+
+
+@pytest.mark.parametrize("up", [True, False])
+def test_ticks_from_frame_path(up):
+    o, c = (100.0, 104.0) if up else (104.0, 100.0)
+    df = pd.DataFrame({"datetime": ["2026-01-01 08:00:00"], "open": [o], "high": [105.0],
+                       "low": [99.0], "close": [c]})
+    prices, _ = ticks_from_frame(df, ticks_per_bar=2)
+    assert prices[0] == o and prices[-1] == c and prices.max() == 105.0 and prices.min() == 99.0
+    # 收紅：先低後高；收黑：先高後低
+    assert (np.argmin(prices) < np.argmax(prices)) == up
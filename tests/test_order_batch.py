@@ -0,0 +1,197 @@
+"""binance_trade.run_batched：同 bar 多筆市價單合併成一支 batchOrders（假交易所）"""
+import threading
+
+import pytest
+
+SYM = "ETHUSDT"
+
+
+def _close_long(bt, qty=1.0):
+    return lambda: bt.place_order(SYM, "SELL", qty=qty, reduce_only=True, position_side="LONG")
+
+
+def _open_short(bt, qty=0.5):
+    return lambda: bt.place_order(SYM, "SELL", qty=qty, position_side="SHORT", strategy_id="eth_v10_S")
+
+
+def test_full_batch(fake_exchange):
+    bt, ex = fake_exchange
+    ex.positions["LONG"] = 1.0
+    res = bt.run_batched([_close_long(bt), _open_short(bt)])
+    assert [r["positionSide"] for r in res] == ["LONG", "SHORT"]
+    assert [sorted(b) for b in ex.batches] == [[("LONG", "1.0"), ("SHORT", "0.5")]]
+    assert "new_order" not in ex.calls
+    assert ex.positions == {"LONG": 0.0, "SHORT": 0.5}
+
+
+def test_failed_leg_recovers_alone(fake_exchange):
+    """-4061 的那條腿走 _recover_market_order（切回 Hedge Mode 後單筆重送），另一條照批次結果"""
+    bt, ex = fake_exchange
+    ex.positions["LONG"] = 1.0
+    ex.fail_leg["SHORT"] = -4061
+    res = bt.run_batched([_close_long(bt), _open_short(bt)])
+    assert res[0]["positionSide"] == "LONG" and res[1]["positionSide"] == "SHORT"
+    assert ex.calls.count("new_batch_order") == 1
+    assert ex.calls.count("change_position_mode") == 1
+    assert ex.calls.count("new_order") == 1
+    assert ex.hedge and ex.positions == {"LONG": 0.0, "SHORT": 0.5}
+
+
+def test_failed_leg_unrecoverable(fake_exchange):
+    """不可恢復的腿錯誤 → 該筆 place_order 回 None，不影響另一條"""
+    bt, ex = fake_exchange
+    ex.positions["LONG"] = 1.0
+    ex.fail_leg["SHORT"] = -2019
+    res = bt.run_batched([_close_long(bt), _open_short(bt)])
+    assert res[0]["positionSide"] == "LONG" and res[1] is None
+    assert "new_order" not in ex.calls
+    assert ex.positions == {"LONG": 0.0, "SHORT": 0.0}
+
+
+def test_batch_timeout_recovers_from_positions(fake_exchange):
+    """整支 -1007（已成交、回應遺失）→ 每條腿各自查 position 確認成交"""
+    bt, ex = fake_exchange
+    ex.batch_error = Exception("(408, -1007, 'Timeout waiting for response from backend server. "
+                               "Send status unknown; execution status unknown.')")
+    res = bt.run_batched([
+        lambda: bt.place_order(SYM, "BUY", qty=0.5, position_side="LONG", strategy_id="eth_v10_L"),
+        _open_short(bt),
+    ])
+    assert [r["orderId"] for r in res] == ["TIMEOUT-RECOVERED"] * 2
+    assert "new_order" not in ex.calls and ex.calls.count("get_position_risk") >= 2
+
+
+def test_solo_fallback(fake_exchange):
+    """只有一個動作真的送單（另一個提早返回）→ 不組批次，照單筆 new_order"""
+    bt, ex = fake_exchange
+    res = bt.run_batched([lambda: None, _open_short(bt)])
+    assert res[0] is None and res[1]["positionSide"] == "SHORT"
+    assert ex.calls.count("new_order") == 1
+    assert "new_batch_order" not in ex.calls
+
+
+def test_other_threads_do_not_join_batch(fake_exchange):
+    """批次進行中，非 run_batched 工作執行緒的下單（exit_watcher 等）照單筆送，不佔用批次的腿"""
+    bt, ex = fake_exchange
+    ex.positions["LONG"] = 2.0
+    outside = {}
+
+    def first():
+        t = threading.Thread(target=lambda: outside.update(res=_close_long(bt, 1.2)()))
+        t.start()
+        t.join()
+        return _close_long(bt, 0.8)()
+
+    res = bt.run_batched([first, _open_short(bt)])
+    assert outside["res"]["positionSide"] == "LONG"
+    assert all(r["positionSide"] for r in res)
+    assert ex.calls.count("new_order") == 1
+    assert [sorted(b) for b in ex.batches] == [[("LONG", "0.8"), ("SHORT", "0.5")]]
+    assert ex.positions == {"LONG": 0.0, "SHORT": 0.5}
+
+
+@pytest.mark.parametrize("n", [1, 2])
+def test_disabled_or_single_runs_sequentially(fake_exchange, monkeypatch, n):
+    bt, ex = fake_exchange
+    monkeypatch.setattr(bt, "ORDER_BATCH", n == 1)
+    ex.positions["LONG"] = 1.0
+    res = bt.run_batched([_close_long(bt), _open_short(bt)][:n])
+    assert all(r is not None for r in res)
+    assert ex.calls.count("new_order") == n and "new_batch_order" not in ex.calls
+
+
+def _run_with_deadline(bt, actions, seconds=10):
+    """run_batched 卡住就讓測試失敗（不讓整個 pytest 掛住）"""
+    out = {}
+    t = threading.Thread(target=lambda: out.update(res=bt.run_batched(actions)), daemon=True)
+    t.start()
+    t.join(seconds)
+    assert not t.is_alive(), "run_batched hung"
+    return out["res"]
+
+
+def test_batch_wait_sends_without_late_participant(fake_exchange, monkeypatch):
+    """第三個動作遲遲不送單：到 BATCH_WAIT 先送已到的兩條腿，遲到的那筆照單筆送"""
+    import time
+    bt, ex = fake_exchange
+    monkeypatch.setattr(bt, "BATCH_WAIT", 0.3)
+    ex.positions["LONG"] = 2.0
+    done = {}
+
+    def timed(name, fn):
+        def run():
+            r = fn()
+            done[name] = time.time()
+            return r
+        return run
+
+    def late():
+        time.sleep(1.0)
+        return _close_long(bt, 1.0)()
+
+    t0 = time.time()
+    res = _run_with_deadline(bt, [timed("L", _close_long(bt)), timed("S", _open_short(bt)), late])
+    assert all(r["positionSide"] for r in res)
+    assert done["L"] - t0 < 0.9 and done["S"] - t0 < 0.9  # 沒等遲到的那條
+    assert [sorted(b) for b in ex.batches] == [[("LONG", "1.0"), ("SHORT", "0.5")]]
+    assert ex.calls.count("new_order") == 1
+    assert ex.positions == {"LONG": 0.0, "SHORT": 0.5}
+
+
+def test_batch_wait_participant_never_orders(fake_exchange, monkeypatch):
+    """另一個動作卡住且最後沒送單：唯一的腿在 BATCH_WAIT 後照單筆送，不等它結束"""
+    import time
+    bt, ex = fake_exchange
+    monkeypatch.setattr(bt, "BATCH_WAIT", 0.3)
+    sent = {}
+    t0 = time.time()
+
+    def short():
+        r = _open_short(bt)()
+        sent["t"] = time.time()
+        return r
+
+    res = _run_with_deadline(bt, [lambda: time.sleep(1.0), short])
+    assert res[0] is None and res[1]["positionSide"] == "SHORT"
+    assert sent["t"] - t0 < 0.9
+    assert ex.calls.count("new_order") == 1 and "new_batch_order" not in ex.calls
+
+
+def test_partial_reject_reports_failed_legs(fake_exchange, monkeypatch):
+    """三條腿：第一條被拒、最後一條從回應中缺漏 → 這兩筆回 None（失敗），中間成交的那筆照常"""
+    bt, ex = fake_exchange
+    ex.positions["LONG"] = 1.0
+    real = ex.new_batch_order
+    order = []
+
+    def partial(batchOrders):
+        order.extend((p["positionSide"], p["side"]) for p in batchOrders)
+        out = real(batchOrders)
+        return [{"code": -2019, "msg": "Margin is insufficient."}] + out[1:-1]
+
+    monkeypatch.setattr(ex, "new_batch_order", partial)
+    actions = [
+        (("LONG", "SELL"), _close_long(bt, 1.0)),
+        (("LONG", "BUY"), lambda: bt.place_order(SYM, "BUY", qty=0.5, position_side="LONG",
+                                                 strategy_id="eth_v10_L")),
+        (("SHORT", "SELL"), _open_short(bt)),
+    ]
+    res = dict(zip((k for k, _ in actions), _run_with_deadline(bt, [fn for _, fn in actions])))
+    assert len(order) == 3
+    assert res[order[0]] is None and res[order[2]] is None
+    assert res[order[1]]["positionSide"] == order[1][0]
+    assert "new_order" not in ex.calls
+
+
+@pytest.mark.parametrize("broken", ["dict_response", "send_crash"])
+def test_broken_batch_fails_every_leg(fake_exchange, monkeypatch, broken):
+    """batchOrders 回應不是清單 / 組批次時程式出錯 → 每條腿都回失敗，沒有執行緒卡住"""
+    bt, ex = fake_exchange
+    ex.positions["LONG"] = 1.0
+    if broken == "dict_response":
+        monkeypatch.setattr(ex, "new_batch_order", lambda batchOrders: {"code": -1000, "msg": "unknown"})
+    else:
+        monkeypatch.setattr(bt, "BATCH_MAX_LEGS", 0)  # range(step=0) → ValueError
+    res = _run_with_deadline(bt, [_close_long(bt), _open_short(bt)])
+    assert res == [None, None]
+    assert "new_order" not in ex.calls
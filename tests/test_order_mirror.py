@@ -0,0 +1,154 @@
+"""binance_trade 掛單鏡像：update_stop_loss 的比對 / 取消 / 補掛，get_active_sl_sides 即時對帳（假交易所）"""
+SYM = "ETHUSDT"
+
+
+def _sl_prices(ex, side="LONG"):
+    return sorted(float(v["triggerPrice"]) for v in ex.algos.values()
+                  if v["positionSide"] == side and v["orderType"] == "STOP_MARKET")
+
+
+def _mirror_prices(bt, side="LONG"):
+    return sorted(v["triggerPrice"] for _, v in bt._mirror_algo(SYM, side, "STOP_MARKET"))
+
+
+def _with_sl(bt, ex, price=1900.0):
+    bt._place_stop_order(SYM, "BUY", 0, price, "STOP_MARKET", 0.01, "LONG")
+    assert bt.reconcile_orders(SYM)
+    ex.calls.clear()
+
+
+def test_update_same_level_is_noop(fake_exchange):
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    bt.update_stop_loss(SYM, 1900.001, "long")
+    assert ex.calls == []
+    assert _sl_prices(ex) == [1900.0]
+
+
+def test_update_moves_stop(fake_exchange):
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    bt.update_stop_loss(SYM, 1950.0, "long")
+    assert ex.calls == ["DELETE /fapi/v1/algoOrder", "POST /fapi/v1/algoOrder"]
+    assert _sl_prices(ex) == [1950.0] and _mirror_prices(bt) == [1950.0]
+
+
+def test_update_restores_old_stop_when_new_fails(fake_exchange):
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    ex.algo_error = Exception("(400, -2021, 'Order would immediately trigger.')")
+    bt.update_stop_loss(SYM, 2100.0, "long")
+    assert ex.calls == ["DELETE /fapi/v1/algoOrder", "POST /fapi/v1/algoOrder", "POST /fapi/v1/algoOrder"]
+    assert _sl_prices(ex) == [1900.0] and _mirror_prices(bt) == [1900.0]
+
+
+def test_update_when_old_stop_already_gone(fake_exchange):
+    """鏡像裡的舊 SL 在交易所已不存在（已觸發 / 手動取消）→ -2011 當成已取消，照樣掛新的"""
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    ex.algos.clear()
+    bt.update_stop_loss(SYM, 1950.0, "long")
+    assert _sl_prices(ex) == [1950.0] and _mirror_prices(bt) == [1950.0]
+
+
+def _listing_only(monkeypatch, ex):
+    """一般掛單查詢失敗 → 整批對帳失敗、鏡像不可用；openAlgoOrders 清單仍查得到"""
+    def boom(symbol):
+        raise Exception("(503, -1001, 'Internal error')")
+    monkeypatch.setattr(ex, "get_orders", boom)
+
+
+def test_active_sl_sides_reads_mirror(fake_exchange):
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    assert bt.get_active_sl_sides(SYM) == {"LONG"}
+    assert ex.calls == []
+
+
+def test_active_sl_sides_verifies_on_slow_cadence(fake_exchange, monkeypatch):
+    """algo 部分超過 ORDER_SL_VERIFY_AGE → 補查一支 openAlgoOrders，看得到被手動取消的停損"""
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    bt._place_stop_order(SYM, "SELL", 0, 2100.0, "STOP_MARKET", 0.01, "SHORT")
+    for k in [k for k, v in ex.algos.items() if v["positionSide"] == "LONG"]:
+        del ex.algos[k]
+    ex.calls.clear()
+    assert bt.get_active_sl_sides(SYM) == {"LONG", "SHORT"}  # 鏡像仍新：不查
+    monkeypatch.setattr(bt, "ORDER_SL_VERIFY_AGE", -1)
+    assert bt.get_active_sl_sides(SYM) == {"SHORT"}
+    assert ex.calls == ["GET /fapi/v1/openAlgoOrders"]
+    assert _mirror_prices(bt) == []
+
+
+def test_active_sl_sides_query_failure(fake_exchange, monkeypatch):
+    bt, ex = fake_exchange
+    _listing_only(monkeypatch, ex)
+    assert bt.get_active_sl_sides(SYM) is None
+
+
+def test_update_falls_back_to_listing(fake_exchange, monkeypatch):
+    """鏡像不可用（從沒對帳成功）→ 查 openAlgoOrders 清單找舊 SL，照樣移動"""
+    bt, ex = fake_exchange
+    ex.algos[7] = {"orderType": "STOP_MARKET", "positionSide": "LONG", "side": "SELL",
+                   "triggerPrice": "1900.0", "algoStatus": "NEW", "symbol": SYM}
+    _listing_only(monkeypatch, ex)
+    bt.update_stop_loss(SYM, 1950.0, "long")
+    assert _sl_prices(ex) == [1950.0]
+
+
+def test_cancel_side_falls_back_to_listing(fake_exchange, monkeypatch):
+    """平倉取消掛單時鏡像不可用 → 查清單取消，不留下會開新倉的舊 STOP_MARKET"""
+    bt, ex = fake_exchange
+    ex.algos[7] = {"orderType": "STOP_MARKET", "positionSide": "LONG", "side": "SELL",
+                   "triggerPrice": "1900.0", "algoStatus": "NEW", "symbol": SYM}
+    ex.algos[8] = {"orderType": "STOP_MARKET", "positionSide": "SHORT", "side": "BUY",
+                   "triggerPrice": "2100.0", "algoStatus": "NEW", "symbol": SYM}
+    _listing_only(monkeypatch, ex)
+    bt.cancel_all_orders(SYM, "LONG")
+    assert list(ex.algos) == [8]
+
+
+def test_cancel_all_clears_unmirrored_algo_orders(fake_exchange):
+    """全部取消：以交易所清單為準，鏡像不知道的 algo 單也取消"""
+    bt, ex = fake_exchange
+    _with_sl(bt, ex)
+    ex.algos[9] = {"orderType": "TAKE_PROFIT_MARKET", "positionSide": "SHORT", "side": "BUY",
+                   "triggerPrice": "1800.0", "algoStatus": "NEW", "symbol": SYM}
+    bt.cancel_all_orders(SYM)
+    assert ex.algos == {} and bt._mirror_algo(SYM) == []
+    assert "cancel_open_orders" in ex.calls
+
+
+def test_unknown_order_matches_codes_only(fake_exchange):
+    bt, _ex = fake_exchange
+    assert bt._is_unknown_order(Exception("(400, -2011, 'Unknown order sent.')"))
+    assert bt._is_unknown_order(Exception("(400, -2013, 'Order does not exist.')"))
+    assert not bt._is_unknown_order(Exception("(400, -1121, 'Invalid symbol.')"))
+    assert not bt._is_unknown_order(Exception("404 Not Found: endpoint not found"))
+    assert not bt._is_unknown_order(Exception("symbol does not exist"))
+    assert not bt._is_unknown_order(Exception("(400, -20110, 'x')"))
+
+    class ClientError(Exception):
+        error_code = -2011
+    assert bt._is_unknown_order(ClientError("Unknown order sent."))
+
+
+def test_protective_stop_retries(fake_exchange, monkeypatch):
+    bt, ex = fake_exchange
+    monkeypatch.setattr(bt.time, "sleep", lambda s: None)
+    ex.algo_error = Exception("(503, -1001, 'Internal error; unable to process your request.')")
+    assert bt._place_protective_stop(SYM, "BUY", 0.5, 1900.0, "STOP_MARKET", 0.01, "LONG") is not None
+    assert ex.calls == ["POST /fapi/v1/algoOrder"] * 2
+    assert _sl_prices(ex) == [1900.0]
+
+
+def test_protective_stop_alerts_after_retries(fake_exchange, monkeypatch):
+    bt, ex = fake_exchange
+    alerts = []
+    monkeypatch.setattr(bt.time, "sleep", lambda s: None)
+    monkeypatch.setattr(bt, "send_telegram_message", alerts.append)
+    monkeypatch.setattr(bt, "_place_stop_order", lambda *a, **k: None)
+    res = bt.place_order(SYM, "BUY", qty=0.5, stop_loss=1900.0, position_side="LONG",
+                         strategy_id="eth_v10_L", wait_stops=True)
+    assert res is not None and ex.positions["LONG"] == 0.5
+    assert len(alerts) == 1 and "SafeNet" in alerts[0]
@@ -0,0 +1,52 @@
+"""strategy.rolling_rank_pctile（共用向量化 kernel）：與原 rolling().apply(lambda) 逐位元一致；
+IndicatorState 存檔 → 讀檔續算的百分位與全量重算逐位元一致"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import strategy
+from indicator_state import IndicatorState
+
+
+def _legacy(values, window):
+    """改版前 strategy.compute_indicators 的寫法"""
+    rank = lambda s: ((s < s.iloc[-1]).sum()) / (len(s) - 1) * 100 if len(s) > 1 else 50
+    return pd.Series(values).rolling(window).apply(rank, raw=False).to_numpy()
+
+
+@pytest.mark.parametrize("window", [1, 2, 20, 100])
+def test_kernel_matches_legacy_apply(window):
+    rng = np.random.default_rng(2)
+    x = rng.normal(size=1500).round(2)  # round → 窗口內有同值（嚴格 < 的邊界）
+    x[[0, 37, 38, 600, 1499]] = np.nan  # 含 NaN 的窗口 → NaN
+    want = _legacy(x, window)
+    got = strategy.rolling_rank_pctile(x, window, block=64)  # 小 block：跨塊邊界也要對
+    assert np.array_equal(got, want, equal_nan=True)
+    assert np.array_equal(strategy.rolling_rank_pctile(x[:window - 1], window), want[:window - 1],
+                          equal_nan=True)  # 窗口未滿
+
+
+def test_indicator_state_restart_matches_kernel(tmp_path):
+    n = 600
+    rng = np.random.default_rng(13)
+    close = 2000 * np.exp(np.cumsum(rng.normal(0, 0.006, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.004, n)) * close
+    df = pd.DataFrame({"datetime": pd.date_range("2026-03-01", periods=n, freq="h"),
+                       "open": open_, "high": np.maximum(open_, close) + spread,
+                       "low": np.minimum(open_, close) - spread, "close": close, "volume": 1.0})
+    ref = strategy.compute_indicators(df)
+    split = 350
+    path = str(tmp_path / "eth_indicators.json")
+    st = IndicatorState()
+    st.apply(df.iloc[:split + 1], upto=split)
+    st.save(path)
+
+    st = IndicatorState.load(path)
+    got = {"gk_pctile": [], "gk_pctile_s": []}
+    for idx in range(split + 1, n - 1):
+        out = st.apply(df.iloc[:idx + 2], upto=idx)
+        for col in got:
+            got[col].append(out[col].iloc[idx])
+    for col, vals in got.items():
+        assert np.array_equal(np.array(vals), ref[col].to_numpy()[split + 1:n - 1], equal_nan=True), col
@@ -0,0 +1,114 @@
+"""trade_ledger：connect() 每個 data_dir 只初始化一次；frame() 型別同 pd.read_csv(trades.csv)"""
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import recorder
+import trade_ledger
+
+
+def _open_row(n, cooldown=False):
+    return {
+        "trade_id": f"t{n:04d}", "trade_number": n,
+        "entry_time_utc": f"2026-01-{n:02d} 02:00:00", "entry_time_utc8": f"2026-01-{n:02d} 10:00:00",
+        "entry_weekday": n % 7, "entry_hour_utc8": 10,
+        "direction": "LONG" if n % 2 else "SHORT", "sub_strategy": "L" if n % 2 else "S1",
+        "entry_price": 3000.5 + n, "entry_signal_bar_close": 3000.25 + n,
+        "gk_pctile_at_entry": 12.5, "gk_ratio_at_entry": 0.123456,
+        "breakout_bar_close": 3000.25, "breakout_10bar_max": 2990.0, "breakout_10bar_min": 2900.0,
+        "breakout_strength_pct": 0.35, "ema20_at_entry": 2980.1, "ema20_distance_pct": 0.7,
+        "was_cooldown_trade": cooldown, "bars_since_last_exit": 6 + n,
+        "btc_close_at_entry": 90000.12, "eth_btc_ratio_at_entry": 0.033333, "eth_24h_change_pct": -1.2,
+        "entry_regime": "UP",
+    }
+
+
+def _exit_data(n):
+    return {
+        "exit_time_utc": f"2026-01-{n:02d} 08:00:00", "exit_time_utc8": f"2026-01-{n:02d} 16:00:00",
+        "exit_type": "TP", "exit_price": 3050.0 + n, "exit_trigger_bar": 6,
+        "hold_bars": 6, "hold_hours": 6,
+        "max_adverse_excursion_pct": -0.4, "max_adverse_excursion_usd": -16.0,
+        "max_favorable_excursion_pct": 2.1, "max_favorable_excursion_usd": 84.0,
+        "mae_time_bar": 1, "mfe_time_bar": 5, "pnl_at_bar7": "", "pnl_at_bar12": "",
+        "gross_pnl_usd": 66.0, "commission_usd": 3.2, "net_pnl_usd": 62.8 - n,
+        "net_pnl_pct": 1.57, "win_loss": "WIN",
+    }
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    for n in range(1, 6):
+        trade_ledger.insert_open(tmp_path, _open_row(n, cooldown=(n == 3)))
+        if n != 5:  # 最後一筆仍持倉：出場欄位空白
+            trade_ledger.update_close(tmp_path, f"t{n:04d}", _exit_data(n))
+    return tmp_path
+
+
+def _read_csv_frame(data_dir, **kwargs):
+    return pd.read_csv(io.StringIO(trade_ledger._to_csv_text(trade_ledger.rows(data_dir, **kwargs))))
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"closed": True}, {"closed": True, "last": 2}])
+def test_frame_matches_read_csv(ledger, kwargs):
+    got = trade_ledger.frame(ledger, **kwargs)
+    want = _read_csv_frame(ledger, **kwargs)
+    # 整欄空白的文字欄：read_csv 推成 float64，frame() 固定為文字欄（值同為 NaN）
+    text_blank = [c for c in recorder.TRADES_FIELDS
+                  if c not in trade_ledger.INT_FIELDS + trade_ledger.BOOL_FIELDS + trade_ledger.FLOAT_FIELDS
+                  and want[c].isna().all()]
+    assert text_blank  # 複盤欄位整欄空白
+    for c in text_blank:
+        assert got[c].isna().all()
+    pd.testing.assert_frame_equal(got.drop(columns=text_blank), want.drop(columns=text_blank))
+
+
+def test_frame_empty(tmp_path):
+    assert trade_ledger.frame(tmp_path).empty
+
+
+def test_connect_initialises_once(tmp_path, monkeypatch):
+    calls = []
+    real = trade_ledger._ensure_schema
+    monkeypatch.setattr(trade_ledger, "_ensure_schema", lambda conn: (calls.append(1), real(conn)))
+    for _ in range(3):
+        trade_ledger.connect(tmp_path).close()
+    assert len(calls) == 1
+    # 帳本檔被刪 → 下次開啟重新建 schema
+    for suffix in ("", "-wal", "-shm"):
+        p = trade_ledger.db_path(tmp_path) + suffix
+        if os.path.exists(p):
+            os.remove(p)
+    conn = trade_ledger.connect(tmp_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM trades").fetchone()[0] == 0
+    finally:
+        conn.close()
+    assert len(calls) == 2
+
+
+def test_get_row(ledger):
+    assert trade_ledger.get_row(ledger, "t0002")["exit_time_utc8"] == "2026-01-02 16:00:00"
+    assert trade_ledger.get_row(ledger, "t0005")["exit_time_utc8"] == ""
+    assert trade_ledger.get_row(ledger, "nope") is None
+
+
+def test_fee_delta_applies_to_breaker_counters(ledger, fake_exchange):
+    """手續費對帳的差額補進 daily_pnl / monthly_pnl / 健康度；已換日的出場只補月與健康度"""
+    import executor
+    ex = executor.Executor(state_path=str(ledger / "eth_state.json"))
+    ex.daily_key, ex.monthly_key = "2026-01-02", "2026-01"
+    ex.daily_pnl, ex.monthly_pnl, ex.edge_cusum = -5.0, {"L": -5.0, "S": 0.0}, 1.0
+    sub = trade_ledger.get_row(ledger, "t0001")["sub_strategy"]
+    assert ex._apply_fee_delta(trade_ledger.get_row(ledger, "t0001"), 0.25)
+    assert ex.daily_pnl == -5.0 and ex.monthly_pnl[sub] == -5.25
+    assert ex.edge_cusum == pytest.approx(1.0 + 0.25 * 4000.0 / executor.strategy.NOTIONAL)
+    ex.monthly_pnl["L"] = -5.0
+    t2 = trade_ledger.get_row(ledger, "t0002")
+    ex._apply_fee_delta(t2, 0.5)
+    assert ex.daily_pnl == -5.5
+    assert ex.snapshot().daily_pnl == -5.5
+    # 仍持倉（無出場時間）→ 不動
+    assert not ex._apply_fee_delta(trade_ledger.get_row(ledger, "t0005"), 1.0)
@@ -0,0 +1,74 @@
+"""觸價計畫（收盤前算好）vs 收盤時 evaluate_long / evaluate_short：逐 bar 結論一致"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import strategy
+from indicator_state import IndicatorState
+
+N_BARS = 3000
+
+
+@pytest.fixture(scope="module")
+def tape():
+    """合成 1h K 線：波動率分段放大 / 收斂，GK 壓縮 + 突破的 bar 夠多"""
+    rng = np.random.default_rng(11)
+    vol = 0.006 * np.exp(np.sin(np.arange(N_BARS) / 97.0) * 0.9)
+    close = 2000 * np.exp(np.cumsum(rng.normal(0, vol)))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, vol * 0.7)) * close
+    return pd.DataFrame({
+        "datetime": pd.date_range("2025-01-01", periods=N_BARS, freq="h"),
+        "open": open_,
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "close": close,
+        "volume": 1.0,
+    })
+
+
+def _account(rng, i):
+    """隨機帳上狀態（冷卻邊界、持倉、月上限 / 月虧停兩側都會出現）"""
+    positions = {}
+    if rng.random() < 0.2:
+        positions["t_l"] = {"sub_strategy": "L"}
+    if rng.random() < 0.2:
+        positions["t_s"] = {"sub_strategy": "S"}
+    last_exits = {"L": i - int(rng.integers(0, 15)), "S": i - int(rng.integers(0, 15))}
+    monthly_entries = {"L": int(rng.integers(0, 22)), "S": int(rng.integers(0, 22))}
+    monthly_pnl = {"L": float(rng.uniform(-90, 40)), "S": float(rng.uniform(-180, 40))}
+    return positions, last_exits, monthly_entries, monthly_pnl
+
+
+def test_plan_matches_evaluate(tape):
+    ref = strategy.compute_indicators(tape)
+    rng = np.random.default_rng(5)
+    st = IndicatorState()
+    fired = {"L": 0, "S": 0}
+    checked = 0
+    for i in range(N_BARS):
+        pre = st.peek_next()
+        row = tape.iloc[i]
+        st.update(row["datetime"], row["open"], row["high"], row["low"], row["close"])
+        if i < strategy.WARMUP_BARS:
+            continue
+        positions, last_exits, entries, pnl = _account(rng, i)
+        plans = [strategy.trigger_plan(strategy.BarFeatures.from_mapping(pre),
+                                       positions, last_exits, i, pnl, entries)]
+        if i % 50 == 0:  # pandas 備援路徑（增量狀態未暖機時用）
+            plans.append(strategy.trigger_plan(strategy.next_bar_features(tape.iloc[:i + 1]),
+                                               positions, last_exits, i, pnl, entries))
+        feat = strategy.BarFeatures.from_frame(ref, i)
+        sig = {
+            "L": strategy.evaluate_long(feat, positions, last_exits, i, pnl["L"], entries["L"]),
+            "S": strategy.evaluate_short(feat, positions, last_exits, i, pnl["S"], entries["S"]),
+        }
+        for plan in plans:
+            assert plan["bar_time"] == str(feat.datetime)
+            for side in ("L", "S"):
+                assert strategy.plan_fires(plan, side, feat.close) == bool(sig[side]), (i, side, plan[side])
+        for side in ("L", "S"):
+            fired[side] += bool(sig[side])
+        checked += 1
+    assert checked > 2000
+    assert fired["L"] >= 10 and fired["S"] >= 10, fired
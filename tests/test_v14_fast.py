@@ -0,0 +1,115 @@
+"""simulate_v14_fast（numba 編譯核心）vs simulate_v14_detailed（Python 參考版）逐筆逐欄對照"""
+import os
+import sys
+import importlib.util
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ENGINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "backtest", "research", "v14_export_trades.py")
+N_BARS = 6000
+REAL_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "data", "ETHUSDT_1h_latest730d.csv")
+
+
+@pytest.fixture(scope="module")
+def eng():
+    spec = importlib.util.spec_from_file_location("v14_export_trades", ENGINE_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod  # 同 run_backtest._load_engine
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@pytest.fixture(scope="module")
+def tape():
+    rng = np.random.default_rng(3)
+    close = 2000 * np.exp(np.cumsum(rng.normal(0, 0.007, N_BARS)))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.004, N_BARS)) * close
+    df = pd.DataFrame({
+        "datetime": pd.date_range("2024-01-01", periods=N_BARS, freq="h").strftime("%Y-%m-%d %H:%M:%S"),
+        "open": open_,
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "close": close,
+        "volume": 1.0,
+    })
+    return df
+
+
+@pytest.fixture(scope="module")
+def bars(eng, tape):
+    return eng.compute_indicators(tape), np.asarray(tape["datetime"], dtype=object)
+
+
+@pytest.mark.parametrize("kw", [
+    {},
+    {"realistic": True},
+    {"realistic": True, "slip_bps": 3.0,
+     "margin_schedule": [("2000-01-01", 200), ("2024-05-01", 500), ("2024-07-15", 300)]},
+    {"start_bar": 2000},
+])
+def test_fast_matches_reference(eng, bars, kw):
+    pytest.importorskip("numba")
+    ind, datetimes = bars
+    assert len(eng.simulate_v14_detailed(ind, datetimes, **kw)) > 20
+    assert eng.check_fast_parity(ind, datetimes, **kw) == []
+
+
+@pytest.mark.skipif(not os.path.exists(REAL_CSV), reason="data/ETHUSDT_1h_latest730d.csv 不在 repo（fetch_backtest_data.py 抓取）")
+@pytest.mark.parametrize("kw", [{}, {"realistic": True, "slip_bps": 3.0}])
+def test_fast_matches_reference_on_real_data(eng, kw):
+    """真實 730 天 ETH K 線（有抓資料才跑）：逐筆對照 + 至少 50 倍加速"""
+    import time
+    pytest.importorskip("numba")
+    df = pd.read_csv(REAL_CSV)
+    ind = eng.compute_indicators(df)
+    datetimes = np.asarray(df["datetime"], dtype=object)
+    assert eng.check_fast_parity(ind, datetimes, **kw) == []
+
+    def best(fn):
+        ts = []
+        for _ in range(5):
+            t0 = time.perf_counter()
+            fn(ind, datetimes, **kw)
+            ts.append(time.perf_counter() - t0)
+        return min(ts)
+
+    assert best(eng.simulate_v14_detailed) / best(eng.simulate_v14_fast) >= 50
+
+
+def test_cached_indicators_bit_exact(eng, tape, tmp_path):
+    """快取尾端追加重算 vs 全量重算：逐位元相同（array_equal，不是 allclose）"""
+    full = eng.compute_indicators(tape)
+    for n in (4000, 5000, N_BARS):
+        ind = eng.compute_indicators_cached(tape.iloc[:n], cache_dir=str(tmp_path))
+        assert int(np.load(next(tmp_path.glob("ind_*.npz")))["n"]) == n
+    again = eng.compute_indicators_cached(tape, cache_dir=str(tmp_path))  # 命中：直接讀檔
+    for k in eng._IND_KEYS:
+        want = np.asarray(full[k])
+        for got in (ind[k], again[k]):
+            assert got.dtype == want.dtype, k
+            assert np.array_equal(got, want, equal_nan=want.dtype.kind == "f"), k
+
+
+def test_margin_scale_matches_string_compare(eng):
+    sched = [("2000-01-01", 200), ("2024-02-10", 300), ("2024-05-01", 500), ("2030-01-01", 100)]
+    rng = pd.date_range("2024-01-01", periods=3000, freq="h")
+    ref = np.full(len(rng), 1.0)
+    as_str = np.array([str(x) for x in rng])
+    for d, m in sched[1:]:
+        ref[as_str >= d] = m / 200.0
+    for dts in (np.asarray(rng.strftime("%Y-%m-%d %H:%M:%S"), dtype=object), rng.values,
+                np.array(list(rng), dtype=object)):
+        assert np.array_equal(eng._margin_scale(dts, sched, len(rng)), ref)
+
+
+def test_round_like_python(eng):
+    rng = np.random.default_rng(1)
+    vals = np.r_[rng.normal(0, 500, 20000), np.arange(-20000, 20000) / 1000 + 0.0005,
+                 np.arange(-4000, 4000) / 200, [2.675, 1.005, 0.125, -0.125, 0.0]]
+    for nd in (1, 2, 3):
+        assert eng._round_like_python(vals, nd).tolist() == [round(float(v), nd) for v in vals]
@@ -0,0 +1,415 @@
+"""
+交易帳本（SQLite，WAL）— 取代 trades.csv 的讀全檔 → 改一行 → 重寫全檔。
+
+原本 recorder.record_trade_close 每次出場都讀整份 trades.csv 再整份重寫；
+/pnl /trades、analysis_report、check_health、edge_falsify、Executor 健康度初始化、
+儀表板 /api/trades /api/analytics /api/percentile-vs-oos 每次呼叫也都重新解析整份 CSV。
+
+  檔案：data_dir/trades.db（paper → data/，live → data_live/；多實例在各自 INSTANCE_DIR 下）
+  表：trades — 欄位 = recorder.TRADES_FIELDS，一律 TEXT，存「csv.DictWriter 會寫出的字串」
+      （None → ""，其他 str()），所以匯出的 CSV 與原本 trades.csv 逐位元組相同；rowid = 原檔行序
+  索引：trade_id、entry_time_utc8、exit_time_utc8、sub_strategy、entry_regime
+  寫入：進場 INSERT、出場 UPDATE ... WHERE trade_id（找不到 → ERROR + 補一行，同原本 fallback）
+  查詢：rows() 依出場時間區間 / 已平倉 / 最近 N 筆走索引；frame() 直接由選到的列組成 DataFrame，
+        各欄型別固定（INT_FIELDS / BOOL_FIELDS / FLOAT_FIELDS），同 pd.read_csv(trades.csv) 的推斷結果
+  連線：每次 connect() 新開；schema / 索引 / 匯入只在該 data_dir 於本進程第一次開啟時做
+  遷移：第一次開啟時若帳本是空的且 trades.csv 存在 → 整份匯入（只做一次，記在 meta 表）
+  匯出：export_csv() 寫出 trades.csv（tmp + os.replace）；每日結算時自動匯出一次，
+        手動：python trade_ledger.py --export [--live]
+        手動在 CSV 填了複盤欄位（review_note 等）→ python trade_ledger.py --import-csv 依 trade_id 併回
+  手續費：下單路徑不查手續費，先以估計值（名目 × TAKER_FEE_RATE）記帳；每筆成交的 orderId 記在
+        fills 表（commission 為 NULL = 待對帳），executor.reconcile_commissions 每小時一次批次
+        userTrades 查回實際值 → settle_fill 把差額補進已平倉列的 commission / net_pnl 欄位
+
+WAL 模式下機器人寫入時，儀表板 / analyze.py 等其他進程照常讀，不互相阻塞。
+"""
+import os
+import io
+import csv
+import sys
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("trade_ledger")
+
+DB_NAME = "trades.db"
+CSV_NAME = "trades.csv"
+INDEXED = ("trade_id", "entry_time_utc8", "exit_time_utc8", "sub_strategy", "entry_regime")
+# 已平倉：有出場類型或有淨損益（出場 fallback 列可能只有其中之一）
+CLOSED_SQL = "(exit_type != '' OR net_pnl_usd != '')"
+
+
+def _fields() -> list:
+    import recorder
+    return recorder.TRADES_FIELDS
+
+
+def db_path(data_dir) -> str:
+    return os.path.join(str(data_dir), DB_NAME)
+
+
+def csv_path(data_dir) -> str:
+    return os.path.join(str(data_dir), CSV_NAME)
+
+
+def exists(data_dir) -> bool:
+    """帳本或待匯入的 trades.csv 任一存在（沒有交易記錄 → False）"""
+    return os.path.exists(db_path(data_dir)) or os.path.exists(csv_path(data_dir))
+
+
+def _cell(v) -> str:
+    """同 csv.DictWriter 的寫法：None → ""，其他 str()"""
+    return "" if v is None else str(v)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 連線 / schema
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+# 本進程已初始化過的帳本路徑（schema / 補欄 / 索引 / CSV 匯入每個 data_dir 只做一次）
+_initialised = set()
+
+
+def connect(data_dir) -> sqlite3.Connection:
+    """開連線（每次呼叫新開，跨執行緒安全）；該 data_dir 在本進程第一次開啟時確保 schema、欄位升級與一次性 CSV 匯入"""
+    path = db_path(data_dir)
+    key = os.path.abspath(path)
+    # 檔案被外力刪掉 → 重新初始化（否則後續查詢會是 no such table）
+    fresh = key not in _initialised or not os.path.exists(path)
+    if fresh:
+        os.makedirs(str(data_dir), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")  # 連線層級設定，每條連線都要設
+    if fresh:
+        # WAL 記在檔案裡、schema 與匯入皆冪等 → 多執行緒同時第一次開啟也只是多做一次
+        conn.execute("PRAGMA journal_mode=WAL")
+        _ensure_schema(conn)
+        _migrate_csv(conn, data_dir)
+        _initialised.add(key)
+    return conn
+
+
+def _ensure_schema(conn):
+    fields = _fields()
+    cols = ", ".join(f'"{c}" TEXT NOT NULL DEFAULT \'\'' for c in fields)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS trades ({cols})")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    # TRADES_FIELDS 新增欄位 → 補欄（同 recorder._ensure_csv 的「只加不減」升級）
+    have = {r[1] for r in conn.execute("PRAGMA table_info(trades)")}
+    for c in fields:
+        if c not in have:
+            conn.execute(f'ALTER TABLE trades ADD COLUMN "{c}" TEXT NOT NULL DEFAULT \'\'')
+    for c in INDEXED:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_trades_{c} ON trades("{c}")')
+    conn.execute("CREATE TABLE IF NOT EXISTS fills (order_id TEXT PRIMARY KEY, trade_id TEXT NOT NULL, "
+                 "leg TEXT NOT NULL, ts_ms INTEGER NOT NULL, est REAL NOT NULL, commission REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fills_trade_id ON fills(trade_id)")
+    conn.commit()
+
+
+def _migrate_csv(conn, data_dir):
+    src = csv_path(data_dir)
+    if not os.path.exists(src):
+        return
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+        return
+    conn.execute("BEGIN IMMEDIATE")  # 多進程同時第一次開啟時只會有一個匯入
+    try:
+        done = conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone()
+        empty = conn.execute("SELECT COUNT(*) FROM trades").fetchone()[0] == 0
+        n = 0
+        if not done and empty:
+            with open(src, "r", newline="", encoding="utf-8") as f:
+                n = _insert_many(conn, csv.DictReader(f))
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('csv_imported', ?)",
+                     (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        conn.commit()
+        if n:
+            logger.info(f"Imported {n} rows from {src} into {DB_NAME}")
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _insert_many(conn, rows) -> int:
+    fields = _fields()
+    cols = ", ".join(f'"{c}"' for c in fields)
+    marks = ", ".join("?" for _ in fields)
+    data = [tuple(_cell(r.get(c)) for c in fields) for r in rows]
+    conn.executemany(f"INSERT INTO trades ({cols}) VALUES ({marks})", data)
+    return len(data)
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 寫入
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def insert_open(data_dir, trade: dict):
+    """進場：新增一列（出場欄位空白）"""
+    conn = connect(data_dir)
+    try:
+        with conn:
+            _insert_many(conn, [trade])
+    finally:
+        conn.close()
+
+
+def update_close(data_dir, trade_id: str, exit_data: dict) -> bool:
+    """出場：只更新該 trade_id 的出場欄位。回傳是否找到原本的進場列（找不到就補一列）"""
+    fields = set(_fields())
+    upd = {k: _cell(v) for k, v in exit_data.items() if k in fields and k != "trade_id"}
+    conn = connect(data_dir)
+    try:
+        with conn:
+            matched = 0
+            if upd:
+                sets = ", ".join(f'"{k}" = ?' for k in upd)
+                matched = conn.execute(f"UPDATE trades SET {sets} WHERE trade_id = ?",
+                                       (*upd.values(), trade_id)).rowcount
+            else:
+                matched = conn.execute("SELECT COUNT(*) FROM trades WHERE trade_id = ?",
+                                       (trade_id,)).fetchone()[0]
+            if not matched:
+                _insert_many(conn, [dict(upd, trade_id=trade_id)])
+        return bool(matched)
+    finally:
+        conn.close()
+
+
+def upsert_csv(data_dir, path: str = None) -> tuple:
+    """把（手動編輯過的）CSV 依 trade_id 併回帳本：已存在的列整列覆寫，新的列追加。回傳 (更新, 新增)"""
+    path = path or csv_path(data_dir)
+    fields = _fields()
+    conn = connect(data_dir)
+    updated = added = 0
+    try:
+        with open(path, "r", newline="", encoding="utf-8") as f, conn:
+            for r in csv.DictReader(f):
+                vals = {c: _cell(r.get(c)) for c in fields if c in r and c != "trade_id"}
+                tid = r.get("trade_id", "")
+                n = 0
+                if tid and vals:
+                    sets = ", ".join(f'"{k}" = ?' for k in vals)
+                    n = conn.execute(f"UPDATE trades SET {sets} WHERE trade_id = ?",
+                                     (*vals.values(), tid)).rowcount
+                if n:
+                    updated += 1
+                else:
+                    _insert_many(conn, [r])
+                    added += 1
+    finally:
+        conn.close()
+    return updated, added
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 手續費對帳（fills）
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def add_fill(data_dir, order_id, trade_id: str, leg: str, ts_ms: int, est: float):
+    """記下一筆待對帳成交（leg = "entry" / "exit"；est = 記帳時用的估計手續費）"""
+    conn = connect(data_dir)
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO fills VALUES (?, ?, ?, ?, ?, NULL)",
+                         (str(order_id), trade_id, leg, int(ts_ms), float(est)))
+    finally:
+        conn.close()
+
+
+def pending_fills(data_dir) -> list:
+    """待對帳成交（依成交時間）：[{order_id, trade_id, leg, ts_ms, est}]"""
+    if not os.path.exists(db_path(data_dir)):
+        return []
+    conn = connect(data_dir)
+    try:
+        return [dict(r) for r in conn.execute(
+            "SELECT order_id, trade_id, leg, ts_ms, est FROM fills WHERE commission IS NULL ORDER BY ts_ms")]
+    finally:
+        conn.close()
+
+
+def settle_fill(data_dir, order_id, commission: float, margin: float = None, adjust_row: bool = True) -> float:
+    """
+    寫入實際手續費。adjust_row 時把 (實際 - 估計) 補進該筆交易列的 commission_usd / net_pnl_usd /
+    net_pnl_pct / win_loss（只改已平倉列；未平倉的進場腿由 executor 直接更新持倉、不動帳本列）。
+    回傳差額（實際 - 估計）。
+    """
+    conn = connect(data_dir)
+    try:
+        with conn:
+            f = conn.execute("SELECT trade_id, est FROM fills WHERE order_id = ?", (str(order_id),)).fetchone()
+            if f is None:
+                return 0.0
+            delta = round(float(commission) - f["est"], 6)
+            conn.execute("UPDATE fills SET commission = ? WHERE order_id = ?", (float(commission), str(order_id)))
+            if not adjust_row or delta == 0:
+                return delta
+            r = conn.execute("SELECT commission_usd, net_pnl_usd, net_pnl_pct FROM trades "
+                             f"WHERE trade_id = ? AND {CLOSED_SQL}", (f["trade_id"],)).fetchone()
+            if r is None or r["net_pnl_usd"] == "":
+                return delta
+            comm = round(float(r["commission_usd"] or 0) + delta, 4)
+            net = round(float(r["net_pnl_usd"]) - delta, 4)
+            if margin:
+                pct = round(net / margin * 100, 2)
+            else:
+                pct = r["net_pnl_pct"]
+            win_loss = "WIN" if net > 0 else ("LOSS" if net < 0 else "BREAKEVEN")
+            conn.execute('UPDATE trades SET commission_usd = ?, net_pnl_usd = ?, net_pnl_pct = ?, win_loss = ? '
+                         "WHERE trade_id = ?", (_cell(comm), _cell(net), _cell(pct), win_loss, f["trade_id"]))
+            return delta
+    finally:
+        conn.close()
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 查詢
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def exit_cutoff(days: int) -> str:
+    """最近 N 天（UTC+8）的出場時間下限字串；exit_time_utc8 為 'YYYY-MM-DD HH:MM:SS' 可直接字串比較"""
+    return ((datetime.utcnow() + timedelta(hours=8)) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def rows(data_dir, closed: bool = False, days: int = None, exit_since: str = None,
+         last: int = None, order: str = "rowid") -> list:
+    """
+    查詢交易列（list[dict]，值為字串，同 csv.DictReader）。
+
+    Args:
+        closed: 只要已平倉
+        days / exit_since: 出場時間 >= 最近 N 天 / 指定字串（走 exit_time_utc8 索引）
+        last: 只取依 order 排序的最後 N 筆（回傳仍為遞增順序）
+        order: "rowid"（= 原 CSV 行序）或 "exit"（出場時間）
+    """
+    if not exists(data_dir):
+        return []
+    where, params = [], []
+    if closed:
+        where.append(CLOSED_SQL)
+    if days:
+        exit_since = exit_cutoff(days)
+    if exit_since:
+        where.append("exit_time_utc8 >= ?")
+        params.append(exit_since)
+    key = "exit_time_utc8" if order == "exit" else "rowid"
+    sql = "SELECT * FROM trades" + (" WHERE " + " AND ".join(where) if where else "")
+    if last:
+        sql += f" ORDER BY {key} DESC LIMIT ?"
+        params.append(int(last))
+    else:
+        sql += f" ORDER BY {key}"
+    conn = connect(data_dir)
+    try:
+        out = [dict(r) for r in conn.execute(sql, params)]
+    finally:
+        conn.close()
+    return out[::-1] if last else out
+
+
+def get_row(data_dir, trade_id: str) -> dict:
+    """單筆交易列（走 trade_id 索引）；找不到 → None"""
+    conn = connect(data_dir)
+    try:
+        r = conn.execute("SELECT * FROM trades WHERE trade_id = ? ORDER BY rowid DESC LIMIT 1",
+                         (trade_id,)).fetchone()
+        return dict(r) if r else None
+    finally:
+        conn.close()
+
+
+def _to_csv_text(records: list) -> str:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=_fields(), extrasaction="ignore")
+    w.writeheader()
+    w.writerows(records)
+    return buf.getvalue()
+
+
+# frame() 的欄位型別（同 pd.read_csv(trades.csv) 對 executor / recorder 寫出內容推斷的結果）
+#   整數欄：全有值 → int64，有空值 → float64；布林欄：全有值 → bool，有空值 → object
+#   浮點欄 → float64；其餘（含 TRADES_FIELDS 日後新增、未列在這裡的欄位）→ 文字，"" → NaN
+#   （唯一差異：整欄空白的文字欄 read_csv 會推成 float64，這裡固定為文字欄）
+INT_FIELDS = ("trade_number", "entry_weekday", "entry_hour_utc8", "bars_since_last_exit",
+              "hold_bars", "hold_hours", "mae_time_bar", "mfe_time_bar", "exit_trigger_bar")
+BOOL_FIELDS = ("was_cooldown_trade",)
+FLOAT_FIELDS = ("entry_price", "entry_signal_bar_close", "gk_pctile_at_entry", "gk_ratio_at_entry",
+                "breakout_bar_close", "breakout_10bar_max", "breakout_10bar_min", "breakout_strength_pct",
+                "ema20_at_entry", "ema20_distance_pct",
+                "max_adverse_excursion_pct", "max_adverse_excursion_usd",
+                "max_favorable_excursion_pct", "max_favorable_excursion_usd",
+                "pnl_at_bar7", "pnl_at_bar12", "exit_price",
+                "gross_pnl_usd", "commission_usd", "net_pnl_usd", "net_pnl_pct",
+                "btc_close_at_entry", "eth_btc_ratio_at_entry", "eth_24h_change_pct",
+                "backtest_entry_price", "backtest_pnl_usd")
+
+
+def frame(data_dir, **kwargs):
+    """同 rows() 的篩選，直接由列組成 DataFrame，型別見 INT_FIELDS / BOOL_FIELDS / FLOAT_FIELDS；沒有資料 → 空 DataFrame"""
+    import numpy as np
+    import pandas as pd
+    recs = rows(data_dir, **kwargs)
+    if not recs:
+        return pd.DataFrame()
+    df = pd.DataFrame(recs, columns=_fields())
+    for c in df.columns:
+        if c in INT_FIELDS or c in FLOAT_FIELDS:
+            col = pd.to_numeric(df[c].replace("", np.nan), errors="coerce").astype("float64")
+            if c in INT_FIELDS and col.notna().all():
+                col = col.astype("int64")
+        elif c in BOOL_FIELDS:
+            col = df[c].map({"True": True, "False": False})
+            col = col.astype(bool) if col.notna().all() else col.astype(object)
+        else:
+            col = df[c].mask(df[c] == "")
+        df[c] = col
+    return df
+
+
+def export_csv(data_dir, path: str = None) -> int:
+    """整份帳本寫成 trades.csv（與原本 recorder 寫出的格式逐位元組相同）。回傳列數"""
+    path = path or csv_path(data_dir)
+    recs = rows(data_dir)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        f.write(_to_csv_text(recs))
+    os.replace(tmp, path)
+    return len(recs)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="交易帳本（trades.db）匯出 / 匯入 / 摘要")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--paper", action="store_true")
+    g.add_argument("--live", action="store_true")
+    ap.add_argument("--export", action="store_true", help="匯出 trades.csv")
+    ap.add_argument("--import-csv", nargs="?", const="", default=None, metavar="PATH",
+                    help="依 trade_id 把 CSV（預設 trades.csv）併回帳本")
+    args = ap.parse_args()
+
+    import paths
+    paper = (not args.live) if (args.paper or args.live) else \
+        os.getenv("PAPER_TRADING", "true").lower() == "true"
+    data_dir = paths.data_dir(paper)
+    if args.import_csv is not None:
+        up, add = upsert_csv(data_dir, args.import_csv or None)
+        print(f"Merged {args.import_csv or csv_path(data_dir)}: {up} updated, {add} added")
+    if args.export:
+        n = export_csv(data_dir)
+        print(f"Exported {n} rows → {csv_path(data_dir)}")
+    if args.import_csv is None and not args.export:
+        all_rows = rows(data_dir)
+        n_closed = sum(1 for r in all_rows if r.get("exit_type") or r.get("net_pnl_usd"))
+        print(f"{db_path(data_dir)}: {len(all_rows)} trades ({n_closed} closed)")
+        for r in rows(data_dir, closed=True, last=5):
+            print(f"  #{r['trade_number']:>4} {r['sub_strategy']:<2} {r['entry_time_utc8'][:16]} → "
+                  f"{r['exit_time_utc8'][:16]} {r['exit_type']:<10} {r['net_pnl_usd']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -158,8 +158,8 @@ header("9. eth_state_live.json")
 import json
 sp = paths.state_file(False)  # 多實例：INSTANCE_DIR/eth_state_live.json
 if os.path.exists(sp):
-    with open(sp) as f:
-        st = json.load(f)
+    import state_journal
+    st = state_journal.load_state(sp)  # 快照 + eth_state_live.journal 重放
     print(f"  {OK} 存在  trade_number={st['trade_number']}（首筆 mainnet trade 將是 #{st['trade_number']+1}）")
     print(f"       positions={st['positions']}（應為空）")
 else: